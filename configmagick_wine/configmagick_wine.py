@@ -27,6 +27,18 @@ import lib_log_utils
 try:
     # imports for local pytest
     from . import lib_wine                    # type: ignore # pragma: no cover
+    from . import lib_wine_archive            # type: ignore # pragma: no cover
+    from . import lib_wine_cache              # type: ignore # pragma: no cover
+    from . import lib_wine_check              # type: ignore # pragma: no cover
+    from . import lib_wine_dedupe             # type: ignore # pragma: no cover
+    from . import lib_wine_display            # type: ignore # pragma: no cover
+    from . import lib_wine_inventory          # type: ignore # pragma: no cover
+    from . import lib_wine_pip                # type: ignore # pragma: no cover
+    from . import lib_wine_plan               # type: ignore # pragma: no cover
+    from . import lib_wine_timings            # type: ignore # pragma: no cover
+    from . import lib_mirror                  # type: ignore # pragma: no cover
+    from . import lib_wine_registry           # type: ignore # pragma: no cover
+    from . import lib_wine_registry_snapshot  # type: ignore # pragma: no cover
     from . import install_gecko          # type: ignore # pragma: no cover
     from . import install_git            # type: ignore # pragma: no cover
     from . import install_wine                # type: ignore # pragma: no cover
@@ -34,11 +46,36 @@ try:
     from . import install_mono           # type: ignore # pragma: no cover
     from . import install_python         # type: ignore # pragma: no cover
     from . import install_python_nuget   # type: ignore # pragma: no cover
+    from . import install_python_wheels  # type: ignore # pragma: no cover
 except ImportError:                           # type: ignore # pragma: no cover
     # imports for doctest
     # noinspection PyUnresolvedReferences
     import lib_wine                           # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
+    import lib_wine_archive                   # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                     # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_check                     # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_dedupe                    # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_display                   # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_inventory                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_pip                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                      # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_timings                   # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_mirror                         # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry                  # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry_snapshot         # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import install_gecko                 # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_git                   # type: ignore # pragma: no cover
@@ -52,6 +89,8 @@ except ImportError:                           # type: ignore # pragma: no cover
     import install_python                # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_python_nuget          # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_python_wheels         # type: ignore # pragma: no cover
 
 
 def main() -> None:
@@ -61,7 +100,7 @@ def main() -> None:
         # we must not call fire if the program is called via pytest
         is_called_via_pytest = [(sys_arg != '') for sys_arg in sys.argv if 'pytest' in sys_arg]
         if not is_called_via_pytest:
-            fire.Fire({
+            d_commands = {
                 'install_wine': install_wine.install_wine,
                 'install_winetricks': install_wine.install_winetricks,
                 'update_winetricks': install_wine.update_winetricks,
@@ -71,11 +110,34 @@ def main() -> None:
                 'install_mono_latest': install_mono.install_mono_latest,
                 'install_mono_recommended': install_mono.install_mono_recommended,
                 'install_gecko': install_gecko.install_gecko,
+                'install_mono_gecko': install_gecko.install_mono_and_gecko,
                 'install_git': install_git.install_git,
                 'install_python': install_python.install_python,
                 'install_python_nuget': install_python_nuget.install_python_nuget,
+                'install_python_wheels': install_python_wheels.install_python_wheels,
+                'install_python_requirements': install_python_wheels.install_python_requirements,
                 'fix_permissions': lib_wine.fix_wine_permissions,
-            })
+                'edit_path': lib_wine.edit_wine_registry_path,
+                'reconcile_registry': lib_wine_registry.reconcile_wine_registry_from_file,
+                'snapshot_registry': lib_wine_registry_snapshot.snapshot_wine_registry,
+                'restore_registry': lib_wine_registry_snapshot.restore_wine_registry,
+                'export_prefix': lib_wine_archive.export_prefix,
+                'import_prefix': lib_wine_archive.import_prefix,
+                'check': lib_wine_check.check_wine_prefixes_report,
+                'inventory': {'scan': lib_wine_inventory.scan_wine_prefix_inventory, 'show': lib_wine_inventory.show_wine_prefix_inventory},
+                'dedupe': lib_wine_dedupe.dedupe_wine_prefixes_report,
+                'cache': {'gc': lib_wine_cache.gc_wine_cache},
+                'mirror': {'sync': lib_mirror.sync_mirror},
+                'pip_cache': {'populate': lib_wine_pip.populate_wheel_cache, 'map': lib_wine_pip.map_wheel_cache_into_prefix},
+                'stats': lib_wine_timings.show_step_stats,
+                'display': {'stop': lib_wine_display.stop_display_pool},
+            }
+            # every command accepts --plan : show the steps with their expected durations, without changing anything
+            if '--plan' in sys.argv[1:]:
+                lib_wine_plan.run_plan(fire.Fire, d_commands, command=lib_wine_plan.get_l_plan_arguments(sys.argv[1:], d_commands))
+            else:
+                with lib_wine_plan.timed_execution(command_line=' '.join(sys.argv[1:])):
+                    fire.Fire(d_commands)
 
     except FileNotFoundError:
         # see https://www.thegeekstuff.com/2010/10/linux-error-codes for error codes
@@ -1,7 +1,7 @@
 # ### STDLIB
 import pathlib
 import subprocess
-from typing import Union
+from typing import List, Union
 
 # ### OWN
 import configmagick_linux
@@ -13,6 +13,9 @@ import lib_shell
 try:
     # imports for local pytest
     from . import lib_wine             # type: ignore # pragma: no cover
+    from . import lib_wine_msi         # type: ignore # pragma: no cover
+    from . import lib_wine_versions    # type: ignore # pragma: no cover
+    from . import install_mono         # type: ignore # pragma: no cover
     from . import install_wine
     from . import install_wine_machine
 except ImportError:                    # type: ignore # pragma: no cover
@@ -20,6 +23,12 @@ except ImportError:                    # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import lib_wine                    # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
+    import lib_wine_msi                # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_versions           # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_mono                # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import install_wine                # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_wine_machine        # type: ignore # pragma: no cover
@@ -27,9 +36,11 @@ except ImportError:                    # type: ignore # pragma: no cover
 
 def install_gecko(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
                   username: str = configmagick_linux.get_current_username(),
+                  ui_level: str = '',
                   quiet: bool = False) -> None:
     """
-    install 32 Bit Gecko for 32/64 Bit Wine, and 64 Bit Gecko for 64 Bit Wine
+    install 32 Bit Gecko for 32/64 Bit Wine, and 64 Bit Gecko for 64 Bit Wine - both in one wine session.
+    ui_level: '' for the full user interface of msiexec, 'quiet' or 'passive'
 
     >>> install_wine_machine.create_wine_test_prefixes()
     >>> install_gecko(wine_prefix='wine_test_32', quiet=True)
@@ -39,18 +50,60 @@ def install_gecko(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get
     lib_log_utils.banner_verbose('Install Gecko on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix), quiet=quiet)
     wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)    # prepend /home/user if needed
     download_gecko_msi_files(wine_prefix=wine_prefix, username=username, quiet=True)
-    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix, username)
+    l_gecko_msi_filenames = get_l_gecko_msi_filenames_to_install(wine_prefix=wine_prefix, username=username, quiet=quiet)
+    lib_wine_msi.install_msi_files_from_wine_cache(l_gecko_msi_filenames, wine_prefix=wine_prefix, username=username, ui_level=ui_level, quiet=quiet)
+    lib_log_utils.banner_success('Wine Gecko installed')
 
-    if wine_arch == 'win32' or wine_arch == 'win64':
-        lib_log_utils.log_verbose('Install Gecko 32 Bit on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix), quiet=quiet)
-        install_gecko_32(wine_prefix=wine_prefix, username=username, quiet=quiet)
 
+def install_mono_and_gecko(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                           username: str = configmagick_linux.get_current_username(),
+                           mono_version: str = 'recommended',
+                           ui_level: str = '',
+                           quiet: bool = False) -> None:
+    """ install mono and gecko (32 and 64 Bit) with one single wine session.
+    syntax: install_mono_gecko --wine_prefix=<prefix> [--mono_version=recommended|latest] [--ui_level=quiet|passive]
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> install_mono_and_gecko(wine_prefix='wine_test_64', ui_level='quiet', quiet=True)
+
+    """
+    lib_log_utils.banner_verbose('Install Mono and Gecko on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix), quiet=quiet)
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)    # prepend /home/user if needed
+    if mono_version == 'recommended':
+        install_mono.download_mono_msi_files_from_appwiz(wine_prefix=wine_prefix, username=username, force_download=False, quiet=quiet)
+        mono_msi_filename = install_mono.get_mono_msi_filename_from_appwiz(wine_prefix=wine_prefix, username=username)
+    elif mono_version == 'latest':
+        install_mono.download_latest_mono_msi_files_from_github(username=username, force_download=False, quiet=quiet)
+        mono_msi_filename = pathlib.Path(install_mono.get_wine_mono_download_link_from_github().rsplit('/', 1)[1])
+    else:
+        raise RuntimeError('invalid mono_version "{mono_version}", valid are : latest, recommended'.format(mono_version=mono_version))
+    download_gecko_msi_files(wine_prefix=wine_prefix, username=username, quiet=True)
+
+    l_msi_filenames = list()    # type: List[pathlib.Path]
+    if not install_mono.is_mono_version_installed(wine_prefix=wine_prefix, mono_msi_filename=mono_msi_filename, username=username):
+        l_msi_filenames.append(mono_msi_filename)
+    l_msi_filenames.extend(get_l_gecko_msi_filenames_to_install(wine_prefix=wine_prefix, username=username, quiet=quiet))
+    lib_wine_msi.install_msi_files_from_wine_cache(l_msi_filenames, wine_prefix=wine_prefix, username=username, ui_level=ui_level, quiet=quiet)
+    lib_log_utils.banner_success('Wine Mono "{mono_msi_filename}" and Wine Gecko installed'.format(mono_msi_filename=mono_msi_filename))
+
+
+def get_l_gecko_msi_filenames_to_install(wine_prefix: Union[str, pathlib.Path], username: str, quiet: bool = False) -> List[pathlib.Path]:
+    """ the 32 Bit Gecko for 32/64 Bit Wine, and the 64 Bit Gecko for 64 Bit Wine - without the ones which are installed already """
+    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix, username)
+    l_gecko_msi_filenames = list()  # type: List[pathlib.Path]
+    if wine_arch == 'win32' or wine_arch == 'win64':
+        l_gecko_msi_filenames.append(get_gecko_32_filename_from_appwiz(wine_prefix, username))
     if wine_arch == 'win64':
-        lib_log_utils.log_verbose('Install Gecko 64 Bit on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix), quiet=quiet)
-        install_gecko_64(wine_prefix=wine_prefix, username=username, quiet=quiet)
+        l_gecko_msi_filenames.append(get_gecko_64_filename_from_appwiz(wine_prefix, username))
 
-    lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)  # it is cheap, just in case
-    lib_log_utils.banner_success('Wine Gecko installed')
+    l_gecko_msi_filenames_to_install = list()  # type: List[pathlib.Path]
+    for path_gecko_msi_filename in l_gecko_msi_filenames:
+        if is_gecko_version_installed(wine_prefix=wine_prefix, path_gecko_msi_filename=path_gecko_msi_filename, username=username):
+            lib_log_utils.log_verbose('"{path_gecko_msi_filename}" is already installed on WINEPREFIX="{wine_prefix}"'
+                                      .format(path_gecko_msi_filename=path_gecko_msi_filename, wine_prefix=wine_prefix), quiet=quiet)
+        else:
+            l_gecko_msi_filenames_to_install.append(path_gecko_msi_filename)
+    return l_gecko_msi_filenames_to_install
 
 
 def install_gecko_32(wine_prefix: Union[str, pathlib.Path], username: str, quiet: bool = False) -> None:
@@ -64,16 +117,11 @@ def install_gecko_64(wine_prefix: Union[str, pathlib.Path], username: str, quiet
 
 
 def install_gecko_by_architecture(wine_prefix: Union[str, pathlib.Path], username: str, path_gecko_msi_filename: pathlib.Path, quiet: bool = False) -> None:
-    path_wine_cache = lib_wine.get_path_wine_cache_for_user(username)
-    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix, username)
-
-    command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine msiexec /i "{path_wine_cache}/{path_gecko_msi_filename}"'.format(
-        wine_prefix=wine_prefix,
-        wine_arch=wine_arch,
-        path_wine_cache=path_wine_cache,
-        path_gecko_msi_filename=path_gecko_msi_filename)
-
-    lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    if is_gecko_version_installed(wine_prefix=wine_prefix, path_gecko_msi_filename=path_gecko_msi_filename, username=username):
+        lib_log_utils.log_verbose('"{path_gecko_msi_filename}" is already installed on WINEPREFIX="{wine_prefix}"'
+                                  .format(path_gecko_msi_filename=path_gecko_msi_filename, wine_prefix=wine_prefix), quiet=quiet)
+        return
+    lib_wine_msi.install_msi_files_from_wine_cache([path_gecko_msi_filename], wine_prefix=wine_prefix, username=username, quiet=quiet)
 
 
 def download_gecko_msi_files(wine_prefix: Union[str, pathlib.Path], username: str, quiet: bool = False) -> None:
@@ -87,25 +135,19 @@ def download_gecko_msi_files(wine_prefix: Union[str, pathlib.Path], username: st
 
 
 def download_gecko_32_msi_files(wine_prefix: Union[str, pathlib.Path], username: str, quiet: bool = False) -> None:
-    path_wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username)
     path_gecko_32_msi_filename = get_gecko_32_filename_from_appwiz(wine_prefix, username)
     gecko_download_link = get_gecko_download_link(path_gecko_32_msi_filename)
     gecko_backup_download_link = get_gecko_backup_download_link(path_gecko_32_msi_filename)
-    try:
-        configmagick_linux.download_file(gecko_download_link, path_wine_cache_directory / path_gecko_32_msi_filename, use_sudo=True, quiet=quiet)
-    except subprocess.CalledProcessError:
-        configmagick_linux.download_file(gecko_backup_download_link, path_wine_cache_directory / path_gecko_32_msi_filename, use_sudo=True, quiet=quiet)
+    lib_wine.download_file_to_winecache_from_links(l_download_links=[gecko_download_link, gecko_backup_download_link],
+                                                   filename=path_gecko_32_msi_filename, username=username)
 
 
 def download_gecko_64_msi_files(wine_prefix: Union[str, pathlib.Path], username: str, quiet: bool = False) -> None:
-    path_wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username)
     path_gecko_64_msi_filename = get_gecko_64_filename_from_appwiz(wine_prefix, username)
     gecko_download_link = get_gecko_download_link(path_gecko_64_msi_filename)
     gecko_backup_download_link = get_gecko_backup_download_link(path_gecko_64_msi_filename)
-    try:
-        configmagick_linux.download_file(gecko_download_link, path_wine_cache_directory / path_gecko_64_msi_filename, use_sudo=True, quiet=quiet)
-    except subprocess.CalledProcessError:
-        configmagick_linux.download_file(gecko_backup_download_link, path_wine_cache_directory / path_gecko_64_msi_filename, use_sudo=True, quiet=quiet)
+    lib_wine.download_file_to_winecache_from_links(l_download_links=[gecko_download_link, gecko_backup_download_link],
+                                                   filename=path_gecko_64_msi_filename, username=username)
 
 
 def get_gecko_download_link(path_gecko_msi_filename: Union[str, pathlib.Path]) -> str:
@@ -137,6 +179,13 @@ def get_gecko_backup_download_link(path_gecko_msi_filename: Union[str, pathlib.P
     return gecko_backup_download_link
 
 
+def is_gecko_version_installed(wine_prefix: Union[str, pathlib.Path], path_gecko_msi_filename: pathlib.Path, username: str) -> bool:
+    """ read from the gecko directory or the Uninstall keys, without starting wine """
+    component = 'gecko_64' if get_gecko_arch_from_path_gecko_msi_filename(path_gecko_msi_filename) == 'x86_64' else 'gecko'
+    component_version = lib_wine_versions.get_component_version(wine_prefix=wine_prefix, component=component, username=username)
+    return component_version is not None and component_version.version == get_gecko_version_from_path_gecko_msi_filename(path_gecko_msi_filename)
+
+
 def get_gecko_version_from_path_gecko_msi_filename(path_gecko_msi_filename: Union[str, pathlib.Path]) -> str:
     """
     wine_gecko-2.47-x86.msi --> 2.47
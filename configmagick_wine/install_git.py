@@ -11,14 +11,29 @@ import lib_shell
 # ####### PROJ
 try:
     # imports for local pytest
+    from . import lib_apt               # type: ignore # pragma: no cover
+    from . import lib_download          # type: ignore # pragma: no cover
+    from . import lib_mirror            # type: ignore # pragma: no cover
     from . import lib_wine              # type: ignore # pragma: no cover
+    from . import lib_wine_versions     # type: ignore # pragma: no cover
+    from . import lib_wine_cache        # type: ignore # pragma: no cover
     from . import install_wine          # type: ignore # pragma: no cover
     from . import install_wine_machine  # type: ignore # pragma: no cover
 except ImportError:                     # type: ignore # pragma: no cover
     # imports for doctest
     # noinspection PyUnresolvedReferences
+    import lib_apt                      # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_download                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_mirror                   # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import lib_wine                     # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
+    import lib_wine_versions            # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache               # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import install_wine                 # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_wine_machine                 # type: ignore # pragma: no cover
@@ -35,8 +50,7 @@ def install_git(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_p
     >>> install_git(wine_prefix='wine_test_64', quiet=True)
 
     """
-    configmagick_linux.full_update_and_upgrade(quiet=quiet)
-    configmagick_linux.install_linux_package('p7zip-full', quiet=quiet)
+    lib_apt.install_linux_packages(['p7zip-full'], quiet=quiet)
     wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
     wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
     wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username=username)
@@ -55,6 +69,7 @@ def install_git(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_p
     download_latest_git_files_from_github_to_winecache(wine_prefix=wine_prefix, username=username, quiet=quiet)
     lib_log_utils.log_verbose('Install "{path_git_filename}" on WINEPREFIX="{wine_prefix}"'
                               .format(path_git_filename=path_git_filename, wine_prefix=wine_prefix), quiet=quiet)
+    lib_wine_cache.record_wine_cache_access(filename=path_git_filename, username=username, wine_prefix=wine_prefix)
 
     path_git_install_dir = wine_prefix / 'drive_c/Program Files/PortableGit'
 
@@ -68,13 +83,11 @@ def install_git(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_p
     lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
     lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)   # it is cheap, just in case
     lib_wine.prepend_path_to_wine_registry_path(path_to_add='C:\\Program Files\\PortableGit', wine_prefix=wine_prefix, username=username)
-    # we need to use wineconsole here
-    command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wineconsole git --version'.format(wine_prefix=wine_prefix, wine_arch=wine_arch)
-    try:
-        lib_shell.run_shell_command(command, run_as_user=username, quiet=True, shell=True)
-        lib_log_utils.banner_success('Git installed')
-    except subprocess.CalledProcessError:
+    # read from git.exe, git is started only if the file does not tell the version
+    component_version = lib_wine_versions.get_component_version(wine_prefix=wine_prefix, component='git', username=username, use_wine=True)
+    if component_version is None or not component_version.version:
         raise RuntimeError('can not install git portable on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix))
+    lib_log_utils.banner_success('Git installed')
 
 
 def download_latest_git_files_from_github_to_winecache(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
@@ -119,17 +132,11 @@ def get_git_portable_download_link_from_github(wine_arch: str) -> str:
     subprocess.CalledProcessError: ...
 
     """
-    filename = configmagick_linux.get_path_home_dir_current_user() / 'git-latest-release.html'
-    try:
-        download_link = 'https://github.com/git-for-windows/git/releases/latest'
-        configmagick_linux.download_file(download_link=download_link, filename=filename)
-        link = lib_shell.run_shell_command('fgrep "PortableGit-" "{filename}" | fgrep "{bit}-bit.7z.exe" | fgrep "href="'
-                                           .format(filename=filename, bit=wine_arch[3:]),
-                                           shell=True, quiet=True, use_sudo=True).stdout
-        link = link.split('href="', 1)[1]
-        link = 'https://github.com' + link.split('"', 1)[0]
-    finally:
-        lib_shell.run_shell_command('rm -f "{filename}"'.format(filename=filename), shell=True, quiet=True, use_sudo=True)
+    download_link = 'https://github.com/git-for-windows/git/releases/latest'
+    link = lib_download.get_line_containing(lib_mirror.download_text(download_link=download_link, quiet=True),
+                                            ['PortableGit-', '{bit}-bit.7z.exe'.format(bit=wine_arch[3:]), 'href='])
+    link = link.split('href="', 1)[1]
+    link = 'https://github.com' + link.split('"', 1)[0]
     return str(link)
 
 
@@ -1,6 +1,5 @@
 # ### STDLIB
 import pathlib
-import subprocess
 from typing import Union
 
 # ### OWN
@@ -11,21 +10,33 @@ import lib_shell
 # ####### PROJ
 try:
     # imports for local pytest
+    from . import lib_download          # type: ignore # pragma: no cover
+    from . import lib_mirror            # type: ignore # pragma: no cover
     from . import lib_wine              # type: ignore # pragma: no cover
+    from . import lib_wine_msi          # type: ignore # pragma: no cover
+    from . import lib_wine_versions     # type: ignore # pragma: no cover
     from . import install_wine          # type: ignore # pragma: no cover
     from . import install_wine_machine  # type: ignore # pragma: no cover
 except ImportError:                     # type: ignore # pragma: no cover
     # imports for doctest
     # noinspection PyUnresolvedReferences
+    import lib_download                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_mirror                   # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import lib_wine                     # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
+    import lib_wine_msi                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_versions            # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import install_wine                 # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_wine_machine                 # type: ignore # pragma: no cover
 
 
 def install_mono_latest(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
-                        username: str = configmagick_linux.get_current_username(), quiet: bool = False) -> None:
+                        username: str = configmagick_linux.get_current_username(), ui_level: str = '', quiet: bool = False) -> None:
     """
     install the latest mono version from github
 
@@ -38,6 +49,10 @@ def install_mono_latest(wine_prefix: Union[str, pathlib.Path] = configmagick_lin
     wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
     mono_download_link = get_wine_mono_download_link_from_github()
     mono_msi_filename = pathlib.Path(mono_download_link.rsplit('/', 1)[1])
+    if is_mono_version_installed(wine_prefix=wine_prefix, mono_msi_filename=mono_msi_filename, username=username):
+        lib_log_utils.banner_success('Wine Mono "{mono_msi_filename}" is already installed on WINEPREFIX="{wine_prefix}"'
+                                     .format(mono_msi_filename=mono_msi_filename, wine_prefix=wine_prefix), quiet=quiet)
+        return
     wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username=username)
     lib_log_utils.banner_verbose('Installing Wine Mono :\n'
                                  'WINEPREFIX="{wine_prefix}"\n'
@@ -52,22 +67,12 @@ def install_mono_latest(wine_prefix: Union[str, pathlib.Path] = configmagick_lin
 
     download_latest_mono_msi_files_from_github(username=username, force_download=False, quiet=quiet)
 
-    lib_log_utils.log_verbose('Install "{mono_msi_filename}" on WINEPREFIX="{wine_prefix}"'
-                              .format(mono_msi_filename=mono_msi_filename, wine_prefix=wine_prefix),
-                              quiet=quiet)
-
-    command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine msiexec /i "{wine_cache_directory}/{mono_msi_filename}"'\
-        .format(wine_prefix=wine_prefix,
-                wine_arch=wine_arch,
-                wine_cache_directory=wine_cache_directory,
-                mono_msi_filename=mono_msi_filename)
-    lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
-    lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)  # it is cheap, just in case
+    lib_wine_msi.install_msi_files_from_wine_cache([mono_msi_filename], wine_prefix=wine_prefix, username=username, ui_level=ui_level, quiet=quiet)
     lib_log_utils.banner_success('Wine Mono "{mono_msi_filename}" installed'.format(mono_msi_filename=mono_msi_filename))
 
 
 def install_mono_recommended(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
-                             username: str = configmagick_linux.get_current_username(), quiet: bool = False) -> None:
+                             username: str = configmagick_linux.get_current_username(), ui_level: str = '', quiet: bool = False) -> None:
     """ Installs the mono version stated in appwiz.cpl - might be not the newest version, se we should prefer to install the latest wine-mono from github
     Mono version can only be extracted from wine prefixes created with wine version 4.18 upwards, on older version this does not work
 
@@ -79,6 +84,10 @@ def install_mono_recommended(wine_prefix: Union[str, pathlib.Path] = configmagic
     wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
     wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
     mono_msi_filename = get_mono_msi_filename_from_appwiz(wine_prefix=wine_prefix, username=username)
+    if is_mono_version_installed(wine_prefix=wine_prefix, mono_msi_filename=mono_msi_filename, username=username):
+        lib_log_utils.banner_success('Wine Mono "{mono_msi_filename}" is already installed on WINEPREFIX="{wine_prefix}"'
+                                     .format(mono_msi_filename=mono_msi_filename, wine_prefix=wine_prefix), quiet=quiet)
+        return
     wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username=username)
     lib_log_utils.banner_verbose('Installing Wine Mono :\n'
                                  'WINEPREFIX="{wine_prefix}"\n'
@@ -92,15 +101,7 @@ def install_mono_recommended(wine_prefix: Union[str, pathlib.Path] = configmagic
                                  quiet=quiet)
 
     download_mono_msi_files_from_appwiz(wine_prefix=wine_prefix, username=username, force_download=False, quiet=quiet)
-
-    command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine msiexec /i "{wine_cache_directory}/{mono_msi_filename}"'\
-        .format(wine_prefix=wine_prefix,
-                wine_arch=wine_arch,
-                wine_cache_directory=wine_cache_directory,
-                mono_msi_filename=mono_msi_filename)
-
-    lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
-    lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)  # it is cheap, just in case
+    lib_wine_msi.install_msi_files_from_wine_cache([mono_msi_filename], wine_prefix=wine_prefix, username=username, ui_level=ui_level, quiet=quiet)
 
 
 def download_latest_mono_msi_files_from_github(username: str, force_download: bool = False, quiet: bool = False) -> None:
@@ -132,15 +133,11 @@ def download_mono_msi_files_from_appwiz(wine_prefix: Union[str, pathlib.Path], u
     if lib_wine.is_file_in_wine_cache(filename=mono_msi_filename, username=username) or force_download:
         if force_download:
             lib_wine.remove_file_from_winecache(filename=mono_msi_filename, username=username)
-            try:
-                lib_wine.download_file_to_winecache(download_link=mono_download_link, filename=mono_msi_filename, username=username)
-            except subprocess.CalledProcessError:
-                lib_wine.download_file_to_winecache(download_link=mono_download_link_backup, filename=mono_msi_filename, username=username)
+            lib_wine.download_file_to_winecache_from_links(l_download_links=[mono_download_link, mono_download_link_backup],
+                                                           filename=mono_msi_filename, username=username)
     else:
-        try:
-            lib_wine.download_file_to_winecache(download_link=mono_download_link, filename=mono_msi_filename, username=username)
-        except subprocess.CalledProcessError:
-            lib_wine.download_file_to_winecache(download_link=mono_download_link_backup, filename=mono_msi_filename, username=username)
+        lib_wine.download_file_to_winecache_from_links(l_download_links=[mono_download_link, mono_download_link_backup],
+                                                       filename=mono_msi_filename, username=username)
 
 
 def get_mono_msi_filename_from_appwiz(wine_prefix: Union[str, pathlib.Path],
@@ -199,19 +196,19 @@ def get_wine_mono_download_link_from_github() -> str:
     >>> get_wine_mono_download_link_from_github()  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
     'https://github.com//madewokherd/wine-mono/releases/download/wine-mono-.../wine-mono-...msi'
     """
-    filename = configmagick_linux.get_path_home_dir_current_user() / 'mono-latest-release.html'
-    try:
-        download_link = 'https://github.com/madewokherd/wine-mono/releases/latest'
-        configmagick_linux.download_file(download_link=download_link, filename=filename)
-        link = lib_shell.run_shell_command('fgrep ".msi" "{filename}" | fgrep "wine-mono" | fgrep "href="'
-                                           .format(filename=filename), shell=True, quiet=True, use_sudo=True).stdout
-        link = link.split('href="', 1)[1]
-        link = 'https://github.com/' + link.split('"', 1)[0]
-    finally:
-        lib_shell.run_shell_command('rm -f "{filename}"'.format(filename=filename), shell=True, quiet=True, use_sudo=True)
+    download_link = 'https://github.com/madewokherd/wine-mono/releases/latest'
+    link = lib_download.get_line_containing(lib_mirror.download_text(download_link=download_link, quiet=True), ['.msi', 'wine-mono', 'href='])
+    link = link.split('href="', 1)[1]
+    link = 'https://github.com/' + link.split('"', 1)[0]
     return str(link)
 
 
+def is_mono_version_installed(wine_prefix: pathlib.Path, mono_msi_filename: pathlib.Path, username: str) -> bool:
+    """ read from the Uninstall keys, without starting wine """
+    component_version = lib_wine_versions.get_component_version(wine_prefix=wine_prefix, component='mono', username=username)
+    return component_version is not None and component_version.version == get_mono_version_from_msi_filename(mono_msi_filename)
+
+
 def get_mono_version_from_msi_filename(path_mono_msi_filename: Union[str, pathlib.Path]) -> str:
     """
     >>> assert get_mono_version_from_msi_filename(path_mono_msi_filename='wine-mono-4.9.3.msi') == '4.9.3'
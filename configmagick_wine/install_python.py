@@ -1,6 +1,5 @@
 # ### STDLIB
 import pathlib
-import subprocess
 from typing import Union
 
 # ### OWN
@@ -11,14 +10,29 @@ import lib_shell
 # ####### PROJ
 try:
     # imports for local pytest
+    from . import lib_download          # type: ignore # pragma: no cover
+    from . import lib_mirror            # type: ignore # pragma: no cover
     from . import lib_wine              # type: ignore # pragma: no cover
+    from . import lib_wine_versions     # type: ignore # pragma: no cover
+    from . import lib_wine_cache        # type: ignore # pragma: no cover
+    from . import lib_wine_display      # type: ignore # pragma: no cover
     from . import install_wine          # type: ignore # pragma: no cover
     from . import install_wine_machine  # type: ignore # pragma: no cover
 except ImportError:                     # type: ignore # pragma: no cover
     # imports for doctest
     # noinspection PyUnresolvedReferences
+    import lib_download                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_mirror                   # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import lib_wine                     # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
+    import lib_wine_versions            # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache               # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_display             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import install_wine                 # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_wine_machine                 # type: ignore # pragma: no cover
@@ -61,6 +75,10 @@ def install_python(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.ge
     wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
     if python_version == 'latest':
         python_version = get_latest_python_version()
+    if is_python_version_installed(wine_prefix=wine_prefix, python_version=python_version, username=username):
+        lib_log_utils.banner_success('Python {python_version} is already installed on WINEPREFIX="{wine_prefix}"'
+                                     .format(python_version=python_version, wine_prefix=wine_prefix), quiet=quiet)
+        return
     path_python_filename = get_path_python_exe_filename(version=python_version, arch=wine_arch)
     wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username=username)
     lib_log_utils.banner_verbose('Installing Python :\n'
@@ -78,26 +96,33 @@ def install_python(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.ge
 
     lib_log_utils.log_verbose('Install "{path_python_filename}" on WINEPREFIX="{wine_prefix}"'
                               .format(path_python_filename=path_python_filename, wine_prefix=wine_prefix), quiet=quiet)
-
-    command = 'DISPLAY="{display}" WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" '\
-              'wineconsole "{wine_cache_directory}/{path_python_filename}" '\
-              '/quiet InstallAllUsers=1 PrependPath=1 Include_test=0'\
-        .format(wine_prefix=wine_prefix,
-                wine_arch=wine_arch,
-                wine_cache_directory=wine_cache_directory,
-                path_python_filename=path_python_filename,
-                display=configmagick_linux.get_env_display())
-
-    lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    lib_wine_cache.record_wine_cache_access(filename=path_python_filename, username=username, wine_prefix=wine_prefix)
+
+    # wineconsole needs a display - concurrent installations get their own Xvfb display from the pool
+    with lib_wine_display.leased_display() as display:
+        command = 'DISPLAY="{display}" WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" '\
+                  'wineconsole "{wine_cache_directory}/{path_python_filename}" '\
+                  '/quiet InstallAllUsers=1 PrependPath=1 Include_test=0'\
+            .format(wine_prefix=wine_prefix,
+                    wine_arch=wine_arch,
+                    wine_cache_directory=wine_cache_directory,
+                    path_python_filename=path_python_filename,
+                    display=display)
+
+        lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
     lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)
 
-    command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine python --version'.format(wine_prefix=wine_prefix, wine_arch=wine_arch)
-    try:
-        result = lib_shell.run_shell_command(command, run_as_user=username, quiet=True, shell=True)
-        assert result.stdout.startswith('Python')
-        lib_log_utils.banner_success('{python_version} installed OK'.format(python_version=result.stdout))
-    except (subprocess.CalledProcessError, AssertionError):
+    # read from python.exe, python is started only if the files do not tell the version
+    component_version = lib_wine_versions.get_component_version(wine_prefix=wine_prefix, component='python', username=username, use_wine=True)
+    if component_version is None or not component_version.version:
         raise RuntimeError('can not install Python on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix))
+    lib_log_utils.banner_success('Python {python_version} installed OK'.format(python_version=component_version.version))
+
+
+def is_python_version_installed(wine_prefix: pathlib.Path, python_version: str, username: str) -> bool:
+    """ read from python.exe, without starting wine """
+    component_version = lib_wine_versions.get_component_version(wine_prefix=wine_prefix, component='python', username=username)
+    return component_version is not None and component_version.version == python_version
 
 
 def get_latest_python_version() -> str:
@@ -111,13 +136,10 @@ def get_latest_python_version() -> str:
     >>> assert get_latest_python_version().startswith('3')
     """
     # noinspection PyBroadException
-    filename = configmagick_linux.get_path_home_dir_current_user() / 'python-latest-release.html'
     try:
         download_link = 'https://www.python.org/downloads/windows/'
-        configmagick_linux.download_file(download_link=download_link, filename=filename)
-
-        s_version = lib_shell.run_shell_command('fgrep "Latest Python 3 Release" "{filename}" | fgrep "href="'
-                                                .format(filename=filename), shell=True, quiet=True, use_sudo=True).stdout
+        s_version = lib_download.get_line_containing(lib_mirror.download_text(download_link=download_link, quiet=True),
+                                                     ['Latest Python 3 Release', 'href='])
         # <li><a href="/downloads/release/python-380/">Latest Python 3 Release - Python 3.8.0</a></li>
         s_version = s_version.rsplit('Latest Python 3 Release', 1)[1]    # - Python 3.8.0</a></li>
         s_version = s_version.split('Python', 1)[1].strip()  # 3.8.0</a></li>
@@ -125,8 +147,6 @@ def get_latest_python_version() -> str:
     except Exception:
         lib_log_utils.log_warning('can not determine latest Python Version, assuming Version 3.8.0')
         s_version = '3.8.0'
-    finally:
-        lib_shell.run_shell_command('rm -f "{filename}"'.format(filename=filename), shell=True, quiet=True, use_sudo=True)
     return str(s_version)
 
 
@@ -164,15 +184,11 @@ def get_python_exe_backup_download_link(version: str, arch: str = 'win32') -> st
     """
     # noinspection PyBroadException
     arch = lib_wine.get_and_check_wine_arch_valid(arch)
-    filename = configmagick_linux.get_path_home_dir_current_user() / 'python-latest-release.html'
     path_python_filename = get_path_python_exe_filename(version=version, arch=arch)
     try:
         download_link = 'https://www.python.org/downloads/windows/'
-        configmagick_linux.download_file(download_link=download_link, filename=filename)
-
-        python_backup_download_link = lib_shell.run_shell_command('fgrep "{path_python_filename}" "{filename}" | fgrep "href="'
-                                                                  .format(filename=filename, path_python_filename=path_python_filename),
-                                                                  shell=True, quiet=True, use_sudo=True).stdout
+        python_backup_download_link = lib_download.get_line_containing(lib_mirror.download_text(download_link=download_link, quiet=True),
+                                                                       [str(path_python_filename), 'href='])
         # <li>Download <a href="https://www.python.org/ftp/python/3.8.0/python-3.8.0-amd64.exe">Windows x86-64 executable installer</a></li>
         python_backup_download_link = python_backup_download_link.split('<a href="')[1]
         # https://www.python.org/ftp/python/3.8.0/python-3.8.0-amd64.exe">Windows x86-64 executable installer</a></li>
@@ -180,8 +196,6 @@ def get_python_exe_backup_download_link(version: str, arch: str = 'win32') -> st
         # https://www.python.org/ftp/python/3.8.0/python-3.8.0-amd64.exe
     except Exception:
         raise RuntimeError('can not get Download Link for Python {path_python_filename}'.format(path_python_filename=path_python_filename))
-    finally:
-        lib_shell.run_shell_command('rm -f "{filename}"'.format(filename=filename), shell=True, quiet=True, use_sudo=True)
     return str(python_backup_download_link)
 
 
@@ -243,7 +257,5 @@ def download_python_exe_file(python_version: str, wine_prefix: Union[str, pathli
         else:
             return
 
-    try:
-        lib_wine.download_file_to_winecache(download_link=python_download_link, filename=path_python_filename, username=username)
-    except subprocess.CalledProcessError:
-        lib_wine.download_file_to_winecache(download_link=python_backup_download_link, filename=path_python_filename, username=username)
+    lib_wine.download_file_to_winecache_from_links(l_download_links=[python_download_link, python_backup_download_link],
+                                                   filename=path_python_filename, username=username)
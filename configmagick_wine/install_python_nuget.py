@@ -1,6 +1,5 @@
 # ### STDLIB
 import pathlib
-import subprocess
 from typing import Union
 
 # ### OWN
@@ -12,6 +11,8 @@ import lib_shell
 try:
     # imports for local pytest
     from . import lib_wine              # type: ignore # pragma: no cover
+    from . import lib_wine_display      # type: ignore # pragma: no cover
+    from . import lib_wine_versions     # type: ignore # pragma: no cover
     from . import install_wine          # type: ignore # pragma: no cover
     from . import install_wine_machine  # type: ignore # pragma: no cover
 except ImportError:                     # type: ignore # pragma: no cover
@@ -19,6 +20,10 @@ except ImportError:                     # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import lib_wine                     # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
+    import lib_wine_display             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_versions            # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import install_wine                 # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_wine_machine                 # type: ignore # pragma: no cover
@@ -78,28 +83,28 @@ def install_python_nuget(wine_prefix: Union[str, pathlib.Path] = configmagick_li
 
     lib_log_utils.log_verbose('Install Python on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix), quiet=quiet)
 
-    command = 'DISPLAY="{display}" WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" '\
-              'wineconsole "{wine_cache_directory}/{path_nuget_filename}" '\
-              'install {python_version} -ExcludeVersion -OutputDirectory "C:\\Program Files"'\
-        .format(display=configmagick_linux.get_env_display(),
-                wine_prefix=wine_prefix,
-                wine_arch=wine_arch,
-                wine_cache_directory=wine_cache_directory,
-                path_nuget_filename=path_nuget_filename,
-                python_version=python_version)
-
-    lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    # wineconsole needs a display - concurrent installations get their own Xvfb display from the pool
+    with lib_wine_display.leased_display() as display:
+        command = 'DISPLAY="{display}" WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" '\
+                  'wineconsole "{wine_cache_directory}/{path_nuget_filename}" '\
+                  'install {python_version} -ExcludeVersion -OutputDirectory "C:\\Program Files"'\
+            .format(display=display,
+                    wine_prefix=wine_prefix,
+                    wine_arch=wine_arch,
+                    wine_cache_directory=wine_cache_directory,
+                    path_nuget_filename=path_nuget_filename,
+                    python_version=python_version)
+
+        lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
     lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)
     lib_wine.prepend_path_to_wine_registry_path('C:\\Program Files\\{python_version}\\tools'.format(python_version=python_version),
                                                 wine_prefix=wine_prefix, username=username)
 
-    command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine python --version'.format(wine_prefix=wine_prefix, wine_arch=wine_arch)
-    try:
-        result = lib_shell.run_shell_command(command, run_as_user=username, quiet=True, shell=True)
-        assert result.stdout.startswith('Python')
-        lib_log_utils.banner_success('{python_version} installed OK'.format(python_version=result.stdout))
-    except (subprocess.CalledProcessError, AssertionError):
+    # read from python.exe, python is started only if the files do not tell the version
+    component_version = lib_wine_versions.get_component_version(wine_prefix=wine_prefix, component='python', username=username, use_wine=True)
+    if component_version is None or not component_version.version:
         raise RuntimeError('can not install Python on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix))
+    lib_log_utils.banner_success('Python {python_version} installed OK'.format(python_version=component_version.version))
 
 
 def download_nuget(username: str = configmagick_linux.get_current_username(), force_download: bool = False) -> None:
@@ -1,6 +1,7 @@
 # ### STDLIB
 import pathlib
 import subprocess
+import time
 from typing import Union
 
 # ### OWN
@@ -12,6 +13,7 @@ import lib_shell
 try:
     # imports for local pytest
     from . import lib_wine              # type: ignore # pragma: no cover
+    from . import lib_wine_pip          # type: ignore # pragma: no cover
     from . import install_wine          # type: ignore # pragma: no cover
     from . import install_wine_machine  # type: ignore # pragma: no cover
 except ImportError:                     # type: ignore # pragma: no cover
@@ -19,20 +21,28 @@ except ImportError:                     # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import lib_wine                     # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
+    import lib_wine_pip                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
     import install_wine                 # type: ignore # pragma: no cover
     # noinspection PyUnresolvedReferences
     import install_wine_machine                 # type: ignore # pragma: no cover
 
 
+# get-pip.py has no version in the name, a new pip gets a new get-pip.py - the cached one is downloaded again after that time
+GET_PIP_MAX_AGE_SECONDS = 7 * 86400
+
+
 def install_python_setuptools(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
                               username: str = configmagick_linux.get_current_username(),
+                              force_download: bool = False,
                               quiet: bool = False) -> None:
-
-
+    """ install pip and setuptools with get-pip.py, use force_download to get a new get-pip.py """
     wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
     wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
     wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username=username)
-    download_get_pip(username=username)
+    download_get_pip(username=username, force_download=force_download)
+    # pip, setuptools and wheel come from the wheel cache, if it has them
+    lib_wine_pip.map_wheel_cache_into_prefix(wine_prefix=wine_prefix, username=username, quiet=True)
     command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine python "{wine_cache_directory}/get-pip.py"'.format(
         wine_prefix=wine_prefix, wine_arch=wine_arch, wine_cache_directory=wine_cache_directory)
     lib_shell.run_shell_command(command, run_as_user=username, quiet=True, shell=True)
@@ -52,8 +62,10 @@ def download_setup_tools(username: str = configmagick_linux.get_current_username
     lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
 
 
-def download_get_pip(username: str) -> None:
-    """
+def download_get_pip(username: str, force_download: bool = False) -> None:
+    """ get-pip.py is downloaded again if it is older than GET_PIP_MAX_AGE_SECONDS, use force_download to get a new one now.
+    the age is the ctime - the time the file was downloaded, or linked into the cache from the node cache
+
     >>> username = configmagick_linux.get_current_username()
     >>> download_get_pip(username=username)
     >>> wine_cache_directory = lib_wine.get_path_wine_cache_for_user(username=username)
@@ -62,4 +74,10 @@ def download_get_pip(username: str) -> None:
     """
     download_link = 'https://bootstrap.pypa.io/get-pip.py'
     filename = pathlib.Path('get-pip.py')
+    if lib_wine.is_file_in_wine_cache(filename=filename, username=username):
+        path_get_pip = lib_wine.get_path_wine_cache_for_user(username=username) / filename
+        if force_download or time.time() - path_get_pip.stat().st_ctime > GET_PIP_MAX_AGE_SECONDS:
+            lib_wine.remove_file_from_winecache(filename=filename, username=username)
+        else:
+            return
     lib_wine.download_file_to_winecache(download_link=download_link, filename=filename, username=username)
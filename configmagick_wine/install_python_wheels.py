@@ -0,0 +1,373 @@
+# ### STDLIB
+import base64
+import csv
+import hashlib
+import io
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import zipfile
+from typing import Dict, List, Sequence, Set, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_cache                # type: ignore # pragma: no cover
+    from . import lib_wine_pip                  # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+    from . import install_python_embedded       # type: ignore # pragma: no cover
+    from . import install_wine_machine          # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_pip                         # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_python_embedded              # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_wine_machine                 # type: ignore # pragma: no cover
+
+
+# written to the INSTALLER file of the .dist-info directory, like pip writes 'pip'
+WHEEL_INSTALLER_NAME = 'configmagick_wine'
+# the directories of '<name>-<version>.data/<scheme>' of a wheel, relative to site-packages
+D_WHEEL_DATA_SCHEMES = {'purelib': '', 'platlib': '', 'scripts': '../../Scripts', 'headers': '../../include', 'data': '../..'}
+# the signatures of RECORD, the only files of a wheel which are not listed in RECORD
+L_WHEEL_RECORD_SIGNATURE_FILES = ['RECORD.jws', 'RECORD.p7s']
+# name-version(-build)-python-abi-platform.whl
+WHEEL_FILENAME_PATTERN = re.compile(r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-(?P<build>\d[^-]*))?-(?P<python>[^-]+)-(?P<abi>[^-]+)-(?P<platform>[^-]+)\.whl$')
+
+
+def install_python_requirements(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                                requirements_file: Union[str, pathlib.Path] = 'requirements.txt',
+                                username: str = configmagick_linux.get_current_username(),
+                                no_index: bool = False,
+                                quiet: bool = False) -> None:
+    """ install the requirements into the embedded python of the prefix, without running pip under wine.
+    the windows wheels are resolved by the pip of the linux python, from the wheel cache (see lib_wine_pip) and pypi - with no_index only from the wheel cache.
+    syntax: install_python_requirements --wine_prefix=<prefix> --requirements_file=<file> [--no_index]
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
+    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
+    path_python = get_path_python_embedded(wine_prefix)
+    python_version = get_python_version_from_path_python_embedded(path_python)
+    path_wheel_cache = lib_wine_pip.create_wheel_cache(username=username)
+    lib_log_utils.banner_verbose('Installing the requirements "{requirements_file}" into "{path_python}"'
+                                 .format(requirements_file=requirements_file, path_python=path_python), quiet=quiet)
+    with tempfile.TemporaryDirectory() as path_download_dir:
+        command = lib_wine_pip.get_pip_download_command(['-r "{requirements_file}"'.format(requirements_file=pathlib.Path(requirements_file).resolve())],
+                                                        path_wheel_cache=pathlib.Path(path_download_dir), python_version=python_version,
+                                                        wine_arch=wine_arch)
+        command = command + ' --find-links "{path_wheel_cache}"'.format(path_wheel_cache=path_wheel_cache)
+        if no_index:
+            command = command + ' --no-index'
+        lib_shell.run_shell_command(command, shell=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
+        l_paths_wheel_files = sorted(pathlib.Path(path_download_dir).glob('*.whl'))
+        add_wheel_files_to_wheel_cache(l_paths_wheel_files, path_wheel_cache=path_wheel_cache)
+        install_python_wheels(wine_prefix=wine_prefix, l_wheel_files=l_paths_wheel_files, username=username, quiet=quiet)
+
+
+def install_python_wheels(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                          l_wheel_files: Sequence[Union[str, pathlib.Path]] = (),
+                          username: str = configmagick_linux.get_current_username(),
+                          quiet: bool = False) -> None:
+    """ unpack pure python and win32 / win_amd64 wheels straight into Lib/site-packages of the embedded python of the prefix.
+    an installed other version of the same distribution is removed first. console script launchers (.exe) are not created,
+    'python -m <module>' works instead. dependencies are not resolved, see install_python_requirements
+    syntax: install_python_wheels --wine_prefix=<prefix> --l_wheel_files=[<wheel>,<wheel>]
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
+    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
+    path_python = get_path_python_embedded(wine_prefix)
+    python_version = get_python_version_from_path_python_embedded(path_python)
+    set_supported_tags = get_set_supported_wheel_tags(python_version=python_version, platform=lib_wine_pip.D_WHEEL_PLATFORMS[wine_arch])
+    l_paths_wheel_files = [pathlib.Path(wheel_file) for wheel_file in l_wheel_files]
+    l_incompatible_wheels = [path_wheel_file.name for path_wheel_file in l_paths_wheel_files
+                             if not is_wheel_compatible(path_wheel_file.name, set_supported_tags)]
+    if l_incompatible_wheels:
+        raise RuntimeError('the wheels {wheels} are not compatible with Python {python_version} {wine_arch} on WINEPREFIX="{wine_prefix}"'
+                           .format(wheels=', '.join(l_incompatible_wheels), python_version=python_version, wine_arch=wine_arch, wine_prefix=wine_prefix))
+
+    install_python_embedded.uncomment_import_site(str(path_python))
+    path_site_packages = path_python / 'Lib/site-packages'
+    if not lib_wine_plan.is_plan_mode():
+        path_site_packages.mkdir(parents=True, exist_ok=True)
+    for path_wheel_file in l_paths_wheel_files:
+        lib_log_utils.log_verbose('Install "{wheel}" into "{path_site_packages}"'.format(wheel=path_wheel_file.name, path_site_packages=path_site_packages),
+                                  quiet=quiet)
+        install_wheel(path_wheel_file, path_site_packages=path_site_packages)
+    lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)
+    lib_log_utils.banner_success('{n_wheels} wheels installed into "{path_python}"'.format(n_wheels=len(l_paths_wheel_files), path_python=path_python),
+                                 quiet=quiet)
+
+
+def install_wheel(path_wheel_file: pathlib.Path, path_site_packages: pathlib.Path) -> None:
+    """ unpack a wheel into site-packages, check the hashes of its RECORD, and write RECORD and INSTALLER with the installed paths.
+    a file which is not listed in RECORD is refused, like a file with a wrong hash
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path_test_dir:
+    ...     path_wheel_file = pathlib.Path(path_test_dir) / 'demo-1.0-py3-none-any.whl'
+    ...     path_site_packages = pathlib.Path(path_test_dir) / 'python/Lib/site-packages'
+    ...     path_site_packages.mkdir(parents=True)
+    ...     write_test_wheel(path_wheel_file, {'demo/__init__.py': b'x = 1', 'demo-1.0.data/scripts/demo.cmd': b'@echo demo'})
+    ...     install_wheel(path_wheel_file, path_site_packages)
+    ...     print((path_site_packages / 'demo/__init__.py').read_text(), (path_site_packages / '../../Scripts/demo.cmd').resolve().name)
+    ...     print((path_site_packages / 'demo-1.0.dist-info/INSTALLER').read_text().strip())
+    ...     print(sorted(row[0] for row in csv.reader(io.StringIO((path_site_packages / 'demo-1.0.dist-info/RECORD').read_text()))))
+    x = 1 demo.cmd
+    configmagick_wine
+    ['../../Scripts/demo.cmd', 'demo-1.0.dist-info/INSTALLER', 'demo-1.0.dist-info/RECORD', 'demo-1.0.dist-info/WHEEL', 'demo/__init__.py']
+
+    >>> import unittest
+    >>> with tempfile.TemporaryDirectory() as path_test_dir:
+    ...     path_wheel_file = pathlib.Path(path_test_dir) / 'demo-1.0-py3-none-any.whl'
+    ...     write_test_wheel(path_wheel_file, {'demo/__init__.py': b'x = 1'})
+    ...     with zipfile.ZipFile(str(path_wheel_file), mode='a') as wheel_zip_file:
+    ...         wheel_zip_file.writestr('demo/unlisted.py', b'x = 2')
+    ...     unittest.TestCase().assertRaises(RuntimeError, install_wheel, path_wheel_file, pathlib.Path(path_test_dir) / 'site-packages')
+
+    """
+    match = WHEEL_FILENAME_PATTERN.match(path_wheel_file.name)
+    if not match:
+        raise RuntimeError('"{wheel}" is not a wheel filename'.format(wheel=path_wheel_file.name))
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('file', description='unpack "{wheel}" into "{path_site_packages}"'
+                                    .format(wheel=path_wheel_file.name, path_site_packages=path_site_packages), step_key='', expected_seconds=0.0)
+        return
+    with zipfile.ZipFile(str(path_wheel_file)) as wheel_zip_file:
+        l_names = wheel_zip_file.namelist()
+        dist_info_dir = get_wheel_dist_info_dir(l_names, wheel=path_wheel_file.name)
+        data_dir = dist_info_dir[:-len('.dist-info')] + '.data'
+        d_record_hashes = get_d_wheel_record_hashes(wheel_zip_file.read(dist_info_dir + '/RECORD').decode('utf-8'))
+        remove_installed_distribution(path_site_packages, distribution_name=match.group('name'))
+
+        l_records = list()  # type: List[Tuple[str, str, str]]
+        for name in l_names:
+            if name.endswith('/') or name in (dist_info_dir + '/RECORD', dist_info_dir + '/INSTALLER'):
+                continue
+            data = wheel_zip_file.read(name)
+            record_hash = get_record_hash(data)
+            if name not in d_record_hashes and name not in [dist_info_dir + '/' + filename for filename in L_WHEEL_RECORD_SIGNATURE_FILES]:
+                raise RuntimeError('"{name}" of "{wheel}" is not listed in RECORD'.format(name=name, wheel=path_wheel_file.name))
+            if d_record_hashes.get(name, record_hash) != record_hash:
+                raise RuntimeError('"{name}" of "{wheel}" does not match the hash in RECORD'.format(name=name, wheel=path_wheel_file.name))
+            relative_path = get_relative_install_path(name, data_dir=data_dir)
+            path_target = pathlib.Path(os.path.normpath(str(path_site_packages / relative_path)))
+            path_target.parent.mkdir(parents=True, exist_ok=True)
+            path_target.write_bytes(data)
+            l_records.append((relative_path, record_hash, str(len(data))))
+
+        path_dist_info = path_site_packages / dist_info_dir
+        (path_dist_info / 'INSTALLER').write_text(WHEEL_INSTALLER_NAME + '\n')
+        installer_data = (WHEEL_INSTALLER_NAME + '\n').encode('utf-8')
+        l_records.append((dist_info_dir + '/INSTALLER', get_record_hash(installer_data), str(len(installer_data))))
+        l_records.append((dist_info_dir + '/RECORD', '', ''))
+        with open(str(path_dist_info / 'RECORD'), mode='w', newline='', encoding='utf-8') as record_file:
+            csv.writer(record_file, lineterminator='\n').writerows(l_records)
+
+
+def get_relative_install_path(name: str, data_dir: str) -> str:
+    """ the path of a file of the wheel, relative to site-packages
+
+    >>> get_relative_install_path('demo/__init__.py', data_dir='demo-1.0.data')
+    'demo/__init__.py'
+    >>> get_relative_install_path('demo-1.0.data/platlib/_demo.pyd', data_dir='demo-1.0.data')
+    '_demo.pyd'
+    >>> get_relative_install_path('demo-1.0.data/scripts/demo.py', data_dir='demo-1.0.data')
+    '../../Scripts/demo.py'
+    >>> get_relative_install_path('../evil.py', data_dir='demo-1.0.data')
+    Traceback (most recent call last):
+        ...
+    RuntimeError: invalid path "../evil.py" in wheel
+
+    """
+    if name.startswith('/') or '..' in name.split('/'):
+        raise RuntimeError('invalid path "{name}" in wheel'.format(name=name))
+    if not name.startswith(data_dir + '/'):
+        return name
+    _, scheme, relative_path = name.split('/', 2)
+    if scheme not in D_WHEEL_DATA_SCHEMES:
+        raise RuntimeError('unknown scheme "{scheme}" in wheel'.format(scheme=scheme))
+    return '/'.join(part for part in (D_WHEEL_DATA_SCHEMES[scheme], relative_path) if part)
+
+
+def get_wheel_dist_info_dir(l_names: Sequence[str], wheel: str) -> str:
+    set_dist_info_dirs = {name.split('/', 1)[0] for name in l_names if name.split('/', 1)[0].endswith('.dist-info')}
+    if len(set_dist_info_dirs) != 1:
+        raise RuntimeError('"{wheel}" must have exactly one .dist-info directory'.format(wheel=wheel))
+    return set_dist_info_dirs.pop()
+
+
+def get_d_wheel_record_hashes(record: str) -> Dict[str, str]:
+    """
+    >>> get_d_wheel_record_hashes('a.py,sha256=abc,3\\nd-1.0.dist-info/RECORD,,\\n')
+    {'a.py': 'sha256=abc'}
+
+    """
+    return {row[0]: row[1] for row in csv.reader(io.StringIO(record)) if len(row) >= 2 and row[1]}
+
+
+def get_record_hash(data: bytes) -> str:
+    """ the urlsafe base64 sha256 without padding, like in RECORD files
+
+    >>> get_record_hash(b'test')
+    'sha256=n4bQgYhMfWWaL-qgxVrQFaO_TxsrC4Is0V1sFbDwCgg'
+
+    """
+    return 'sha256=' + base64.urlsafe_b64encode(hashlib.sha256(data).digest()).decode('ascii').rstrip('=')
+
+
+def remove_installed_distribution(path_site_packages: pathlib.Path, distribution_name: str) -> None:
+    """ remove the files listed in the RECORD of an installed version of the distribution, and its .dist-info directory """
+    normalized_name = get_normalized_distribution_name(distribution_name)
+    path_python = pathlib.Path(os.path.normpath(str(path_site_packages / '../..')))
+    for path_dist_info in path_site_packages.glob('*.dist-info'):
+        if get_normalized_distribution_name(path_dist_info.name[:-len('.dist-info')].rsplit('-', 1)[0]) != normalized_name:
+            continue
+        path_record = path_dist_info / 'RECORD'
+        if path_record.is_file():
+            for row in csv.reader(io.StringIO(path_record.read_text(encoding='utf-8'))):
+                if not row:
+                    continue
+                # only files of the python directory, whatever the RECORD says
+                path_file = pathlib.Path(os.path.normpath(str(path_site_packages / row[0])))
+                if path_python in path_file.parents and path_file.is_file():
+                    path_file.unlink()
+        shutil.rmtree(str(path_dist_info), ignore_errors=True)
+
+
+def get_normalized_distribution_name(distribution_name: str) -> str:
+    """
+    >>> get_normalized_distribution_name('Foo.Bar-baz_qux')
+    'foo_bar_baz_qux'
+
+    """
+    return re.sub(r'[-_.]+', '_', distribution_name).lower()
+
+
+def get_set_supported_wheel_tags(python_version: str, platform: str) -> Set[Tuple[str, str, str]]:
+    """ the (python, abi, platform) tags the embedded cpython can load, python_version like '38'
+
+    >>> set_tags = get_set_supported_wheel_tags('38', 'win_amd64')
+    >>> ('cp38', 'cp38', 'win_amd64') in set_tags, ('cp36', 'abi3', 'win_amd64') in set_tags, ('py3', 'none', 'any') in set_tags
+    (True, True, True)
+    >>> ('cp38', 'cp38', 'win32') in set_tags, ('cp39', 'abi3', 'win_amd64') in set_tags, ('py2', 'none', 'any') in set_tags
+    (False, False, False)
+
+    """
+    major, minor = python_version[0], int(python_version[1:])
+    cpython = 'cp' + python_version
+    set_tags = {(cpython, cpython, platform), (cpython, 'none', platform), (cpython, 'none', 'any')}
+    for minor_version in range(2, minor + 1):
+        set_tags.add(('cp{major}{minor}'.format(major=major, minor=minor_version), 'abi3', platform))
+    for python_tag in ['py' + major] + ['py{major}{minor}'.format(major=major, minor=minor_version) for minor_version in range(minor + 1)]:
+        set_tags.add((python_tag, 'none', platform))
+        set_tags.add((python_tag, 'none', 'any'))
+    return set_tags
+
+
+def is_wheel_compatible(wheel_filename: str, set_supported_tags: Set[Tuple[str, str, str]]) -> bool:
+    """ the tags of a wheel filename can be compressed sets like 'py2.py3'
+
+    >>> set_tags = get_set_supported_wheel_tags('38', 'win32')
+    >>> is_wheel_compatible('six-1.14.0-py2.py3-none-any.whl', set_tags)
+    True
+    >>> is_wheel_compatible('pywin32-227-cp38-cp38-win32.whl', set_tags)
+    True
+    >>> is_wheel_compatible('pywin32-227-cp38-cp38-win_amd64.whl', set_tags)
+    False
+    >>> is_wheel_compatible('numpy-1.18.1-cp38-cp38-manylinux1_x86_64.whl', set_tags)
+    False
+
+    """
+    match = WHEEL_FILENAME_PATTERN.match(wheel_filename)
+    if not match:
+        return False
+    for python_tag in match.group('python').split('.'):
+        for abi_tag in match.group('abi').split('.'):
+            for platform_tag in match.group('platform').split('.'):
+                if (python_tag, abi_tag, platform_tag) in set_supported_tags:
+                    return True
+    return False
+
+
+def get_path_python_embedded(wine_prefix: pathlib.Path) -> pathlib.Path:
+    """ the directory of the embedded python of the prefix - the one with a pythonXY._pth file, laid out by install_python_embedded.
+    if there are more, the newest version - Python310 before Python38
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path_test_dir:
+    ...     for python_dir, pth_file in [('Python38', 'python38._pth'), ('Python310', 'python310._pth'), ('Python39', 'python39._pth')]:
+    ...         path_python = pathlib.Path(path_test_dir) / 'drive_c/Program Files' / python_dir
+    ...         path_python.mkdir(parents=True)
+    ...         (path_python / pth_file).touch()
+    ...     get_path_python_embedded(pathlib.Path(path_test_dir)).name
+    'Python310'
+
+    """
+    l_paths_pth_files = (wine_prefix / 'drive_c/Program Files').glob('Python*/python*._pth')
+    for path_pth_file in sorted(l_paths_pth_files, key=lambda path: get_python_version_tuple(path.name[len('python'):-len('._pth')]), reverse=True):
+        return path_pth_file.parent
+    raise RuntimeError('no embedded Python found on WINEPREFIX="{wine_prefix}", see install_python_embedded'.format(wine_prefix=wine_prefix))
+
+
+def get_python_version_tuple(python_version_nodot: str) -> Tuple[int, int]:
+    """ the version of the pythonXY._pth files, the major version has one digit
+
+    >>> get_python_version_tuple('310')
+    (3, 10)
+    >>> get_python_version_tuple('38')
+    (3, 8)
+    >>> get_python_version_tuple('x')
+    (0, 0)
+
+    """
+    if not python_version_nodot.isdigit():
+        return 0, 0
+    return int(python_version_nodot[0]), int(python_version_nodot[1:] or 0)
+
+
+def get_python_version_from_path_python_embedded(path_python: pathlib.Path) -> str:
+    """ '38' from python38._pth """
+    for path_pth_file in path_python.glob('python*._pth'):
+        return path_pth_file.name[len('python'):-len('._pth')]
+    raise RuntimeError('no pythonXY._pth file in "{path_python}"'.format(path_python=path_python))
+
+
+def add_wheel_files_to_wheel_cache(l_paths_wheel_files: Sequence[pathlib.Path], path_wheel_cache: pathlib.Path) -> None:
+    """ the node wheel cache is shared by all users, a wheel is added once and kept - a cache we can not write is just used """
+    if not os.access(str(path_wheel_cache), os.W_OK):
+        return
+    for path_wheel_file in l_paths_wheel_files:
+        if not (path_wheel_cache / path_wheel_file.name).is_file():
+            shutil.copy2(str(path_wheel_file), str(path_wheel_cache / path_wheel_file.name))
+            if lib_wine_cache.is_node_wine_cache_enabled():
+                os.chmod(str(path_wheel_cache / path_wheel_file.name), 0o644)
+
+
+def write_test_wheel(path_wheel_file: pathlib.Path, d_files: Dict[str, bytes]) -> None:
+    """ a minimal wheel for the doctests, with WHEEL and RECORD """
+    match = WHEEL_FILENAME_PATTERN.match(path_wheel_file.name)
+    assert match
+    dist_info_dir = '{name}-{version}.dist-info'.format(name=match.group('name'), version=match.group('version'))
+    d_files = dict(d_files)
+    d_files[dist_info_dir + '/WHEEL'] = b'Wheel-Version: 1.0\nRoot-Is-Purelib: true\n'
+    record = ''.join('{name},{record_hash},{size}\n'.format(name=name, record_hash=get_record_hash(data), size=len(data)) for name, data in d_files.items())
+    with zipfile.ZipFile(str(path_wheel_file), mode='w') as wheel_zip_file:
+        for name, data in d_files.items():
+            wheel_zip_file.writestr(name, data)
+        wheel_zip_file.writestr(dist_info_dir + '/RECORD', record + dist_info_dir + '/RECORD,,\n')
@@ -1,11 +1,39 @@
 # ### STDLIB
-import subprocess
+import os
+import pathlib
+import time
+from typing import List
 
 # ### OWN
 import configmagick_linux
 import lib_log_utils
 import lib_shell
 
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_apt               # type: ignore # pragma: no cover
+    from . import lib_mirror            # type: ignore # pragma: no cover
+    from . import lib_wine_detect       # type: ignore # pragma: no cover
+except ImportError:                     # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_apt                      # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_mirror                   # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_detect              # type: ignore # pragma: no cover
+
+
+WINE_REPOSITORY_URL = 'https://dl.winehq.org/wine-builds/ubuntu/'
+PATH_APT_TRUSTED_KEYRING = pathlib.Path('/etc/apt/trusted.gpg')
+PATH_APT_TRUSTED_KEYRING_DIR = pathlib.Path('/etc/apt/trusted.gpg.d')
+# the long key id of https://dl.winehq.org/wine-builds/winehq.key, fingerprint D43F 6401 4536 9C51 D786 DDEA 76F1 A20F F987 672F
+WINE_KEY_ID = bytes.fromhex('76F1A20FF987672F')
+PATH_WINETRICKS = pathlib.Path('/usr/bin/winetricks')
+# winetricks is downloaded again if it is older than that
+WINETRICKS_MAX_AGE_SECONDS = 7 * 86400
+
 
 def install_wine(wine_release: str, linux_release_name: str = configmagick_linux.get_linux_release_name(), quiet: bool = False) -> None:
     """installs wine. syntax: install_wine --wine_release=(stable|devel|staging)
@@ -15,6 +43,11 @@ def install_wine(wine_release: str, linux_release_name: str = configmagick_linux
         --wine_release=devel: this package is used to provide development headers, mostly used by third party software compilation.
         --wine_release=staging: this is the most recent testing wine version
 
+    the packages are installed with two 'apt-get install' after one refresh of the package index (only if it is stale):
+    the winehq packages need --install-recommends, the recommends of the helper packages (libpng-dev pulls in a toolchain) are not wanted.
+    apt can not take --install-recommends per package, and listing the winehq recommends ourselves would break with every wine release.
+    both calls are skipped if their packages are installed already.
+
     """
 
     lib_log_utils.banner_verbose('Installing WINE: \n'
@@ -23,20 +56,21 @@ def install_wine(wine_release: str, linux_release_name: str = configmagick_linux
                                  .format(linux_release_name=linux_release_name, wine_release=wine_release), quiet=quiet)
 
     raise_if_wine_release_unknown(wine_release)
-    configmagick_linux.full_update_and_upgrade(quiet=quiet)
-    install_wine_required_packages()
     add_architecture_386(quiet=quiet)
     add_wine_key(linux_release_name=linux_release_name, quiet=quiet)
-    install_libfaudio0_if_needed(quiet=quiet)
-    update_wine_packages(quiet=quiet)
-    install_wine_packages(wine_release, quiet=quiet)
+    l_packages = get_l_wine_required_packages() + get_l_wine_helper_packages()
+    if is_libfaudio0_needed():
+        add_libfaudio0_backport_if_needed(quiet=quiet)
+        l_packages.append('libfaudio0')
+    lib_apt.install_linux_packages(l_packages, quiet=quiet)
+    lib_apt.install_linux_packages(get_l_winehq_packages(wine_release), parameters=['--install-recommends'], quiet=quiet)
 
     lib_log_utils.banner_success('Wine Installation OK - Wine Release: "{wine_release}", Wine Version: "{wine_version_number}"'
                                  .format(wine_release=wine_release, wine_version_number=get_wine_version_number()), quiet=quiet)
 
 
-def install_wine_required_packages(quiet: bool = False) -> None:
-    configmagick_linux.install_linux_packages(['winbind'], quiet=quiet)
+def get_l_wine_required_packages() -> List[str]:
+    return ['winbind']
 
 
 def raise_if_wine_release_unknown(wine_release: str) -> None:
@@ -56,66 +90,160 @@ def raise_if_wine_release_unknown(wine_release: str) -> None:
 
 
 def add_architecture_386(quiet: bool = False) -> None:
+    if is_architecture_386_added():
+        lib_log_utils.log_verbose('386 Architecture already added', quiet=quiet)
+        return
     lib_log_utils.log_verbose('Add 386 Architecture', quiet=quiet)
     lib_shell.run_shell_command('dpkg --add-architecture i386', use_sudo=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
 
 
 def add_wine_key(linux_release_name: str, quiet: bool = False) -> None:
-    """
+    """ add the winehq key and repository - both steps are skipped if they are already configured
+
     >>> add_wine_key(configmagick_linux.get_linux_release_name(), quiet=True)
 
     """
     lib_log_utils.log_verbose('Add Wine Key and Repository, linux_release_name="{linux_release_name}"'
                               .format(linux_release_name=linux_release_name), quiet=quiet)
-    lib_shell.run_shell_command('rm -f ./winehq.key*', shell=True, use_sudo=True, quiet=quiet)
-    lib_shell.run_shell_command('wget -nv -c https://dl.winehq.org/wine-builds/winehq.key', use_sudo=True, quiet=quiet)
-    lib_shell.run_shell_command('apt-key add winehq.key', use_sudo=True, quiet=quiet)
-    lib_shell.run_shell_command('rm -f ./winehq.key*', shell=True, use_sudo=True, quiet=quiet)
-    lib_shell.run_shell_command('apt-add-repository "deb https://dl.winehq.org/wine-builds/ubuntu/ {linux_release_name} main"'
-                                .format(linux_release_name=linux_release_name),
-                                use_sudo=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    if is_wine_key_added():
+        lib_log_utils.log_verbose('Wine Key already added', quiet=quiet)
+    else:
+        lib_shell.run_shell_command('rm -f ./winehq.key*', shell=True, use_sudo=True, quiet=quiet)
+        lib_mirror.download_file(download_link='https://dl.winehq.org/wine-builds/winehq.key', filename=pathlib.Path('winehq.key'), use_sudo=True, quiet=quiet)
+        lib_shell.run_shell_command('apt-key add winehq.key', use_sudo=True, quiet=quiet)
+        lib_shell.run_shell_command('rm -f ./winehq.key*', shell=True, use_sudo=True, quiet=quiet)
+
+    if is_wine_repository_added(linux_release_name=linux_release_name):
+        lib_log_utils.log_verbose('Wine Repository already added', quiet=quiet)
+    else:
+        lib_shell.run_shell_command('apt-add-repository "{wine_repository}"'
+                                    .format(wine_repository=get_wine_repository(linux_release_name=linux_release_name)),
+                                    use_sudo=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
+
+
+def is_wine_key_added() -> bool:
+    """ look for the long key id of the winehq key in the apt keyrings, without running apt-key or gpg.
+    the self signature of a key carries the key id of the issuer, in binary keyrings it is stored as it is.
+    """
+    l_paths_keyring = [PATH_APT_TRUSTED_KEYRING]
+    if PATH_APT_TRUSTED_KEYRING_DIR.is_dir():
+        l_paths_keyring.extend(sorted(PATH_APT_TRUSTED_KEYRING_DIR.glob('*.gpg')))
+    for path_keyring in l_paths_keyring:
+        if path_keyring.is_file() and WINE_KEY_ID in path_keyring.read_bytes():
+            return True
+    return False
+
+
+def is_wine_repository_added(linux_release_name: str) -> bool:
+    """ look for the winehq repository line in the apt sources """
+    l_paths_sources = [pathlib.Path('/etc/apt/sources.list')]
+    if pathlib.Path('/etc/apt/sources.list.d').is_dir():
+        l_paths_sources.extend(sorted(pathlib.Path('/etc/apt/sources.list.d').glob('*.list')))
+    for path_sources in l_paths_sources:
+        if path_sources.is_file():
+            with open(str(path_sources), mode='r', encoding='utf-8', errors='replace') as sources_file:
+                if is_wine_repository_in_sources(sources_file.read(), linux_release_name=linux_release_name):
+                    return True
+    return False
+
+
+def is_wine_repository_in_sources(sources: str, linux_release_name: str) -> bool:
+    """
+    >>> is_wine_repository_in_sources('deb https://dl.winehq.org/wine-builds/ubuntu/ bionic main\\n', 'bionic')
+    True
+    >>> is_wine_repository_in_sources('# deb https://dl.winehq.org/wine-builds/ubuntu/ bionic main\\n', 'bionic')
+    False
+    >>> is_wine_repository_in_sources('deb https://dl.winehq.org/wine-builds/ubuntu/ bionic main\\n', 'focal')
+    False
+
+    """
+    l_wine_repository = get_wine_repository(linux_release_name=linux_release_name).split()
+    for line in sources.splitlines():
+        l_line = [part.rstrip('/') for part in line.split('#', 1)[0].split() if not part.startswith('[')]
+        if l_line == [part.rstrip('/') for part in l_wine_repository]:
+            return True
+    return False
+
+
+def get_wine_repository(linux_release_name: str) -> str:
+    """ the winehq apt source - pointing to the mirror, if one is configured """
+    return 'deb {repository_url} {linux_release_name} main'.format(repository_url=lib_mirror.get_mirrored_apt_repository_url(WINE_REPOSITORY_URL),
+                                                                   linux_release_name=linux_release_name)
+
+
+def is_architecture_386_added() -> bool:
+    """ the foreign architectures are listed in /var/lib/dpkg/arch, so we dont need to ask dpkg """
+    if not lib_apt.PATH_DPKG_ARCH.is_file():
+        return False
+    with open(str(lib_apt.PATH_DPKG_ARCH), mode='r') as dpkg_arch_file:
+        return 'i386' in dpkg_arch_file.read().split()
+
 
+def is_libfaudio0_needed() -> bool:
+    return int(configmagick_linux.get_linux_release_number_major()) >= 18
 
-def install_libfaudio0_if_needed(quiet: bool = False) -> None:
-    if int(configmagick_linux.get_linux_release_number_major()) >= 18:
-        try:
-            lib_log_utils.log_verbose('Install libfaudio0', quiet=quiet)
-            configmagick_linux.install_linux_package('libfaudio0', quiet=quiet)
-        except subprocess.CalledProcessError:
-            lib_log_utils.log_verbose('Install libfaudio0 backport', quiet=quiet)
-            install_libfaudio0_backport(quiet=quiet)
+
+def add_libfaudio0_backport_if_needed(quiet: bool = False) -> None:
+    """ add the backport repository only if libfaudio0 is neither installed nor available from the configured repositories """
+    if lib_apt.is_linux_package_installed('libfaudio0'):
+        return
+    lib_apt.update_apt_index_if_stale(quiet=quiet)
+    if not lib_apt.is_linux_package_available('libfaudio0'):
+        lib_log_utils.log_verbose('Add libfaudio0 backport', quiet=quiet)
+        install_libfaudio0_backport(quiet=quiet)
 
 
 def install_libfaudio0_backport(quiet: bool = False) -> None:
     lib_shell.run_shell_command('add-apt-repository ppa:cybermax-dexter/sdl2-backport -y', use_sudo=True, quiet=quiet)
 
 
-def update_wine_packages(quiet: bool = False) -> None:
-    lib_log_utils.log_verbose('Update wine packages', quiet=quiet)
-    configmagick_linux.full_update_and_upgrade(quiet=quiet)
+def get_l_winehq_packages(wine_release: str) -> List[str]:
+    """
+    >>> get_l_winehq_packages('staging')
+    ['winehq-staging']
+
+    """
+    return ['winehq-{wine_release}'.format(wine_release=wine_release)]
+
+
+def get_l_wine_helper_packages() -> List[str]:
+    return ['cabextract', 'libxml2', 'libpng-dev']
+
 
+def get_wine_version_number(use_wine: bool = False) -> str:
+    """ the version like 'wine-4.0.3', read from the installed files - wine is only started with use_wine=True, or if the version is unknown """
+    return lib_wine_detect.get_wine_version_number(use_wine=use_wine)
 
-def install_wine_packages(wine_release: str, reinstall: bool = False, quiet: bool = False) -> None:
-    lib_log_utils.log_verbose('Install Wine Packages', quiet=quiet)
-    configmagick_linux.install_linux_package('winehq-{wine_release}'.format(wine_release=wine_release),
-                                             parameters=['--install-recommends'], reinstall=reinstall, quiet=quiet)
-    configmagick_linux.install_linux_packages(['cabextract', 'libxml2', 'libpng-dev'], reinstall=reinstall, quiet=quiet)
 
+def install_winetricks(force: bool = False, quiet: bool = False) -> None:
+    """ installs winetricks. syntax: install_winetricks [--force]
 
-def get_wine_version_number() -> str:
-    wine_version_number = lib_shell.run_shell_command('wine --version', quiet=True).stdout
-    return str(wine_version_number)
+    a winetricks which was downloaded within the last WINETRICKS_MAX_AGE_SECONDS is considered up to date and kept,
+    the new winetricks replaces the old one only after a complete download.
 
+    Args:
+        --force     download winetricks, even if it is up to date
 
-def install_winetricks(quiet: bool = False) -> None:
+    """
     lib_log_utils.banner_verbose('Installing Winetricks', quiet=quiet)
-    lib_shell.run_shell_command('rm -f /usr/bin/winetricks', use_sudo=True, quiet=quiet)
-    lib_shell.run_shell_command('wget -nv -c --directory-prefix=/usr/bin/ https://raw.githubusercontent.com/Winetricks/winetricks/master/src/winetricks',
-                                use_sudo=True, quiet=quiet)
-    lib_shell.run_shell_command('chmod +x /usr/bin/winetricks', use_sudo=True, quiet=quiet)
+    if not force and is_winetricks_up_to_date():
+        lib_log_utils.banner_success('Winetricks is up to date', quiet=quiet)
+        return
+    path_winetricks_tmp = PATH_WINETRICKS.parent / '.winetricks.configmagick_wine.tmp'
+    lib_mirror.download_file(download_link='https://raw.githubusercontent.com/Winetricks/winetricks/master/src/winetricks',
+                             filename=path_winetricks_tmp, use_sudo=True, quiet=quiet)
+    lib_shell.run_shell_command('chmod +x "{path_winetricks_tmp}"'.format(path_winetricks_tmp=path_winetricks_tmp), use_sudo=True, quiet=quiet)
+    lib_shell.run_shell_command('mv -f "{path_winetricks_tmp}" "{path_winetricks}"'
+                                .format(path_winetricks_tmp=path_winetricks_tmp, path_winetricks=PATH_WINETRICKS), use_sudo=True, quiet=quiet)
     lib_log_utils.banner_success('Winetricks Installation OK', quiet=quiet)
 
 
+def is_winetricks_up_to_date(max_age_seconds: float = WINETRICKS_MAX_AGE_SECONDS) -> bool:
+    if not PATH_WINETRICKS.is_file() or not os.access(str(PATH_WINETRICKS), os.X_OK):
+        return False
+    return time.time() - PATH_WINETRICKS.stat().st_mtime < max_age_seconds
+
+
 def update_winetricks(quiet: bool = False) -> None:
     lib_log_utils.banner_verbose('Updating Winetricks', quiet=quiet)
     lib_shell.run_shell_command('winetricks -q --self-update', use_sudo=True, quiet=quiet)
@@ -129,10 +257,4 @@ def is_wine_installed() -> bool:
     >>> assert is_wine_installed() == True
 
     """
-
-    # noinspection PyBroadException
-    try:
-        get_wine_version_number()
-        return True
-    except Exception:
-        return False
+    return lib_wine_detect.get_wine_installation() is not None
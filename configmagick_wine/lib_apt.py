@@ -0,0 +1,187 @@
+# ### STDLIB
+import pathlib
+import subprocess
+import time
+from typing import Dict, List, Sequence, Set
+
+# ### OWN
+import lib_log_utils
+import lib_shell
+
+
+PATH_DPKG_STATUS = pathlib.Path('/var/lib/dpkg/status')
+PATH_DPKG_ARCH = pathlib.Path('/var/lib/dpkg/arch')
+PATH_APT_LISTS = pathlib.Path('/var/lib/apt/lists')
+# touched by the APT::Update::Post-Invoke-Success hook on ubuntu, also if no list changed
+PATH_APT_UPDATE_SUCCESS_STAMP = pathlib.Path('/var/lib/apt/periodic/update-success-stamp')
+L_PATHS_APT_SOURCES = [pathlib.Path('/etc/apt/sources.list'), pathlib.Path('/etc/apt/sources.list.d')]
+# the package index is not refreshed if it is younger than that, and no apt source or architecture was added since
+APT_INDEX_MAX_AGE_SECONDS = 6 * 3600
+
+
+def install_linux_packages(l_packages: Sequence[str],
+                           parameters: Sequence[str] = (),
+                           reinstall: bool = False,
+                           quiet: bool = False) -> List[str]:
+    """ install all missing packages in one apt transaction, returns the list of packages which were installed.
+
+    the installed packages are read from the dpkg status file, without calling apt. if nothing is missing, apt is not called at all,
+    otherwise the package index is refreshed once (only if it is stale), and all missing packages are installed with one 'apt-get install'
+    """
+    if reinstall:
+        l_missing_packages = list(l_packages)
+    else:
+        l_missing_packages = get_l_missing_linux_packages(l_packages)
+    if not l_missing_packages:
+        lib_log_utils.log_verbose('Linux packages already installed: {packages}'.format(packages=' '.join(l_packages)), quiet=quiet)
+        return l_missing_packages
+    update_apt_index_if_stale(quiet=quiet)
+    l_parameters = list(parameters)
+    if reinstall:
+        l_parameters.append('--reinstall')
+    lib_log_utils.log_verbose('Install Linux packages: {packages}'.format(packages=' '.join(l_missing_packages)), quiet=quiet)
+    lib_shell.run_shell_command('DEBIAN_FRONTEND=noninteractive apt-get install -y {parameters} {packages}'
+                                .format(parameters=' '.join(l_parameters), packages=' '.join(l_missing_packages)),
+                                shell=True, use_sudo=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    return l_missing_packages
+
+
+def get_l_missing_linux_packages(l_packages: Sequence[str]) -> List[str]:
+    set_installed_packages = get_set_installed_linux_packages()
+    return [package for package in l_packages if package not in set_installed_packages]
+
+
+def is_linux_package_installed(package: str) -> bool:
+    return package in get_set_installed_linux_packages()
+
+
+def get_set_installed_linux_packages(path_dpkg_status: pathlib.Path = PATH_DPKG_STATUS) -> Set[str]:
+    if not path_dpkg_status.is_file():
+        return set()
+    with open(str(path_dpkg_status), mode='r', encoding='utf-8', errors='replace') as dpkg_status_file:
+        return parse_dpkg_status(dpkg_status_file.read())
+
+
+def parse_dpkg_status(dpkg_status: str) -> Set[str]:
+    """ get the installed packages from the dpkg status file, as 'name' and 'name:architecture'
+
+    >>> sorted(parse_dpkg_status(DPKG_STATUS_EXAMPLE))
+    ['libfaudio0', 'libfaudio0:amd64', 'libfaudio0:i386', 'winbind', 'winbind:amd64']
+
+    """
+    set_installed_packages = set()     # type: Set[str]
+    for d_fields in get_l_installed_dpkg_status_stanzas(dpkg_status):
+        set_installed_packages.add(d_fields['Package'])
+        if 'Architecture' in d_fields:
+            set_installed_packages.add('{package}:{architecture}'.format(package=d_fields['Package'], architecture=d_fields['Architecture']))
+    return set_installed_packages
+
+
+def get_d_installed_linux_package_versions(path_dpkg_status: pathlib.Path = PATH_DPKG_STATUS) -> Dict[str, str]:
+    if not path_dpkg_status.is_file():
+        return dict()
+    with open(str(path_dpkg_status), mode='r', encoding='utf-8', errors='replace') as dpkg_status_file:
+        return parse_dpkg_status_versions(dpkg_status_file.read())
+
+
+def parse_dpkg_status_versions(dpkg_status: str) -> Dict[str, str]:
+    """ get the versions of the installed packages from the dpkg status file, as {'name': 'version'}
+
+    >>> sorted(parse_dpkg_status_versions(DPKG_STATUS_EXAMPLE).items())
+    [('libfaudio0', '19.07-0~bionic'), ('winbind', '2:4.7.6+dfsg~ubuntu-0ubuntu2.15')]
+
+    """
+    d_package_versions = dict()     # type: Dict[str, str]
+    for d_fields in get_l_installed_dpkg_status_stanzas(dpkg_status):
+        if 'Version' in d_fields:
+            d_package_versions[d_fields['Package']] = d_fields['Version']
+    return d_package_versions
+
+
+def get_l_installed_dpkg_status_stanzas(dpkg_status: str) -> List[Dict[str, str]]:
+    """ get the fields of the installed packages from the dpkg status file, continuation lines are skipped """
+    l_stanzas = list()  # type: List[Dict[str, str]]
+    for stanza in dpkg_status.split('\n\n'):
+        d_fields = dict()
+        for line in stanza.splitlines():
+            if line and not line[0].isspace() and ':' in line:
+                field, value = line.split(':', 1)
+                d_fields[field] = value.strip()
+        if d_fields.get('Status', '').split(' ')[-1:] != ['installed'] or 'Package' not in d_fields:
+            continue
+        l_stanzas.append(d_fields)
+    return l_stanzas
+
+
+def is_linux_package_available(package: str) -> bool:
+    """ is there an installation candidate for the package in the package index """
+    try:
+        candidate = lib_shell.run_shell_command('apt-cache policy {package} | grep "Candidate:"'.format(package=package),
+                                                shell=True, quiet=True).stdout
+    except subprocess.CalledProcessError:
+        return False
+    return candidate.split(':', 1)[1].strip() not in ('', '(none)')
+
+
+def update_apt_index_if_stale(max_age_seconds: float = APT_INDEX_MAX_AGE_SECONDS, quiet: bool = False) -> bool:
+    """ refresh the package index only if it is stale, returns True if it was refreshed """
+    if is_apt_index_fresh(max_age_seconds=max_age_seconds):
+        lib_log_utils.log_verbose('apt package index is fresh, no update needed', quiet=quiet)
+        return False
+    update_apt_index(quiet=quiet)
+    return True
+
+
+def update_apt_index(quiet: bool = False) -> None:
+    lib_log_utils.log_verbose('Update apt package index', quiet=quiet)
+    lib_shell.run_shell_command('apt-get update', use_sudo=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    if PATH_APT_LISTS.is_dir():
+        # apt does not rewrite unchanged lists, so we mark the time of the update ourselves
+        lib_shell.run_shell_command('touch "{path_apt_lists}"'.format(path_apt_lists=PATH_APT_LISTS), use_sudo=True, quiet=True)
+
+
+def is_apt_index_fresh(max_age_seconds: float = APT_INDEX_MAX_AGE_SECONDS) -> bool:
+    """ the index is fresh if it was updated within max_age_seconds, and no apt source or architecture was added since """
+    index_timestamp = get_apt_index_timestamp()
+    if time.time() - index_timestamp > max_age_seconds:
+        return False
+    return get_apt_configuration_timestamp() <= index_timestamp
+
+
+def get_apt_index_timestamp() -> float:
+    l_timestamps = [0.0]
+    for path_index in (PATH_APT_LISTS, PATH_APT_UPDATE_SUCCESS_STAMP):
+        if path_index.exists():
+            l_timestamps.append(path_index.stat().st_mtime)
+    return max(l_timestamps)
+
+
+def get_apt_configuration_timestamp() -> float:
+    l_paths = [PATH_DPKG_ARCH] + L_PATHS_APT_SOURCES
+    if L_PATHS_APT_SOURCES[1].is_dir():
+        l_paths.extend(L_PATHS_APT_SOURCES[1].iterdir())
+    l_timestamps = [path.stat().st_mtime for path in l_paths if path.exists()]
+    return max(l_timestamps + [0.0])
+
+
+# a part of /var/lib/dpkg/status, used in the doctests
+DPKG_STATUS_EXAMPLE = ('Package: winbind\n'
+                       'Status: install ok installed\n'
+                       'Architecture: amd64\n'
+                       'Version: 2:4.7.6+dfsg~ubuntu-0ubuntu2.15\n'
+                       'Description: service to resolve user and group information from Windows NT servers\n'
+                       ' Samba is an implementation of the SMB/CIFS protocol for Unix systems\n'
+                       '\n'
+                       'Package: libfaudio0\n'
+                       'Status: install ok installed\n'
+                       'Architecture: amd64\n'
+                       'Version: 19.07-0~bionic\n'
+                       '\n'
+                       'Package: libfaudio0\n'
+                       'Status: install ok installed\n'
+                       'Architecture: i386\n'
+                       'Version: 19.07-0~bionic\n'
+                       '\n'
+                       'Package: cabextract\n'
+                       'Status: deinstall ok config-files\n'
+                       'Architecture: amd64\n')
@@ -0,0 +1,448 @@
+# ### STDLIB
+import gzip
+import json
+import lzma
+import os
+import pathlib
+import re
+import subprocess
+import tempfile
+import urllib.parse
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_download                  # type: ignore # pragma: no cover
+    from . import lib_wine_cache                # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_download                         # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+
+
+# set this environment variable to a base url like 'http://mirror.lan/configmagick_wine' or a directory like '/srv/configmagick_wine_mirror'
+# to fetch every download and the winehq apt repository from a local mirror, made with 'mirror sync'
+ENV_MIRROR = 'CONFIGMAGICK_WINE_MIRROR'
+
+
+def get_mirror() -> Optional[str]:
+    """ the configured mirror (base url or directory), or None
+
+    >>> os.environ[ENV_MIRROR] = 'http://mirror.lan/configmagick_wine/'
+    >>> get_mirror()
+    'http://mirror.lan/configmagick_wine'
+    >>> os.environ[ENV_MIRROR] = ''
+    >>> assert get_mirror() is None
+
+    """
+    mirror = os.environ.get(ENV_MIRROR, '').strip()
+    if not mirror:
+        return None
+    return mirror.rstrip('/')
+
+
+def get_path_mirror_directory(mirror: str) -> Optional[pathlib.Path]:
+    """ the directory of a local mirror, or None if the mirror is an url
+
+    >>> get_path_mirror_directory('/srv/mirror')
+    PosixPath('/srv/mirror')
+    >>> get_path_mirror_directory('file:///srv/mirror')
+    PosixPath('/srv/mirror')
+    >>> assert get_path_mirror_directory('http://mirror.lan/configmagick_wine') is None
+
+    """
+    if mirror.startswith('file://'):
+        return pathlib.Path(urllib.parse.unquote(urllib.parse.urlsplit(mirror).path))
+    if mirror.startswith('/'):
+        return pathlib.Path(mirror)
+    return None
+
+
+def get_mirror_relative_path(download_link: str) -> str:
+    """ the place of a download in the mirror : <host>/<path>, the query string appended with '@'
+
+    >>> get_mirror_relative_path('https://source.winehq.org/winemono.php?v=4.9.4')
+    'source.winehq.org/winemono.php@v=4.9.4'
+    >>> get_mirror_relative_path('https://github.com//madewokherd/wine-mono/releases/latest')
+    'github.com/madewokherd/wine-mono/releases/latest'
+    >>> get_mirror_relative_path('https://www.python.org/downloads/windows/')
+    'www.python.org/downloads/windows/index.html'
+
+    """
+    parsed_link = urllib.parse.urlsplit(download_link)
+    l_path_parts = [part for part in parsed_link.path.split('/') if part and part != '.']
+    if not l_path_parts or parsed_link.path.endswith('/'):
+        l_path_parts.append('index.html')
+    relative_path = '/'.join([parsed_link.netloc] + l_path_parts)
+    if parsed_link.query:
+        relative_path += '@' + parsed_link.query
+    return relative_path
+
+
+def get_mirrored_download_link(download_link: str) -> str:
+    """ rewrite a download link to the mirror, if one is configured
+
+    >>> os.environ[ENV_MIRROR] = 'http://mirror.lan/configmagick_wine'
+    >>> get_mirrored_download_link('https://source.winehq.org/winegecko.php?v=2.47&arch=x86')
+    'http://mirror.lan/configmagick_wine/source.winehq.org/winegecko.php@v=2.47&arch=x86'
+    >>> os.environ[ENV_MIRROR] = '/srv/mirror'
+    >>> get_mirrored_download_link('https://dl.winehq.org/wine-builds/ubuntu/')
+    'file:///srv/mirror/dl.winehq.org/wine-builds/ubuntu/index.html'
+    >>> os.environ[ENV_MIRROR] = ''
+    >>> get_mirrored_download_link('https://bootstrap.pypa.io/get-pip.py')
+    'https://bootstrap.pypa.io/get-pip.py'
+
+    """
+    mirror = get_mirror()
+    if mirror is None:
+        return download_link
+    relative_path = urllib.parse.quote(get_mirror_relative_path(download_link), safe='/@=&')
+    path_mirror_directory = get_path_mirror_directory(mirror)
+    if path_mirror_directory is not None:
+        return 'file://' + urllib.parse.quote(str(path_mirror_directory)) + '/' + relative_path
+    return mirror + '/' + relative_path
+
+
+def get_mirrored_apt_repository_url(repository_url: str) -> str:
+    """ rewrite the url of an apt repository to the mirror, apt reads local mirrors with 'file:'
+
+    >>> os.environ[ENV_MIRROR] = '/srv/mirror'
+    >>> get_mirrored_apt_repository_url('https://dl.winehq.org/wine-builds/ubuntu/')
+    'file:/srv/mirror/dl.winehq.org/wine-builds/ubuntu/'
+    >>> os.environ[ENV_MIRROR] = 'http://mirror.lan/configmagick_wine'
+    >>> get_mirrored_apt_repository_url('https://dl.winehq.org/wine-builds/ubuntu/')
+    'http://mirror.lan/configmagick_wine/dl.winehq.org/wine-builds/ubuntu/'
+    >>> os.environ[ENV_MIRROR] = ''
+
+    """
+    mirror = get_mirror()
+    if mirror is None:
+        return repository_url
+    parsed_url = urllib.parse.urlsplit(repository_url)
+    relative_path = '/'.join([parsed_url.netloc] + [part for part in parsed_url.path.split('/') if part]) + '/'
+    path_mirror_directory = get_path_mirror_directory(mirror)
+    if path_mirror_directory is not None:
+        return 'file:{path_mirror_directory}/{relative_path}'.format(path_mirror_directory=path_mirror_directory, relative_path=relative_path)
+    return '{mirror}/{relative_path}'.format(mirror=mirror, relative_path=relative_path)
+
+
+def download_file(download_link: str, filename: pathlib.Path, use_sudo: bool = False, quiet: bool = False) -> None:
+    """ download a file - from the mirror, if one is configured. a local mirror directory is copied from, without network.
+    the download itself is done by the pooled http client of lib_download, with use_sudo the file is copied into place with sudo.
+    an existing file is replaced, never written through - it might be a hardlink to the read-only node wine cache.
+    raises subprocess.CalledProcessError if the file can not be fetched, like configmagick_linux.download_file
+    """
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('download', description=download_link, step_key='download {filename}'.format(filename=pathlib.Path(filename).name),
+                                    note='to "{filename}"'.format(filename=filename))
+        return
+    mirror = get_mirror()
+    path_mirror_directory = get_path_mirror_directory(mirror) if mirror is not None else None
+    if path_mirror_directory is not None:
+        path_mirror_file = path_mirror_directory / get_mirror_relative_path(download_link)
+        lib_shell.run_shell_command('cp --remove-destination "{path_mirror_file}" "{filename}"'.format(path_mirror_file=path_mirror_file, filename=filename),
+                                    shell=True, use_sudo=use_sudo, quiet=quiet)
+        return
+    if not use_sudo or configmagick_linux.get_current_username() == 'root':
+        lib_download.download_file(download_link=get_mirrored_download_link(download_link), filename=filename, quiet=quiet)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path_downloaded_file = pathlib.Path(tmp_dir) / pathlib.Path(filename).name
+        lib_download.download_file(download_link=get_mirrored_download_link(download_link), filename=path_downloaded_file, quiet=quiet)
+        lib_shell.run_shell_command('cp --remove-destination "{path_downloaded_file}" "{filename}"'
+                                    .format(path_downloaded_file=path_downloaded_file, filename=filename),
+                                    shell=True, use_sudo=True, quiet=quiet)
+
+
+def download_text(download_link: str, quiet: bool = False) -> str:
+    """ download a page like a release page into memory - from the mirror, if one is configured.
+    raises subprocess.CalledProcessError if the page can not be fetched
+    """
+    mirror = get_mirror()
+    path_mirror_directory = get_path_mirror_directory(mirror) if mirror is not None else None
+    if path_mirror_directory is not None:
+        path_mirror_file = path_mirror_directory / get_mirror_relative_path(download_link)
+        if not path_mirror_file.is_file():
+            raise subprocess.CalledProcessError(returncode=1, cmd='cat "{path_mirror_file}"'.format(path_mirror_file=path_mirror_file))
+        return path_mirror_file.read_text(encoding='utf-8', errors='replace')
+    return lib_download.download_text(download_link=get_mirrored_download_link(download_link), quiet=quiet)
+
+
+def sync_mirror(profile_file: Union[str, pathlib.Path],
+                mirror_directory: Union[str, pathlib.Path],
+                force: bool = False,
+                quiet: bool = False) -> None:
+    """ fill a mirror directory from a profile. syntax: mirror sync --profile_file=<profile.json> --mirror_directory=<dir> [--force]
+
+    the profile is a json file :
+        {"downloads": ["https://source.winehq.org/winemono.php?v=4.9.4", "https://dl.winehq.org/wine-builds/winehq.key", ...],
+         "apt_repositories": [{"url": "https://dl.winehq.org/wine-builds/ubuntu/", "releases": ["bionic"], "components": ["main"],
+                               "architectures": ["amd64", "i386"], "packages": ["winehq-stable"]}]}
+
+    downloads are fetched only if they are not in the mirror yet (or with --force), the apt index files are always fetched.
+    from the apt repositories only the newest version of the listed packages and their dependencies within the repository are mirrored.
+    serve the directory with any web server, or share it and set CONFIGMAGICK_WINE_MIRROR to the directory.
+
+    Args:
+        --profile_file=<profile.json>   the mirror profile
+        --mirror_directory=<dir>        the mirror directory to fill
+        --force                         fetch all downloads again
+
+    """
+    path_mirror_directory = pathlib.Path(mirror_directory)
+    with open(str(profile_file), mode='r') as profile:
+        d_profile = json.load(profile)     # type: Dict[str, Any]
+
+    n_files = 0
+    for download_link in d_profile.get('downloads', []):
+        path_mirror_file = path_mirror_directory / get_mirror_relative_path(download_link)
+        if force or not path_mirror_file.is_file():
+            download_file_to_mirror(download_link, path_mirror_file, quiet=quiet)
+            n_files += 1
+
+    for d_apt_repository in d_profile.get('apt_repositories', []):
+        n_files += sync_apt_repository_to_mirror(d_apt_repository, path_mirror_directory=path_mirror_directory, quiet=quiet)
+    lib_log_utils.banner_success('Mirror "{path_mirror_directory}" synced, {n_files} files fetched'
+                                 .format(path_mirror_directory=path_mirror_directory, n_files=n_files), quiet=quiet)
+
+
+def sync_apt_repository_to_mirror(d_apt_repository: Dict[str, Any], path_mirror_directory: pathlib.Path, quiet: bool = False) -> int:
+    """ mirror the index files of the releases and the pool files of the wanted packages, returns the number of fetched files """
+    repository_url = d_apt_repository['url'].rstrip('/') + '/'
+    l_components = d_apt_repository.get('components', ['main'])
+    l_architectures = d_apt_repository.get('architectures', ['amd64', 'i386'])
+    n_files = 0
+    l_package_stanzas = list()  # type: List[Dict[str, str]]
+    for release in d_apt_repository['releases']:
+        for index_filename in ('InRelease', 'Release', 'Release.gpg'):
+            if download_optional_file_to_mirror(repository_url + 'dists/{release}/{index_filename}'.format(release=release, index_filename=index_filename),
+                                                path_mirror_directory, quiet=quiet):
+                n_files += 1
+        for component in l_components:
+            for architecture in l_architectures:
+                packages_index_link = repository_url + 'dists/{release}/{component}/binary-{architecture}/Packages'\
+                    .format(release=release, component=component, architecture=architecture)
+                for extension in ('', '.gz', '.xz'):
+                    if download_optional_file_to_mirror(packages_index_link + extension, path_mirror_directory, quiet=quiet):
+                        n_files += 1
+                path_packages_index = path_mirror_directory / get_mirror_relative_path(packages_index_link)
+                l_package_stanzas.extend(parse_apt_packages_index(read_apt_packages_index(path_packages_index)))
+
+    for package_stanza in get_l_apt_package_stanzas_to_mirror(l_package_stanzas, d_apt_repository.get('packages', [])):
+        pool_file_link = repository_url + package_stanza['Filename']
+        path_pool_file = path_mirror_directory / get_mirror_relative_path(pool_file_link)
+        if path_pool_file.is_file() and lib_wine_cache.get_sha256_of_file(path_pool_file) == package_stanza.get('SHA256', ''):
+            continue
+        download_file_to_mirror(pool_file_link, path_pool_file, quiet=quiet)
+        if lib_wine_plan.is_plan_mode():
+            n_files += 1
+            continue
+        if 'SHA256' in package_stanza and lib_wine_cache.get_sha256_of_file(path_pool_file) != package_stanza['SHA256']:
+            path_pool_file.unlink()
+            raise RuntimeError('checksum mismatch of "{pool_file_link}"'.format(pool_file_link=pool_file_link))
+        n_files += 1
+    return n_files
+
+
+def download_file_to_mirror(download_link: str, path_mirror_file: pathlib.Path, quiet: bool = False) -> None:
+    """ always from the original source, never from a configured mirror """
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('download', description=download_link, step_key='download {filename}'.format(filename=path_mirror_file.name),
+                                    note='to "{path_mirror_file}"'.format(path_mirror_file=path_mirror_file))
+        return
+    lib_log_utils.log_verbose('Mirror "{download_link}"'.format(download_link=download_link), quiet=quiet)
+    path_mirror_file.parent.mkdir(parents=True, exist_ok=True)
+    lib_download.download_file(download_link=download_link, filename=path_mirror_file, quiet=True)
+
+
+def download_optional_file_to_mirror(download_link: str, path_mirror_directory: pathlib.Path, quiet: bool = False) -> bool:
+    """ apt repositories dont need to have all index files (InRelease or Release.gpg, Packages in different compressions).
+    a missing file is also removed from the mirror, so no stale index is left over from an earlier sync
+    """
+    path_mirror_file = path_mirror_directory / get_mirror_relative_path(download_link)
+    try:
+        download_file_to_mirror(download_link, path_mirror_file, quiet=quiet)
+        return True
+    except subprocess.CalledProcessError:
+        if path_mirror_file.exists():
+            path_mirror_file.unlink()
+        return False
+
+
+def read_apt_packages_index(path_packages_index: pathlib.Path) -> str:
+    for extension, open_function in (('', open), ('.xz', lzma.open), ('.gz', gzip.open)):
+        path_index = path_packages_index.parent / (path_packages_index.name + extension)
+        if path_index.is_file():
+            with open_function(str(path_index), mode='rt', encoding='utf-8', errors='replace') as packages_index:     # type: ignore
+                return str(packages_index.read())
+    return ''
+
+
+def parse_apt_packages_index(packages_index: str) -> List[Dict[str, str]]:
+    """
+    >>> l_stanzas = parse_apt_packages_index(APT_PACKAGES_INDEX_EXAMPLE)
+    >>> [stanza['Package'] for stanza in l_stanzas]
+    ['winehq-stable', 'winehq-stable', 'wine-stable', 'wine-stable-amd64', 'wine-devel']
+
+    """
+    l_stanzas = list()  # type: List[Dict[str, str]]
+    for stanza in packages_index.split('\n\n'):
+        d_fields = dict()   # type: Dict[str, str]
+        for line in stanza.splitlines():
+            if line and not line[0].isspace() and ':' in line:
+                field, value = line.split(':', 1)
+                d_fields[field] = value.strip()
+        if 'Package' in d_fields and 'Filename' in d_fields:
+            l_stanzas.append(d_fields)
+    return l_stanzas
+
+
+def get_l_apt_package_stanzas_to_mirror(l_package_stanzas: Sequence[Dict[str, str]], l_packages: Sequence[str]) -> List[Dict[str, str]]:
+    """ the newest version of the packages and their dependencies, as far as they are in the repository - for every architecture
+
+    >>> l_stanzas = get_l_apt_package_stanzas_to_mirror(parse_apt_packages_index(APT_PACKAGES_INDEX_EXAMPLE), ['winehq-stable'])
+    >>> [(stanza['Package'], stanza['Version']) for stanza in l_stanzas]
+    [('wine-stable', '4.0.3~bionic'), ('wine-stable-amd64', '4.0.3~bionic'), ('winehq-stable', '4.0.3~bionic')]
+
+    """
+    d_newest_stanzas = dict()     # type: Dict[Tuple[str, str], Dict[str, str]]
+    for package_stanza in l_package_stanzas:
+        key = (package_stanza['Package'], package_stanza.get('Architecture', ''))
+        if key not in d_newest_stanzas or compare_debian_versions(package_stanza['Version'], d_newest_stanzas[key]['Version']) > 0:
+            d_newest_stanzas[key] = package_stanza
+
+    set_packages_to_mirror = set()    # type: Set[str]
+    l_packages_to_check = list(l_packages)
+    set_packages_in_repository = {package for package, _ in d_newest_stanzas}
+    while l_packages_to_check:
+        package = l_packages_to_check.pop()
+        if package in set_packages_to_mirror or package not in set_packages_in_repository:
+            continue
+        set_packages_to_mirror.add(package)
+        for (package_name, _), package_stanza in d_newest_stanzas.items():
+            if package_name == package:
+                l_packages_to_check.extend(get_l_apt_package_dependencies(package_stanza))
+    return [d_newest_stanzas[key] for key in sorted(d_newest_stanzas) if key[0] in set_packages_to_mirror]
+
+
+def get_l_apt_package_dependencies(package_stanza: Dict[str, str]) -> List[str]:
+    """ all package names of Depends and Pre-Depends, including all alternatives
+
+    >>> get_l_apt_package_dependencies({'Depends': 'wine-stable-amd64 (= 4.0.3~bionic) | wine-stable-i386:i386 (= 4.0.3~bionic), libc6'})
+    ['wine-stable-amd64', 'wine-stable-i386', 'libc6']
+
+    """
+    l_dependencies = list()   # type: List[str]
+    for field in ('Pre-Depends', 'Depends'):
+        for dependency in re.split(r'[,|]', package_stanza.get(field, '')):
+            package = dependency.strip().split(' ', 1)[0].split(':', 1)[0]
+            if package:
+                l_dependencies.append(package)
+    return l_dependencies
+
+
+def compare_debian_versions(version_a: str, version_b: str) -> int:
+    """ compare debian package versions like dpkg does, returns -1, 0 or 1
+
+    >>> compare_debian_versions('5.0~rc1', '5.0')
+    -1
+    >>> compare_debian_versions('4.0.3~bionic', '4.0.2~bionic')
+    1
+    >>> compare_debian_versions('1:0.9', '2.0')
+    1
+    >>> compare_debian_versions('1.0-1', '1.0')
+    1
+    >>> compare_debian_versions('1.0a', '1.0+')
+    -1
+    >>> compare_debian_versions('2.30-0ubuntu1', '2.30-0ubuntu1')
+    0
+
+    """
+    epoch_a, upstream_a, revision_a = split_debian_version(version_a)
+    epoch_b, upstream_b, revision_b = split_debian_version(version_b)
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+    return compare_debian_version_part(upstream_a, upstream_b) or compare_debian_version_part(revision_a, revision_b)
+
+
+def split_debian_version(version: str) -> Tuple[int, str, str]:
+    epoch = 0
+    if ':' in version:
+        s_epoch, version = version.split(':', 1)
+        epoch = int(s_epoch)
+    revision = ''
+    if '-' in version:
+        version, revision = version.rsplit('-', 1)
+    return epoch, version, revision
+
+
+def compare_debian_version_part(part_a: str, part_b: str) -> int:
+    """ alternating non-digit parts (compared char by char, '~' sorts before everything, letters before other chars)
+    and digit parts (compared numerically)
+    """
+    while part_a or part_b:
+        non_digits_a = re.match(r'\D*', part_a).group()      # type: ignore
+        non_digits_b = re.match(r'\D*', part_b).group()      # type: ignore
+        for index in range(max(len(non_digits_a), len(non_digits_b))):
+            order_a = get_debian_version_char_order(non_digits_a[index:index + 1])
+            order_b = get_debian_version_char_order(non_digits_b[index:index + 1])
+            if order_a != order_b:
+                return 1 if order_a > order_b else -1
+        part_a, part_b = part_a[len(non_digits_a):], part_b[len(non_digits_b):]
+        digits_a = re.match(r'\d*', part_a).group()          # type: ignore
+        digits_b = re.match(r'\d*', part_b).group()          # type: ignore
+        if int(digits_a or '0') != int(digits_b or '0'):
+            return 1 if int(digits_a or '0') > int(digits_b or '0') else -1
+        part_a, part_b = part_a[len(digits_a):], part_b[len(digits_b):]
+    return 0
+
+
+def get_debian_version_char_order(char: str) -> int:
+    if char == '~':
+        return -1
+    if not char:
+        return 0
+    if char.isalpha():
+        return ord(char)
+    return ord(char) + 256
+
+
+# a part of a Packages index of an apt repository, used in the doctests
+APT_PACKAGES_INDEX_EXAMPLE = ('Package: winehq-stable\n'
+                              'Architecture: amd64\n'
+                              'Version: 4.0.2~bionic\n'
+                              'Depends: wine-stable (= 4.0.2~bionic)\n'
+                              'Filename: ./amd64/winehq-stable_4.0.2~bionic_amd64.deb\n'
+                              '\n'
+                              'Package: winehq-stable\n'
+                              'Architecture: amd64\n'
+                              'Version: 4.0.3~bionic\n'
+                              'Depends: wine-stable (= 4.0.3~bionic)\n'
+                              'Filename: ./amd64/winehq-stable_4.0.3~bionic_amd64.deb\n'
+                              '\n'
+                              'Package: wine-stable\n'
+                              'Architecture: amd64\n'
+                              'Version: 4.0.3~bionic\n'
+                              'Depends: wine-stable-amd64 (= 4.0.3~bionic) | wine-stable-i386 (= 4.0.3~bionic), libc6\n'
+                              'Filename: ./amd64/wine-stable_4.0.3~bionic_amd64.deb\n'
+                              '\n'
+                              'Package: wine-stable-amd64\n'
+                              'Architecture: amd64\n'
+                              'Version: 4.0.3~bionic\n'
+                              'Filename: ./amd64/wine-stable-amd64_4.0.3~bionic_amd64.deb\n'
+                              '\n'
+                              'Package: wine-devel\n'
+                              'Architecture: amd64\n'
+                              'Version: 5.0~rc1~bionic\n'
+                              'Filename: ./amd64/wine-devel_5.0~rc1~bionic_amd64.deb\n')
@@ -1,11 +1,13 @@
 # ### STDLIB
+import os
 import pathlib
+import pwd
 import subprocess
-from typing import Tuple, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 # ### OWN
 import configmagick_linux
-import lib_list
+import lib_log_utils
 import lib_regexp
 import lib_shell
 
@@ -13,25 +15,47 @@ import lib_shell
 try:
     # imports for local pytest
     from . import install_wine_machine  # type: ignore # pragma: no cover
+    from . import lib_download          # type: ignore # pragma: no cover
+    from . import lib_wine_cache        # type: ignore # pragma: no cover
+    from . import lib_mirror            # type: ignore # pragma: no cover
+    from . import lib_wine_plan         # type: ignore # pragma: no cover
+    from . import lib_wine_registry     # type: ignore # pragma: no cover
+    from . import lib_wine_timings      # type: ignore # pragma: no cover
 except ImportError:                     # type: ignore # pragma: no cover
     # imports for doctest
     # noinspection PyUnresolvedReferences
     import install_wine_machine                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_download                         # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_mirror                           # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry                    # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_timings                     # type: ignore # pragma: no cover
 
 
 def fix_wine_permissions(wine_prefix: Union[str, pathlib.Path], username: str) -> None:
     wine_prefix = get_and_check_wine_prefix(wine_prefix, username)    # prepend /home/user if needed
 
     if wine_prefix.exists():
-        lib_shell.run_shell_command('chown -R "{username}"."{username}" "{wine_prefix}"'
-                                    .format(username=username, wine_prefix=wine_prefix),
-                                    quiet=True, use_sudo=True)
-        lib_shell.run_shell_command('chmod -R 0775 "{wine_prefix}"'
-                                    .format(wine_prefix=wine_prefix),
-                                    quiet=True, use_sudo=True)
+        for command in get_l_fix_wine_permissions_commands(wine_prefix=wine_prefix, username=username):
+            lib_shell.run_shell_command(command, shell=True, quiet=True, use_sudo=True)
     fix_permissions_winecache(username=username)
 
 
+def get_l_fix_wine_permissions_commands(wine_prefix: pathlib.Path, username: str) -> List[str]:
+    """ the files and directories of the prefix get mode 0775 - except hardlinked files, those are shared with other prefixes
+    by lib_wine_dedupe and stay read-only, so a write through one prefix can not change the file in all of them """
+    return ['chown -R "{username}"."{username}" "{wine_prefix}"'.format(username=username, wine_prefix=wine_prefix),
+            'find "{wine_prefix}" ! -type l \\( -type d -o -links 1 \\) ! -perm 0775 -exec chmod 0775 {{}} +'.format(wine_prefix=wine_prefix),
+            'find "{wine_prefix}" -type f -links +1 -perm /0222 -exec chmod a-w {{}} +'.format(wine_prefix=wine_prefix)]
+
+
 def get_and_check_wine_prefix(wine_prefix: Union[str, pathlib.Path],
                               username: str = configmagick_linux.get_current_username()) -> pathlib.Path:
     """
@@ -96,6 +120,39 @@ def get_path_wine_cache_for_user(username: str = configmagick_linux.get_current_
     return pathlib.Path(path_wine_cache)
 
 
+def get_path_configmagick_wine_state_file(filename: str, username: str = configmagick_linux.get_current_username()) -> pathlib.Path:
+    """ the indexes of configmagick_wine are kept in /var/lib/configmagick_wine for root, in ~/.cache/configmagick_wine for other users
+
+    >>> get_path_configmagick_wine_state_file('test.sqlite', username='root')
+    PosixPath('/var/lib/configmagick_wine/test.sqlite')
+
+    """
+    if username == 'root':
+        return pathlib.Path('/var/lib/configmagick_wine') / filename
+    return configmagick_linux.get_path_home_dir_user(username=username) / '.cache/configmagick_wine' / filename
+
+
+def create_configmagick_wine_state_directory(path_state_file: pathlib.Path, username: str = configmagick_linux.get_current_username()) -> None:
+    """ create the directory of the state file. when root works for another user, the directories are given to the user,
+    otherwise the next run as that user can not write its state
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     create_configmagick_wine_state_directory(pathlib.Path(tmp_dir) / 'cache/configmagick_wine/test.json',
+    ...                                              username=configmagick_linux.get_current_username())
+    ...     is_created = (pathlib.Path(tmp_dir) / 'cache/configmagick_wine').is_dir()
+    >>> is_created
+    True
+
+    """
+    l_paths_missing = [path_directory for path_directory in path_state_file.parents if not path_directory.exists()]
+    path_state_file.parent.mkdir(parents=True, exist_ok=True)
+    if os.geteuid() == 0:
+        user_entry = pwd.getpwnam(username)
+        for path_directory in set(l_paths_missing + [path_state_file.parent]):
+            os.chown(str(path_directory), user_entry.pw_uid, user_entry.pw_gid)
+
+
 def create_wine_cache_for_user(username: str = configmagick_linux.get_current_username()) -> None:
     path_wine_cache = get_path_wine_cache_for_user(username=username)
     if not path_wine_cache.is_dir():
@@ -104,14 +161,17 @@ def create_wine_cache_for_user(username: str = configmagick_linux.get_current_us
 
 
 def fix_permissions_winecache(username: str = configmagick_linux.get_current_username()) -> None:
+    """ only entries with wrong owner or mode are changed. symlinks and hardlinked files are left alone,
+    those are the immutable blobs of the node wine cache, shared by all users (see lib_wine_cache) """
     path_wine_cache = get_path_wine_cache_for_user(username=username)
     if path_wine_cache.exists():
-        lib_shell.run_shell_command('chown -R "{username}"."{username}" "{path_wine_cache}"'
+        lib_shell.run_shell_command('find "{path_wine_cache}" ! -type l \\( -type d -o -links 1 \\) \\( ! -user "{username}" -o ! -group "{username}" \\) '
+                                    '-exec chown "{username}"."{username}" {{}} +'
                                     .format(username=username, path_wine_cache=path_wine_cache),
-                                    quiet=True, use_sudo=True)
-        lib_shell.run_shell_command('chmod -R 0775 "{path_wine_cache}"'
+                                    shell=True, quiet=True, use_sudo=True)
+        lib_shell.run_shell_command('find "{path_wine_cache}" ! -type l \\( -type d -o -links 1 \\) ! -perm 0775 -exec chmod 0775 {{}} +'
                                     .format(path_wine_cache=path_wine_cache),
-                                    quiet=True, use_sudo=True)
+                                    shell=True, quiet=True, use_sudo=True)
 
 
 def get_wine_arch_from_wine_prefix(wine_prefix: Union[str, pathlib.Path],
@@ -199,19 +259,63 @@ def download_file_to_winecache(download_link: str, filename: pathlib.Path, usern
     >>> assert pathlib.Path( configmagick_linux.get_path_home_dir_current_user() / '.cache/wine/wine-mono-4.9.3.msi').is_file()
 
     """
+    if lib_wine_plan.is_plan_mode():
+        add_download_to_plan(download_link=download_link, filename=filename, username=username)
+        return
     create_wine_cache_for_user(username=username)
     path_wine_cache = get_path_wine_cache_for_user(username=username)
     download_filename = path_wine_cache / filename
-    configmagick_linux.download_file(download_link=download_link, filename=download_filename)
+    if lib_wine_cache.is_node_wine_cache_enabled():
+        # fetched and stored once per machine, the users wine cache gets a link to the blob
+        if lib_wine_cache.get_path_node_wine_cache_file(filename) is None:
+            with lib_wine_timings.timed_step(lib_wine_timings.get_step_key_from_download(str(filename))):
+                lib_mirror.download_file(download_link=download_link, filename=download_filename)
+            lib_wine_cache.add_file_to_node_wine_cache(download_filename, filename)
+        lib_wine_cache.link_node_wine_cache_file(filename, download_filename)
+    else:
+        with lib_wine_timings.timed_step(lib_wine_timings.get_step_key_from_download(str(filename))):
+            lib_mirror.download_file(download_link=download_link, filename=download_filename)
+    lib_wine_cache.record_wine_cache_access(filename=filename, username=username)
     fix_permissions_winecache(username=username)
 
 
+def download_file_to_winecache_from_links(l_download_links: Sequence[str], filename: pathlib.Path, username: str) -> None:
+    """ download from the first download link (the primary link and its backups) which responds, see lib_download.
+    if the download from that link fails, the other links are tried in order of their recorded latency
+    """
+    if lib_wine_plan.is_plan_mode() or lib_wine_cache.is_node_wine_cache_enabled() and lib_wine_cache.get_path_node_wine_cache_file(filename) is not None:
+        # already on the node, nothing to fetch - or just planned, without probing the links
+        download_file_to_winecache(download_link=l_download_links[0], filename=filename, username=username)
+        return
+    l_download_links = lib_download.get_l_download_links_by_response(l_download_links, username=username)
+    for download_link in l_download_links[:-1]:
+        try:
+            download_file_to_winecache(download_link=download_link, filename=filename, username=username)
+            return
+        except subprocess.CalledProcessError:
+            lib_log_utils.log_warning('Download from "{download_link}" failed, trying the next mirror'.format(download_link=download_link))
+    download_file_to_winecache(download_link=l_download_links[-1], filename=filename, username=username)
+
+
+def add_download_to_plan(download_link: str, filename: pathlib.Path, username: str) -> None:
+    """ a download from the node wine cache is just a link, it takes no time """
+    is_in_node_wine_cache = lib_wine_cache.is_node_wine_cache_enabled() and lib_wine_cache.get_path_node_wine_cache_file(filename) is not None
+    if is_in_node_wine_cache:
+        lib_wine_plan.add_plan_step('download', description=download_link, step_key='', note='node cache hit', expected_seconds=0.0)
+    else:
+        note = 'cache miss, replaces the cached file' if is_file_in_wine_cache(filename=filename, username=username) else 'cache miss'
+        lib_wine_plan.add_plan_step('download', description=download_link, step_key=lib_wine_timings.get_step_key_from_download(str(filename)), note=note)
+
+
 def remove_file_from_winecache(filename: pathlib.Path, username: str) -> None:
     create_wine_cache_for_user(username=username)
     path_wine_cache_file = get_path_wine_cache_for_user(username=username) / filename
     if path_wine_cache_file.exists():
         lib_shell.run_shell_command('rm -f "{path_wine_cache_file}"'.format(path_wine_cache_file=path_wine_cache_file),
                                     quiet=True, use_sudo=True)
+    if lib_wine_cache.is_node_wine_cache_enabled():
+        # the next download fetches the file again for the whole node
+        lib_wine_cache.remove_file_from_node_wine_cache_index(filename)
 
 
 def prepend_path_to_wine_registry_path(path_to_add: Union[str, pathlib.WindowsPath],
@@ -225,20 +329,123 @@ def prepend_path_to_wine_registry_path(path_to_add: Union[str, pathlib.WindowsPa
     >>> write_wine_registry_path(path=old_path, wine_prefix='wine_test_32')
     >>> assert get_wine_registry_path(wine_prefix='wine_test_32') == old_path
 
+    """
+    edit_wine_registry_path(l_paths_to_prepend=[str(path_to_add)], wine_prefix=wine_prefix, username=username)
+
+
+def edit_wine_registry_path(l_paths_to_prepend: Sequence[str] = (),
+                            l_paths_to_append: Sequence[str] = (),
+                            l_paths_to_remove: Sequence[str] = (),
+                            wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                            username: str = configmagick_linux.get_current_username()) -> bool:
+    """ prepend, append and remove many PATH entries at once - one read, at most one write.
+    if no wineserver is running on the prefix, the hive file is read and written under the wineserver lock, so concurrent edits
+    do not overwrite each other. otherwise the PATH is read from the running wineserver and written with one single 'wine reg import',
+    the same way as lib_wine_registry.write_wine_registry_entries
+
+    entries are compared case insensitive and without trailing backslash, double entries are removed.
+    entries to prepend or append which are already in the PATH stay where they are.
+
+    Returns:
+        True if the PATH was changed, False if there was nothing to do and nothing was written
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> old_path = get_wine_registry_path(wine_prefix='wine_test_32')
+    >>> assert edit_wine_registry_path(l_paths_to_prepend=['c:\\\\test1', 'c:\\\\test2\\\\'], l_paths_to_append=['c:\\\\test3'],
+    ...                                wine_prefix='wine_test_32') == True
+    >>> assert get_wine_registry_path(wine_prefix='wine_test_32').startswith('c:\\\\test1;c:\\\\test2;')
+    >>> assert get_wine_registry_path(wine_prefix='wine_test_32').endswith(';c:\\\\test3')
+    >>> assert edit_wine_registry_path(l_paths_to_prepend=['C:\\\\TEST1\\\\'], wine_prefix='wine_test_32') == False
+    >>> assert edit_wine_registry_path(l_paths_to_remove=['c:\\\\test1', 'c:\\\\test2', 'c:\\\\test3'], wine_prefix='wine_test_32') == True
+    >>> assert get_wine_registry_path(wine_prefix='wine_test_32').lower() == ';'.join(get_l_normalized_path_entries(old_path.split(';'))).lower()
+
     """
     wine_prefix = get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
-    current_wine_registry_path = get_wine_registry_path(wine_prefix=wine_prefix, username=username)
-    s_path_to_add = str(path_to_add).strip()
-    l_current_wine_registry_path = current_wine_registry_path.split(';')
-    l_current_wine_registry_path = lib_list.ls_strip_elements(l_current_wine_registry_path)
-    # the path must not end with \\ , because if we set it this might escape the last " !!!
-    # like : wine reg add "..." /t "REG_EXPAND_SZ" /v "PATH" /d "c:\test\" /f  leads to : /bin/sh: 1: Syntax error: Unterminated quoted string
-    l_current_wine_registry_path = lib_list.ls_rstrip_elements(l_current_wine_registry_path, '\\')
-    l_current_wine_registry_path = lib_list.del_double_elements(l_current_wine_registry_path)
-    if not lib_list.is_list_element_fnmatching(ls_elements=l_current_wine_registry_path, s_fnmatch_searchpattern=s_path_to_add):
-        l_current_wine_registry_path = [s_path_to_add] + l_current_wine_registry_path
-    new_wine_registry_path = ';'.join(l_current_wine_registry_path)
-    write_wine_registry_path(path=new_wine_registry_path, wine_prefix=wine_prefix, username=username)
+    reg_key = 'HKEY_LOCAL_MACHINE\\SYSTEM\\CurrentControlSet\\Control\\Session Manager\\Environment'
+    hive_filename, relative_key = lib_wine_registry.get_hive_filename_and_relative_key(reg_key)
+    path_hive = lib_wine_registry.get_and_check_path_wine_registry_hive(wine_prefix=wine_prefix, hive_filename=hive_filename)
+    with lib_wine_registry.wineserver_lock(wine_prefix=wine_prefix, username=username) as is_wineserver_locked:
+        if is_wineserver_locked:
+            current_value = lib_wine_registry.get_wine_registry_hive_value(lib_wine_registry.read_wine_registry_hive(path_hive), relative_key, 'PATH')
+            if current_value is None:
+                raise RuntimeError('can not read Wine Registry Data, WINEPREFIX="{wine_prefix}", key="{reg_key}", subkey="PATH"'.format(
+                    wine_prefix=wine_prefix, reg_key=reg_key))
+            registry_entry = get_edited_wine_registry_path_entry(reg_key, current_value, l_paths_to_prepend, l_paths_to_append, l_paths_to_remove)
+            if registry_entry is None:
+                return False
+            lib_wine_registry.write_wine_registry_hives_offline([registry_entry], wine_prefix=wine_prefix)
+            return True
+
+    # a wineserver is running, the hive file is not up to date - read and write through the wineserver
+    current_value = get_l_wine_registry_data_struct(reg_key=reg_key, reg_subkey='PATH', wine_prefix=wine_prefix, username=username)
+    registry_entry = get_edited_wine_registry_path_entry(reg_key, current_value, l_paths_to_prepend, l_paths_to_append, l_paths_to_remove)
+    if registry_entry is None:
+        return False
+    lib_wine_registry.import_wine_registry_entries([registry_entry], wine_prefix=wine_prefix, username=username)
+    return True
+
+
+def get_edited_wine_registry_path_entry(reg_key: str,
+                                        current_value: Tuple[str, str],
+                                        l_paths_to_prepend: Sequence[str] = (),
+                                        l_paths_to_append: Sequence[str] = (),
+                                        l_paths_to_remove: Sequence[str] = ()) -> Optional[lib_wine_registry.RegistryEntry]:
+    """ the registry entry of the edited PATH, None if the PATH does not change
+
+    >>> reg_key = 'HKEY_LOCAL_MACHINE\\\\SYSTEM\\\\CurrentControlSet\\\\Control\\\\Session Manager\\\\Environment'
+    >>> get_edited_wine_registry_path_entry(reg_key, ('REG_EXPAND_SZ', 'c:\\\\windows'), l_paths_to_prepend=['c:\\\\test']).reg_data
+    'c:\\\\test;c:\\\\windows'
+    >>> get_edited_wine_registry_path_entry(reg_key, ('REG_EXPAND_SZ', 'c:\\\\windows'), l_paths_to_append=['C:\\\\WINDOWS\\\\']) is None
+    True
+
+    """
+    reg_data_type, current_wine_registry_path = current_value
+    new_wine_registry_path = get_edited_wine_registry_path(current_wine_registry_path=current_wine_registry_path,
+                                                           l_paths_to_prepend=l_paths_to_prepend,
+                                                           l_paths_to_append=l_paths_to_append,
+                                                           l_paths_to_remove=l_paths_to_remove)
+    if new_wine_registry_path == current_wine_registry_path:
+        return None
+    return lib_wine_registry.RegistryEntry(reg_key, 'PATH', reg_data_type, new_wine_registry_path)
+
+
+def get_edited_wine_registry_path(current_wine_registry_path: str,
+                                  l_paths_to_prepend: Sequence[str] = (),
+                                  l_paths_to_append: Sequence[str] = (),
+                                  l_paths_to_remove: Sequence[str] = ()) -> str:
+    """
+    >>> get_edited_wine_registry_path('c:\\\\windows;C:\\\\Windows\\\\;c:\\\\x', ['c:\\\\a', 'C:\\\\X\\\\'], ['c:\\\\b'], ['C:\\\\WINDOWS'])
+    'c:\\\\a;c:\\\\x;c:\\\\b'
+    >>> get_edited_wine_registry_path('c:\\\\windows;;c:\\\\x')
+    'c:\\\\windows;c:\\\\x'
+
+    """
+    l_paths_to_remove = [path_entry.lower() for path_entry in get_l_normalized_path_entries(l_paths_to_remove)]
+    l_current_paths = [path_entry for path_entry in get_l_normalized_path_entries(current_wine_registry_path.split(';'))
+                       if path_entry.lower() not in l_paths_to_remove]
+    l_current_paths_lower = [path_entry.lower() for path_entry in l_current_paths]
+    l_prepend = [path_entry for path_entry in get_l_normalized_path_entries(l_paths_to_prepend) if path_entry.lower() not in l_current_paths_lower]
+    l_new_paths = get_l_normalized_path_entries(l_prepend + l_current_paths + list(l_paths_to_append))
+    return ';'.join(l_new_paths)
+
+
+def get_l_normalized_path_entries(l_path_entries: Sequence[str]) -> List[str]:
+    """ strip blanks and trailing backslashes, remove empty and double entries (case insensitive), keeps the order
+
+    >>> get_l_normalized_path_entries([' c:\\\\test\\\\ ', 'C:\\\\TEST', '', 'c:\\\\windows'])
+    ['c:\\\\test', 'c:\\\\windows']
+
+    """
+    l_normalized_path_entries = list()  # type: List[str]
+    l_path_entries_lower = list()       # type: List[str]
+    for path_entry in l_path_entries:
+        # the path must not end with \\ , because if we set it this might escape the last " !!!
+        # like : wine reg add "..." /t "REG_EXPAND_SZ" /v "PATH" /d "c:\test\" /f  leads to : /bin/sh: 1: Syntax error: Unterminated quoted string
+        path_entry = str(path_entry).strip().rstrip('\\')
+        if path_entry and path_entry.lower() not in l_path_entries_lower:
+            l_normalized_path_entries.append(path_entry)
+            l_path_entries_lower.append(path_entry.lower())
+    return l_normalized_path_entries
 
 
 def get_wine_registry_path(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
@@ -0,0 +1,221 @@
+# ### STDLIB
+import json
+import os
+import pathlib
+import pwd
+import re
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import install_wine_machine          # type: ignore # pragma: no cover
+    from . import lib_apt                       # type: ignore # pragma: no cover
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_registry             # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import install_wine_machine                 # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_apt                              # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry                    # type: ignore # pragma: no cover
+
+
+# written into the archive next to the prefix files, it tells the import which user paths to rewrite
+WINE_PREFIX_EXPORT_INFO_FILENAME = '.configmagick_wine_export.json'
+WINE_PREFIX_EXPORT_INFO_VERSION = 1
+L_WINE_REGISTRY_HIVE_FILENAMES = ['system.reg', 'user.reg', 'userdef.reg']
+# zstd -T0 uses one thread per cpu core
+ZSTD_DEFAULT_LEVEL = 3
+
+
+def export_prefix(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                  archive_file: str = '',
+                  username: str = configmagick_linux.get_current_username(),
+                  compression_level: int = ZSTD_DEFAULT_LEVEL,
+                  quiet: bool = False) -> None:
+    """export a wine prefix to a tar.zst archive. syntax: export_prefix --wine_prefix=<prefix> --archive_file=<file.tar.zst>
+
+    the prefix is streamed through tar into multithreaded zstd, hardlinks, sparse files and permissions are kept.
+
+    Args:
+        --wine_prefix=<prefix>              the prefix to export, it must not be in use by a wineserver
+        --archive_file=<file.tar.zst>       default <prefix>.tar.zst next to the prefix
+        --compression_level=<1..19>         the zstd compression level, default 3
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    if not lib_wine.get_path_wine_system_registry(wine_prefix).is_file():
+        raise RuntimeError('can not export, WINEPREFIX="{wine_prefix}" is not a wine prefix'.format(wine_prefix=wine_prefix))
+    if lib_wine_registry.is_wineserver_running(wine_prefix=wine_prefix, username=username):
+        raise RuntimeError('can not export, a wineserver is running on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix))
+    archive_file = archive_file or str(wine_prefix.parent / '{prefix_name}.tar.zst'.format(prefix_name=wine_prefix.name))
+    lib_log_utils.banner_verbose('Export WINEPREFIX="{wine_prefix}" to "{archive_file}"'
+                                 .format(wine_prefix=wine_prefix, archive_file=archive_file), quiet=quiet)
+
+    lib_apt.install_linux_packages(['zstd'], quiet=quiet)
+    start_time = time.time()
+    with tempfile.TemporaryDirectory() as export_info_directory:
+        path_export_info = pathlib.Path(export_info_directory) / WINE_PREFIX_EXPORT_INFO_FILENAME
+        path_export_info.write_text(json.dumps(get_wine_prefix_export_info(wine_prefix), indent=4))
+        # the export info comes first, so an import can read it before the prefix files
+        command = 'tar --create --file="{archive_file}" --use-compress-program="zstd -T0 -{compression_level} -q" --sparse --numeric-owner '\
+                  '-C "{export_info_directory}" "{export_info_filename}" -C "{wine_prefix}" .'\
+            .format(archive_file=archive_file, compression_level=int(compression_level), export_info_directory=export_info_directory,
+                    export_info_filename=WINE_PREFIX_EXPORT_INFO_FILENAME, wine_prefix=wine_prefix)
+        lib_shell.run_shell_command(command, shell=True, use_sudo=True, quiet=True)
+
+    lib_log_utils.banner_success('WINEPREFIX="{wine_prefix}" exported in {seconds:.1f} seconds'
+                                 .format(wine_prefix=wine_prefix, seconds=time.time() - start_time), quiet=quiet)
+
+
+def import_prefix(archive_file: str,
+                  wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                  username: str = configmagick_linux.get_current_username(),
+                  overwrite_existing_wine_machine: bool = False,
+                  quiet: bool = False) -> None:
+    """import a wine prefix from a tar.zst archive. syntax: import_prefix --archive_file=<file.tar.zst> --wine_prefix=<prefix>
+
+    the archive is streamed through zstd directly into the new prefix, without a temporary copy.
+    the home directory and the username of the exporting user are replaced in the hives, in drive_c/users and in the symlinks,
+    the files are owned by the importing user.
+
+    Args:
+        --archive_file=<file.tar.zst>       the archive made by export_prefix
+        --wine_prefix=<prefix>              the new prefix
+        --overwrite_existing_wine_machine   replace an existing prefix
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    lib_log_utils.banner_verbose('Import "{archive_file}" to WINEPREFIX="{wine_prefix}"'
+                                 .format(archive_file=archive_file, wine_prefix=wine_prefix), quiet=quiet)
+    install_wine_machine.delete_existing_wine_machine_or_raise(overwrite_existing_wine_machine=overwrite_existing_wine_machine,
+                                                               wine_prefix=wine_prefix, username=username)
+    lib_apt.install_linux_packages(['zstd'], quiet=quiet)
+    start_time = time.time()
+    lib_shell.run_shell_command('mkdir -p "{wine_prefix}"'.format(wine_prefix=wine_prefix), shell=True, use_sudo=True, quiet=True)
+    command = 'tar --extract --file="{archive_file}" --use-compress-program="zstd -d -T0 -q" --preserve-permissions --no-same-owner -C "{wine_prefix}"'\
+        .format(archive_file=archive_file, wine_prefix=wine_prefix)
+    lib_shell.run_shell_command(command, shell=True, use_sudo=True, quiet=True)
+    lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)
+
+    path_export_info = wine_prefix / WINE_PREFIX_EXPORT_INFO_FILENAME
+    if not path_export_info.is_file():
+        raise RuntimeError('"{archive_file}" was not made by export_prefix, the export info is missing'.format(archive_file=archive_file))
+    export_info = json.loads(path_export_info.read_text())
+    path_export_info.unlink()
+    rewrite_user_paths_in_wine_prefix(wine_prefix=wine_prefix,
+                                      old_username=export_info['username'], old_path_home=export_info['path_home'],
+                                      new_username=username, new_path_home=str(configmagick_linux.get_path_home_dir_user(username=username)))
+    lib_log_utils.banner_success('WINEPREFIX="{wine_prefix}" imported in {seconds:.1f} seconds'
+                                 .format(wine_prefix=wine_prefix, seconds=time.time() - start_time), quiet=quiet)
+
+
+def get_wine_prefix_export_info(wine_prefix: pathlib.Path) -> Dict[str, Any]:
+    stat_wine_prefix = wine_prefix.stat()
+    try:
+        export_username = pwd.getpwuid(stat_wine_prefix.st_uid).pw_name
+        path_home = pwd.getpwuid(stat_wine_prefix.st_uid).pw_dir
+    except KeyError:
+        export_username, path_home = str(stat_wine_prefix.st_uid), ''
+    return {'version': WINE_PREFIX_EXPORT_INFO_VERSION,
+            'wine_prefix': str(wine_prefix),
+            'username': export_username,
+            'path_home': path_home,
+            'timestamp': time.time()}
+
+
+def rewrite_user_paths_in_wine_prefix(wine_prefix: pathlib.Path, old_username: str, old_path_home: str, new_username: str, new_path_home: str) -> None:
+    """ move drive_c/users/<old_username>, and replace the old user paths in the hives and in the symlinks
+
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     wine_prefix = pathlib.Path(tmp_dir)
+    ...     (wine_prefix / 'drive_c/users/old/Temp').mkdir(parents=True)
+    ...     (wine_prefix / 'drive_c/users/old/My Documents').symlink_to('/home/old/Documents')
+    ...     (wine_prefix / 'dosdevices').mkdir()
+    ...     (wine_prefix / 'dosdevices/c:').symlink_to('../drive_c')
+    ...     _ = (wine_prefix / 'user.reg').write_text('WINE REGISTRY Version 2\\n\\n[Software\\\\\\\\Wine] 1\\n'
+    ...                                               '"Personal"="C:\\\\\\\\users\\\\\\\\old\\\\\\\\My Documents"\\n')
+    ...     rewrite_user_paths_in_wine_prefix(wine_prefix, 'old', '/home/old', 'new', '/home/new')
+    ...     print((wine_prefix / 'user.reg').read_text().splitlines()[-1])
+    ...     print(os.readlink(str(wine_prefix / 'drive_c/users/new/My Documents')), os.readlink(str(wine_prefix / 'dosdevices/c:')))
+    "Personal"="C:\\\\users\\\\new\\\\My Documents"
+    /home/new/Documents ../drive_c
+
+    """
+    if old_username == new_username and old_path_home == new_path_home:
+        return
+    path_users = wine_prefix / 'drive_c/users'
+    path_old_user = path_users / old_username
+    path_new_user = path_users / new_username
+    if old_username != new_username and path_old_user.is_dir() and not path_new_user.exists():
+        path_old_user.rename(path_new_user)
+
+    l_replacements = get_l_user_path_replacements(old_username, old_path_home, new_username, new_path_home)
+    for hive_filename in L_WINE_REGISTRY_HIVE_FILENAMES:
+        path_hive = wine_prefix / hive_filename
+        if path_hive.is_file():
+            rewrite_user_paths_in_hive(path_hive, l_replacements)
+
+    if old_path_home:
+        for path_directory in (wine_prefix / 'dosdevices', path_new_user):
+            if path_directory.is_dir():
+                rewrite_user_paths_in_symlinks(path_directory, old_path_home, new_path_home)
+
+
+def get_l_user_path_replacements(old_username: str, old_path_home: str, new_username: str, new_path_home: str) -> List[Tuple[str, str]]:
+    """ the (regexp, replacement) for the hive files - the backslashes are doubled in the hives, and the paths are case insensitive
+
+    >>> l_replacements = get_l_user_path_replacements('old', '/home/old', 'new', '/home/new')
+    >>> hive_line = '"a"="C:\\\\\\\\users\\\\\\\\OLD\\\\\\\\Temp;Z:\\\\\\\\home\\\\\\\\old\\\\\\\\x;/home/old;/home/older"'
+    >>> for regexp, replacement in l_replacements:
+    ...     hive_line = re.sub(regexp, replacement, hive_line)
+    >>> print(hive_line)
+    "a"="C:\\\\users\\\\new\\\\Temp;Z:\\\\home\\\\new\\\\x;/home/new;/home/older"
+
+    """
+    # the path must end there - /home/old must not match /home/older
+    end_of_path = r'(?=[\\/";]|$)'
+    l_replacements = list()     # type: List[Tuple[str, Any]]
+    l_replacements.append((r'(?i)(C:\\\\users\\\\)' + re.escape(old_username) + end_of_path, lambda match: match.group(1) + new_username))
+    if old_path_home and new_path_home:
+        old_path_home_windows = 'Z:' + old_path_home.replace('/', '\\\\')
+        new_path_home_windows = 'Z:' + new_path_home.replace('/', '\\\\')
+        l_replacements.append((r'(?i)' + re.escape(old_path_home_windows) + end_of_path, lambda match: new_path_home_windows))
+        l_replacements.append((re.escape(old_path_home) + end_of_path, lambda match: new_path_home))
+    return l_replacements
+
+
+def rewrite_user_paths_in_hive(path_hive: pathlib.Path, l_replacements: List[Tuple[str, Any]]) -> None:
+    with open(str(path_hive), mode='r', encoding='utf-8', errors='surrogateescape', newline='') as hive_file:
+        hive_content = hive_file.read()
+    new_hive_content = hive_content
+    for regexp, replacement in l_replacements:
+        new_hive_content = re.sub(regexp, replacement, new_hive_content)
+    if new_hive_content != hive_content:
+        lib_wine_registry.write_wine_registry_hive(path_hive, lib_wine_registry.parse_wine_registry_hive(new_hive_content))
+
+
+def rewrite_user_paths_in_symlinks(path_directory: pathlib.Path, old_path_home: str, new_path_home: str) -> None:
+    """ retarget the symlinks which point into the old home directory, the directories are not followed """
+    for path_entry in path_directory.iterdir():
+        if not path_entry.is_symlink():
+            continue
+        target = os.readlink(str(path_entry))
+        if target == old_path_home or target.startswith(old_path_home.rstrip('/') + '/'):
+            stat_symlink = os.lstat(str(path_entry))
+            path_entry.unlink()
+            os.symlink(new_path_home.rstrip('/') + target[len(old_path_home.rstrip('/')):], str(path_entry))
+            if os.geteuid() == 0:
+                os.lchown(str(path_entry), stat_symlink.st_uid, stat_symlink.st_gid)
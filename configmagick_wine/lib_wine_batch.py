@@ -0,0 +1,147 @@
+# ### STDLIB
+import os
+import pathlib
+import subprocess
+import uuid
+from typing import List, NamedTuple, Sequence, Union
+
+# ### OWN
+import configmagick_linux
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+    from . import lib_wine_timings              # type: ignore # pragma: no cover
+    from . import install_wine_machine          # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_timings                     # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_wine_machine                 # type: ignore # pragma: no cover
+
+
+# the output of every command is framed by the lines '<marker> BEGIN <index>' and '<marker> END <index> <exit code>'
+BATCH_MARKER_PREFIX = 'CONFIGMAGICK_WINE_BATCH_'
+
+# the result of one windows command of a batch - returncode is -1 if the command did not run, because the batch was aborted
+WindowsCommandResult = NamedTuple('WindowsCommandResult', [('command', str), ('returncode', int), ('output', str)])
+
+
+def run_windows_commands(l_commands: Sequence[str],
+                         wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                         username: str = configmagick_linux.get_current_username()) -> List[WindowsCommandResult]:
+    """ run windows commands like 'python --version' in one generated .cmd script, with one single 'wine cmd /c',
+    instead of starting wine for every command. the commands run in the given order, also if one of them fails.
+    the output (stdout and stderr) of the commands is written to a log file in the prefix, and split by markers.
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> l_results = run_windows_commands(['ver', 'cmd /c exit 3'], wine_prefix='wine_test_32')
+    >>> assert 'Windows' in l_results[0].output
+    >>> l_results[1].returncode
+    3
+
+    """
+    if not l_commands:
+        return list()
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    step_key = lib_wine_timings.get_step_key_from_windows_commands(l_commands)
+    if lib_wine_plan.is_plan_mode():
+        try:
+            wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
+        except RuntimeError:
+            # the prefix is only planned yet, the timings of all archs are used
+            wine_arch = ''
+        lib_wine_plan.add_plan_step('windows', description=' & '.join(l_commands), step_key=step_key,
+                                    note='one wine session on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix), wine_arch=wine_arch)
+        return [WindowsCommandResult(command=command, returncode=0, output='') for command in l_commands]
+    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
+    marker = BATCH_MARKER_PREFIX + uuid.uuid4().hex
+    batch_filename = 'configmagick_wine_{pid}_{marker}'.format(pid=os.getpid(), marker=marker[-8:])
+    path_temp_directory = wine_prefix / 'drive_c/windows/temp'
+    path_script_file = path_temp_directory / (batch_filename + '.cmd')
+    path_log_file = path_temp_directory / (batch_filename + '.log')
+    path_temp_directory.mkdir(parents=True, exist_ok=True)
+    log_filename = 'C:\\windows\\temp\\{log_filename}'.format(log_filename=path_log_file.name)
+    with open(str(path_script_file), mode='w', newline='') as script_file:
+        script_file.write(get_batch_script_content(l_commands, marker=marker, log_filename=log_filename))
+    try:
+        command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine cmd /c "C:\\windows\\temp\\{script_filename}"'\
+                  .format(wine_prefix=wine_prefix, wine_arch=wine_arch, script_filename=path_script_file.name)
+        try:
+            with lib_wine_timings.timed_step(step_key, wine_arch=wine_arch):
+                lib_shell.run_shell_command(command, quiet=True, shell=True, run_as_user=username)
+        except subprocess.CalledProcessError:
+            # the exit code of cmd is the one of the last command, we report the exit codes per command
+            pass
+        if not path_log_file.is_file():
+            raise RuntimeError('can not run Windows commands, WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix))
+        batch_output = path_log_file.read_bytes().decode('utf-8', errors='replace')
+    finally:
+        for path_file in (path_script_file, path_log_file):
+            if path_file.exists():
+                path_file.unlink()
+    return parse_batch_output(batch_output, l_commands=l_commands, marker=marker)
+
+
+def get_batch_script_content(l_commands: Sequence[str], marker: str, log_filename: str) -> str:
+    """ 'call' lets .cmd and .bat files return to the script, and sets %ERRORLEVEL% for them too
+
+    >>> print(get_batch_script_content(['python --version'], marker='M', log_filename='C:\\\\x.log').replace('\\r', ''))
+    @echo off
+    echo M BEGIN 0 >> "C:\\x.log"
+    call python --version >> "C:\\x.log" 2>&1
+    echo M END 0 %ERRORLEVEL% >> "C:\\x.log"
+    <BLANKLINE>
+
+    """
+    l_lines = ['@echo off']
+    for index, command in enumerate(l_commands):
+        l_lines.append('echo {marker} BEGIN {index} >> "{log_filename}"'.format(marker=marker, index=index, log_filename=log_filename))
+        l_lines.append('call {command} >> "{log_filename}" 2>&1'.format(command=command, log_filename=log_filename))
+        l_lines.append('echo {marker} END {index} %ERRORLEVEL% >> "{log_filename}"'.format(marker=marker, index=index, log_filename=log_filename))
+    return '\r\n'.join(l_lines) + '\r\n'
+
+
+def parse_batch_output(batch_output: str, l_commands: Sequence[str], marker: str) -> List[WindowsCommandResult]:
+    """ split the output of a batch into the results of the commands
+
+    >>> batch_output = 'M BEGIN 0 \\r\\nPython 3.8.0\\r\\nM END 0 0 \\r\\nM BEGIN 1 \\r\\nnot found\\r\\nM END 1 9009 \\r\\n'
+    >>> for result in parse_batch_output(batch_output, ['python --version', 'git --version', 'ver'], marker='M'):
+    ...     print(result)
+    WindowsCommandResult(command='python --version', returncode=0, output='Python 3.8.0')
+    WindowsCommandResult(command='git --version', returncode=9009, output='not found')
+    WindowsCommandResult(command='ver', returncode=-1, output='')
+
+    """
+    l_results = [WindowsCommandResult(command=command, returncode=-1, output='') for command in l_commands]
+    index = -1
+    l_output_lines = list()     # type: List[str]
+    for line in batch_output.splitlines():
+        l_words = line.split()
+        if len(l_words) >= 3 and l_words[0] == marker and l_words[1] == 'BEGIN':
+            index = int(l_words[2])
+            l_output_lines = list()
+        elif len(l_words) >= 4 and l_words[0] == marker and l_words[1] == 'END' and int(l_words[2]) == index:
+            returncode = int(l_words[3]) if l_words[3].lstrip('-').isdigit() else -1
+            l_results[index] = l_results[index]._replace(returncode=returncode, output='\n'.join(l_output_lines).strip())
+            index = -1
+        elif index >= 0:
+            l_output_lines.append(line.rstrip())
+    return l_results
+
+
+def get_failed_windows_commands(l_results: Sequence[WindowsCommandResult]) -> List[str]:
+    """
+    >>> get_failed_windows_commands([WindowsCommandResult('ver', 0, 'Wine'), WindowsCommandResult('git --version', 9009, '')])
+    ['git --version']
+
+    """
+    return [result.command for result in l_results if result.returncode != 0]
@@ -0,0 +1,501 @@
+# ### STDLIB
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import re
+import shutil
+import stat
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+
+
+# set this environment variable to a directory like '/var/cache/configmagick_wine' to share the downloads of all users on the node
+ENV_NODE_WINE_CACHE = 'CONFIGMAGICK_WINE_NODE_CACHE'
+# the access records of a cache directory, {filename: {'last_access': <timestamp>, 'wine_prefixes': [...]}}
+WINE_CACHE_ACCESS_RECORDS_FILENAME = '.configmagick_wine_access.json'
+# the cache files a wine prefix was installed from, one filename per line - those are pinned as long as the prefix exists
+WINE_PREFIX_CACHE_MANIFEST_FILENAME = '.configmagick_wine_cache_manifest'
+# the directories of the node cache are shared by all users like /tmp/.X11-unix : writable for all, sticky - only the owner removes a blob.
+# the name index is writable for all without the sticky bit, so every user can point a name at a newer blob
+NODE_WINE_CACHE_DIRECTORY_MODE = 0o1777
+NODE_WINE_CACHE_NAMES_DIRECTORY_MODE = 0o777
+# files without a version in the name, like get-pip.py or nuget.exe, change upstream under the same name -
+# they are served from the node cache for that long, then they are downloaded again
+NODE_WINE_CACHE_UNVERSIONED_MAX_AGE_SECONDS = 7 * 24 * 3600
+
+# a file in a cache directory, as seen by the garbage collection
+WineCacheEntry = NamedTuple('WineCacheEntry', [('path', pathlib.Path), ('size', int), ('last_access', float), ('is_pinned', bool)])
+
+
+def get_path_node_wine_cache() -> Optional[pathlib.Path]:
+    """ the optional node-wide wine cache, None if it is not configured
+
+    the node cache holds every artifact once per machine, as immutable blob named by its sha256 :
+        <node cache>/blobs/<sha256[:2]>/<sha256>    mode 0444, the directories 1777, so every user can read and add them
+        <node cache>/names/<filename>               symlink to the blob, the index by filename, the directory 0777
+    the entries in the users wine cache ~/.cache/wine are hardlinks to the blobs (or symlinks, if the node cache is on another filesystem)
+
+    >>> os.environ[ENV_NODE_WINE_CACHE] = '/var/cache/configmagick_wine'
+    >>> get_path_node_wine_cache()
+    PosixPath('/var/cache/configmagick_wine')
+    >>> os.environ[ENV_NODE_WINE_CACHE] = ''
+    >>> assert get_path_node_wine_cache() is None
+
+    """
+    node_wine_cache = os.environ.get(ENV_NODE_WINE_CACHE, '').strip()
+    if not node_wine_cache:
+        return None
+    return pathlib.Path(node_wine_cache)
+
+
+def is_node_wine_cache_enabled() -> bool:
+    return get_path_node_wine_cache() is not None
+
+
+def get_and_check_path_node_wine_cache() -> pathlib.Path:
+    path_node_wine_cache = get_path_node_wine_cache()
+    if path_node_wine_cache is None:
+        raise RuntimeError('the node wine cache is not configured, set the environment variable {env}'.format(env=ENV_NODE_WINE_CACHE))
+    return path_node_wine_cache
+
+
+def get_path_node_wine_cache_blob(sha256: str) -> pathlib.Path:
+    """
+    >>> os.environ[ENV_NODE_WINE_CACHE] = '/var/cache/configmagick_wine'
+    >>> get_path_node_wine_cache_blob('ab12cd')
+    PosixPath('/var/cache/configmagick_wine/blobs/ab/ab12cd')
+    >>> os.environ[ENV_NODE_WINE_CACHE] = ''
+
+    """
+    return get_and_check_path_node_wine_cache() / 'blobs' / sha256[:2] / sha256
+
+
+def get_path_node_wine_cache_name(filename: Union[str, pathlib.Path]) -> pathlib.Path:
+    return get_and_check_path_node_wine_cache() / 'names' / pathlib.Path(filename).name
+
+
+def get_path_node_wine_cache_file(filename: Union[str, pathlib.Path]) -> Optional[pathlib.Path]:
+    """ get the blob of a file in the node wine cache, or None if the node cache does not have it.
+    a file without a version in the name is None after NODE_WINE_CACHE_UNVERSIONED_MAX_AGE_SECONDS, so it is downloaded again """
+    path_name = get_path_node_wine_cache_name(filename)
+    if not path_name.is_symlink():
+        return None
+    if not is_versioned_filename(filename) and time.time() - path_name.lstat().st_mtime > NODE_WINE_CACHE_UNVERSIONED_MAX_AGE_SECONDS:
+        return None
+    path_blob = pathlib.Path(os.path.realpath(str(path_name)))
+    if not path_blob.is_file():
+        return None
+    return path_blob
+
+
+def is_versioned_filename(filename: Union[str, pathlib.Path]) -> bool:
+    """ a file with a version in the name does not change upstream - a new version gets a new name
+
+    >>> is_versioned_filename('wine-mono-4.9.4.msi')
+    True
+    >>> is_versioned_filename('PortableGit-2.24.0-64-bit.7z.exe')
+    True
+    >>> is_versioned_filename('get-pip.py')
+    False
+    >>> is_versioned_filename('nuget.exe')
+    False
+
+    """
+    return re.search(r'\d+\.\d+', pathlib.Path(filename).name) is not None
+
+
+def add_file_to_node_wine_cache(path_file: pathlib.Path, filename: Union[str, pathlib.Path] = '') -> pathlib.Path:
+    """ store a copy of the file as immutable blob and point the name index at it, returns the path of the blob.
+    a blob which is already there is not stored again.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path_tmp_dir:
+    ...     os.environ[ENV_NODE_WINE_CACHE] = str(pathlib.Path(path_tmp_dir) / 'node_cache')
+    ...     path_file = pathlib.Path(path_tmp_dir) / 'test.msi'
+    ...     _ = path_file.write_bytes(b'test')
+    ...     path_blob = add_file_to_node_wine_cache(path_file)
+    ...     path_blob.name
+    ...     assert get_path_node_wine_cache_file('test.msi') == path_blob
+    ...     link_node_wine_cache_file('test.msi', pathlib.Path(path_tmp_dir) / 'user_cache' / 'test.msi')
+    ...     (pathlib.Path(path_tmp_dir) / 'user_cache' / 'test.msi').read_bytes()
+    ...     remove_file_from_node_wine_cache_index('test.msi')
+    ...     assert get_path_node_wine_cache_file('test.msi') is None
+    '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+    b'test'
+    >>> os.environ[ENV_NODE_WINE_CACHE] = ''
+
+    """
+    if not filename:
+        filename = path_file.name
+    sha256 = get_sha256_of_file(path_file)
+    path_blob = get_path_node_wine_cache_blob(sha256)
+    if not path_blob.is_file():
+        create_node_wine_cache_directory(path_blob.parent)
+        path_blob_tmp = path_blob.parent / '.{sha256}.{pid}.tmp'.format(sha256=sha256, pid=os.getpid())
+        try:
+            shutil.copyfile(str(path_file), str(path_blob_tmp))
+            os.chmod(str(path_blob_tmp), 0o444)
+            os.replace(str(path_blob_tmp), str(path_blob))
+        finally:
+            if path_blob_tmp.exists():
+                path_blob_tmp.unlink()
+
+    path_name = get_path_node_wine_cache_name(filename)
+    create_node_wine_cache_directory(path_name.parent, mode=NODE_WINE_CACHE_NAMES_DIRECTORY_MODE)
+    replace_with_link(path_target=path_name, path_link_to=pathlib.Path(os.path.relpath(str(path_blob), str(path_name.parent))), hardlink=False)
+    lib_log_utils.log_verbose('added "{filename}" to the node wine cache as "{path_blob}"'.format(filename=filename, path_blob=path_blob), quiet=True)
+    return path_blob
+
+
+def link_node_wine_cache_file(filename: Union[str, pathlib.Path], path_target: pathlib.Path) -> None:
+    """ make path_target a hardlink to the blob of the node wine cache - or a symlink if the blob is on another filesystem """
+    path_blob = get_path_node_wine_cache_file(filename)
+    if path_blob is None:
+        raise RuntimeError('"{filename}" is not in the node wine cache'.format(filename=filename))
+    path_target.parent.mkdir(parents=True, exist_ok=True)
+    replace_with_link(path_target=path_target, path_link_to=path_blob, hardlink=True)
+
+
+def remove_file_from_node_wine_cache_index(filename: Union[str, pathlib.Path]) -> None:
+    """ the blob itself stays, other users might have it linked - it is removed by the garbage collection """
+    path_name = get_path_node_wine_cache_name(filename)
+    if path_name.is_symlink():
+        path_name.unlink()
+
+
+def replace_with_link(path_target: pathlib.Path, path_link_to: pathlib.Path, hardlink: bool) -> None:
+    path_target_tmp = path_target.parent / '.{filename}.configmagick_wine.tmp'.format(filename=path_target.name)
+    if path_target_tmp.is_symlink() or path_target_tmp.exists():
+        path_target_tmp.unlink()
+    try:
+        if hardlink:
+            try:
+                os.link(str(path_link_to), str(path_target_tmp))
+            except OSError:
+                # another filesystem, or the kernel does not allow to hardlink files of other users (fs.protected_hardlinks)
+                os.symlink(str(path_link_to), str(path_target_tmp))
+        else:
+            os.symlink(str(path_link_to), str(path_target_tmp))
+        os.replace(str(path_target_tmp), str(path_target))
+    finally:
+        if path_target_tmp.is_symlink() or path_target_tmp.exists():
+            path_target_tmp.unlink()
+
+
+def create_node_wine_cache_directory(path_directory: pathlib.Path, mode: int = NODE_WINE_CACHE_DIRECTORY_MODE) -> None:
+    """ the directories of the node cache are shared by all users, the missing parents get NODE_WINE_CACHE_DIRECTORY_MODE.
+    a directory we own with an other mode (like 0755 of older versions) gets the mode, too
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path_tmp_dir:
+    ...     create_node_wine_cache_directory(pathlib.Path(path_tmp_dir) / 'node_cache/names', mode=NODE_WINE_CACHE_NAMES_DIRECTORY_MODE)
+    ...     oct(stat.S_IMODE((pathlib.Path(path_tmp_dir) / 'node_cache').stat().st_mode))
+    ...     oct(stat.S_IMODE((pathlib.Path(path_tmp_dir) / 'node_cache/names').stat().st_mode))
+    '0o1777'
+    '0o777'
+
+    """
+    l_paths_missing = list()    # type: List[pathlib.Path]
+    path_missing = path_directory
+    while not path_missing.is_dir():
+        l_paths_missing.insert(0, path_missing)
+        path_missing = path_missing.parent
+    for path_missing in l_paths_missing:
+        path_missing.mkdir(exist_ok=True)
+    for path_created in l_paths_missing[:-1] + [path_directory]:
+        stat_directory = path_created.stat()
+        directory_mode = mode if path_created == path_directory else NODE_WINE_CACHE_DIRECTORY_MODE
+        # the directory might have been created by an other user in the meantime, then it is his to chmod
+        if stat_directory.st_uid == os.geteuid() and stat.S_IMODE(stat_directory.st_mode) != directory_mode:
+            os.chmod(str(path_created), directory_mode)
+
+
+def get_sha256_of_file(path_file: pathlib.Path) -> str:
+    """
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile() as test_file:
+    ...     _ = test_file.write(b'test')
+    ...     test_file.flush()
+    ...     get_sha256_of_file(pathlib.Path(test_file.name))
+    '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+
+    """
+    sha256 = hashlib.sha256()
+    with open(str(path_file), mode='rb') as hash_file:
+        for chunk in iter(lambda: hash_file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def record_wine_cache_access(filename: Union[str, pathlib.Path],
+                             username: str = configmagick_linux.get_current_username(),
+                             wine_prefix: Union[str, pathlib.Path] = '') -> None:
+    """ record the use of a cache file - the access records drive the LRU eviction of gc_wine_cache,
+    the atime of the files is not reliable (noatime, relatime).
+    if a wine_prefix is given, the file is also listed in the cache manifest of the prefix, which pins it as long as the prefix exists.
+    the records of the node cache are shared by all users - if we can not write them, the access is just not recorded there
+    """
+    if lib_wine_plan.is_plan_mode():
+        return
+    filename = pathlib.Path(filename).name
+    timestamp = time.time()
+    add_wine_cache_access_record(lib_wine.get_path_wine_cache_for_user(username=username), filename, timestamp=timestamp, wine_prefix=wine_prefix)
+    path_node_wine_cache = get_path_node_wine_cache()
+    if path_node_wine_cache is not None:
+        try:
+            add_wine_cache_access_record(path_node_wine_cache, filename, timestamp=timestamp, wine_prefix=wine_prefix, is_shared=True)
+        except OSError:
+            lib_log_utils.log_verbose('can not record the access of "{filename}" in the node wine cache "{path_node_wine_cache}"'
+                                      .format(filename=filename, path_node_wine_cache=path_node_wine_cache), quiet=True)
+    if wine_prefix:
+        add_file_to_wine_prefix_cache_manifest(filename=filename, wine_prefix=pathlib.Path(wine_prefix))
+
+
+def add_wine_cache_access_record(path_cache: pathlib.Path, filename: str, timestamp: float, wine_prefix: Union[str, pathlib.Path] = '',
+                                 is_shared: bool = False) -> None:
+    with locked_wine_cache_access_records(path_cache, is_shared=is_shared) as d_access_records:
+        access_record = d_access_records.setdefault(filename, {'last_access': 0.0, 'wine_prefixes': []})
+        access_record['last_access'] = timestamp
+        if wine_prefix and str(wine_prefix) not in access_record['wine_prefixes']:
+            access_record['wine_prefixes'].append(str(wine_prefix))
+
+
+def add_file_to_wine_prefix_cache_manifest(filename: str, wine_prefix: pathlib.Path) -> None:
+    path_manifest = wine_prefix / WINE_PREFIX_CACHE_MANIFEST_FILENAME
+    l_filenames = read_wine_cache_pin_file(path_manifest)
+    if filename not in l_filenames:
+        with open(str(path_manifest), mode='a') as manifest_file:
+            manifest_file.write(filename + '\n')
+
+
+def read_wine_cache_pin_file(path_pin_file: pathlib.Path) -> List[str]:
+    """ read a prefix manifest or lockfile : one cache filename per line, empty lines and lines starting with '#' are ignored
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(mode='w') as pin_file:
+    ...     _ = pin_file.write('# pinned\\nwine-mono-4.9.4.msi\\n\\n  wine_gecko-2.47-x86.msi  \\n')
+    ...     pin_file.flush()
+    ...     read_wine_cache_pin_file(pathlib.Path(pin_file.name))
+    ['wine-mono-4.9.4.msi', 'wine_gecko-2.47-x86.msi']
+    >>> read_wine_cache_pin_file(pathlib.Path('/does/not/exist'))
+    []
+
+    """
+    if not path_pin_file.is_file():
+        return list()
+    with open(str(path_pin_file), mode='r') as pin_file:
+        l_lines = [line.strip() for line in pin_file]
+    return [line for line in l_lines if line and not line.startswith('#')]
+
+
+@contextlib.contextmanager
+def locked_wine_cache_access_records(path_cache: pathlib.Path, is_shared: bool = False) -> Iterator[Dict[str, Dict[str, Any]]]:
+    """ read - modify - write the access records of a cache directory, locked against concurrent jobs.
+    the records of a shared cache (is_shared) are writable for all users, see open_shared_file
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path_tmp_dir:
+    ...     with locked_wine_cache_access_records(pathlib.Path(path_tmp_dir), is_shared=True) as d_access_records:
+    ...         d_access_records['get-pip.py'] = {'last_access': 1.0, 'wine_prefixes': []}
+    ...     path_access_records = pathlib.Path(path_tmp_dir) / WINE_CACHE_ACCESS_RECORDS_FILENAME
+    ...     oct(stat.S_IMODE(path_access_records.stat().st_mode)), read_wine_cache_access_records(pathlib.Path(path_tmp_dir))
+    ('0o666', {'get-pip.py': {'last_access': 1.0, 'wine_prefixes': []}})
+
+    """
+    path_access_records = path_cache / WINE_CACHE_ACCESS_RECORDS_FILENAME
+    if is_shared:
+        access_records_file_descriptor = open_shared_file(path_access_records)
+    else:
+        path_cache.mkdir(parents=True, exist_ok=True)
+        access_records_file_descriptor = os.open(str(path_access_records), os.O_RDWR | os.O_CREAT, 0o644)
+    with open(access_records_file_descriptor, mode='r+') as access_records_file:
+        fcntl.flock(access_records_file, fcntl.LOCK_EX)
+        access_records_file.seek(0)
+        content = access_records_file.read()
+        d_access_records = json.loads(content) if content.strip() else dict()     # type: Dict[str, Dict[str, Any]]
+        yield d_access_records
+        access_records_file.seek(0)
+        access_records_file.truncate()
+        json.dump(d_access_records, access_records_file, indent=1, sort_keys=True)
+
+
+def open_shared_file(path_file: pathlib.Path) -> int:
+    """ open a file in a directory shared by all users (sticky and writable for all) for reading and writing, a new file is writable for all.
+    an existing file is opened without O_CREAT - with fs.protected_regular (the default of ubuntu) opening a file of an other user
+    in a sticky directory with O_CREAT fails, even for root. returns the file descriptor, raises OSError if we may not write the file
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path_tmp_dir:
+    ...     file_descriptor = open_shared_file(pathlib.Path(path_tmp_dir) / 'shared')
+    ...     os.close(file_descriptor)
+    ...     file_descriptor = open_shared_file(pathlib.Path(path_tmp_dir) / 'shared')
+    ...     os.close(file_descriptor)
+    ...     oct(stat.S_IMODE((pathlib.Path(path_tmp_dir) / 'shared').stat().st_mode))
+    '0o666'
+
+    """
+    while True:
+        try:
+            file_descriptor = os.open(str(path_file), os.O_RDWR)
+            break
+        except FileNotFoundError:
+            pass
+        try:
+            file_descriptor = os.open(str(path_file), os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            # created by an other job in the meantime, open that one
+            continue
+    if os.fstat(file_descriptor).st_uid == os.geteuid():
+        os.fchmod(file_descriptor, 0o666)
+    return file_descriptor
+
+
+def read_wine_cache_access_records(path_cache: pathlib.Path) -> Dict[str, Dict[str, Any]]:
+    path_access_records = path_cache / WINE_CACHE_ACCESS_RECORDS_FILENAME
+    if not path_access_records.is_file():
+        return dict()
+    with open(str(path_access_records), mode='r') as access_records_file:
+        content = access_records_file.read()
+    return json.loads(content) if content.strip() else dict()
+
+
+def gc_wine_cache(max_size_mb: float = 0,
+                  max_age_days: float = 0,
+                  l_lockfiles: Sequence[str] = (),
+                  username: str = configmagick_linux.get_current_username(),
+                  dry_run: bool = False,
+                  quiet: bool = False) -> None:
+    """ evict files from the wine cache of the user and from the node wine cache. syntax: cache gc --max_size_mb=<n> --max_age_days=<n>
+
+    first all files not used for max_age_days are evicted, then the least recently used files until the cache fits into max_size_mb.
+    files listed in the cache manifest of an existing wine prefix, or in one of the lockfiles, are pinned and never evicted.
+    in the node cache, blobs which are not in the filename index any more and not hardlinked by a user are removed.
+
+    Args:
+        --max_size_mb=<n>               the size budget per cache, 0 for no size budget
+        --max_age_days=<n>              evict files not used for n days, 0 for no age budget
+        --l_lockfiles=[...]             files which list pinned cache files, one filename per line
+        --dry_run                       only report what would be evicted
+
+    """
+    set_pinned_filenames = set()    # type: Set[str]
+    for lockfile in l_lockfiles:
+        set_pinned_filenames.update(read_wine_cache_pin_file(pathlib.Path(lockfile)))
+
+    # (directory with the cache files, directory with the access records)
+    path_wine_cache = lib_wine.get_path_wine_cache_for_user(username=username)
+    l_caches = [(path_wine_cache, path_wine_cache)]
+    path_node_wine_cache = get_path_node_wine_cache()
+    if path_node_wine_cache is not None:
+        l_caches.append((path_node_wine_cache / 'names', path_node_wine_cache))
+
+    n_evicted_files = 0
+    for path_cache, path_access_records_dir in l_caches:
+        if not path_cache.is_dir():
+            continue
+        l_entries = get_wine_cache_entries(path_cache, path_access_records_dir=path_access_records_dir, set_pinned_filenames=set_pinned_filenames)
+        for entry in get_l_wine_cache_entries_to_evict(l_entries, max_size=int(max_size_mb * 1024 * 1024), max_age=max_age_days * 86400, now=time.time()):
+            lib_log_utils.log_verbose('Wine Cache evict{dry_run}: "{path}", {size} bytes'
+                                      .format(dry_run=' (dry run)' if dry_run else '', path=entry.path, size=entry.size), quiet=quiet)
+            n_evicted_files += 1
+            if not dry_run:
+                entry.path.unlink()
+    freed_blob_bytes = 0
+    if path_node_wine_cache is not None:
+        freed_blob_bytes = remove_unreferenced_node_wine_cache_blobs(dry_run=dry_run, quiet=quiet)
+    # evicted hardlinks free no space as long as other links exist, so we only report the freed bytes of the node cache blobs
+    lib_log_utils.banner_success('Wine Cache garbage collected, {n_evicted_files} files {evicted}, {freed_mb:.1f} MB of node cache blobs {freed}'
+                                 .format(n_evicted_files=n_evicted_files, evicted='to evict' if dry_run else 'evicted',
+                                         freed_mb=freed_blob_bytes / 1024 / 1024, freed='to free' if dry_run else 'freed'), quiet=quiet)
+
+
+def get_wine_cache_entries(path_cache: pathlib.Path, path_access_records_dir: pathlib.Path, set_pinned_filenames: Set[str]) -> List[WineCacheEntry]:
+    """ the files of a cache directory, with the last access from the access records (or the mtime, for files never recorded) """
+    d_access_records = read_wine_cache_access_records(path_access_records_dir)
+    l_entries = list()   # type: List[WineCacheEntry]
+    for path_file in path_cache.iterdir():
+        if path_file.name.startswith('.') or not path_file.is_file():
+            continue
+        stat_file = path_file.stat()
+        access_record = d_access_records.get(path_file.name, dict())
+        is_pinned = path_file.name in set_pinned_filenames
+        for wine_prefix in access_record.get('wine_prefixes', []):
+            if path_file.name in read_wine_cache_pin_file(pathlib.Path(wine_prefix) / WINE_PREFIX_CACHE_MANIFEST_FILENAME):
+                is_pinned = True
+        l_entries.append(WineCacheEntry(path=path_file,
+                                        size=stat_file.st_size,
+                                        last_access=max(access_record.get('last_access', 0.0), stat_file.st_mtime),
+                                        is_pinned=is_pinned))
+    return l_entries
+
+
+def get_l_wine_cache_entries_to_evict(l_entries: Sequence[WineCacheEntry], max_size: int, max_age: float, now: float) -> List[WineCacheEntry]:
+    """ select the files to evict : first the files older than max_age, then the least recently used files until the rest fits into max_size
+
+    >>> l_entries = [WineCacheEntry(pathlib.Path('a'), 100, 1000, False), WineCacheEntry(pathlib.Path('b'), 100, 3000, False),
+    ...              WineCacheEntry(pathlib.Path('c'), 100, 500, True), WineCacheEntry(pathlib.Path('d'), 100, 2000, False)]
+    >>> [str(entry.path) for entry in get_l_wine_cache_entries_to_evict(l_entries, max_size=0, max_age=0, now=4000)]
+    []
+    >>> [str(entry.path) for entry in get_l_wine_cache_entries_to_evict(l_entries, max_size=0, max_age=2500, now=4000)]
+    ['a']
+    >>> [str(entry.path) for entry in get_l_wine_cache_entries_to_evict(l_entries, max_size=200, max_age=0, now=4000)]
+    ['a', 'd']
+    >>> [str(entry.path) for entry in get_l_wine_cache_entries_to_evict(l_entries, max_size=50, max_age=0, now=4000)]
+    ['a', 'd', 'b']
+
+    """
+    l_entries_to_evict = list()     # type: List[WineCacheEntry]
+    l_unpinned_entries = sorted((entry for entry in l_entries if not entry.is_pinned), key=lambda entry: entry.last_access)
+    total_size = sum(entry.size for entry in l_entries)
+    for entry in l_unpinned_entries:
+        is_too_old = bool(max_age) and (now - entry.last_access > max_age)
+        is_too_big = bool(max_size) and (total_size > max_size)
+        if is_too_old or is_too_big:
+            l_entries_to_evict.append(entry)
+            total_size -= entry.size
+    return l_entries_to_evict
+
+
+def remove_unreferenced_node_wine_cache_blobs(dry_run: bool = False, quiet: bool = False) -> int:
+    """ remove the blobs which are not in the filename index and not hardlinked from a users wine cache, returns the freed bytes """
+    path_node_wine_cache = get_and_check_path_node_wine_cache()
+    path_names = path_node_wine_cache / 'names'
+    set_referenced_blobs = set()    # type: Set[str]
+    if path_names.is_dir():
+        set_referenced_blobs = {os.path.realpath(str(path_name)) for path_name in path_names.iterdir() if path_name.is_symlink()}
+    freed_bytes = 0
+    path_blobs = path_node_wine_cache / 'blobs'
+    if not path_blobs.is_dir():
+        return freed_bytes
+    for path_blob in path_blobs.glob('*/*'):
+        if path_blob.name.startswith('.') or str(path_blob) in set_referenced_blobs:
+            continue
+        stat_blob = path_blob.stat()
+        if stat_blob.st_nlink > 1:
+            continue
+        lib_log_utils.log_verbose('Node Wine Cache remove unreferenced blob{dry_run}: "{path_blob}", {size} bytes'
+                                  .format(dry_run=' (dry run)' if dry_run else '', path_blob=path_blob, size=stat_blob.st_size), quiet=quiet)
+        freed_bytes += stat_blob.st_size
+        if not dry_run:
+            path_blob.unlink()
+    return freed_bytes
@@ -0,0 +1,342 @@
+# ### STDLIB
+import concurrent.futures
+import json
+import os
+import pathlib
+import sys
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+    from . import lib_wine_registry             # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry                    # type: ignore # pragma: no cover
+
+
+L_WINE_REGISTRY_HIVE_FILENAMES = ['system.reg', 'user.reg', 'userdef.reg']
+REG_KEY_ENVIRONMENT = 'HKEY_LOCAL_MACHINE\\SYSTEM\\CurrentControlSet\\Control\\Session Manager\\Environment'
+# every wine prefix has those in the PATH
+L_DEFAULT_PATH_ENTRIES = ['C:\\windows\\system32', 'C:\\windows']
+# the components are detected by those files or directories, relative to the wine prefix - one of them must exist
+D_WINE_COMPONENT_PATHS = {'mono': ['drive_c/windows/mono/mono-2.0'],
+                          'gecko': ['drive_c/windows/system32/gecko', 'drive_c/windows/syswow64/gecko'],
+                          'git': ['drive_c/Program Files/PortableGit/cmd/git.exe']}     # type: Dict[str, List[str]]
+# the PATH entries the installers add for a component
+D_WINE_COMPONENT_PATH_ENTRIES = {'git': ['C:\\Program Files\\PortableGit']}       # type: Dict[str, List[str]]
+# python can be installed in various places, it counts as installed if python.exe is found in the PATH
+L_WINE_COMPONENTS = sorted(list(D_WINE_COMPONENT_PATHS.keys()) + ['python'])
+
+# the result of the check of one wine prefix, is_ok is True if l_problems is empty
+WinePrefixCheckResult = NamedTuple('WinePrefixCheckResult', [('wine_prefix', str),
+                                                             ('is_ok', bool),
+                                                             ('wine_arch', str),
+                                                             ('d_hives_ok', Dict[str, bool]),
+                                                             ('d_components', Dict[str, bool]),
+                                                             ('l_path_entries', List[str]),
+                                                             ('l_problems', List[str])])
+
+
+def check_wine_prefixes_report(*wine_prefixes: str,
+                               report_file: str = '',
+                               wine_arch: str = '',
+                               components: Union[str, Sequence[str]] = (),
+                               path_entries: Union[str, Sequence[str]] = (),
+                               max_workers: int = 0,
+                               username: str = configmagick_linux.get_current_username(),
+                               quiet: bool = False) -> None:
+    """check wine prefixes without starting wine. syntax: check <prefix> [<prefix> ...] [--report_file=<file.json>] [--wine_arch=win32|win64]
+    [--components=mono,gecko,git,python] [--path_entries=<entry>,<entry>]
+
+    the hives, the architecture, the PATH and the installed components are checked from the files of the prefix only,
+    the prefixes are checked in parallel. the report is a json list, one entry per prefix.
+
+    Args:
+        <prefix>                    absolute paths like /home/*/.wine, or names in the home directory of the user
+        --report_file=<file.json>   write the report to that file, otherwise to stdout
+        --wine_arch=win32|win64     the expected architecture
+        --components=mono,git       the components which must be installed
+        --path_entries=<entry>      windows paths which must be in the PATH, additionally to the default entries
+        --max_workers=<n>           the number of parallel checks, default the number of cpus
+
+    """
+    l_results = check_wine_prefixes(l_wine_prefixes=wine_prefixes,
+                                    wine_arch=wine_arch,
+                                    l_components=get_l_arguments(components),
+                                    l_path_entries=get_l_arguments(path_entries),
+                                    max_workers=max_workers,
+                                    username=username)
+    report = json.dumps(get_report_from_results(l_results), indent=4)
+    if report_file and lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('file', description='write "{report_file}"'.format(report_file=report_file), step_key='', expected_seconds=0.0)
+    elif report_file:
+        with open(str(report_file), mode='w') as report_output:
+            report_output.write(report + '\n')
+    else:
+        sys.stdout.write(report + '\n')
+
+    l_failed_wine_prefixes = [result.wine_prefix for result in l_results if not result.is_ok]
+    if l_failed_wine_prefixes:
+        raise RuntimeError('{n_failed} of {n_checked} wine prefixes failed the check: {wine_prefixes}'
+                           .format(n_failed=len(l_failed_wine_prefixes), n_checked=len(l_results), wine_prefixes=', '.join(l_failed_wine_prefixes)))
+    lib_log_utils.banner_success('{n_checked} wine prefixes checked OK'.format(n_checked=len(l_results)), quiet=quiet)
+
+
+def check_wine_prefixes(l_wine_prefixes: Sequence[Union[str, pathlib.Path]],
+                        wine_arch: str = '',
+                        l_components: Sequence[str] = (),
+                        l_path_entries: Sequence[str] = (),
+                        max_workers: int = 0,
+                        username: str = configmagick_linux.get_current_username()) -> List[WinePrefixCheckResult]:
+    """ check many wine prefixes in parallel processes (parsing the hives is cpu bound), the results are in the order of the prefixes """
+    l_paths_wine_prefix = [get_path_wine_prefix_to_check(wine_prefix=wine_prefix, username=username) for wine_prefix in l_wine_prefixes]
+    if len(l_paths_wine_prefix) < 2:
+        return [check_wine_prefix(path_wine_prefix, wine_arch, l_components, l_path_entries) for path_wine_prefix in l_paths_wine_prefix]
+    max_workers = max_workers or os.cpu_count() or 1
+    n_paths = len(l_paths_wine_prefix)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        l_results = list(executor.map(check_wine_prefix, l_paths_wine_prefix, [wine_arch] * n_paths, [l_components] * n_paths,
+                                      [l_path_entries] * n_paths, chunksize=max(1, n_paths // (max_workers * 4))))
+    return l_results
+
+
+def check_wine_prefix(wine_prefix: pathlib.Path,
+                      wine_arch: str = '',
+                      l_components: Sequence[str] = (),
+                      l_path_entries: Sequence[str] = ()) -> WinePrefixCheckResult:
+    """ check one wine prefix from its files, without starting wine
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     wine_prefix = pathlib.Path(tmp_dir)
+    ...     _ = (wine_prefix / 'system.reg').write_text(SYSTEM_HIVE_CONTENT_EXAMPLE)
+    ...     result = check_wine_prefix(wine_prefix, wine_arch='win32', l_components=['git'])
+    >>> result.wine_arch
+    'win32'
+    >>> sorted(result.d_hives_ok.items())
+    [('system.reg', True), ('user.reg', False), ('userdef.reg', False)]
+    >>> result.l_problems    # doctest: +NORMALIZE_WHITESPACE
+    ['hive "user.reg" is missing', 'hive "userdef.reg" is missing', 'directory "drive_c/windows" is missing',
+     'PATH entry "C:\\\\windows\\\\system32" does not exist', 'PATH entry "C:\\\\windows" does not exist',
+     'component "git" is not installed', 'PATH entry "C:\\\\Program Files\\\\PortableGit" is missing']
+
+    """
+    wine_prefix = pathlib.Path(wine_prefix)
+    l_problems = list()     # type: List[str]
+    if not wine_prefix.is_dir():
+        return WinePrefixCheckResult(wine_prefix=str(wine_prefix), is_ok=False, wine_arch='', d_hives_ok=dict(), d_components=dict(),
+                                     l_path_entries=list(), l_problems=['wine prefix does not exist'])
+
+    d_hives = dict()        # type: Dict[str, lib_wine_registry.WineRegistryHive]
+    d_hives_ok = dict()     # type: Dict[str, bool]
+    for hive_filename in L_WINE_REGISTRY_HIVE_FILENAMES:
+        hive = read_wine_registry_hive_to_check(wine_prefix / hive_filename, l_problems)
+        d_hives_ok[hive_filename] = hive is not None
+        if hive is not None:
+            d_hives[hive_filename] = hive
+
+    detected_wine_arch = ''
+    if 'system.reg' in d_hives:
+        detected_wine_arch = get_wine_arch_from_hive(d_hives['system.reg'])
+        l_problems.extend(get_l_wine_arch_problems(wine_prefix, detected_wine_arch, wine_arch))
+
+    l_current_path_entries = list()     # type: List[str]
+    if 'system.reg' in d_hives:
+        l_current_path_entries = get_l_wine_registry_path_entries(d_hives['system.reg'])
+        l_problems.extend(get_l_path_entries_problems(wine_prefix, l_current_path_entries, list(L_DEFAULT_PATH_ENTRIES) + list(l_path_entries)))
+
+    d_components = get_d_installed_wine_components(wine_prefix, l_current_path_entries)
+    for component in l_components:
+        if component not in d_components:
+            l_problems.append('component "{component}" is unknown'.format(component=component))
+        elif not d_components[component]:
+            l_problems.append('component "{component}" is not installed'.format(component=component))
+    l_component_path_entries = [path_entry for component, is_installed in sorted(d_components.items()) if is_installed or component in l_components
+                                for path_entry in D_WINE_COMPONENT_PATH_ENTRIES.get(component, [])]
+    if 'system.reg' in d_hives:
+        l_problems.extend(get_l_path_entries_problems(wine_prefix, l_current_path_entries, l_component_path_entries, check_exists=False))
+
+    return WinePrefixCheckResult(wine_prefix=str(wine_prefix), is_ok=not l_problems, wine_arch=detected_wine_arch, d_hives_ok=d_hives_ok,
+                                 d_components=d_components, l_path_entries=l_current_path_entries, l_problems=l_problems)
+
+
+def read_wine_registry_hive_to_check(path_hive: pathlib.Path, l_problems: List[str]) -> Optional[lib_wine_registry.WineRegistryHive]:
+    """ read and parse a hive, a problem is added to l_problems if it is missing or damaged """
+    if not path_hive.is_file():
+        l_problems.append('hive "{hive_filename}" is missing'.format(hive_filename=path_hive.name))
+        return None
+    try:
+        hive = lib_wine_registry.read_wine_registry_hive(path_hive)
+    except (OSError, ValueError, IndexError) as exc:
+        l_problems.append('hive "{hive_filename}" can not be parsed: {exc}'.format(hive_filename=path_hive.name, exc=exc))
+        return None
+    if not hive.l_header_lines or not hive.l_header_lines[0].startswith('WINE REGISTRY Version'):
+        l_problems.append('hive "{hive_filename}" has no valid header'.format(hive_filename=path_hive.name))
+        return None
+    return hive
+
+
+def get_wine_arch_from_hive(hive: lib_wine_registry.WineRegistryHive) -> str:
+    """ the architecture from the '#arch=' header line of system.reg, '' if not found
+
+    >>> get_wine_arch_from_hive(lib_wine_registry.parse_wine_registry_hive(SYSTEM_HIVE_CONTENT_EXAMPLE))
+    'win32'
+
+    """
+    for line in hive.l_header_lines:
+        if line.startswith('#arch='):
+            return line.split('=', 1)[1].strip().lower()
+    return ''
+
+
+def get_l_wine_arch_problems(wine_prefix: pathlib.Path, detected_wine_arch: str, wine_arch: str = '') -> List[str]:
+    """ a win64 prefix has a syswow64 directory, a win32 prefix has not """
+    l_problems = list()     # type: List[str]
+    if detected_wine_arch not in ('win32', 'win64'):
+        l_problems.append('invalid wine_arch in system.reg: "{detected_wine_arch}"'.format(detected_wine_arch=detected_wine_arch))
+        return l_problems
+    if wine_arch and wine_arch != detected_wine_arch:
+        l_problems.append('wine_arch is "{detected_wine_arch}", expected "{wine_arch}"'.format(detected_wine_arch=detected_wine_arch, wine_arch=wine_arch))
+    path_windows = wine_prefix / 'drive_c/windows'
+    if not path_windows.is_dir():
+        l_problems.append('directory "drive_c/windows" is missing')
+    elif (path_windows / 'syswow64').is_dir() != (detected_wine_arch == 'win64'):
+        l_problems.append('directory "drive_c/windows/syswow64" does not match wine_arch "{detected_wine_arch}"'.format(detected_wine_arch=detected_wine_arch))
+    return l_problems
+
+
+def get_l_wine_registry_path_entries(system_hive: lib_wine_registry.WineRegistryHive) -> List[str]:
+    """
+    >>> get_l_wine_registry_path_entries(lib_wine_registry.parse_wine_registry_hive(SYSTEM_HIVE_CONTENT_EXAMPLE))
+    ['C:\\\\windows\\\\system32', 'C:\\\\windows', '%SystemRoot%\\\\system32\\\\wbem']
+
+    """
+    hive_filename, relative_key = lib_wine_registry.get_hive_filename_and_relative_key(REG_KEY_ENVIRONMENT)
+    value = lib_wine_registry.get_wine_registry_hive_value(system_hive, relative_key, 'PATH')
+    if value is None:
+        return list()
+    return lib_wine.get_l_normalized_path_entries(value[1].split(';'))
+
+
+def get_l_path_entries_problems(wine_prefix: pathlib.Path, l_current_path_entries: Sequence[str], l_expected_path_entries: Sequence[str],
+                                check_exists: bool = True) -> List[str]:
+    l_problems = list()     # type: List[str]
+    l_current_path_entries_lower = [path_entry.lower() for path_entry in l_current_path_entries]
+    for path_entry in lib_wine.get_l_normalized_path_entries(l_expected_path_entries):
+        if path_entry.lower() not in l_current_path_entries_lower:
+            l_problems.append('PATH entry "{path_entry}" is missing'.format(path_entry=path_entry))
+        elif check_exists and get_path_linux_from_windows_path(wine_prefix, path_entry) is None:
+            l_problems.append('PATH entry "{path_entry}" does not exist'.format(path_entry=path_entry))
+    return l_problems
+
+
+def get_d_installed_wine_components(wine_prefix: pathlib.Path, l_path_entries: Sequence[str]) -> Dict[str, bool]:
+    d_components = dict()   # type: Dict[str, bool]
+    for component, l_relative_paths in D_WINE_COMPONENT_PATHS.items():
+        d_components[component] = any((wine_prefix / relative_path).exists() for relative_path in l_relative_paths)
+    d_components['python'] = any(get_path_linux_from_windows_path(wine_prefix, path_entry + '\\python.exe') is not None for path_entry in l_path_entries)
+    return d_components
+
+
+def get_path_linux_from_windows_path(wine_prefix: pathlib.Path, windows_path: str) -> Optional[pathlib.Path]:
+    """ the existing linux path of a windows path in the wine prefix, the lookup is case insensitive like in wine. None if it does not exist
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     wine_prefix = pathlib.Path(tmp_dir)
+    ...     (wine_prefix / 'drive_c/Program Files/PortableGit').mkdir(parents=True)
+    ...     (wine_prefix / 'dosdevices').mkdir()
+    ...     (wine_prefix / 'dosdevices/c:').symlink_to('../drive_c')
+    ...     path_linux = get_path_linux_from_windows_path(wine_prefix, 'c:\\\\PROGRAM FILES\\\\portablegit')
+    ...     assert path_linux == wine_prefix / 'dosdevices/c:/Program Files/PortableGit'
+    ...     assert get_path_linux_from_windows_path(wine_prefix, 'c:\\\\windows') is None
+    ...     assert get_path_linux_from_windows_path(wine_prefix, '%SystemRoot%\\\\system32') is None
+
+    """
+    windows_path = expand_wine_environment_variables(windows_path)
+    if len(windows_path) < 2 or windows_path[1] != ':' or '%' in windows_path:
+        return None
+    path_linux = wine_prefix / 'dosdevices' / windows_path[:2].lower()
+    if not path_linux.exists():
+        return None
+    for part in windows_path[2:].split('\\'):
+        if not part:
+            continue
+        if (path_linux / part).exists():
+            path_linux = path_linux / part
+            continue
+        l_matches = [path_child for path_child in path_linux.iterdir() if path_child.name.lower() == part.lower()] if path_linux.is_dir() else []
+        if not l_matches:
+            return None
+        path_linux = l_matches[0]
+    return path_linux
+
+
+def expand_wine_environment_variables(windows_path: str) -> str:
+    """ expand the variables which are the same in every wine prefix
+
+    >>> expand_wine_environment_variables('%SystemRoot%\\\\system32')
+    'C:\\\\windows\\\\system32'
+
+    """
+    for variable, value in (('%systemroot%', 'C:\\windows'), ('%windir%', 'C:\\windows'), ('%systemdrive%', 'C:'),
+                            ('%programfiles%', 'C:\\Program Files')):
+        position = windows_path.lower().find(variable)
+        if position >= 0:
+            windows_path = windows_path[:position] + value + windows_path[position + len(variable):]
+    return windows_path
+
+
+def get_path_wine_prefix_to_check(wine_prefix: Union[str, pathlib.Path], username: str = configmagick_linux.get_current_username()) -> pathlib.Path:
+    """ absolute paths are checked as they are, so prefixes of all users can be checked - other names are in the home directory of the user
+
+    >>> get_path_wine_prefix_to_check('/home/other/.wine', username='test')
+    PosixPath('/home/other/.wine')
+    >>> get_path_wine_prefix_to_check('wine_test_32', username='test')
+    PosixPath('/home/test/wine_test_32')
+
+    """
+    if pathlib.Path(wine_prefix).is_absolute():
+        return pathlib.Path(wine_prefix)
+    return lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+
+
+def get_l_arguments(arguments: Union[str, Sequence[str]]) -> List[str]:
+    """ commandline arguments can be passed as comma separated string or as list
+
+    >>> get_l_arguments('mono, git')
+    ['mono', 'git']
+    >>> get_l_arguments(('mono', 'git'))
+    ['mono', 'git']
+
+    """
+    if isinstance(arguments, str):
+        arguments = arguments.split(',')
+    return [str(argument).strip() for argument in arguments if str(argument).strip()]
+
+
+def get_report_from_results(l_results: Sequence[WinePrefixCheckResult]) -> List[Dict[str, Any]]:
+    return [dict(result._asdict()) for result in l_results]
+
+
+# a minimal system.reg of a win32 prefix, used in the doctests
+SYSTEM_HIVE_CONTENT_EXAMPLE = ('WINE REGISTRY Version 2\n'
+                               ';; All keys relative to \\\\Machine\n'
+                               '\n'
+                               '#arch=win32\n'
+                               '\n'
+                               '[System\\\\CurrentControlSet\\\\Control\\\\Session Manager\\\\Environment] 1572355339\n'
+                               '#time=1d58ef3d5e2b6e6\n'
+                               '"PATH"=str(2):"C:\\\\windows\\\\system32;C:\\\\windows;%SystemRoot%\\\\system32\\\\wbem"\n')
@@ -0,0 +1,370 @@
+# ### STDLIB
+import concurrent.futures
+import contextlib
+import fcntl
+import os
+import pathlib
+import sqlite3
+import stat
+import time
+import urllib.parse
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_cache                # type: ignore # pragma: no cover
+    from . import lib_wine_check                # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_check                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+
+
+# only the files wine and the wine installers put there are deduplicated - those are identical for every prefix made with the same wine build,
+# and are not changed by the applications. the user data and the programs installed by the users are left alone.
+L_DEDUPE_DIRECTORIES = ['drive_c/windows/system32', 'drive_c/windows/syswow64', 'drive_c/windows/mono', 'drive_c/windows/Microsoft.NET',
+                        'drive_c/windows/winsxs', 'drive_c/windows/Fonts']
+# smaller files are not worth a hash and an inode
+DEDUPE_MIN_FILE_SIZE = 4096
+DEDUPE_INDEX_FILENAME = 'wine_dedupe_index.sqlite'
+DEDUPE_INDEX_SCHEMA_VERSION = 1
+# hashes of inodes which were not seen for that time are removed from the index
+DEDUPE_INDEX_MAX_AGE_SECONDS = 30 * 86400
+# the ioctl to clone a file on btrfs, xfs and other copy-on-write filesystems
+FICLONE = 0x40049409
+
+# a file found in the prefixes, with the stat values which key the hash index
+DedupeFile = NamedTuple('DedupeFile', [('path', str), ('dev', int), ('ino', int), ('mtime_ns', int), ('size', int), ('uid', int), ('gid', int), ('mode', int)])
+
+DedupeResult = NamedTuple('DedupeResult', [('n_files', int), ('n_files_hashed', int), ('n_files_linked', int), ('bytes_saved', int)])
+
+
+def dedupe_wine_prefixes_report(*wine_prefixes: str,
+                                index_file: str = '',
+                                reflink: bool = False,
+                                min_file_size: int = DEDUPE_MIN_FILE_SIZE,
+                                max_workers: int = 0,
+                                dry_run: bool = False,
+                                username: str = configmagick_linux.get_current_username(),
+                                quiet: bool = False) -> None:
+    """link identical wine files across wine prefixes. syntax: dedupe <prefix> [<prefix> ...] [--reflink] [--dry_run]
+
+    identical files in the windows directories (fake dlls, mono, gecko, fonts) are replaced by read-only hardlinks to one of them,
+    or with --reflink by copy-on-write clones (btrfs, xfs). the hashes are kept in an index keyed by inode and mtime,
+    so repeated runs only hash new or changed files.
+
+    Args:
+        <prefix>                    absolute paths like /home/*/.wine, or names in the home directory of the user
+        --index_file=<file.sqlite>  default /var/lib/configmagick_wine/wine_dedupe_index.sqlite for root, ~/.cache/configmagick_wine/... for other users
+        --reflink                   clone the files instead of hardlinking them, every prefix keeps its own inode
+        --min_file_size=<bytes>     smaller files are skipped, default 4096
+        --dry_run                   only report what would be linked, the index is not written
+
+    while planning, the prefixes are deduplicated as a dry run, and the links are a step of the plan
+    """
+    dry_run = dry_run or lib_wine_plan.is_plan_mode()
+    path_index_file = get_path_dedupe_index_file(index_file)
+    l_paths_wine_prefix = [lib_wine_check.get_path_wine_prefix_to_check(wine_prefix=wine_prefix, username=username) for wine_prefix in wine_prefixes]
+    lib_log_utils.banner_verbose('Deduplicate {n_prefixes} wine prefixes, index="{path_index_file}"'
+                                 .format(n_prefixes=len(l_paths_wine_prefix), path_index_file=path_index_file), quiet=quiet)
+    result = dedupe_wine_prefixes(l_paths_wine_prefix=l_paths_wine_prefix, path_index_file=path_index_file, reflink=reflink,
+                                  min_file_size=min_file_size, max_workers=max_workers, dry_run=dry_run)
+    lib_log_utils.banner_success('{n_files_linked} of {n_files} files {linked} ({n_files_hashed} hashed), {mb_saved:.1f} MB {saved}'
+                                 .format(n_files_linked=result.n_files_linked, n_files=result.n_files, n_files_hashed=result.n_files_hashed,
+                                         linked='to link' if dry_run else 'linked', mb_saved=result.bytes_saved / 1024 / 1024,
+                                         saved='to save' if dry_run else 'saved'), quiet=quiet)
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('file', description='link {n_files_linked} identical files in {n_prefixes} wine prefixes, {mb_saved:.1f} MB to save'
+                                    .format(n_files_linked=result.n_files_linked, n_prefixes=len(l_paths_wine_prefix),
+                                            mb_saved=result.bytes_saved / 1024 / 1024), step_key='', expected_seconds=0.0)
+
+
+def dedupe_wine_prefixes(l_paths_wine_prefix: Sequence[pathlib.Path],
+                         path_index_file: pathlib.Path,
+                         reflink: bool = False,
+                         min_file_size: int = DEDUPE_MIN_FILE_SIZE,
+                         max_workers: int = 0,
+                         dry_run: bool = False) -> DedupeResult:
+    """ replace identical files in the wine prefixes by links to one of them
+
+    only files on the same filesystem are linked. hardlinks are only made between files with the same owner, group and mode (apart from
+    the write bits), and the linked files are made read-only - a write through one prefix would change the file in all prefixes.
+    fix_wine_permissions keeps the hardlinked files read-only, and never changes the files of another user.
+    the clones of reflink=True are independent copies, they keep their mode. with dry_run the index is only read.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     for wine_prefix in ('wine_1', 'wine_2', 'wine_3'):
+    ...         path_system32 = pathlib.Path(tmp_dir) / wine_prefix / 'drive_c/windows/system32'
+    ...         path_system32.mkdir(parents=True)
+    ...         _ = (path_system32 / 'kernel32.dll').write_bytes(b'k' * 8192)
+    ...         (path_system32 / 'kernel32.dll').chmod(0o444)
+    ...         _ = (path_system32 / 'user.dat').write_bytes(wine_prefix.encode() * 4096)
+    ...     l_paths_wine_prefix = [pathlib.Path(tmp_dir) / wine_prefix for wine_prefix in ('wine_1', 'wine_2', 'wine_3')]
+    ...     path_index_file = pathlib.Path(tmp_dir) / 'index.sqlite'
+    ...     result_dry_run = dedupe_wine_prefixes(l_paths_wine_prefix, path_index_file, dry_run=True)
+    ...     is_index_written = path_index_file.exists()
+    ...     result = dedupe_wine_prefixes(l_paths_wine_prefix, path_index_file)
+    ...     n_links = (pathlib.Path(tmp_dir) / 'wine_3/drive_c/windows/system32/kernel32.dll').stat().st_nlink
+    ...     result_repeated = dedupe_wine_prefixes(l_paths_wine_prefix, path_index_file)
+    >>> result_dry_run, is_index_written
+    (DedupeResult(n_files=6, n_files_hashed=6, n_files_linked=2, bytes_saved=16384), False)
+    >>> result
+    DedupeResult(n_files=6, n_files_hashed=6, n_files_linked=2, bytes_saved=16384)
+    >>> n_links
+    3
+    >>> result_repeated
+    DedupeResult(n_files=6, n_files_hashed=0, n_files_linked=0, bytes_saved=0)
+
+    the prefixes made by this tool are 0775 (see lib_wine.fix_wine_permissions) - their files are linked read-only,
+    and fix_wine_permissions keeps the links read-only
+
+    >>> import subprocess
+    >>> username = configmagick_linux.get_current_username()
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     for wine_prefix in ('wine_1', 'wine_2'):
+    ...         path_system32 = pathlib.Path(tmp_dir) / wine_prefix / 'drive_c/windows/system32'
+    ...         path_system32.mkdir(parents=True)
+    ...         _ = (path_system32 / 'kernel32.dll').write_bytes(b'k' * 8192)
+    ...         for command in lib_wine.get_l_fix_wine_permissions_commands(pathlib.Path(tmp_dir) / wine_prefix, username=username):
+    ...             _ = subprocess.run(command, shell=True, check=True)
+    ...     l_paths_wine_prefix = [pathlib.Path(tmp_dir) / wine_prefix for wine_prefix in ('wine_1', 'wine_2')]
+    ...     result = dedupe_wine_prefixes(l_paths_wine_prefix, pathlib.Path(tmp_dir) / 'index.sqlite')
+    ...     for command in lib_wine.get_l_fix_wine_permissions_commands(pathlib.Path(tmp_dir) / 'wine_1', username=username):
+    ...         _ = subprocess.run(command, shell=True, check=True)
+    ...     stat_file = (pathlib.Path(tmp_dir) / 'wine_2/drive_c/windows/system32/kernel32.dll').stat()
+    >>> result.n_files_linked, stat_file.st_nlink, oct(stat.S_IMODE(stat_file.st_mode))
+    (1, 2, '0o555')
+
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        l_files = [dedupe_file for l_prefix_files in executor.map(get_l_dedupe_files, l_paths_wine_prefix, [min_file_size] * len(l_paths_wine_prefix))
+                   for dedupe_file in l_prefix_files]
+        l_candidates = get_l_dedupe_candidates(l_files)
+
+        with open_dedupe_index(path_index_file, read_only=dry_run) as index:
+            d_hashes = read_dedupe_hashes(index, l_candidates)
+            l_files_to_hash = [dedupe_file for dedupe_file in l_candidates if get_dedupe_key(dedupe_file) not in d_hashes]
+            for dedupe_file, sha256 in zip(l_files_to_hash, executor.map(get_sha256_of_dedupe_file, l_files_to_hash)):
+                if sha256:
+                    d_hashes[get_dedupe_key(dedupe_file)] = sha256
+            if not dry_run:
+                write_dedupe_hashes(index, l_candidates, d_hashes)
+
+    n_files_linked, bytes_saved = 0, 0
+    for l_identical_files in get_l_identical_files(l_candidates, d_hashes, reflink=reflink):
+        dedupe_file_master = l_identical_files[0]
+        for dedupe_file in l_identical_files[1:]:
+            if dry_run or link_dedupe_file(dedupe_file_master, dedupe_file, reflink=reflink):
+                n_files_linked = n_files_linked + 1
+                bytes_saved = bytes_saved + dedupe_file.size
+    return DedupeResult(n_files=len(l_files), n_files_hashed=len(l_files_to_hash), n_files_linked=n_files_linked, bytes_saved=bytes_saved)
+
+
+def get_l_dedupe_files(path_wine_prefix: pathlib.Path, min_file_size: int = DEDUPE_MIN_FILE_SIZE) -> List[DedupeFile]:
+    """ the regular files in the dedupe directories of the prefix, symlinks are not followed """
+    l_files = list()    # type: List[DedupeFile]
+    l_directories = [str(path_wine_prefix / dedupe_directory) for dedupe_directory in L_DEDUPE_DIRECTORIES]
+    while l_directories:
+        directory = l_directories.pop()
+        try:
+            with contextlib.closing(os.scandir(directory)) as directory_entries:    # type: ignore
+                for directory_entry in directory_entries:
+                    if directory_entry.is_dir(follow_symlinks=False):
+                        l_directories.append(directory_entry.path)
+                    elif directory_entry.is_file(follow_symlinks=False):
+                        stat_file = directory_entry.stat(follow_symlinks=False)
+                        if stat_file.st_size >= min_file_size:
+                            l_files.append(DedupeFile(path=directory_entry.path, dev=stat_file.st_dev, ino=stat_file.st_ino, mtime_ns=stat_file.st_mtime_ns,
+                                                      size=stat_file.st_size, uid=stat_file.st_uid, gid=stat_file.st_gid,
+                                                      mode=stat.S_IMODE(stat_file.st_mode)))
+        except OSError:
+            continue
+    return l_files
+
+
+def get_l_dedupe_candidates(l_files: Sequence[DedupeFile]) -> List[DedupeFile]:
+    """ only files with the same size on the same filesystem, which are not already the same inode, can be duplicates - the others are not hashed
+
+    >>> l_files = [DedupeFile('a', 1, 10, 0, 100, 0, 0, 0o775), DedupeFile('b', 1, 11, 0, 100, 0, 0, 0o775),
+    ...            DedupeFile('c', 1, 12, 0, 200, 0, 0, 0o775), DedupeFile('d', 1, 13, 0, 300, 0, 0, 0o775), DedupeFile('e', 1, 13, 0, 300, 0, 0, 0o775)]
+    >>> [dedupe_file.path for dedupe_file in get_l_dedupe_candidates(l_files)]
+    ['a', 'b']
+
+    """
+    d_files_by_size = dict()    # type: Dict[Tuple[int, int], List[DedupeFile]]
+    for dedupe_file in l_files:
+        d_files_by_size.setdefault((dedupe_file.dev, dedupe_file.size), list()).append(dedupe_file)
+    return [dedupe_file for l_same_size in d_files_by_size.values() if len(set(dedupe_file.ino for dedupe_file in l_same_size)) > 1
+            for dedupe_file in l_same_size]
+
+
+def get_l_identical_files(l_candidates: Sequence[DedupeFile], d_hashes: Dict[Tuple[int, int, int, int], str], reflink: bool = False) -> List[List[DedupeFile]]:
+    """ the groups of identical files which are not yet linked, the first file of a group is the one with the most links already.
+    the write bits do not matter, the hardlinked files are made read-only
+
+    >>> l_files = [DedupeFile('a', 1, 10, 0, 100, 0, 0, 0o555), DedupeFile('b', 1, 11, 0, 100, 0, 0, 0o555),
+    ...            DedupeFile('c', 1, 11, 0, 100, 0, 0, 0o555), DedupeFile('d', 1, 12, 0, 100, 1000, 1000, 0o555),
+    ...            DedupeFile('e', 1, 13, 0, 100, 0, 0, 0o775), DedupeFile('f', 1, 14, 0, 100, 0, 0, 0o644)]
+    >>> d_hashes = {(1, 10, 0, 100): 'x', (1, 11, 0, 100): 'x', (1, 12, 0, 100): 'x', (1, 13, 0, 100): 'x', (1, 14, 0, 100): 'x'}
+    >>> [[dedupe_file.path for dedupe_file in l_identical] for l_identical in get_l_identical_files(l_files, d_hashes)]
+    [['b', 'a', 'e']]
+    >>> [[dedupe_file.path for dedupe_file in l_identical] for l_identical in get_l_identical_files(l_files, d_hashes, reflink=True)]
+    [['b', 'a', 'd', 'e', 'f']]
+
+    """
+    d_groups = dict()   # type: Dict[Tuple[int, int, str, int, int, int], List[DedupeFile]]
+    for dedupe_file in l_candidates:
+        sha256 = d_hashes.get(get_dedupe_key(dedupe_file))
+        if not sha256:
+            continue
+        if reflink:
+            # every clone keeps its own owner and mode
+            group_key = (dedupe_file.dev, dedupe_file.size, sha256, -1, -1, -1)
+        else:
+            group_key = (dedupe_file.dev, dedupe_file.size, sha256, dedupe_file.uid, dedupe_file.gid, get_read_only_mode(dedupe_file.mode))
+        d_groups.setdefault(group_key, list()).append(dedupe_file)
+
+    l_l_identical_files = list()    # type: List[List[DedupeFile]]
+    for l_group in d_groups.values():
+        d_files_by_inode = dict()   # type: Dict[int, List[DedupeFile]]
+        for dedupe_file in l_group:
+            d_files_by_inode.setdefault(dedupe_file.ino, list()).append(dedupe_file)
+        if len(d_files_by_inode) < 2:
+            continue
+        l_inodes = sorted(d_files_by_inode, key=lambda ino: (-len(d_files_by_inode[ino]), d_files_by_inode[ino][0].path))
+        l_identical_files = [d_files_by_inode[l_inodes[0]][0]] + [dedupe_file for ino in l_inodes[1:] for dedupe_file in d_files_by_inode[ino]]
+        l_l_identical_files.append(l_identical_files)
+    return sorted(l_l_identical_files, key=lambda l_identical_files: l_identical_files[0].path)
+
+
+def link_dedupe_file(dedupe_file_master: DedupeFile, dedupe_file: DedupeFile, reflink: bool = False) -> bool:
+    """ replace the file by a link to the master, returns False if it was changed since it was hashed or can not be linked.
+    the master of a hardlink is made read-only before it is linked """
+    path_file = pathlib.Path(dedupe_file.path)
+    path_file_tmp = path_file.parent / '.{filename}.configmagick_wine.tmp'.format(filename=path_file.name)
+    if not is_dedupe_file_unchanged(dedupe_file_master) or not is_dedupe_file_unchanged(dedupe_file):
+        return False
+    try:
+        if reflink:
+            clone_file(pathlib.Path(dedupe_file_master.path), path_file_tmp)
+            os.chown(str(path_file_tmp), dedupe_file.uid, dedupe_file.gid)
+            os.chmod(str(path_file_tmp), dedupe_file.mode)
+            os.utime(str(path_file_tmp), ns=(dedupe_file.mtime_ns, dedupe_file.mtime_ns))
+        else:
+            os.chmod(dedupe_file_master.path, get_read_only_mode(dedupe_file_master.mode))
+            os.link(dedupe_file_master.path, str(path_file_tmp))
+        os.replace(str(path_file_tmp), str(path_file))
+    except OSError:
+        return False
+    finally:
+        if path_file_tmp.exists():
+            path_file_tmp.unlink()
+    return True
+
+
+def clone_file(path_source: pathlib.Path, path_target: pathlib.Path) -> None:
+    """ a copy-on-write clone of the file, raises OSError if the filesystem does not support it """
+    with open(str(path_source), mode='rb') as source_file:
+        with open(str(path_target), mode='wb') as target_file:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+def is_dedupe_file_unchanged(dedupe_file: DedupeFile) -> bool:
+    """ inode, mtime, size and mode are still the ones we hashed and checked - the master of a group may be made read-only meanwhile """
+    try:
+        stat_file = os.lstat(dedupe_file.path)
+    except OSError:
+        return False
+    stat_values = (stat_file.st_ino, stat_file.st_mtime_ns, stat_file.st_size, get_read_only_mode(stat.S_IMODE(stat_file.st_mode)))
+    return stat_values == (dedupe_file.ino, dedupe_file.mtime_ns, dedupe_file.size, get_read_only_mode(dedupe_file.mode))
+
+
+def get_read_only_mode(mode: int) -> int:
+    """
+    >>> oct(get_read_only_mode(0o775))
+    '0o555'
+    >>> oct(get_read_only_mode(0o444))
+    '0o444'
+
+    """
+    return mode & ~0o222
+
+
+def get_sha256_of_dedupe_file(dedupe_file: DedupeFile) -> str:
+    """ the sha256 of the file, '' if it can not be read """
+    try:
+        return str(lib_wine_cache.get_sha256_of_file(pathlib.Path(dedupe_file.path)))
+    except OSError:
+        return ''
+
+
+def get_dedupe_key(dedupe_file: DedupeFile) -> Tuple[int, int, int, int]:
+    return dedupe_file.dev, dedupe_file.ino, dedupe_file.mtime_ns, dedupe_file.size
+
+
+@contextlib.contextmanager
+def open_dedupe_index(path_index_file: pathlib.Path, read_only: bool = False) -> Iterator[sqlite3.Connection]:
+    """ open the hash index and create the table if needed, the changes are committed when the context is left without exception.
+    read_only opens an existing index without changing it, a missing or outdated index is read as an empty one """
+    if read_only:
+        index = connect_dedupe_index_read_only(path_index_file)
+    else:
+        path_index_file.parent.mkdir(parents=True, exist_ok=True)
+        index = sqlite3.connect(str(path_index_file), timeout=60)
+    try:
+        if index.execute('PRAGMA user_version').fetchone()[0] != DEDUPE_INDEX_SCHEMA_VERSION:
+            index.executescript('DROP TABLE IF EXISTS hashes;'
+                                'CREATE TABLE hashes (dev INTEGER, ino INTEGER, mtime_ns INTEGER, size INTEGER, sha256 TEXT, last_seen REAL, '
+                                'PRIMARY KEY (dev, ino));'
+                                'PRAGMA user_version = {schema_version};'.format(schema_version=DEDUPE_INDEX_SCHEMA_VERSION))
+        with index:
+            yield index
+    finally:
+        index.close()
+
+
+def connect_dedupe_index_read_only(path_index_file: pathlib.Path) -> sqlite3.Connection:
+    if path_index_file.is_file():
+        index = sqlite3.connect('file:{path}?mode=ro'.format(path=urllib.parse.quote(str(path_index_file))), uri=True, timeout=60)
+        if index.execute('PRAGMA user_version').fetchone()[0] == DEDUPE_INDEX_SCHEMA_VERSION:
+            return index
+        index.close()
+    return sqlite3.connect(':memory:')
+
+
+def read_dedupe_hashes(index: sqlite3.Connection, l_files: Sequence[DedupeFile]) -> Dict[Tuple[int, int, int, int], str]:
+    """ the known hashes of the files - a hash is only valid as long as inode, mtime and size did not change """
+    d_hashes = dict()   # type: Dict[Tuple[int, int, int, int], str]
+    for dev, ino, mtime_ns, size, sha256 in index.execute('SELECT dev, ino, mtime_ns, size, sha256 FROM hashes'):
+        d_hashes[(dev, ino, mtime_ns, size)] = sha256
+    set_keys = set(get_dedupe_key(dedupe_file) for dedupe_file in l_files)
+    return {key: sha256 for key, sha256 in d_hashes.items() if key in set_keys}
+
+
+def write_dedupe_hashes(index: sqlite3.Connection, l_files: Sequence[DedupeFile], d_hashes: Dict[Tuple[int, int, int, int], str]) -> None:
+    now = time.time()
+    index.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+                      [get_dedupe_key(dedupe_file) + (d_hashes[get_dedupe_key(dedupe_file)], now)
+                       for dedupe_file in l_files if get_dedupe_key(dedupe_file) in d_hashes])
+    index.execute('DELETE FROM hashes WHERE last_seen < ?', (now - DEDUPE_INDEX_MAX_AGE_SECONDS, ))
+
+
+def get_path_dedupe_index_file(index_file: Union[str, pathlib.Path] = '') -> pathlib.Path:
+    if index_file:
+        return pathlib.Path(index_file)
+    return lib_wine.get_path_configmagick_wine_state_file(DEDUPE_INDEX_FILENAME)
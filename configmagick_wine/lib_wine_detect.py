@@ -0,0 +1,225 @@
+# ### STDLIB
+import mmap
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# ### OWN
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_apt                       # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_apt                              # type: ignore # pragma: no cover
+
+
+# the winehq packages install wine to /opt/wine-<flavour>, and link /usr/bin/wine to it
+L_WINE_FLAVOURS = ['stable', 'devel', 'staging']
+L_PATHS_OPT_WINE = [pathlib.Path('/opt/wine-{flavour}/bin/wine'.format(flavour=flavour)) for flavour in L_WINE_FLAVOURS]
+# the packages of the linux distribution, the first installed one wins
+L_DISTRIBUTION_WINE_PACKAGES = [('wine', 'stable'), ('wine64', 'stable'), ('wine32', 'stable'), ('wine-development', 'devel')]
+# the loader libraries, relative to the installation root, which contain the build id like 'wine-4.0.3' or 'wine-5.0 (Staging)'
+L_WINE_BUILD_ID_FILE_PATTERNS = ['lib*/libwine.so.1*', 'lib*/*/libwine.so.1*', 'lib*/wine/ntdll.so', 'lib*/wine/*-unix/ntdll.so',
+                                 'lib*/*/wine/ntdll.so', 'lib*/*/wine/*-unix/ntdll.so']
+
+# path_wine is the resolved wine binary, version like '4.0.3' or '5.0-rc1' ('' if unknown), flavour 'stable', 'devel' or 'staging'
+WineInstallation = NamedTuple('WineInstallation', [('path_wine', pathlib.Path), ('version', str), ('flavour', str)])
+
+# {str(path_wine): ((st_mtime_ns, st_size), WineInstallation)} - the detection is repeated only if the wine binary changed
+_d_wine_installation_cache = dict()     # type: Dict[str, Tuple[Tuple[int, int], WineInstallation]]
+
+
+def get_wine_installation(use_wine: bool = False) -> Optional[WineInstallation]:
+    """ detect the wine installation without starting wine, None if wine is not installed
+
+    the version is read from the dpkg status file, or from the build id in the wine loader libraries.
+    the result is cached until the wine binary changes. only with use_wine=True the version is asked from 'wine --version'
+
+    >>> wine_installation = get_wine_installation()
+    >>> if wine_installation is not None:
+    ...     assert wine_installation.flavour in L_WINE_FLAVOURS
+
+    """
+    path_wine = get_path_wine_binary()
+    if path_wine is None:
+        return None
+    stat_wine = path_wine.stat()
+    cache_key = (stat_wine.st_mtime_ns, stat_wine.st_size)
+    if use_wine:
+        wine_installation = get_wine_installation_from_wine(path_wine)
+    elif str(path_wine) in _d_wine_installation_cache and _d_wine_installation_cache[str(path_wine)][0] == cache_key:
+        return _d_wine_installation_cache[str(path_wine)][1]
+    else:
+        wine_installation = get_wine_installation_from_files(path_wine)
+    _d_wine_installation_cache[str(path_wine)] = (cache_key, wine_installation)
+    return wine_installation
+
+
+def get_path_wine_binary() -> Optional[pathlib.Path]:
+    """ the resolved path of the wine binary on the PATH, or in /opt/wine-<flavour> """
+    s_path_wine = shutil.which('wine')
+    l_paths_wine = [pathlib.Path(s_path_wine)] if s_path_wine else []
+    for path_wine in l_paths_wine + L_PATHS_OPT_WINE:
+        if path_wine.is_file() and os.access(str(path_wine), os.X_OK):
+            return path_wine.resolve()
+    return None
+
+
+def get_wine_installation_from_files(path_wine: pathlib.Path) -> WineInstallation:
+    d_package_versions = lib_apt.get_d_installed_linux_package_versions()
+    flavour, debian_version = get_wine_flavour_and_debian_version(path_wine, d_package_versions)
+    version = get_wine_version_from_debian_version(debian_version)
+    if not version:
+        build_id = get_wine_build_id_from_loader(get_path_wine_installation_root(path_wine))
+        if build_id:
+            wine_installation = get_wine_installation_from_build_id(path_wine, build_id)
+            if wine_installation.flavour != 'staging':
+                wine_installation = wine_installation._replace(flavour=flavour)
+            return wine_installation
+    return WineInstallation(path_wine=path_wine, version=version, flavour=flavour)
+
+
+def get_wine_installation_from_wine(path_wine: pathlib.Path) -> WineInstallation:
+    build_id = lib_shell.run_shell_command('"{path_wine}" --version'.format(path_wine=path_wine), shell=True, quiet=True).stdout
+    return get_wine_installation_from_build_id(path_wine, build_id)
+
+
+def get_wine_installation_from_build_id(path_wine: pathlib.Path, build_id: str) -> WineInstallation:
+    """
+    >>> get_wine_installation_from_build_id(pathlib.Path('/opt/wine-staging/bin/wine'), 'wine-5.0-rc1 (Staging)')
+    WineInstallation(path_wine=PosixPath('/opt/wine-staging/bin/wine'), version='5.0-rc1', flavour='staging')
+    >>> get_wine_installation_from_build_id(pathlib.Path('/usr/bin/wine'), 'wine-4.0.3')
+    WineInstallation(path_wine=PosixPath('/usr/bin/wine'), version='4.0.3', flavour='stable')
+
+    """
+    build_id = build_id.strip()
+    if build_id.startswith('wine-'):
+        build_id = build_id[len('wine-'):]
+    version = build_id.split(' ', 1)[0]
+    flavour = get_wine_flavour_from_path(path_wine)
+    if '(Staging)' in build_id:
+        flavour = 'staging'
+    return WineInstallation(path_wine=path_wine, version=version, flavour=flavour)
+
+
+def get_wine_flavour_and_debian_version(path_wine: pathlib.Path, d_package_versions: Dict[str, str]) -> Tuple[str, str]:
+    """ the flavour and the debian package version of the wine binary ('' if it was not installed by a package)
+
+    >>> get_wine_flavour_and_debian_version(pathlib.Path('/opt/wine-devel/bin/wine'), {'wine-devel': '5.0~rc1~bionic', 'winehq-devel': '5.0~rc1~bionic'})
+    ('devel', '5.0~rc1~bionic')
+    >>> get_wine_flavour_and_debian_version(pathlib.Path('/usr/bin/wine'), {'wine': '4.0-2', 'wine-development': '4.3-1'})
+    ('stable', '4.0-2')
+    >>> get_wine_flavour_and_debian_version(pathlib.Path('/usr/local/bin/wine'), {})
+    ('stable', '')
+
+    """
+    flavour = get_wine_flavour_from_path(path_wine)
+    if str(path_wine).startswith('/opt/wine-'):
+        for package in ('wine-{flavour}'.format(flavour=flavour), 'winehq-{flavour}'.format(flavour=flavour)):
+            if package in d_package_versions:
+                return flavour, d_package_versions[package]
+    elif str(path_wine).startswith('/usr/bin/') or str(path_wine).startswith('/usr/lib/'):
+        for package, package_flavour in L_DISTRIBUTION_WINE_PACKAGES:
+            if package in d_package_versions:
+                return package_flavour, d_package_versions[package]
+    return flavour, ''
+
+
+def get_wine_flavour_from_path(path_wine: pathlib.Path) -> str:
+    """
+    >>> get_wine_flavour_from_path(pathlib.Path('/opt/wine-staging/bin/wine'))
+    'staging'
+    >>> get_wine_flavour_from_path(pathlib.Path('/usr/bin/wine'))
+    'stable'
+
+    """
+    match = re.match(r'/opt/wine-({flavours})/'.format(flavours='|'.join(L_WINE_FLAVOURS)), str(path_wine))
+    if match:
+        return match.group(1)
+    return 'stable'
+
+
+def get_wine_version_from_debian_version(debian_version: str) -> str:
+    """ the wine version from the version of the debian package, '' if unknown
+
+    >>> get_wine_version_from_debian_version('4.0.3~bionic')
+    '4.0.3'
+    >>> get_wine_version_from_debian_version('5.0~rc1~bionic')
+    '5.0-rc1'
+    >>> get_wine_version_from_debian_version('1:6.0.3~repack-1')
+    '6.0.3'
+    >>> get_wine_version_from_debian_version('')
+    ''
+
+    """
+    match = re.match(r'^(?:\d+:)?(\d+(?:\.\d+)*)(?:~(rc\d+))?', debian_version)
+    if not match:
+        return ''
+    if match.group(2):
+        return '{version}-{rc}'.format(version=match.group(1), rc=match.group(2))
+    return match.group(1)
+
+
+def get_path_wine_installation_root(path_wine: pathlib.Path) -> pathlib.Path:
+    """
+    >>> get_path_wine_installation_root(pathlib.Path('/opt/wine-stable/bin/wine'))
+    PosixPath('/opt/wine-stable')
+
+    """
+    return path_wine.parent.parent
+
+
+def get_wine_build_id_from_loader(path_installation_root: pathlib.Path) -> str:
+    """ search the build id like 'wine-5.0 (Staging)' in the wine loader libraries, '' if not found """
+    for path_library in get_l_paths_wine_build_id_files(path_installation_root):
+        build_id = get_wine_build_id_from_file(path_library)
+        if build_id:
+            return build_id
+    return ''
+
+
+def get_l_paths_wine_build_id_files(path_installation_root: pathlib.Path) -> List[pathlib.Path]:
+    l_paths = list()    # type: List[pathlib.Path]
+    for pattern in L_WINE_BUILD_ID_FILE_PATTERNS:
+        l_paths.extend(sorted(path for path in path_installation_root.glob(pattern) if path.is_file()))
+    return l_paths
+
+
+def get_wine_build_id_from_file(path_file: pathlib.Path) -> str:
+    """
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     path_library = pathlib.Path(tmp_dir) / 'ntdll.so'
+    ...     _ = path_library.write_bytes(b'ELF\\x00wine_get_build_id\\x00wine-5.0 (Staging)\\x00')
+    ...     get_wine_build_id_from_file(path_library)
+    'wine-5.0 (Staging)'
+
+    """
+    try:
+        with open(str(path_file), 'rb') as library_file:
+            with mmap.mmap(library_file.fileno(), 0, access=mmap.ACCESS_READ) as library:
+                match = re.search(rb'\x00(wine-\d+\.\d+(?:\.\d+)?(?:-rc\d+)?(?: \(Staging\))?)\x00', library)
+                # the match refers to the mapped memory, so we need to copy it before the file is unmapped
+                return bytes(match.group(1)).decode('ascii') if match else ''
+    except (OSError, ValueError):
+        return ''
+
+
+def get_wine_version_number(use_wine: bool = False) -> str:
+    """ the version like 'wine-4.0.3' or 'wine-5.0 (Staging)', as 'wine --version' would report it. wine is started only if the version is unknown """
+    wine_installation = get_wine_installation(use_wine=use_wine)
+    if wine_installation is None:
+        raise subprocess.CalledProcessError(returncode=127, cmd='wine --version')
+    if not wine_installation.version:
+        wine_installation = get_wine_installation_from_wine(wine_installation.path_wine)
+    wine_version_number = 'wine-{version}'.format(version=wine_installation.version)
+    if wine_installation.flavour == 'staging':
+        wine_version_number = wine_version_number + ' (Staging)'
+    return wine_version_number
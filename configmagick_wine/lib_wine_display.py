@@ -0,0 +1,257 @@
+# ### STDLIB
+import contextlib
+import errno
+import fcntl
+import os
+import pathlib
+import shutil
+import signal
+import subprocess
+import time
+from typing import Iterator, List, Optional, Tuple
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine_cache                # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+
+
+# set this environment variable to the number of Xvfb displays of the pool, '0' disables the pool and the DISPLAY of the environment is used
+ENV_DISPLAY_POOL_SIZE = 'CONFIGMAGICK_WINE_DISPLAY_POOL_SIZE'
+DISPLAY_POOL_SIZE = 4
+# the pool uses the displays :90, :91, ... - far above the displays of desktops and ssh forwarding
+DISPLAY_POOL_FIRST_DISPLAY = 90
+# the lease locks and the pid files of the pool, shared by all users like /tmp/.X11-unix
+PATH_DISPLAY_POOL_DIRECTORY = pathlib.Path('/tmp/.configmagick_wine-displays')
+PATH_X11_SOCKET_DIRECTORY = pathlib.Path('/tmp/.X11-unix')
+XVFB_SCREEN = '1024x768x24'
+XVFB_START_TIMEOUT_SECONDS = 10.0
+# a job waits that long for a free display, then it fails
+DISPLAY_LEASE_TIMEOUT_SECONDS = 600.0
+DISPLAY_LEASE_POLL_SECONDS = 0.5
+# an Xvfb server which was not leased for that long is stopped, with the next lease
+DISPLAY_IDLE_SECONDS = 900.0
+
+
+@contextlib.contextmanager
+def leased_display(timeout: float = DISPLAY_LEASE_TIMEOUT_SECONDS) -> Iterator[str]:
+    """ lease a display of the pool for one wine job, like ':90'. the Xvfb server of the display is started if it is not running,
+    and kept running for the next job. concurrent jobs (also threads) get different displays, if all are leased the job waits.
+    the lease is a lock on a file, so it ends also if the job dies.
+
+    without Xvfb, with the pool disabled or while planning, the DISPLAY of the environment is yielded
+
+    >>> save_display_pool_size = os.environ.get(ENV_DISPLAY_POOL_SIZE)
+    >>> os.environ[ENV_DISPLAY_POOL_SIZE] = '0'
+    >>> with leased_display() as display:
+    ...     assert display == configmagick_linux.get_env_display()
+    >>> restore_env_display_pool_size(save_display_pool_size)
+
+    """
+    if lib_wine_plan.is_plan_mode() or not is_display_pool_enabled():
+        yield configmagick_linux.get_env_display()
+        return
+    create_display_pool_directory()
+    stop_idle_xvfb_servers()
+    display_number, lease_file_descriptor = get_display_lease(timeout=timeout)
+    try:
+        start_xvfb_server(display_number)
+        yield ':{display_number}'.format(display_number=display_number)
+    finally:
+        # the mtime of the lease file is the last use of the display, see stop_idle_xvfb_servers
+        os.utime(str(get_path_display_lease_file(display_number)))
+        fcntl.flock(lease_file_descriptor, fcntl.LOCK_UN)
+        os.close(lease_file_descriptor)
+
+
+def stop_display_pool(quiet: bool = False) -> None:
+    """ stop the Xvfb servers of the pool which are not leased now. syntax: display stop """
+    n_stopped = stop_idle_xvfb_servers(idle_seconds=0.0)
+    lib_log_utils.log_verbose('{n_stopped} Xvfb servers of the display pool stopped'.format(n_stopped=n_stopped), quiet=quiet)
+
+
+def is_display_pool_enabled() -> bool:
+    return get_display_pool_size() > 0 and shutil.which('Xvfb') is not None
+
+
+def get_display_pool_size() -> int:
+    """
+    >>> save_display_pool_size = os.environ.get(ENV_DISPLAY_POOL_SIZE)
+    >>> os.environ[ENV_DISPLAY_POOL_SIZE] = '2'
+    >>> get_display_pool_size()
+    2
+    >>> os.environ[ENV_DISPLAY_POOL_SIZE] = ''
+    >>> get_display_pool_size()
+    4
+    >>> restore_env_display_pool_size(save_display_pool_size)
+
+    """
+    display_pool_size = os.environ.get(ENV_DISPLAY_POOL_SIZE, '').strip()
+    if not display_pool_size:
+        return DISPLAY_POOL_SIZE
+    if not display_pool_size.isdigit():
+        raise RuntimeError('invalid {env}="{display_pool_size}", the number of displays is needed'
+                           .format(env=ENV_DISPLAY_POOL_SIZE, display_pool_size=display_pool_size))
+    return int(display_pool_size)
+
+
+def restore_env_display_pool_size(display_pool_size: Optional[str]) -> None:
+    """ for the doctests, which change the pool size """
+    if display_pool_size is None:
+        os.environ.pop(ENV_DISPLAY_POOL_SIZE, None)
+    else:
+        os.environ[ENV_DISPLAY_POOL_SIZE] = display_pool_size
+
+
+def get_l_pool_display_numbers() -> List[int]:
+    return list(range(DISPLAY_POOL_FIRST_DISPLAY, DISPLAY_POOL_FIRST_DISPLAY + get_display_pool_size()))
+
+
+def create_display_pool_directory() -> None:
+    """ sticky and writable for all, so the jobs of all users share the pool """
+    if not PATH_DISPLAY_POOL_DIRECTORY.is_dir():
+        PATH_DISPLAY_POOL_DIRECTORY.mkdir(exist_ok=True)
+        os.chmod(str(PATH_DISPLAY_POOL_DIRECTORY), 0o1777)
+
+
+def get_display_lease(timeout: float = DISPLAY_LEASE_TIMEOUT_SECONDS) -> Tuple[int, int]:
+    """ the display number and the file descriptor of its lease lock - wait until a display is free """
+    deadline = time.time() + timeout
+    while True:
+        for display_number in get_l_pool_display_numbers():
+            lease_file_descriptor = try_lock_display_lease_file(display_number)
+            if lease_file_descriptor is not None:
+                return display_number, lease_file_descriptor
+        if time.time() > deadline:
+            raise RuntimeError('no free display in the pool of {pool_size} Xvfb displays within {timeout} seconds, see {env}'
+                               .format(pool_size=get_display_pool_size(), timeout=timeout, env=ENV_DISPLAY_POOL_SIZE))
+        time.sleep(DISPLAY_LEASE_POLL_SECONDS)
+
+
+def try_lock_display_lease_file(display_number: int) -> Optional[int]:
+    """ the file descriptor of the locked lease file, None if the display is leased by an other job.
+    the lease files are shared by all users, see lib_wine_cache.open_shared_file """
+    path_lease_file = get_path_display_lease_file(display_number)
+    lease_file_descriptor = lib_wine_cache.open_shared_file(path_lease_file)
+    try:
+        # flock and not lockf - the locks of lockf are per process, then two threads would get the same display
+        fcntl.flock(lease_file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as exc:
+        os.close(lease_file_descriptor)
+        if exc.errno in (errno.EACCES, errno.EAGAIN):
+            return None
+        raise
+    return lease_file_descriptor
+
+
+def start_xvfb_server(display_number: int) -> None:
+    """ start the Xvfb server of a leased display, if it is not running. the server is detached, it outlives the job.
+    an X server on the display which was not started by the pool (a desktop, or a forwarding) is left alone and used.
+    Xvfb is started in the background by a shell which exits at once, so Xvfb is not our child - init reaps it when it is stopped, no zombie is left """
+    if get_x_server_pid(display_number) is not None:
+        return
+    xvfb_command = 'Xvfb "$@" </dev/null >/dev/null 2>&1 & echo $!'
+    process = subprocess.Popen(['sh', '-c', xvfb_command, 'sh', ':{display_number}'.format(display_number=display_number), '-screen', '0', XVFB_SCREEN,
+                                '-nolisten', 'tcp'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=True)
+    xvfb_pid = int(process.communicate()[0].strip() or 0)
+    if not xvfb_pid:
+        raise RuntimeError('can not start Xvfb on display :{display_number}'.format(display_number=display_number))
+    write_xvfb_pid_file(display_number, xvfb_pid=xvfb_pid)
+    path_x11_socket = PATH_X11_SOCKET_DIRECTORY / 'X{display_number}'.format(display_number=display_number)
+    deadline = time.time() + XVFB_START_TIMEOUT_SECONDS
+    while not path_x11_socket.exists():
+        if not is_process_running(xvfb_pid) or time.time() > deadline:
+            raise RuntimeError('can not start Xvfb on display :{display_number}'.format(display_number=display_number))
+        time.sleep(0.1)
+
+
+def stop_idle_xvfb_servers(idle_seconds: float = DISPLAY_IDLE_SECONDS) -> int:
+    """ stop the Xvfb servers the pool started, which are not leased and were not used for idle_seconds. returns the number of stopped servers """
+    n_stopped = 0
+    if not PATH_DISPLAY_POOL_DIRECTORY.is_dir():
+        return n_stopped
+    for display_number in get_l_pool_display_numbers():
+        path_pid_file = get_path_xvfb_pid_file(display_number)
+        if not path_pid_file.is_file() or not path_pid_file.read_text().strip():
+            continue
+        lease_file_descriptor = try_lock_display_lease_file(display_number)
+        if lease_file_descriptor is None:
+            continue
+        try:
+            if time.time() - os.fstat(lease_file_descriptor).st_mtime >= idle_seconds:
+                xvfb_pid = int(path_pid_file.read_text().strip() or 0)
+                if xvfb_pid and xvfb_pid == get_x_server_pid(display_number):
+                    try:
+                        os.kill(xvfb_pid, signal.SIGTERM)
+                    except PermissionError:
+                        # started by an other user, that user stops it
+                        continue
+                    n_stopped = n_stopped + 1
+                write_xvfb_pid_file(display_number, xvfb_pid=0)
+        finally:
+            fcntl.flock(lease_file_descriptor, fcntl.LOCK_UN)
+            os.close(lease_file_descriptor)
+    return n_stopped
+
+
+def get_x_server_pid(display_number: int) -> Optional[int]:
+    """ the pid of the X server which runs on the display, from the lock file X servers write to /tmp/.X<n>-lock. None if none is running
+
+    >>> get_x_server_pid(display_number=65000) is None
+    True
+
+    """
+    path_x_lock_file = pathlib.Path('/tmp/.X{display_number}-lock'.format(display_number=display_number))
+    try:
+        x_server_pid = int(path_x_lock_file.read_text().strip())
+    except (OSError, ValueError):
+        return None
+    if not is_process_running(x_server_pid):
+        return None
+    return x_server_pid
+
+
+def is_process_running(pid: int) -> bool:
+    """
+    >>> is_process_running(os.getpid())
+    True
+
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, as an other user
+        pass
+    return True
+
+
+def get_path_display_lease_file(display_number: int) -> pathlib.Path:
+    return PATH_DISPLAY_POOL_DIRECTORY / 'display-{display_number}.lease'.format(display_number=display_number)
+
+
+def get_path_xvfb_pid_file(display_number: int) -> pathlib.Path:
+    """ the pid of the Xvfb server the pool started on the display - only those are stopped by the pool """
+    return PATH_DISPLAY_POOL_DIRECTORY / 'display-{display_number}.pid'.format(display_number=display_number)
+
+
+def write_xvfb_pid_file(display_number: int, xvfb_pid: int) -> None:
+    """ the pid file is writable for all - the next Xvfb server of the display may be started by an other user. xvfb_pid 0 is no server """
+    pid_file_descriptor = lib_wine_cache.open_shared_file(get_path_xvfb_pid_file(display_number))
+    try:
+        os.ftruncate(pid_file_descriptor, 0)
+        os.write(pid_file_descriptor, (str(xvfb_pid) if xvfb_pid else '').encode())
+    finally:
+        os.close(pid_file_descriptor)
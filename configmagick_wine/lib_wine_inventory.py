@@ -0,0 +1,391 @@
+# ### STDLIB
+import concurrent.futures
+import contextlib
+import json
+import os
+import pathlib
+import pwd
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+# ### OWN
+import lib_log_utils
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_check                # type: ignore # pragma: no cover
+    from . import lib_wine_detect               # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+    from . import lib_wine_registry             # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_check                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_detect                      # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry                    # type: ignore # pragma: no cover
+
+
+# the directories which are searched for wine prefixes, '/home/*' is every home directory
+L_INVENTORY_SEARCH_ROOTS = ['/home/*', '/root']
+# a wine prefix is found up to that depth below a search root, like /home/<user>/<depth 1>/<depth 2>/<depth 3>
+INVENTORY_MAX_DEPTH = 3
+INVENTORY_INDEX_FILENAME = 'wine_prefix_inventory.sqlite'
+INVENTORY_INDEX_SCHEMA_VERSION = 1
+# wine writes the mtime of the wine.inf it updated the prefix with into that file
+WINE_UPDATE_TIMESTAMP_FILENAME = '.update-timestamp'
+REG_KEY_WINE = 'HKEY_CURRENT_USER\\Software\\Wine'
+REG_KEY_WINDOWS_NT_CURRENT_VERSION = 'HKEY_LOCAL_MACHINE\\Software\\Microsoft\\Windows NT\\CurrentVersion'
+# the windows versions as winetricks names them, by the windows nt version
+D_WINDOWS_VERSIONS = {'4.0': 'nt40', '5.0': 'win2k', '5.1': 'winxp', '5.2': 'win2k3', '6.0': 'vista',
+                      '6.1': 'win7', '6.2': 'win8', '6.3': 'win81', '10.0': 'win10'}    # type: Dict[str, str]
+
+# one wine prefix in the inventory, components is {component: is_installed}, disk_usage in bytes
+WinePrefixInventoryEntry = NamedTuple('WinePrefixInventoryEntry', [('wine_prefix', str),
+                                                                   ('username', str),
+                                                                   ('wine_arch', str),
+                                                                   ('wine_version', str),
+                                                                   ('wine_update_timestamp', str),
+                                                                   ('windows_version', str),
+                                                                   ('components', Dict[str, bool]),
+                                                                   ('disk_usage', int),
+                                                                   ('hives_mtime_ns', int),
+                                                                   ('last_scan', float)])
+
+# a directory of a wine prefix, as remembered for the incremental disk usage - if the mtime did not change, the directory is not listed again
+InventoryDirectory = NamedTuple('InventoryDirectory', [('path', str), ('mtime_ns', int), ('files_size', int), ('l_subdirectories', List[str])])
+
+
+def scan_wine_prefix_inventory(index_file: str = '',
+                               search_roots: Union[str, Sequence[str]] = (),
+                               max_depth: int = INVENTORY_MAX_DEPTH,
+                               max_workers: int = 0,
+                               quiet: bool = False) -> None:
+    """update the inventory of the wine prefixes on this machine. syntax: inventory scan [--index_file=<file.sqlite>] [--search_roots=/home/*,/root]
+
+    the home directories are searched in parallel, with bounded depth. for every prefix the arch, the wine version stamp, the windows version,
+    the installed components and the disk usage are recorded in a sqlite index. unchanged hives and directories (by mtime) are not read again.
+
+    Args:
+        --index_file=<file.sqlite>  default /var/lib/configmagick_wine/wine_prefix_inventory.sqlite for root, ~/.cache/configmagick_wine/... for other users
+        --search_roots=<dir>,<dir>  default /home/*,/root
+        --max_depth=<n>             the depth below the search roots, default 3
+        --max_workers=<n>           the number of parallel scans, default the number of cpus
+
+    """
+    path_index_file = get_path_inventory_index_file(index_file)
+    l_search_roots = lib_wine_check.get_l_arguments(search_roots) or L_INVENTORY_SEARCH_ROOTS
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('file', description='scan {search_roots}, update "{path_index_file}"'
+                                    .format(search_roots=', '.join(l_search_roots), path_index_file=path_index_file), step_key='')
+        return
+    lib_log_utils.banner_verbose('Scanning wine prefixes in {search_roots}, index="{path_index_file}"'
+                                 .format(search_roots=', '.join(l_search_roots), path_index_file=path_index_file), quiet=quiet)
+    l_entries = update_wine_prefix_inventory(path_index_file=path_index_file, l_search_roots=l_search_roots, max_depth=max_depth, max_workers=max_workers)
+    lib_log_utils.banner_success('{n_prefixes} wine prefixes in the inventory, {disk_usage_mb:.1f} MB'
+                                 .format(n_prefixes=len(l_entries), disk_usage_mb=sum(entry.disk_usage for entry in l_entries) / 1024 / 1024), quiet=quiet)
+
+
+def show_wine_prefix_inventory(index_file: str = '') -> None:
+    """print the inventory as json, without scanning. syntax: inventory show [--index_file=<file.sqlite>] """
+    l_entries = get_wine_prefix_inventory(get_path_inventory_index_file(index_file))
+    sys.stdout.write(json.dumps([dict(entry._asdict()) for entry in l_entries], indent=4) + '\n')
+
+
+def update_wine_prefix_inventory(path_index_file: pathlib.Path,
+                                 l_search_roots: Sequence[str] = L_INVENTORY_SEARCH_ROOTS,
+                                 max_depth: int = INVENTORY_MAX_DEPTH,
+                                 max_workers: int = 0) -> List[WinePrefixInventoryEntry]:
+    """ scan the search roots and update the index, prefixes under the search roots which are no longer found are removed from the index
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     wine_prefix = pathlib.Path(tmp_dir) / 'user/.wine'
+    ...     (wine_prefix / 'drive_c/windows/syswow64').mkdir(parents=True)
+    ...     _ = (wine_prefix / 'system.reg').write_text(lib_wine_check.SYSTEM_HIVE_CONTENT_EXAMPLE.replace('#arch=win32', '#arch=win64'))
+    ...     path_index_file = pathlib.Path(tmp_dir) / 'inventory.sqlite'
+    ...     l_entries = update_wine_prefix_inventory(path_index_file, l_search_roots=[tmp_dir + '/*'])
+    ...     _ = (wine_prefix / 'drive_c/test.txt').write_bytes(b'x' * 8192)
+    ...     l_entries_updated = update_wine_prefix_inventory(path_index_file, l_search_roots=[tmp_dir + '/*'])
+    ...     l_entries_stored = get_wine_prefix_inventory(path_index_file)
+    >>> [(pathlib.Path(entry.wine_prefix).name, entry.wine_arch, entry.windows_version) for entry in l_entries]
+    [('.wine', 'win64', '')]
+    >>> assert l_entries_updated[0].disk_usage >= l_entries[0].disk_usage + 8192
+    >>> assert l_entries_stored == l_entries_updated
+
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    l_paths_search_root = get_l_paths_search_roots(l_search_roots)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        l_l_found = executor.map(get_l_wine_prefixes_in_directory, l_paths_search_root, [max_depth] * len(l_paths_search_root))
+        l_paths_wine_prefix = sorted(set(path_wine_prefix for l_found in l_l_found for path_wine_prefix in l_found))
+
+        with open_inventory_index(path_index_file) as index:
+            d_old_entries = {entry.wine_prefix: entry for entry in read_inventory_entries(index)}
+            l_old_directories = [read_inventory_directories(index, str(path_wine_prefix)) for path_wine_prefix in l_paths_wine_prefix]
+            d_wine_inf_mtimes = get_d_installed_wine_inf_mtimes()
+            l_futures = [executor.submit(get_wine_prefix_inventory_entry, path_wine_prefix, d_old_entries.get(str(path_wine_prefix)), d_old_directories,
+                                         d_wine_inf_mtimes)
+                         for path_wine_prefix, d_old_directories in zip(l_paths_wine_prefix, l_old_directories)]
+            l_entries = list()  # type: List[WinePrefixInventoryEntry]
+            for future in l_futures:
+                entry, l_directories = future.result()
+                write_inventory_entry(index, entry, l_directories)
+                l_entries.append(entry)
+            for wine_prefix in set(d_old_entries) - set(entry.wine_prefix for entry in l_entries):
+                if is_path_in_search_roots(pathlib.Path(wine_prefix), l_paths_search_root):
+                    delete_inventory_entry(index, wine_prefix)
+    return l_entries
+
+
+def get_wine_prefix_inventory(path_index_file: pathlib.Path) -> List[WinePrefixInventoryEntry]:
+    """ read the inventory from the index, without scanning """
+    with open_inventory_index(path_index_file) as index:
+        return read_inventory_entries(index)
+
+
+def get_wine_prefix_inventory_entry(path_wine_prefix: pathlib.Path,
+                                    old_entry: Optional[WinePrefixInventoryEntry],
+                                    d_old_directories: Dict[str, InventoryDirectory],
+                                    d_wine_inf_mtimes: Dict[str, str]) -> Tuple[WinePrefixInventoryEntry, List[InventoryDirectory]]:
+    """ the hives are only parsed again if one of them changed """
+    stat_wine_prefix = path_wine_prefix.stat()
+    hives_mtime_ns = max([(path_wine_prefix / hive_filename).stat().st_mtime_ns for hive_filename in lib_wine_check.L_WINE_REGISTRY_HIVE_FILENAMES
+                          if (path_wine_prefix / hive_filename).is_file()] + [0])
+    wine_update_timestamp = read_wine_update_timestamp(path_wine_prefix)
+
+    if old_entry is not None and old_entry.hives_mtime_ns == hives_mtime_ns:
+        wine_arch, windows_version, components = old_entry.wine_arch, old_entry.windows_version, old_entry.components
+    else:
+        wine_arch, windows_version, l_path_entries = get_wine_prefix_registry_facts(path_wine_prefix)
+        components = lib_wine_check.get_d_installed_wine_components(path_wine_prefix, l_path_entries)
+
+    disk_usage, l_directories = get_wine_prefix_disk_usage(path_wine_prefix, d_old_directories)
+    entry = WinePrefixInventoryEntry(wine_prefix=str(path_wine_prefix),
+                                     username=get_username_from_uid(stat_wine_prefix.st_uid),
+                                     wine_arch=wine_arch,
+                                     wine_version=d_wine_inf_mtimes.get(wine_update_timestamp, ''),
+                                     wine_update_timestamp=wine_update_timestamp,
+                                     windows_version=windows_version,
+                                     components=components,
+                                     disk_usage=disk_usage,
+                                     hives_mtime_ns=hives_mtime_ns,
+                                     last_scan=time.time())
+    return entry, l_directories
+
+
+def get_wine_prefix_registry_facts(path_wine_prefix: pathlib.Path) -> Tuple[str, str, List[str]]:
+    """ the wine_arch, the windows version and the PATH entries from the hives, '' or [] if not found """
+    wine_arch, windows_version, l_path_entries = '', '', list()     # type: str, str, List[str]
+    d_hives = dict()        # type: Dict[str, lib_wine_registry.WineRegistryHive]
+    for hive_filename in ('system.reg', 'user.reg'):
+        hive = lib_wine_check.read_wine_registry_hive_to_check(path_wine_prefix / hive_filename, list())
+        if hive is not None:
+            d_hives[hive_filename] = hive
+    if 'system.reg' in d_hives:
+        wine_arch = lib_wine_check.get_wine_arch_from_hive(d_hives['system.reg'])
+        l_path_entries = lib_wine_check.get_l_wine_registry_path_entries(d_hives['system.reg'])
+    windows_version = get_windows_version_from_hives(d_hives)
+    return wine_arch, windows_version, l_path_entries
+
+
+def get_windows_version_from_hives(d_hives: Dict[str, lib_wine_registry.WineRegistryHive]) -> str:
+    """ the windows version set by winecfg or winetricks, otherwise the default version of the prefix
+
+    >>> system_hive = lib_wine_registry.parse_wine_registry_hive('WINE REGISTRY Version 2\\n\\n'
+    ...     '[Software\\\\\\\\Microsoft\\\\\\\\Windows NT\\\\\\\\CurrentVersion] 1572355339\\n"CurrentVersion"="6.1"\\n')
+    >>> get_windows_version_from_hives({'system.reg': system_hive})
+    'win7'
+    >>> user_hive = lib_wine_registry.parse_wine_registry_hive('WINE REGISTRY Version 2\\n\\n[Software\\\\\\\\Wine] 1572355339\\n"Version"="win10"\\n')
+    >>> get_windows_version_from_hives({'system.reg': system_hive, 'user.reg': user_hive})
+    'win10'
+
+    """
+    for reg_key, reg_subkey in ((REG_KEY_WINE, 'Version'), (REG_KEY_WINDOWS_NT_CURRENT_VERSION, 'CurrentVersion')):
+        hive_filename, relative_key = lib_wine_registry.get_hive_filename_and_relative_key(reg_key)
+        if hive_filename not in d_hives:
+            continue
+        value = lib_wine_registry.get_wine_registry_hive_value(d_hives[hive_filename], relative_key, reg_subkey)
+        if value is not None and value[1]:
+            return D_WINDOWS_VERSIONS.get(value[1], value[1]).lower()
+    return ''
+
+
+def get_wine_prefix_disk_usage(path_wine_prefix: pathlib.Path, d_old_directories: Dict[str, InventoryDirectory]) -> Tuple[int, List[InventoryDirectory]]:
+    """ the disk usage of the prefix in bytes - directories with unchanged mtime are not listed again
+
+    a file which is rewritten in place does not change the mtime of its directory, so its new size is found only if the directory changes.
+    symlinks (like dosdevices) are not followed.
+    """
+    disk_usage = 0
+    l_directories = list()  # type: List[InventoryDirectory]
+    l_paths_to_scan = [str(path_wine_prefix)]
+    while l_paths_to_scan:
+        path_directory = l_paths_to_scan.pop()
+        try:
+            mtime_ns = os.lstat(path_directory).st_mtime_ns
+            directory = d_old_directories.get(path_directory)
+            if directory is None or directory.mtime_ns != mtime_ns:
+                directory = get_inventory_directory(path_directory, mtime_ns)
+        except OSError:
+            continue
+        l_directories.append(directory)
+        disk_usage = disk_usage + directory.files_size
+        l_paths_to_scan.extend(os.path.join(path_directory, subdirectory) for subdirectory in directory.l_subdirectories)
+    return disk_usage, l_directories
+
+
+def get_inventory_directory(path_directory: str, mtime_ns: int) -> InventoryDirectory:
+    files_size = os.lstat(path_directory).st_blocks * 512
+    l_subdirectories = list()   # type: List[str]
+    with contextlib.closing(os.scandir(path_directory)) as directory_entries:   # type: ignore
+        for directory_entry in directory_entries:
+            if directory_entry.is_dir(follow_symlinks=False):
+                l_subdirectories.append(directory_entry.name)
+            else:
+                files_size = files_size + directory_entry.stat(follow_symlinks=False).st_blocks * 512
+    return InventoryDirectory(path=path_directory, mtime_ns=mtime_ns, files_size=files_size, l_subdirectories=sorted(l_subdirectories))
+
+
+def get_l_wine_prefixes_in_directory(path_directory: pathlib.Path, max_depth: int = INVENTORY_MAX_DEPTH) -> List[pathlib.Path]:
+    """ search wine prefixes up to max_depth below the directory, the prefixes themselves are not searched and symlinks are not followed """
+    l_wine_prefixes = list()    # type: List[pathlib.Path]
+    if is_wine_prefix(path_directory):
+        return [path_directory]
+    l_directories_to_scan = [(str(path_directory), 1)]
+    while l_directories_to_scan:
+        directory, depth = l_directories_to_scan.pop()
+        try:
+            with contextlib.closing(os.scandir(directory)) as directory_entries:   # type: ignore
+                l_subdirectories = [directory_entry.path for directory_entry in directory_entries if directory_entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            continue
+        for subdirectory in l_subdirectories:
+            if is_wine_prefix(pathlib.Path(subdirectory)):
+                l_wine_prefixes.append(pathlib.Path(subdirectory))
+            elif depth < max_depth:
+                l_directories_to_scan.append((subdirectory, depth + 1))
+    return l_wine_prefixes
+
+
+def is_wine_prefix(path_directory: pathlib.Path) -> bool:
+    return (path_directory / 'system.reg').is_file() and (path_directory / 'drive_c').is_dir()
+
+
+def get_l_paths_search_roots(l_search_roots: Sequence[str]) -> List[pathlib.Path]:
+    """ expand the search roots like '/home/*' """
+    l_paths_search_root = list()    # type: List[pathlib.Path]
+    for search_root in l_search_roots:
+        if search_root.endswith('/*'):
+            path_parent = pathlib.Path(search_root[:-2])
+            if path_parent.is_dir():
+                l_paths_search_root.extend(sorted(path for path in path_parent.iterdir() if path.is_dir() and not path.is_symlink()))
+        elif pathlib.Path(search_root).is_dir():
+            l_paths_search_root.append(pathlib.Path(search_root))
+    return l_paths_search_root
+
+
+def is_path_in_search_roots(path: pathlib.Path, l_paths_search_root: Sequence[pathlib.Path]) -> bool:
+    """
+    >>> is_path_in_search_roots(pathlib.Path('/home/test/.wine'), [pathlib.Path('/home/test')])
+    True
+    >>> is_path_in_search_roots(pathlib.Path('/home/test2/.wine'), [pathlib.Path('/home/test')])
+    False
+
+    """
+    return any(path_search_root == path or path_search_root in path.parents for path_search_root in l_paths_search_root)
+
+
+def read_wine_update_timestamp(path_wine_prefix: pathlib.Path) -> str:
+    path_update_timestamp = path_wine_prefix / WINE_UPDATE_TIMESTAMP_FILENAME
+    try:
+        return path_update_timestamp.read_text().strip()
+    except (OSError, UnicodeDecodeError):
+        return ''
+
+
+def get_d_installed_wine_inf_mtimes() -> Dict[str, str]:
+    """ {wine.inf mtime: wine version} of the installed wine - a prefix which was updated by this wine has that mtime as update stamp """
+    wine_installation = lib_wine_detect.get_wine_installation()
+    if wine_installation is None:
+        return dict()
+    path_installation_root = lib_wine_detect.get_path_wine_installation_root(wine_installation.path_wine)
+    path_wine_inf = path_installation_root / 'share/wine/wine.inf'
+    if not path_wine_inf.is_file():
+        return dict()
+    return {str(int(path_wine_inf.stat().st_mtime)): wine_installation.version}
+
+
+def get_username_from_uid(uid: int) -> str:
+    try:
+        return str(pwd.getpwuid(uid).pw_name)
+    except KeyError:
+        return str(uid)
+
+
+def get_path_inventory_index_file(index_file: Union[str, pathlib.Path] = '') -> pathlib.Path:
+    if index_file:
+        return pathlib.Path(index_file)
+    return lib_wine.get_path_configmagick_wine_state_file(INVENTORY_INDEX_FILENAME)
+
+
+@contextlib.contextmanager
+def open_inventory_index(path_index_file: pathlib.Path) -> Iterator[sqlite3.Connection]:
+    """ open the index and create the tables if needed, the changes are committed when the context is left without exception """
+    path_index_file.parent.mkdir(parents=True, exist_ok=True)
+    index = sqlite3.connect(str(path_index_file), timeout=60)
+    try:
+        if index.execute('PRAGMA user_version').fetchone()[0] != INVENTORY_INDEX_SCHEMA_VERSION:
+            index.executescript('DROP TABLE IF EXISTS wine_prefixes;'
+                                'DROP TABLE IF EXISTS directories;'
+                                'CREATE TABLE wine_prefixes (wine_prefix TEXT PRIMARY KEY, username TEXT, wine_arch TEXT, wine_version TEXT, '
+                                'wine_update_timestamp TEXT, windows_version TEXT, components TEXT, disk_usage INTEGER, hives_mtime_ns INTEGER, '
+                                'last_scan REAL);'
+                                'CREATE TABLE directories (path TEXT PRIMARY KEY, wine_prefix TEXT, mtime_ns INTEGER, files_size INTEGER, subdirectories TEXT);'
+                                'CREATE INDEX directories_wine_prefix ON directories (wine_prefix);'
+                                'PRAGMA user_version = {schema_version};'.format(schema_version=INVENTORY_INDEX_SCHEMA_VERSION))
+        with index:
+            yield index
+    finally:
+        index.close()
+
+
+def read_inventory_entries(index: sqlite3.Connection) -> List[WinePrefixInventoryEntry]:
+    l_entries = list()  # type: List[WinePrefixInventoryEntry]
+    for row in index.execute('SELECT wine_prefix, username, wine_arch, wine_version, wine_update_timestamp, windows_version, components, '
+                             'disk_usage, hives_mtime_ns, last_scan FROM wine_prefixes ORDER BY wine_prefix'):
+        l_row = list(row)
+        l_row[6] = json.loads(l_row[6])
+        l_entries.append(WinePrefixInventoryEntry(*l_row))
+    return l_entries
+
+
+def read_inventory_directories(index: sqlite3.Connection, wine_prefix: str) -> Dict[str, InventoryDirectory]:
+    d_directories = dict()  # type: Dict[str, InventoryDirectory]
+    for path, mtime_ns, files_size, subdirectories in index.execute('SELECT path, mtime_ns, files_size, subdirectories FROM directories WHERE wine_prefix = ?',
+                                                                    (wine_prefix, )):
+        d_directories[path] = InventoryDirectory(path=path, mtime_ns=mtime_ns, files_size=files_size, l_subdirectories=json.loads(subdirectories))
+    return d_directories
+
+
+def write_inventory_entry(index: sqlite3.Connection, entry: WinePrefixInventoryEntry, l_directories: Sequence[InventoryDirectory]) -> None:
+    index.execute('INSERT OR REPLACE INTO wine_prefixes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                  entry[:6] + (json.dumps(entry.components, sort_keys=True), ) + entry[7:])
+    index.execute('DELETE FROM directories WHERE wine_prefix = ?', (entry.wine_prefix, ))
+    index.executemany('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)',
+                      [(directory.path, entry.wine_prefix, directory.mtime_ns, directory.files_size, json.dumps(directory.l_subdirectories))
+                       for directory in l_directories])
+
+
+def delete_inventory_entry(index: sqlite3.Connection, wine_prefix: str) -> None:
+    index.execute('DELETE FROM wine_prefixes WHERE wine_prefix = ?', (wine_prefix, ))
+    index.execute('DELETE FROM directories WHERE wine_prefix = ?', (wine_prefix, ))
@@ -0,0 +1,440 @@
+# ### STDLIB
+import pathlib
+import struct
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_batch                # type: ignore # pragma: no cover
+    from . import lib_wine_cache                # type: ignore # pragma: no cover
+    from . import lib_wine_versions             # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_batch                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_versions                    # type: ignore # pragma: no cover
+
+
+# the options of msiexec for the user interface, '' shows the full user interface like a plain 'msiexec /i'
+D_MSI_UI_LEVELS = {'': '', 'quiet': '/quiet', 'passive': '/passive'}
+# success, success with a restart initiated, success with a restart required
+L_MSI_SUCCESS_EXIT_CODES = [0, 1641, 3010]
+
+# what to do with a msi package, by its ProductCode and ProductVersion compared with the Uninstall keys of the prefix :
+# skip - the same product in the same version is installed, reinstall - the same ProductCode in an other version (minor upgrade),
+# upgrade - an other ProductCode of the same ProductName is installed (major upgrade), install - the product is not installed
+L_MSI_INSTALL_ACTIONS = ['install', 'reinstall', 'skip', 'upgrade']
+# the msiexec properties for a minor upgrade over the same ProductCode
+MSI_REINSTALL_PROPERTIES = 'REINSTALL=ALL REINSTALLMODE=vomus'
+
+# the OLE compound file format of msi files
+COMPOUND_FILE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+COMPOUND_FILE_END_OF_CHAIN = 0xFFFFFFFE
+COMPOUND_FILE_NO_STREAM = 0xFFFFFFFF
+COMPOUND_FILE_TYPE_STREAM = 2
+# the characters which msi packs into the names of the streams, 6 Bits each
+MSI_STREAM_NAME_CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz._'
+
+# the result of the installation of one msi package, returncode is 0 for skipped packages
+MsiInstallResult = NamedTuple('MsiInstallResult', [('msi_file', str), ('returncode', int), ('is_ok', bool), ('action', str)])
+# the properties of the Property table of a msi package
+MsiProductInfo = NamedTuple('MsiProductInfo', [('product_code', str), ('product_version', str), ('product_name', str), ('upgrade_code', str)])
+# the parts of the compound file header we need - the sectors of the file allocation table are collected from the DIFAT
+CompoundFileHeader = NamedTuple('CompoundFileHeader', [('sector_size', int), ('mini_sector_size', int), ('mini_stream_cutoff', int),
+                                                       ('first_directory_sector', int), ('first_mini_fat_sector', int), ('l_fat_sectors', List[int])])
+# an entry of the directory of a compound file
+CompoundFileEntry = NamedTuple('CompoundFileEntry', [('name', str), ('entry_type', int), ('left_id', int), ('right_id', int), ('child_id', int),
+                                                     ('start_sector', int), ('size', int)])
+
+# {str(path): ((st_mtime_ns, st_size, st_ino), result)} - a msi file is parsed again only if it changed
+_d_msi_product_info_cache = dict()             # type: Dict[str, Tuple[Tuple[int, int, int], MsiProductInfo]]
+
+
+def install_msi_files_from_wine_cache(l_msi_filenames: Sequence[Union[str, pathlib.Path]],
+                                      wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                                      username: str = configmagick_linux.get_current_username(),
+                                      ui_level: str = '',
+                                      quiet: bool = False) -> List[MsiInstallResult]:
+    """ install msi files of the wine cache in one wine session, raises RuntimeError if one of them fails """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
+    path_wine_cache = lib_wine.get_path_wine_cache_for_user(username)
+    for msi_filename in l_msi_filenames:
+        lib_wine_cache.record_wine_cache_access(filename=msi_filename, username=username, wine_prefix=wine_prefix)
+    l_results = install_msi_packages([path_wine_cache / msi_filename for msi_filename in l_msi_filenames],
+                                     wine_prefix=wine_prefix, username=username, ui_level=ui_level, quiet=quiet)
+    l_failed_msi_files = [result.msi_file for result in l_results if not result.is_ok]
+    if l_failed_msi_files:
+        raise RuntimeError('can not install {msi_files} on WINEPREFIX="{wine_prefix}"'
+                           .format(msi_files=', '.join('"{msi_file}"'.format(msi_file=msi_file) for msi_file in l_failed_msi_files),
+                                   wine_prefix=wine_prefix))
+    return l_results
+
+
+def install_msi_packages(l_paths_msi_files: Sequence[Union[str, pathlib.Path]],
+                         wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                         username: str = configmagick_linux.get_current_username(),
+                         ui_level: str = '',
+                         quiet: bool = False) -> List[MsiInstallResult]:
+    """ install msi packages in the given order with one single 'wine cmd /c', instead of one wine start per package.
+    packages which are already installed in the same version are skipped without starting wine at all.
+    the installation goes on if a package fails, the exit code of msiexec is reported per package.
+    the permissions of the prefix are fixed once at the end
+
+    ui_level: '' for the full user interface, 'quiet' or 'passive'
+    """
+    if ui_level not in D_MSI_UI_LEVELS:
+        raise RuntimeError('invalid msi ui_level "{ui_level}", valid are : {ui_levels}'.format(ui_level=ui_level, ui_levels=sorted(D_MSI_UI_LEVELS)))
+    if not l_paths_msi_files:
+        return list()
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
+    l_uninstall_entries = lib_wine_versions.get_l_uninstall_entries(wine_prefix)
+    d_actions = dict()  # type: Dict[str, str]
+    l_commands = list()  # type: List[str]
+    for path_msi_file in l_paths_msi_files:
+        action = get_msi_install_action_for_file(pathlib.Path(path_msi_file), l_uninstall_entries)
+        d_actions[str(path_msi_file)] = action
+        if action == 'skip':
+            lib_log_utils.log_verbose('"{msi_file}" is already installed on WINEPREFIX="{wine_prefix}"'.format(msi_file=path_msi_file, wine_prefix=wine_prefix),
+                                      quiet=quiet)
+            continue
+        lib_log_utils.log_verbose('{action} "{msi_file}" on WINEPREFIX="{wine_prefix}"'
+                                  .format(action=action.capitalize(), msi_file=path_msi_file, wine_prefix=wine_prefix), quiet=quiet)
+        properties = MSI_REINSTALL_PROPERTIES if action == 'reinstall' else ''
+        l_commands.append(get_msiexec_install_command(path_msi_file, ui_level=ui_level, properties=properties))
+
+    l_batch_results = list()    # type: List[lib_wine_batch.WindowsCommandResult]
+    if l_commands:
+        l_batch_results = lib_wine_batch.run_windows_commands(l_commands, wine_prefix=wine_prefix, username=username)
+        lib_wine.fix_wine_permissions(wine_prefix=wine_prefix, username=username)
+
+    l_results = list()  # type: List[MsiInstallResult]
+    for path_msi_file in l_paths_msi_files:
+        action = d_actions[str(path_msi_file)]
+        if action == 'skip':
+            l_results.append(MsiInstallResult(msi_file=str(path_msi_file), returncode=0, is_ok=True, action=action))
+            continue
+        returncode = l_batch_results.pop(0).returncode
+        is_ok = returncode in L_MSI_SUCCESS_EXIT_CODES
+        l_results.append(MsiInstallResult(msi_file=str(path_msi_file), returncode=returncode, is_ok=is_ok, action=action))
+        if not is_ok:
+            lib_log_utils.log_warning('msiexec failed with exit code {returncode} on "{msi_file}"'.format(returncode=returncode, msi_file=path_msi_file))
+    return l_results
+
+
+def get_msi_install_action_for_file(path_msi_file: pathlib.Path, l_uninstall_entries: Sequence[lib_wine_versions.UninstallEntry]) -> str:
+    """ 'install' if the msi file can not be read, so msiexec decides """
+    try:
+        msi_product_info = get_msi_product_info(path_msi_file)
+    except RuntimeError as exc:
+        lib_log_utils.log_warning('can not read the product of "{msi_file}" : {exc}'.format(msi_file=path_msi_file, exc=exc))
+        return 'install'
+    return get_msi_install_action(msi_product_info, l_uninstall_entries)
+
+
+def get_msi_install_action(msi_product_info: MsiProductInfo, l_uninstall_entries: Sequence[lib_wine_versions.UninstallEntry]) -> str:
+    """ msiexec writes the Uninstall key of a package as {ProductCode}, with the ProductVersion as DisplayVersion
+
+    >>> msi_product_info = MsiProductInfo('{DE624609-C6B5-486A-9274-EF0B854F6BC5}', '4.9.4', 'Wine Mono', '')
+    >>> reg_key = lib_wine_versions.REG_KEY_UNINSTALL + '\\\\'
+    >>> get_msi_install_action(msi_product_info, [])
+    'install'
+    >>> get_msi_install_action(msi_product_info, [lib_wine_versions.UninstallEntry(reg_key + '{de624609-c6b5-486a-9274-ef0b854f6bc5}', 'Wine Mono', '4.9.4')])
+    'skip'
+    >>> get_msi_install_action(msi_product_info, [lib_wine_versions.UninstallEntry(reg_key + '{DE624609-C6B5-486A-9274-EF0B854F6BC5}', 'Wine Mono', '4.9.3')])
+    'reinstall'
+    >>> get_msi_install_action(msi_product_info, [lib_wine_versions.UninstallEntry(reg_key + '{E45D8920-A758-4088-B6C6-31DBB276992E}', 'Wine Mono', '4.7.5')])
+    'upgrade'
+
+    """
+    l_product_entries = [uninstall_entry for uninstall_entry in l_uninstall_entries
+                         if uninstall_entry.reg_key.rsplit('\\', 1)[-1].upper() == msi_product_info.product_code.upper()]
+    if l_product_entries:
+        if any(uninstall_entry.display_version == msi_product_info.product_version for uninstall_entry in l_product_entries):
+            return 'skip'
+        return 'reinstall'
+    if any(uninstall_entry.display_name == msi_product_info.product_name for uninstall_entry in l_uninstall_entries):
+        return 'upgrade'
+    return 'install'
+
+
+def get_msi_product_info(path_msi_file: pathlib.Path) -> MsiProductInfo:
+    """ ProductCode, ProductVersion, ProductName and UpgradeCode from the Property table of a msi file, without starting wine.
+    cached until the file changes, raises RuntimeError if the file is not a msi package
+    """
+    try:
+        stat_file = path_msi_file.stat()
+    except OSError:
+        raise RuntimeError('msi file "{msi_file}" not found'.format(msi_file=path_msi_file))
+    cache_key = (stat_file.st_mtime_ns, stat_file.st_size, stat_file.st_ino)
+    if str(path_msi_file) in _d_msi_product_info_cache and _d_msi_product_info_cache[str(path_msi_file)][0] == cache_key:
+        return _d_msi_product_info_cache[str(path_msi_file)][1]
+    try:
+        with open(str(path_msi_file), mode='rb') as msi_file:
+            d_properties = read_msi_properties(msi_file)
+    except (OSError, struct.error, ValueError, IndexError) as exc:
+        raise RuntimeError('can not parse msi file "{msi_file}" : {exc}'.format(msi_file=path_msi_file, exc=exc))
+    if 'ProductCode' not in d_properties:
+        raise RuntimeError('msi file "{msi_file}" has no ProductCode'.format(msi_file=path_msi_file))
+    msi_product_info = MsiProductInfo(product_code=d_properties['ProductCode'],
+                                      product_version=d_properties.get('ProductVersion', ''),
+                                      product_name=d_properties.get('ProductName', ''),
+                                      upgrade_code=d_properties.get('UpgradeCode', ''))
+    _d_msi_product_info_cache[str(path_msi_file)] = (cache_key, msi_product_info)
+    return msi_product_info
+
+
+def read_msi_properties(msi_file: BinaryIO) -> Dict[str, str]:
+    """ the Property table of a msi file. the table has two string columns (Property, Value), stored column by column
+    as indices into the string pool - 2 bytes per index, or 3 bytes if the string pool says so
+    """
+    d_streams = read_compound_file_streams(msi_file, [get_msi_stream_name(table_name, is_table=True)
+                                                      for table_name in ('_StringPool', '_StringData', 'Property')])
+    l_strings, string_index_size = parse_msi_string_pool(d_streams[get_msi_stream_name('_StringPool', is_table=True)],
+                                                         d_streams[get_msi_stream_name('_StringData', is_table=True)])
+    property_table = d_streams[get_msi_stream_name('Property', is_table=True)]
+    n_rows = len(property_table) // (2 * string_index_size)
+    d_properties = dict()   # type: Dict[str, str]
+    for row in range(n_rows):
+        property_index = int.from_bytes(property_table[row * string_index_size:(row + 1) * string_index_size], 'little')
+        value_offset = (n_rows + row) * string_index_size
+        value_index = int.from_bytes(property_table[value_offset:value_offset + string_index_size], 'little')
+        d_properties[l_strings[property_index]] = l_strings[value_index]
+    return d_properties
+
+
+def parse_msi_string_pool(string_pool: bytes, string_data: bytes) -> Tuple[List[str], int]:
+    """ returns the strings, index 0 is the empty string, and the size of a string index in the tables.
+    the pool starts with the codepage, then a (length, reference count) pair of words per string. strings over 64k have
+    a pair with length 0, followed by a pair with the low word of the length and the reference count, the high word is the first reference count
+
+    >>> parse_msi_string_pool(struct.pack('<8H', 1252, 0, 4, 1, 0, 0, 2, 1), b'TestOK')
+    (['', 'Test', '', 'OK'], 2)
+    >>> parse_msi_string_pool(struct.pack('<4H', 65001, 0x8000, 3, 1), 'ä1'.encode('utf-8'))
+    (['', 'ä1'], 3)
+
+    """
+    l_words = struct.unpack('<{n}H'.format(n=len(string_pool) // 2), string_pool[:len(string_pool) // 2 * 2])
+    codepage = l_words[0] | ((l_words[1] & 0x7FFF) << 16)
+    string_index_size = 3 if l_words[1] & 0x8000 else 2
+    encoding = get_encoding_from_codepage(codepage)
+    l_strings = ['']
+    offset = 0
+    index = 2
+    while index + 1 < len(l_words):
+        length, references = l_words[index], l_words[index + 1]
+        if length == 0 and references == 0:
+            l_strings.append('')
+            index = index + 2
+            continue
+        if length == 0:
+            length = (l_words[index + 3] << 16) + l_words[index + 2]
+            index = index + 4
+        else:
+            index = index + 2
+        l_strings.append(string_data[offset:offset + length].decode(encoding, errors='replace'))
+        offset = offset + length
+    return l_strings, string_index_size
+
+
+def get_encoding_from_codepage(codepage: int) -> str:
+    """
+    >>> get_encoding_from_codepage(65001)
+    'utf-8'
+    >>> get_encoding_from_codepage(0)
+    'cp1252'
+    >>> get_encoding_from_codepage(99999)
+    'latin-1'
+
+    """
+    if codepage == 65001:
+        return 'utf-8'
+    encoding = 'cp{codepage}'.format(codepage=codepage or 1252)
+    try:
+        ''.encode(encoding)
+    except LookupError:
+        return 'latin-1'
+    return encoding
+
+
+def get_msi_stream_name(name: str, is_table: bool = False) -> str:
+    """ msi packs two characters of the names of its streams into one character of the compound file directory,
+    a single character goes to 0x4800, other characters stay as they are, and the names of tables start with 0x4840
+
+    >>> [hex(ord(character)) for character in get_msi_stream_name('Property', is_table=True)]
+    ['0x4840', '0x4559', '0x44f2', '0x4568', '0x4737']
+    >>> get_msi_stream_name('a-b') == chr(0x4800 + 36) + '-' + chr(0x4800 + 37)
+    True
+
+    """
+    l_characters = [chr(0x4840)] if is_table else []
+    index = 0
+    while index < len(name):
+        value = MSI_STREAM_NAME_CHARACTERS.find(name[index])
+        if value < 0:
+            l_characters.append(name[index])
+            index = index + 1
+            continue
+        next_value = MSI_STREAM_NAME_CHARACTERS.find(name[index + 1]) if index + 1 < len(name) else -1
+        if next_value >= 0:
+            l_characters.append(chr(0x3800 + value + (next_value << 6)))
+            index = index + 2
+        else:
+            l_characters.append(chr(0x4800 + value))
+            index = index + 1
+    return ''.join(l_characters)
+
+
+def read_compound_file_streams(compound_file: BinaryIO, l_stream_names: Sequence[str]) -> Dict[str, bytes]:
+    """ read the named streams of the root storage of an OLE compound file, without reading the rest of the file -
+    the cabinets of a msi file can be large. raises ValueError if the file is not a compound file or a stream is missing
+    """
+    compound_file_header = read_compound_file_header(compound_file)
+    l_fat = read_compound_file_fat(compound_file, compound_file_header)
+    directory = read_compound_file_chain(compound_file, compound_file_header.sector_size, l_fat, compound_file_header.first_directory_sector)
+    l_entries = [parse_compound_file_entry(directory[offset:offset + 128]) for offset in range(0, len(directory) - 127, 128)]
+    d_root_streams = dict()     # type: Dict[str, CompoundFileEntry]
+    for entry in get_l_compound_file_children(l_entries, l_entries[0].child_id):
+        if entry.entry_type == COMPOUND_FILE_TYPE_STREAM:
+            d_root_streams[entry.name] = entry
+
+    l_mini_fat = list()         # type: List[int]
+    mini_stream = b''
+    d_streams = dict()          # type: Dict[str, bytes]
+    for stream_name in l_stream_names:
+        if stream_name not in d_root_streams:
+            raise ValueError('stream "{stream_name}" not found'.format(stream_name=stream_name.encode('unicode_escape').decode('ascii')))
+        entry = d_root_streams[stream_name]
+        if entry.size >= compound_file_header.mini_stream_cutoff:
+            data = read_compound_file_chain(compound_file, compound_file_header.sector_size, l_fat, entry.start_sector)
+        else:
+            if not mini_stream:
+                l_mini_fat = get_l_sector_numbers(read_compound_file_chain(compound_file, compound_file_header.sector_size, l_fat,
+                                                                           compound_file_header.first_mini_fat_sector))
+                mini_stream = read_compound_file_chain(compound_file, compound_file_header.sector_size, l_fat, l_entries[0].start_sector)
+            data = b''.join(mini_stream[sector * compound_file_header.mini_sector_size:(sector + 1) * compound_file_header.mini_sector_size]
+                            for sector in get_l_sector_chain(l_mini_fat, entry.start_sector))
+        d_streams[stream_name] = data[:entry.size]
+    return d_streams
+
+
+def read_compound_file_header(compound_file: BinaryIO) -> CompoundFileHeader:
+    compound_file.seek(0)
+    header = compound_file.read(512)
+    if len(header) < 512 or header[:8] != COMPOUND_FILE_SIGNATURE:
+        raise ValueError('not an OLE compound file')
+    sector_shift, mini_sector_shift = struct.unpack_from('<HH', header, 0x1E)
+    n_fat_sectors, first_directory_sector = struct.unpack_from('<II', header, 0x2C)
+    mini_stream_cutoff, first_mini_fat_sector, _, first_difat_sector, n_difat_sectors = struct.unpack_from('<IIIII', header, 0x38)
+    sector_size = 1 << sector_shift
+    l_fat_sectors = list(struct.unpack_from('<109I', header, 0x4C))
+    difat_sector = first_difat_sector
+    for _ in range(n_difat_sectors):
+        if difat_sector >= COMPOUND_FILE_END_OF_CHAIN:
+            break
+        l_difat = get_l_sector_numbers(read_compound_file_sector(compound_file, sector_size, difat_sector))
+        l_fat_sectors.extend(l_difat[:-1])
+        difat_sector = l_difat[-1]
+    return CompoundFileHeader(sector_size=sector_size, mini_sector_size=1 << mini_sector_shift, mini_stream_cutoff=mini_stream_cutoff,
+                              first_directory_sector=first_directory_sector, first_mini_fat_sector=first_mini_fat_sector,
+                              l_fat_sectors=l_fat_sectors[:n_fat_sectors])
+
+
+def read_compound_file_fat(compound_file: BinaryIO, compound_file_header: CompoundFileHeader) -> List[int]:
+    """ the file allocation table - the next sector of every sector """
+    return get_l_sector_numbers(b''.join(read_compound_file_sector(compound_file, compound_file_header.sector_size, fat_sector)
+                                         for fat_sector in compound_file_header.l_fat_sectors))
+
+
+def read_compound_file_chain(compound_file: BinaryIO, sector_size: int, l_fat: List[int], start_sector: int) -> bytes:
+    return b''.join(read_compound_file_sector(compound_file, sector_size, sector) for sector in get_l_sector_chain(l_fat, start_sector))
+
+
+def read_compound_file_sector(compound_file: BinaryIO, sector_size: int, sector: int) -> bytes:
+    """ the sectors start after the header, which takes one sector """
+    compound_file.seek((sector + 1) * sector_size)
+    return compound_file.read(sector_size)
+
+
+def get_l_sector_chain(l_fat: List[int], start_sector: int) -> List[int]:
+    """
+    >>> get_l_sector_chain([3, COMPOUND_FILE_END_OF_CHAIN, 1, 2], 0)
+    [0, 3, 2, 1]
+    >>> get_l_sector_chain([0], 0)
+    Traceback (most recent call last):
+        ...
+    ValueError: broken sector chain
+
+    """
+    l_sectors = list()  # type: List[int]
+    sector = start_sector
+    while sector < COMPOUND_FILE_END_OF_CHAIN:
+        if sector >= len(l_fat) or len(l_sectors) > len(l_fat):
+            raise ValueError('broken sector chain')
+        l_sectors.append(sector)
+        sector = l_fat[sector]
+    return l_sectors
+
+
+def get_l_sector_numbers(data: bytes) -> List[int]:
+    return list(struct.unpack('<{n}I'.format(n=len(data) // 4), data[:len(data) // 4 * 4]))
+
+
+def parse_compound_file_entry(entry: bytes) -> CompoundFileEntry:
+    name_size, entry_type = struct.unpack_from('<HB', entry, 0x40)
+    left_id, right_id, child_id = struct.unpack_from('<III', entry, 0x44)
+    start_sector, size = struct.unpack_from('<II', entry, 0x74)
+    name = entry[:max(name_size - 2, 0)].decode('utf-16-le', errors='surrogatepass')
+    return CompoundFileEntry(name=name, entry_type=entry_type, left_id=left_id, right_id=right_id, child_id=child_id, start_sector=start_sector, size=size)
+
+
+def get_l_compound_file_children(l_entries: List[CompoundFileEntry], entry_id: int) -> List[CompoundFileEntry]:
+    """ the children of a storage are a tree of siblings, starting at the child of the storage """
+    l_children = list()     # type: List[CompoundFileEntry]
+    l_entry_ids = [entry_id]
+    while l_entry_ids:
+        entry_id = l_entry_ids.pop()
+        if entry_id == COMPOUND_FILE_NO_STREAM or entry_id >= len(l_entries) or len(l_children) > len(l_entries):
+            continue
+        entry = l_entries[entry_id]
+        l_children.append(entry)
+        l_entry_ids.extend([entry.left_id, entry.right_id])
+    return l_children
+
+
+def get_msiexec_install_command(path_msi_file: Union[str, pathlib.Path], ui_level: str = '', properties: str = '') -> str:
+    """
+    >>> get_msiexec_install_command('/home/test/.cache/wine/wine-mono-4.9.4.msi', ui_level='quiet')
+    'msiexec /i "Z:\\\\home\\\\test\\\\.cache\\\\wine\\\\wine-mono-4.9.4.msi" /quiet'
+    >>> get_msiexec_install_command('/home/test/.cache/wine/wine_gecko-2.47-x86.msi')
+    'msiexec /i "Z:\\\\home\\\\test\\\\.cache\\\\wine\\\\wine_gecko-2.47-x86.msi"'
+    >>> get_msiexec_install_command('/a.msi', ui_level='passive', properties=MSI_REINSTALL_PROPERTIES)
+    'msiexec /i "Z:\\\\a.msi" REINSTALL=ALL REINSTALLMODE=vomus /passive'
+
+    """
+    command = 'msiexec /i "{msi_file}"'.format(msi_file=get_windows_path_from_linux_path(path_msi_file))
+    if properties:
+        command = command + ' ' + properties
+    if D_MSI_UI_LEVELS[ui_level]:
+        command = command + ' ' + D_MSI_UI_LEVELS[ui_level]
+    return command
+
+
+def get_windows_path_from_linux_path(path_linux: Union[str, pathlib.Path]) -> str:
+    """ the path on drive Z:, which is the root of the linux filesystem in every wine prefix
+
+    >>> get_windows_path_from_linux_path(pathlib.Path('/home/test/a.msi'))
+    'Z:\\\\home\\\\test\\\\a.msi'
+
+    """
+    return 'Z:' + str(pathlib.Path(path_linux).absolute()).replace('/', '\\')
@@ -0,0 +1,197 @@
+# ### STDLIB
+import configparser
+import io
+import os
+import pathlib
+import pwd
+from typing import List, Optional, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_cache                # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+    from . import install_wine_machine          # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_wine_machine                 # type: ignore # pragma: no cover
+
+
+# the drive letter of the wheel cache in the wine prefixes
+WHEEL_CACHE_DRIVE = 'w:'
+# the site-wide pip configuration of windows, relative to the wine prefix
+PIP_CONFIG_FILE = 'drive_c/ProgramData/pip/pip.ini'
+# the pip platform tags of the wine architectures
+D_WHEEL_PLATFORMS = {'win32': 'win32', 'win64': 'win_amd64'}
+# always in the wheel cache, so get-pip.py can bootstrap pip without network
+L_PIP_BOOTSTRAP_PACKAGES = ['pip', 'setuptools', 'wheel']
+
+
+def get_path_wheel_cache(username: str = configmagick_linux.get_current_username()) -> pathlib.Path:
+    """ the wheels are shared by all users in <node cache>/wheels if the node wine cache is configured, otherwise they are kept in ~/.cache/wine/wheels
+
+    >>> import os
+    >>> os.environ[lib_wine_cache.ENV_NODE_WINE_CACHE] = '/var/cache/configmagick_wine'
+    >>> get_path_wheel_cache(username='root')
+    PosixPath('/var/cache/configmagick_wine/wheels')
+    >>> os.environ[lib_wine_cache.ENV_NODE_WINE_CACHE] = ''
+
+    """
+    path_node_wine_cache = lib_wine_cache.get_path_node_wine_cache()
+    if path_node_wine_cache is not None:
+        return path_node_wine_cache / 'wheels'
+    return lib_wine.get_path_wine_cache_for_user(username=username) / 'wheels'
+
+
+def populate_wheel_cache(requirements_file: Union[str, pathlib.Path] = '',
+                         python_version: str = '3.8',
+                         wine_arch: str = 'win64',
+                         username: str = configmagick_linux.get_current_username(),
+                         quiet: bool = False) -> None:
+    """ download the windows wheels of a requirements file (and pip, setuptools, wheel) on the linux side, with the pip of the linux python.
+    only wheels can be downloaded for an other platform - a requirement without a windows wheel fails.
+    syntax: pip_cache populate --requirements_file=<file> [--python_version=3.8] [--wine_arch=win32|win64]
+
+    >>> populate_wheel_cache(python_version='3.8', wine_arch='win32', quiet=True)
+    >>> assert list(get_path_wheel_cache().glob('pip-*.whl'))
+
+    """
+    if wine_arch not in D_WHEEL_PLATFORMS:
+        raise RuntimeError('invalid wine_arch "{wine_arch}", valid are : {wine_archs}'.format(wine_arch=wine_arch, wine_archs=sorted(D_WHEEL_PLATFORMS)))
+    path_wheel_cache = create_wheel_cache(username=username)
+    lib_log_utils.banner_verbose('Populate the wheel cache "{path_wheel_cache}" for Python {python_version} {wine_arch}'
+                                 .format(path_wheel_cache=path_wheel_cache, python_version=python_version, wine_arch=wine_arch), quiet=quiet)
+    l_requirements = list(L_PIP_BOOTSTRAP_PACKAGES)
+    if requirements_file:
+        l_requirements.append('-r "{requirements_file}"'.format(requirements_file=pathlib.Path(requirements_file).resolve()))
+    command = get_pip_download_command(l_requirements, path_wheel_cache=path_wheel_cache, python_version=python_version, wine_arch=wine_arch)
+    if lib_wine_cache.is_node_wine_cache_enabled():
+        lib_shell.run_shell_command(command, shell=True, use_sudo=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    else:
+        lib_shell.run_shell_command(command, shell=True, run_as_user=username, pass_stdout_stderr_to_sys=True, quiet=quiet)
+    lib_log_utils.banner_success('Wheel cache "{path_wheel_cache}" populated'.format(path_wheel_cache=path_wheel_cache), quiet=quiet)
+
+
+def get_pip_download_command(l_requirements: List[str], path_wheel_cache: pathlib.Path, python_version: str, wine_arch: str) -> str:
+    """ wheels which are already in the cache are not downloaded again, pip finds them by --find-links
+
+    >>> get_pip_download_command(['pip', '-r "/r.txt"'], pathlib.Path('/w'), python_version='3.8.1', wine_arch='win64')
+    'python3 -m pip download --dest "/w" --find-links "/w" --only-binary=:all: --platform win_amd64 --python-version 38 --implementation cp pip -r "/r.txt"'
+
+    """
+    python_version_nodot = ''.join(python_version.split('.')[:2])
+    return ('python3 -m pip download --dest "{path_wheel_cache}" --find-links "{path_wheel_cache}" --only-binary=:all: '
+            '--platform {platform} --python-version {python_version} --implementation cp {requirements}'
+            .format(path_wheel_cache=path_wheel_cache, platform=D_WHEEL_PLATFORMS[wine_arch], python_version=python_version_nodot,
+                    requirements=' '.join(l_requirements)))
+
+
+def create_wheel_cache(username: str = configmagick_linux.get_current_username()) -> pathlib.Path:
+    path_wheel_cache = get_path_wheel_cache(username=username)
+    if lib_wine_cache.is_node_wine_cache_enabled():
+        lib_wine_cache.create_node_wine_cache_directory(path_wheel_cache)
+    else:
+        lib_wine.create_wine_cache_for_user(username=username)
+        if not path_wheel_cache.is_dir():
+            path_wheel_cache.mkdir(parents=True, exist_ok=True)
+            lib_wine.fix_permissions_winecache(username=username)
+    return path_wheel_cache
+
+
+def map_wheel_cache_into_prefix(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                                username: str = configmagick_linux.get_current_username(),
+                                no_index: Optional[bool] = None,
+                                quiet: bool = False) -> None:
+    """ map the wheel cache as drive W: into the prefix, and let pip of the prefix find its packages there, with the site-wide pip.ini.
+    with no_index pip does not ask pypi at all, so the packages install without network - but only packages from the wheel cache.
+    no_index=False removes the setting, by default an existing no-index and the other settings of an existing pip.ini are kept.
+    when root maps the cache for another user, the created files belong to the user.
+    syntax: pip_cache map --wine_prefix=<prefix> [--no_index]
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> map_wheel_cache_into_prefix(wine_prefix='wine_test_32', quiet=True)
+    >>> wine_prefix = lib_wine.get_and_check_wine_prefix('wine_test_32')
+    >>> assert (wine_prefix / 'dosdevices' / WHEEL_CACHE_DRIVE).resolve() == get_path_wheel_cache().resolve()
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix, username)
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('file', description='map "{path_wheel_cache}" to {drive}, write "{path_pip_config_file}"'
+                                    .format(path_wheel_cache=get_path_wheel_cache(username=username), drive=WHEEL_CACHE_DRIVE.upper(),
+                                            path_pip_config_file=wine_prefix / PIP_CONFIG_FILE), step_key='', expected_seconds=0.0)
+        return
+    path_wheel_cache = create_wheel_cache(username=username)
+    path_drive = wine_prefix / 'dosdevices' / WHEEL_CACHE_DRIVE
+    if path_drive.exists() and not path_drive.is_symlink():
+        raise RuntimeError('can not map the wheel cache, "{path_drive}" exists and is not a drive symlink'.format(path_drive=path_drive))
+    lib_wine_cache.replace_with_link(path_target=path_drive, path_link_to=path_wheel_cache, hardlink=False)
+    path_pip_config_file = wine_prefix / PIP_CONFIG_FILE
+    l_paths_created = [path_directory for path_directory in path_pip_config_file.parents if not path_directory.exists()]
+    path_pip_config_file.parent.mkdir(parents=True, exist_ok=True)
+    pip_config = ''
+    if path_pip_config_file.is_file():
+        pip_config = path_pip_config_file.read_text(encoding='utf-8', errors='replace')
+    with open(str(path_pip_config_file), mode='w', newline='') as pip_config_file:
+        pip_config_file.write(get_pip_config(pip_config=pip_config, no_index=no_index))
+    if os.geteuid() == 0:
+        user_entry = pwd.getpwnam(username)
+        os.lchown(str(path_drive), user_entry.pw_uid, user_entry.pw_gid)
+        for path_created in l_paths_created + [path_pip_config_file]:
+            os.chown(str(path_created), user_entry.pw_uid, user_entry.pw_gid)
+    lib_log_utils.log_verbose('Wheel cache "{path_wheel_cache}" mapped to {drive} on WINEPREFIX="{wine_prefix}"'
+                              .format(path_wheel_cache=path_wheel_cache, drive=WHEEL_CACHE_DRIVE.upper(), wine_prefix=wine_prefix), quiet=quiet)
+
+
+def get_pip_config(pip_config: str = '', no_index: Optional[bool] = None) -> str:
+    """ the existing pip config with the wheel cache added to find-links of [global], and no-index set, removed or kept (None)
+
+    >>> print(get_pip_config(no_index=True).replace('\\r', ''))
+    [global]
+    find-links = W:\\
+    no-index = true
+    <BLANKLINE>
+    >>> print(get_pip_config('[global]\\ntimeout = 60\\nfind-links = C:\\\\wheels\\nno-index = true\\n[install]\\nuser = false\\n').replace('\\r', ''))
+    [global]
+    timeout = 60
+    find-links = C:\\wheels W:\\
+    no-index = true
+    <BLANKLINE>
+    [install]
+    user = false
+    <BLANKLINE>
+    >>> print(get_pip_config('[global]\\nno-index = true\\n', no_index=False).replace('\\r', ''))
+    [global]
+    find-links = W:\\
+    <BLANKLINE>
+
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str    # type: ignore
+    config.read_string(pip_config)
+    if not config.has_section('global'):
+        config.add_section('global')
+    wheel_cache_link = '{drive}\\'.format(drive=WHEEL_CACHE_DRIVE.upper())
+    l_find_links = config.get('global', 'find-links', fallback='').split()
+    if wheel_cache_link not in l_find_links:
+        l_find_links.append(wheel_cache_link)
+    config.set('global', 'find-links', ' '.join(l_find_links))
+    if no_index:
+        config.set('global', 'no-index', 'true')
+    elif no_index is not None:
+        config.remove_option('global', 'no-index')
+    config_file = io.StringIO()
+    config.write(config_file)
+    return config_file.getvalue().strip('\n').replace('\n', '\r\n') + '\r\n'
@@ -0,0 +1,170 @@
+# ### STDLIB
+import contextlib
+import inspect
+import re
+import subprocess
+import sys
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+# ### OWN
+import configmagick_linux
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine_timings              # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine_timings                     # type: ignore # pragma: no cover
+
+
+# the shell commands which only read - they run also while planning, because the next steps depend on their output
+L_READ_ONLY_COMMAND_PATTERNS = [r'^strings ', r'^apt-cache ', r'^dpkg -l', r'^"[^"]*" --version$', r'^wine --version$']
+# the steps of those programs change the registry
+L_REGISTRY_STEP_KEYS = ['wine reg', 'wine regedit']
+
+# kind is 'command', 'download', 'registry', 'windows' or 'file'. expected_seconds is None if the step was never timed
+PlanStep = NamedTuple('PlanStep', [('kind', str), ('description', str), ('note', str), ('expected_seconds', Optional[float])])
+# what lib_shell.run_shell_command returns for a planned command, which did not run
+PlannedCommandResponse = NamedTuple('PlannedCommandResponse', [('returncode', int), ('stdout', str), ('stderr', str)])
+
+# the steps recorded while planning, see planned_execution
+_l_plan_steps = list()      # type: List[PlanStep]
+_d_plan_state = {'is_plan_mode': False}
+
+
+def run_plan(function: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+    """ run the function in plan mode and show the plan. if a step needs the result of a planned step, the plan stops there """
+    stop_reason = ''
+    with planned_execution() as l_plan_steps:
+        try:
+            function(*args, **kwargs)
+        except (RuntimeError, subprocess.CalledProcessError, OSError) as exc:
+            stop_reason = str(exc)
+    sys.stdout.write(get_plan_report(l_plan_steps, stop_reason=stop_reason))
+
+
+def is_plan_mode() -> bool:
+    return bool(_d_plan_state['is_plan_mode'])
+
+
+def add_plan_step(kind: str, description: str, step_key: str, note: str = '', expected_seconds: Optional[float] = None, wine_arch: str = '') -> None:
+    """ the expected duration comes from the recorded timings of the step on the wine arch, if not given """
+    if expected_seconds is None:
+        expected_seconds = lib_wine_timings.get_expected_step_seconds(step_key, username=configmagick_linux.get_current_username(), wine_arch=wine_arch)
+    _l_plan_steps.append(PlanStep(kind=kind, description=description, note=note, expected_seconds=expected_seconds))
+
+
+@contextlib.contextmanager
+def planned_execution() -> Iterator[List[PlanStep]]:
+    """ while active, lib_shell.run_shell_command records the commands as steps of the plan instead of running them - except read only queries.
+    downloads, registry writes, windows batches and file writes of the installers check is_plan_mode and record their steps too -
+    so do the indexes, reports, snapshots and mirror downloads of the maintenance commands
+    """
+    run_shell_command_original = lib_shell.run_shell_command
+
+    def run_shell_command_planned(command: str, *args: Any, **kwargs: Any) -> Any:
+        if is_read_only_command(command):
+            return run_shell_command_original(command, *args, **kwargs)
+        step_key = lib_wine_timings.get_step_key_from_command(command)
+        kind = 'registry' if step_key in L_REGISTRY_STEP_KEYS else 'command'
+        note = 'as user {username}'.format(username=kwargs['run_as_user']) if kwargs.get('run_as_user') else 'sudo' if kwargs.get('use_sudo') else ''
+        add_plan_step(kind, description=command, step_key=step_key, note=note, wine_arch=lib_wine_timings.get_wine_arch_from_command(command))
+        return PlannedCommandResponse(returncode=0, stdout='', stderr='')
+
+    del _l_plan_steps[:]
+    lib_shell.run_shell_command = run_shell_command_planned
+    _d_plan_state['is_plan_mode'] = True
+    try:
+        yield _l_plan_steps
+    finally:
+        lib_shell.run_shell_command = run_shell_command_original
+        _d_plan_state['is_plan_mode'] = False
+
+
+@contextlib.contextmanager
+def timed_execution(command_line: str = '') -> Iterator[None]:
+    """ while active, the duration of every shell command is recorded in the timing history, as one run of the command line -
+    those are the expected durations of the plans, see also lib_wine_timings.show_step_stats """
+    run_shell_command_original = lib_shell.run_shell_command
+
+    def run_shell_command_timed(command: str, *args: Any, **kwargs: Any) -> Any:
+        with lib_wine_timings.timed_step(lib_wine_timings.get_step_key_from_command(command), username=configmagick_linux.get_current_username(),
+                                         wine_arch=lib_wine_timings.get_wine_arch_from_command(command)):
+            return run_shell_command_original(command, *args, **kwargs)
+
+    lib_wine_timings.begin_timing_run(command_line)
+    lib_shell.run_shell_command = run_shell_command_timed
+    try:
+        yield
+    finally:
+        lib_shell.run_shell_command = run_shell_command_original
+
+
+def is_read_only_command(command: str) -> bool:
+    """
+    >>> is_read_only_command('strings -d --bytes=12 --encoding=s "/opt/wine-stable/lib/wine/appwiz.cpl.so" | fgrep "wine-mono-"')
+    True
+    >>> is_read_only_command('"/opt/wine-stable/bin/wine" --version')
+    True
+    >>> is_read_only_command('rm -Rf "/root/.wine"')
+    False
+
+    """
+    return any(re.match(pattern, command.strip()) for pattern in L_READ_ONLY_COMMAND_PATTERNS)
+
+
+def get_l_plan_arguments(l_arguments: Sequence[str], d_commands: Dict[str, Any]) -> List[str]:
+    """ the command line without '--plan'. commands which have a dry run get '--dry_run', so they report instead of changing things
+
+    >>> def gc(max_size_mb: float = 0, dry_run: bool = False) -> None: pass
+    >>> def install_git(wine_prefix: str = '') -> None: pass
+    >>> d_commands = {'install_git': install_git, 'cache': {'gc': gc}}
+    >>> get_l_plan_arguments(['cache', 'gc', '--plan', '--max_size_mb=10'], d_commands)
+    ['cache', 'gc', '--max_size_mb=10', '--dry_run']
+    >>> get_l_plan_arguments(['install_git', '--wine_prefix=wine_test_32', '--plan'], d_commands)
+    ['install_git', '--wine_prefix=wine_test_32']
+
+    """
+    l_plan_arguments = [argument for argument in l_arguments if argument != '--plan']
+    command = d_commands  # type: Any
+    for argument in l_plan_arguments:
+        if not isinstance(command, dict) or argument not in command:
+            break
+        command = command[argument]
+    if callable(command) and 'dry_run' in inspect.signature(command).parameters and '--dry_run' not in l_plan_arguments:
+        l_plan_arguments.append('--dry_run')
+    return l_plan_arguments
+
+
+def get_plan_report(l_plan_steps: Sequence[PlanStep], stop_reason: str = '') -> str:
+    """
+    >>> l_steps = [PlanStep('download', 'https://dl.winehq.org/wine/wine-mono/4.9.4/wine-mono-4.9.4.msi', 'cache miss', 12.5),
+    ...            PlanStep('windows', 'msiexec /i "Z:\\\\root\\\\.cache\\\\wine\\\\wine-mono-4.9.4.msi"', '', None)]
+    >>> print(get_plan_report(l_steps, stop_reason='can not install Mono'))
+    Plan :
+      1. download     12.5 s  https://dl.winehq.org/wine/wine-mono/4.9.4/wine-mono-4.9.4.msi (cache miss)
+      2. windows           ?  msiexec /i "Z:\\root\\.cache\\wine\\wine-mono-4.9.4.msi"
+    the plan stops here, the next steps depend on the results of the planned steps : can not install Mono
+    expected duration : 12.5 s, 1 of 2 steps never timed
+    <BLANKLINE>
+
+    """
+    l_lines = ['Plan :']
+    for index, plan_step in enumerate(l_plan_steps, start=1):
+        expected = '?' if plan_step.expected_seconds is None else '{seconds:.1f} s'.format(seconds=plan_step.expected_seconds)
+        note = ' ({note})'.format(note=plan_step.note) if plan_step.note else ''
+        l_lines.append('{index:>3}. {kind:<9} {expected:>9}  {description}{note}'
+                       .format(index=index, kind=plan_step.kind, expected=expected, description=plan_step.description, note=note))
+    if not l_plan_steps:
+        l_lines.append('  nothing to do')
+    if stop_reason:
+        l_lines.append('the plan stops here, the next steps depend on the results of the planned steps : {stop_reason}'.format(stop_reason=stop_reason))
+    expected_seconds = sum(plan_step.expected_seconds for plan_step in l_plan_steps if plan_step.expected_seconds is not None)
+    n_never_timed = len([plan_step for plan_step in l_plan_steps if plan_step.expected_seconds is None])
+    l_lines.append('expected duration : {seconds:.1f} s{never_timed}'
+                   .format(seconds=expected_seconds,
+                           never_timed=', {n} of {total} steps never timed'.format(n=n_never_timed, total=len(l_plan_steps)) if n_never_timed else ''))
+    return '\n'.join(l_lines) + '\n'
@@ -0,0 +1,1046 @@
+# ### STDLIB
+import collections
+import contextlib
+import errno
+import fcntl
+import json
+import os
+import pathlib
+import pwd
+import stat
+import subprocess
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+import lib_shell
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+    from . import install_wine_machine          # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_wine_machine                 # type: ignore # pragma: no cover
+
+
+# one desired registry value - reg_subkey is the value name like in lib_wine, '' is the default value
+RegistryEntry = NamedTuple('RegistryEntry', [('reg_key', str), ('reg_subkey', str), ('reg_data_type', str), ('reg_data', str)])
+
+# one applied change - old_reg_data_type and old_reg_data are None if the value did not exist before
+RegistryChange = NamedTuple('RegistryChange', [('reg_key', str), ('reg_subkey', str),
+                                               ('old_reg_data_type', Optional[str]), ('old_reg_data', Optional[str]),
+                                               ('reg_data_type', str), ('reg_data', str)])
+
+# a key section of a wine hive file - l_lines holds the raw lines (the [key] header first),
+# so keys we do not touch are written back byte-identical
+WineRegistryHiveKey = NamedTuple('WineRegistryHiveKey', [('name', str), ('l_lines', List[str])])
+
+# a parsed wine hive file (system.reg, user.reg, userdef.reg), d_keys maps the lowercase key name to the key section
+WineRegistryHive = NamedTuple('WineRegistryHive', [('l_header_lines', List[str]), ('d_keys', Dict[str, WineRegistryHiveKey])])
+
+
+D_REG_DATA_TYPES = {0x0: 'REG_NONE',
+                    0x1: 'REG_SZ',
+                    0x2: 'REG_EXPAND_SZ',
+                    0x3: 'REG_BINARY',
+                    0x4: 'REG_DWORD',
+                    0x5: 'REG_DWORD_BIG_ENDIAN',
+                    0x6: 'REG_LINK',
+                    0x7: 'REG_MULTI_SZ',
+                    0xb: 'REG_QWORD'}    # type: Dict[int, str]
+
+D_REG_ROOT_KEYS = {'HKLM': 'HKEY_LOCAL_MACHINE',
+                   'HKCU': 'HKEY_CURRENT_USER',
+                   'HKCR': 'HKEY_CLASSES_ROOT',
+                   'HKU': 'HKEY_USERS'}     # type: Dict[str, str]
+
+# the escape characters wine uses in the hive files for the control characters 0..31, '.' means octal escape
+WINE_REGISTRY_ESCAPES = '.......abtnvfr.............e....'
+# a running wineserver keeps the registry in memory and saves the hive files only from time to time and on exit -
+# before the hive files are read, a running wineserver is waited for that long to exit
+WINESERVER_EXIT_TIMEOUT_SECONDS = 60
+# a wineserver might start again between its exit and our lock, then we wait again
+WINESERVER_LOCK_ATTEMPTS = 3
+
+
+def reconcile_wine_registry(l_registry_entries: Sequence[Union[RegistryEntry, Tuple[str, str, str, str]]],
+                            wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                            username: str = configmagick_linux.get_current_username(),
+                            dry_run: bool = False,
+                            quiet: bool = False) -> List[RegistryChange]:
+    """ bring the registry of a wine prefix to the desired state with the minimum of writes
+
+    the current state is read in one pass directly from the hive files, only values which differ are written,
+    all of them in one batch directly into the hive files. A converged prefix costs no wine startup at all.
+    a running wineserver is waited for to exit first (it saves the hive files on exit), and its lock is held
+    from the read to the write - see offline_wine_registry_lock.
+
+    Parameter:
+        l_registry_entries: RegistryEntry or tuples (reg_key, reg_subkey, reg_data_type, reg_data)
+                            reg_data_type: 'auto' to keep the data type if the value already exists (otherwise 'REG_SZ'),
+                            or 'REG_SZ', 'REG_EXPAND_SZ', 'REG_MULTI_SZ', 'REG_DWORD', 'REG_QWORD', 'REG_BINARY'
+        dry_run:            only report the changes, dont write
+
+    Returns:
+        the list of changes which were applied (or would be applied on dry_run)
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> reg_key = 'HKEY_CURRENT_USER\\\\Software\\\\configmagick_wine_test'
+    >>> l_entries = [(reg_key, 'test_sz', 'REG_SZ', 'test'), (reg_key, 'test_dword', 'REG_DWORD', '0x1')]
+    >>> l_changes = reconcile_wine_registry(l_entries, wine_prefix='wine_test_32', quiet=True)
+    >>> assert reconcile_wine_registry(l_entries, wine_prefix='wine_test_32', quiet=True) == []
+    >>> assert lib_wine.get_wine_registry_data(reg_key=reg_key, reg_subkey='test_sz', wine_prefix='wine_test_32') == 'test'
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    l_desired_entries = [RegistryEntry(*registry_entry) for registry_entry in l_registry_entries]
+    with offline_wine_registry_lock(wine_prefix=wine_prefix, username=username):
+        d_hives = read_wine_registry_hives_for_keys([registry_entry.reg_key for registry_entry in l_desired_entries], wine_prefix=wine_prefix)
+
+        l_changes = list()      # type: List[RegistryChange]
+        for registry_entry in l_desired_entries:
+            hive_filename, relative_key = get_hive_filename_and_relative_key(registry_entry.reg_key)
+            current_value = get_wine_registry_hive_value(d_hives[hive_filename], relative_key, registry_entry.reg_subkey)
+            registry_change = get_registry_change(registry_entry=registry_entry, current_value=current_value)
+            if registry_change is not None:
+                l_changes.append(registry_change)
+
+        for registry_change in l_changes:
+            lib_log_utils.log_verbose('Registry {action}: WINEPREFIX="{wine_prefix}", key="{reg_key}", subkey="{reg_subkey}", '
+                                      'data_type="{reg_data_type}", data="{old_reg_data}" --> "{reg_data}"'
+                                      .format(action='change (dry run)' if dry_run else 'change',
+                                              wine_prefix=wine_prefix,
+                                              reg_key=registry_change.reg_key,
+                                              reg_subkey=registry_change.reg_subkey,
+                                              reg_data_type=registry_change.reg_data_type,
+                                              old_reg_data=registry_change.old_reg_data,
+                                              reg_data=registry_change.reg_data), quiet=quiet)
+
+        if l_changes and not dry_run:
+            l_changed_entries = [RegistryEntry(registry_change.reg_key, registry_change.reg_subkey, registry_change.reg_data_type, registry_change.reg_data)
+                                 for registry_change in l_changes]
+            write_wine_registry_hives_offline(l_changed_entries, wine_prefix=wine_prefix)
+    return l_changes
+
+
+def reconcile_wine_registry_from_file(desired_state_file: Union[str, pathlib.Path],
+                                      wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                                      username: str = configmagick_linux.get_current_username(),
+                                      dry_run: bool = False,
+                                      quiet: bool = False) -> None:
+    """reconcile the wine registry. syntax: reconcile_registry --desired_state_file=<file.json> --wine_prefix=<prefix> [--dry_run]
+
+    Args:
+        --desired_state_file=<file.json>    a json list of [reg_key, reg_subkey, reg_data_type, reg_data]
+        --dry_run                           only report the changes, dont write
+
+    """
+    with open(str(desired_state_file), mode='r') as desired_state:
+        l_registry_entries = json.load(desired_state)
+    l_changes = reconcile_wine_registry(l_registry_entries, wine_prefix=wine_prefix, username=username, dry_run=dry_run, quiet=quiet)
+    lib_log_utils.banner_success('Wine Registry reconciled, {n_changes} of {n_entries} values {changed}'
+                                 .format(n_changes=len(l_changes), n_entries=len(l_registry_entries),
+                                         changed='to change' if dry_run else 'changed'), quiet=quiet)
+
+
+def get_registry_change(registry_entry: RegistryEntry, current_value: Optional[Tuple[str, str]]) -> Optional[RegistryChange]:
+    """ compare the desired registry entry with the current (data_type, data), returns None if nothing needs to be changed
+
+    >>> entry = RegistryEntry('HKCU\\\\Software\\\\Test', 'test', 'auto', 'data')
+    >>> assert get_registry_change(entry, ('REG_EXPAND_SZ', 'data')) is None
+    >>> get_registry_change(entry, ('REG_EXPAND_SZ', 'old')).reg_data_type
+    'REG_EXPAND_SZ'
+    >>> get_registry_change(entry, None).reg_data_type
+    'REG_SZ'
+    >>> assert get_registry_change(RegistryEntry('HKCU\\\\Software\\\\Test', 'test', 'REG_DWORD', '16'), ('REG_DWORD', '0x10')) is None
+    >>> assert get_registry_change(RegistryEntry('HKCU\\\\Software\\\\Test', 'test', 'REG_SZ', '16'), ('REG_DWORD', '0x10')) is not None
+
+    """
+    reg_data_type = registry_entry.reg_data_type.strip().upper()
+    if reg_data_type == 'AUTO':
+        reg_data_type = current_value[0] if current_value is not None else 'REG_SZ'
+    reg_data = get_normalized_registry_data(reg_data_type, registry_entry.reg_data)
+
+    if current_value is not None:
+        current_data_type, current_data = current_value
+        if current_data_type == reg_data_type and get_normalized_registry_data(current_data_type, current_data) == reg_data:
+            return None
+        return RegistryChange(registry_entry.reg_key, registry_entry.reg_subkey, current_data_type, current_data, reg_data_type, reg_data)
+    return RegistryChange(registry_entry.reg_key, registry_entry.reg_subkey, None, None, reg_data_type, reg_data)
+
+
+def get_normalized_registry_data(reg_data_type: str, reg_data: str) -> str:
+    """ normalize the data the same way 'wine reg query' shows it, so desired and current data can be compared
+
+    >>> assert get_normalized_registry_data('REG_DWORD', '16') == '0x10'
+    >>> assert get_normalized_registry_data('REG_DWORD', '0x00000010') == '0x10'
+    >>> assert get_normalized_registry_data('REG_BINARY', '0a0B') == '0A0B'
+    >>> assert get_normalized_registry_data('REG_SZ', ' test ') == ' test '
+
+    """
+    reg_data = str(reg_data)
+    if reg_data_type in ('REG_DWORD', 'REG_QWORD', 'REG_DWORD_BIG_ENDIAN'):
+        return '0x{value:x}'.format(value=int(reg_data.strip(), 0))
+    if reg_data_type in ('REG_BINARY', 'REG_NONE') or reg_data_type.startswith('REG_UNKNOWN'):
+        return reg_data.strip().upper()
+    return reg_data
+
+
+def read_wine_registry_hives_for_keys(l_reg_keys: Sequence[str], wine_prefix: pathlib.Path) -> Dict[str, WineRegistryHive]:
+    """ read every hive file needed for the given registry keys exactly once """
+    d_hives = dict()   # type: Dict[str, WineRegistryHive]
+    for reg_key in l_reg_keys:
+        hive_filename = get_hive_filename_and_relative_key(reg_key)[0]
+        if hive_filename not in d_hives:
+            d_hives[hive_filename] = read_wine_registry_hive(get_and_check_path_wine_registry_hive(wine_prefix, hive_filename))
+    return d_hives
+
+
+def get_path_wine_registry_hive(wine_prefix: pathlib.Path, hive_filename: str) -> pathlib.Path:
+    """ get the path to a wine hive file like system.reg, user.reg, userdef.reg
+
+    >>> assert get_path_wine_registry_hive(pathlib.Path('/home/test/wine'), 'user.reg') == pathlib.Path('/home/test/wine/user.reg')
+
+    """
+    path_wine_registry_hive = pathlib.Path(wine_prefix) / hive_filename
+    return path_wine_registry_hive
+
+
+def get_and_check_path_wine_registry_hive(wine_prefix: pathlib.Path, hive_filename: str) -> pathlib.Path:
+    path_wine_registry_hive = get_path_wine_registry_hive(wine_prefix=wine_prefix, hive_filename=hive_filename)
+    if not path_wine_registry_hive.exists():
+        raise RuntimeError('can not find registry hive "{hive_filename}" for WINEPREFIX="{wine_prefix}"'
+                           .format(hive_filename=hive_filename, wine_prefix=wine_prefix))
+    return path_wine_registry_hive
+
+
+def get_hive_filename_and_relative_key(reg_key: str) -> Tuple[str, str]:
+    """ map a registry key to the wine hive file which holds it, and the key relative to the hive root
+
+    >>> get_hive_filename_and_relative_key('HKEY_LOCAL_MACHINE\\\\SYSTEM\\\\CurrentControlSet')
+    ('system.reg', 'SYSTEM\\\\CurrentControlSet')
+    >>> get_hive_filename_and_relative_key('HKCU\\\\Software\\\\Wine')
+    ('user.reg', 'Software\\\\Wine')
+    >>> get_hive_filename_and_relative_key('HKCR\\\\.txt')
+    ('system.reg', 'Software\\\\Classes\\\\.txt')
+    >>> get_hive_filename_and_relative_key('HKEY_USERS\\\\.Default\\\\Software')
+    ('userdef.reg', 'Software')
+    >>> get_hive_filename_and_relative_key('HKEY_UNKNOWN\\\\Software')  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
+    Traceback (most recent call last):
+        ...
+    RuntimeError: can not map registry key "HKEY_UNKNOWN\\Software" to a wine hive file
+
+    """
+    root_key, _, relative_key = reg_key.strip().strip('\\').partition('\\')
+    root_key = D_REG_ROOT_KEYS.get(root_key.upper(), root_key.upper())
+    if root_key == 'HKEY_LOCAL_MACHINE':
+        return 'system.reg', relative_key
+    if root_key == 'HKEY_CURRENT_USER':
+        return 'user.reg', relative_key
+    if root_key == 'HKEY_CLASSES_ROOT':
+        return 'system.reg', '\\'.join(['Software\\Classes', relative_key]).rstrip('\\')
+    if root_key == 'HKEY_USERS':
+        user_key, _, relative_key = relative_key.partition('\\')
+        if user_key.lower() == '.default':
+            return 'userdef.reg', relative_key
+    raise RuntimeError('can not map registry key "{reg_key}" to a wine hive file'.format(reg_key=reg_key))
+
+
+def get_reg_key_from_hive_filename_and_relative_key(hive_filename: str, relative_key: str) -> str:
+    """ the inverse of get_hive_filename_and_relative_key
+
+    >>> get_reg_key_from_hive_filename_and_relative_key('userdef.reg', 'Software\\\\Wine')
+    'HKEY_USERS\\\\.Default\\\\Software\\\\Wine'
+    >>> get_reg_key_from_hive_filename_and_relative_key('system.reg', '')
+    'HKEY_LOCAL_MACHINE'
+
+    """
+    d_hive_root_keys = {'system.reg': 'HKEY_LOCAL_MACHINE', 'user.reg': 'HKEY_CURRENT_USER', 'userdef.reg': 'HKEY_USERS\\.Default'}
+    if hive_filename not in d_hive_root_keys:
+        raise RuntimeError('unknown wine hive file "{hive_filename}"'.format(hive_filename=hive_filename))
+    return '\\'.join([d_hive_root_keys[hive_filename], relative_key.strip('\\')]).rstrip('\\')
+
+
+def get_reg_key_with_long_root_key(reg_key: str) -> str:
+    """ regedit files need the long names of the root keys
+
+    >>> get_reg_key_with_long_root_key('HKLM\\\\Software')
+    'HKEY_LOCAL_MACHINE\\\\Software'
+    >>> get_reg_key_with_long_root_key('HKEY_CURRENT_USER\\\\Software')
+    'HKEY_CURRENT_USER\\\\Software'
+
+    """
+    root_key, separator, relative_key = reg_key.strip().strip('\\').partition('\\')
+    root_key = D_REG_ROOT_KEYS.get(root_key.upper(), root_key.upper())
+    return root_key + separator + relative_key
+
+
+def read_wine_registry_hive(path_hive: pathlib.Path) -> WineRegistryHive:
+    with open(str(path_hive), mode='r', encoding='utf-8', errors='surrogateescape', newline='') as hive_file:
+        hive_content = hive_file.read()
+    return parse_wine_registry_hive(hive_content)
+
+
+def parse_wine_registry_hive(hive_content: str) -> WineRegistryHive:
+    """ split a wine hive file into the header and the key sections
+
+    >>> hive = parse_wine_registry_hive(HIVE_CONTENT_EXAMPLE)
+    >>> list(hive.d_keys)
+    ['software\\\\wine', 'system\\\\currentcontrolset\\\\control\\\\session manager\\\\environment']
+    >>> assert ''.join(hive.l_header_lines) + ''.join(''.join(key.l_lines) for key in hive.d_keys.values()) == HIVE_CONTENT_EXAMPLE
+
+    """
+    l_header_lines = list()                         # type: List[str]
+    d_keys = collections.OrderedDict()              # type: Dict[str, WineRegistryHiveKey]
+    l_current_lines = l_header_lines
+    for line in hive_content.splitlines(True):
+        if line.startswith('['):
+            key_name = get_key_name_from_hive_key_header(line)
+            hive_key = WineRegistryHiveKey(name=key_name, l_lines=[line])
+            d_keys[key_name.lower()] = hive_key
+            l_current_lines = hive_key.l_lines
+        else:
+            l_current_lines.append(line)
+    return WineRegistryHive(l_header_lines=l_header_lines, d_keys=d_keys)
+
+
+def get_key_name_from_hive_key_header(line: str) -> str:
+    """
+    >>> get_key_name_from_hive_key_header('[Software\\\\\\\\Wine\\\\\\\\Drivers] 1572355339\\n')
+    'Software\\\\Wine\\\\Drivers'
+
+    """
+    key_name, _ = parse_wine_registry_string(line, 1, ']')
+    return key_name
+
+
+def get_wine_registry_hive_value(hive: WineRegistryHive, relative_key: str, reg_subkey: str) -> Optional[Tuple[str, str]]:
+    """ get (data_type, data) of a value, or None if the key or value does not exist
+
+    >>> hive = parse_wine_registry_hive(HIVE_CONTENT_EXAMPLE)
+    >>> get_wine_registry_hive_value(hive, 'System\\\\CurrentControlSet\\\\Control\\\\Session Manager\\\\Environment', 'path')
+    ('REG_EXPAND_SZ', 'C:\\\\windows\\\\system32;C:\\\\windows')
+    >>> get_wine_registry_hive_value(hive, 'Software\\\\Wine', 'Version')
+    ('REG_SZ', 'win7')
+    >>> assert get_wine_registry_hive_value(hive, 'Software\\\\Wine', 'unknown') is None
+    >>> assert get_wine_registry_hive_value(hive, 'Software\\\\Unknown', 'Version') is None
+
+    """
+    hive_key = hive.d_keys.get(relative_key.strip('\\').lower())
+    if hive_key is None:
+        return None
+    d_values = get_wine_registry_hive_key_values(hive_key)
+    value = d_values.get(reg_subkey.lower())
+    if value is None:
+        return None
+    return value[1], value[2]
+
+
+def get_wine_registry_hive_key_values(hive_key: WineRegistryHiveKey) -> Dict[str, Tuple[str, str, str]]:
+    """ get the values of a key section as dict value_name.lower() : (value_name, data_type, data)
+
+    >>> hive = parse_wine_registry_hive(HIVE_CONTENT_EXAMPLE)
+    >>> d_values = get_wine_registry_hive_key_values(hive.d_keys['software\\\\wine'])
+    >>> d_values['binary']
+    ('Binary', 'REG_BINARY', '0102030405060708090A0B0C0D0E0F10')
+    >>> d_values['']
+    ('', 'REG_SZ', 'default')
+
+    """
+    d_values = collections.OrderedDict()    # type: Dict[str, Tuple[str, str, str]]
+    for logical_line in get_logical_lines(hive_key.l_lines[1:]):
+        if logical_line.startswith('"') or logical_line.startswith('@'):
+            value_name, reg_data_type, reg_data = parse_wine_registry_value_line(logical_line)
+            d_values[value_name.lower()] = (value_name, reg_data_type, reg_data)
+    return d_values
+
+
+def get_logical_lines(l_lines: Sequence[str]) -> List[str]:
+    """ join the continuation lines of long hex values, wine wraps them with a trailing backslash
+
+    >>> get_logical_lines(['"a"=hex:01,02,\\\\\\n', '  03,04\\n', '"b"=dword:00000001\\n'])
+    ['"a"=hex:01,02,03,04', '"b"=dword:00000001']
+
+    """
+    l_logical_lines = list()    # type: List[str]
+    logical_line = ''
+    for line in l_lines:
+        line = line.rstrip('\r\n')
+        if logical_line:
+            line = line.lstrip()
+        if line.endswith('\\') and not line.endswith('"'):
+            logical_line = logical_line + line[:-1]
+            continue
+        l_logical_lines.append(logical_line + line)
+        logical_line = ''
+    if logical_line:
+        l_logical_lines.append(logical_line)
+    return l_logical_lines
+
+
+def parse_wine_registry_value_line(line: str) -> Tuple[str, str, str]:
+    """ parse a value line of a wine hive file into (value_name, data_type, data)
+
+    >>> parse_wine_registry_value_line('"Test"="test\\\\\\\\path"')
+    ('Test', 'REG_SZ', 'test\\\\path')
+    >>> parse_wine_registry_value_line('@=dword:00000010')
+    ('', 'REG_DWORD', '0x10')
+
+    """
+    if line.startswith('@'):
+        value_name, pos = '', 1
+    else:
+        value_name, pos = parse_wine_registry_string(line, 1, '"')
+    if line[pos:pos + 1] != '=':
+        raise RuntimeError('invalid wine registry value line: "{line}"'.format(line=line))
+    reg_data_type, reg_data = parse_wine_registry_data(line[pos + 1:])
+    return value_name, reg_data_type, reg_data
+
+
+def parse_wine_registry_data(raw_data: str) -> Tuple[str, str]:
+    """ parse the data part of a wine hive value into (data_type, data), the data is formatted like 'wine reg query' shows it
+
+    >>> parse_wine_registry_data('"C:\\\\\\\\windows"')
+    ('REG_SZ', 'C:\\\\windows')
+    >>> parse_wine_registry_data('str(2):"%SystemRoot%"')
+    ('REG_EXPAND_SZ', '%SystemRoot%')
+    >>> parse_wine_registry_data('str(7):"a\\\\0b\\\\0"')
+    ('REG_MULTI_SZ', 'a\\\\0b')
+    >>> parse_wine_registry_data('dword:000000ff')
+    ('REG_DWORD', '0xff')
+    >>> parse_wine_registry_data('hex:de,ad')
+    ('REG_BINARY', 'DEAD')
+    >>> parse_wine_registry_data('hex(2):25,00,41,00,00,00')
+    ('REG_EXPAND_SZ', '%A')
+    >>> parse_wine_registry_data('hex(b):01,00,00,00,00,00,00,00')
+    ('REG_QWORD', '0x1')
+
+    """
+    raw_data = raw_data.strip()
+    if raw_data.startswith('"'):
+        return 'REG_SZ', parse_wine_registry_string(raw_data, 1, '"')[0]
+    if raw_data.startswith('str('):
+        s_type_number, _, raw_string = raw_data[4:].partition('):')
+        reg_data_type = get_reg_data_type_name(int(s_type_number, 16))
+        reg_data = parse_wine_registry_string(raw_string, 1, '"')[0]
+        if reg_data_type == 'REG_MULTI_SZ':
+            reg_data = reg_data.rstrip('\0').replace('\0', '\\0')
+        return reg_data_type, reg_data
+    if raw_data.startswith('dword:'):
+        return 'REG_DWORD', '0x{value:x}'.format(value=int(raw_data[6:], 16))
+    if raw_data.startswith('hex'):
+        s_type, _, raw_bytes = raw_data.partition(':')
+        type_number = int(s_type[4:-1], 16) if s_type.startswith('hex(') else 0x3
+        data_bytes = bytes(int(s_byte, 16) for s_byte in raw_bytes.replace(' ', '').split(',') if s_byte)
+        return get_reg_data_type_name(type_number), get_registry_data_from_bytes(type_number, data_bytes)
+    raise RuntimeError('invalid wine registry data: "{raw_data}"'.format(raw_data=raw_data))
+
+
+def get_reg_data_type_name(type_number: int) -> str:
+    """
+    >>> get_reg_data_type_name(2)
+    'REG_EXPAND_SZ'
+    >>> get_reg_data_type_name(0x20)
+    'REG_UNKNOWN_20'
+
+    """
+    return D_REG_DATA_TYPES.get(type_number, 'REG_UNKNOWN_{type_number:x}'.format(type_number=type_number))
+
+
+def get_reg_data_type_number(reg_data_type: str) -> int:
+    """
+    >>> get_reg_data_type_number('REG_MULTI_SZ')
+    7
+    >>> get_reg_data_type_number('REG_UNKNOWN_20')
+    32
+
+    """
+    for type_number, type_name in D_REG_DATA_TYPES.items():
+        if type_name == reg_data_type:
+            return type_number
+    if reg_data_type.startswith('REG_UNKNOWN_'):
+        return int(reg_data_type[12:], 16)
+    raise RuntimeError('invalid registry data type: "{reg_data_type}"'.format(reg_data_type=reg_data_type))
+
+
+def get_registry_data_from_bytes(type_number: int, data_bytes: bytes) -> str:
+    if type_number in (0x1, 0x2, 0x6):
+        return data_bytes.decode('utf-16-le', errors='replace').rstrip('\0')
+    if type_number == 0x7:
+        return data_bytes.decode('utf-16-le', errors='replace').rstrip('\0').replace('\0', '\\0')
+    if type_number in (0x4, 0xb) and data_bytes:
+        return '0x{value:x}'.format(value=int.from_bytes(data_bytes, byteorder='little'))
+    if type_number == 0x5 and data_bytes:
+        return '0x{value:x}'.format(value=int.from_bytes(data_bytes, byteorder='big'))
+    return ''.join('{data_byte:02X}'.format(data_byte=data_byte) for data_byte in data_bytes)
+
+
+def get_registry_bytes_from_data(reg_data_type: str, reg_data: str) -> bytes:
+    """ the inverse of get_registry_data_from_bytes
+
+    >>> get_registry_bytes_from_data('REG_EXPAND_SZ', '%A')
+    b'%\\x00A\\x00\\x00\\x00'
+    >>> get_registry_bytes_from_data('REG_MULTI_SZ', 'a\\\\0b')
+    b'a\\x00\\x00\\x00b\\x00\\x00\\x00\\x00\\x00'
+    >>> get_registry_bytes_from_data('REG_DWORD', '0x10')
+    b'\\x10\\x00\\x00\\x00'
+    >>> get_registry_bytes_from_data('REG_BINARY', 'DEAD')
+    b'\\xde\\xad'
+
+    """
+    if reg_data_type in ('REG_SZ', 'REG_EXPAND_SZ', 'REG_LINK'):
+        return (reg_data + '\0').encode('utf-16-le')
+    if reg_data_type == 'REG_MULTI_SZ':
+        return ('\0'.join(reg_data.split('\\0')) + '\0\0').encode('utf-16-le')
+    if reg_data_type == 'REG_DWORD':
+        return int(reg_data, 0).to_bytes(4, byteorder='little')
+    if reg_data_type == 'REG_DWORD_BIG_ENDIAN':
+        return int(reg_data, 0).to_bytes(4, byteorder='big')
+    if reg_data_type == 'REG_QWORD':
+        return int(reg_data, 0).to_bytes(8, byteorder='little')
+    return bytes.fromhex(reg_data)
+
+
+def parse_wine_registry_string(line: str, pos: int, delimiter: str) -> Tuple[str, int]:
+    """ unescape a string of a wine hive file, starting after the opening delimiter
+
+    Returns:
+        (unescaped string, position after the closing delimiter)
+
+    >>> parse_wine_registry_string('"a\\\\\\\\b\\\\"c"=', 1, '"')
+    ('a\\\\b"c', 9)
+    >>> parse_wine_registry_string('"\\\\x00e4\\\\0\\\\n"', 1, '"')
+    ('ä\\x00\\n', 12)
+
+    """
+    l_utf16_units = list()      # type: List[int]
+    length = len(line)
+    while pos < length and line[pos] != delimiter:
+        char = line[pos]
+        pos += 1
+        if char != '\\' or pos >= length:
+            l_utf16_units.extend(get_utf16_units(char))
+            continue
+        char = line[pos]
+        pos += 1
+        if char == 'x':
+            end_pos = pos
+            while end_pos < length and end_pos < pos + 4 and line[end_pos] in '0123456789abcdefABCDEF':
+                end_pos += 1
+            l_utf16_units.append(int(line[pos:end_pos], 16) if end_pos > pos else ord('x'))
+            pos = end_pos
+        elif char in '01234567':
+            end_pos = pos
+            while end_pos < length and end_pos < pos + 2 and line[end_pos] in '01234567':
+                end_pos += 1
+            l_utf16_units.append(int(line[pos - 1:end_pos], 8))
+            pos = end_pos
+        elif char in WINE_REGISTRY_ESCAPES.replace('.', ''):
+            l_utf16_units.append(WINE_REGISTRY_ESCAPES.index(char))
+        else:
+            l_utf16_units.extend(get_utf16_units(char))
+    unescaped = b''.join(unit.to_bytes(2, byteorder='little') for unit in l_utf16_units).decode('utf-16-le', errors='surrogatepass')
+    return unescaped, pos + 1
+
+
+def get_escaped_wine_registry_string(value: str, delimiters: str = '"') -> str:
+    """ escape a string the way wine writes it into the hive files, delimiters are the characters to escape additionally to the backslash
+
+    >>> get_escaped_wine_registry_string('C:\\\\windows "x"')
+    'C:\\\\\\\\windows \\\\"x\\\\"'
+    >>> get_escaped_wine_registry_string('ä\\x00\\n1')
+    '\\\\xe4\\\\0\\\\n1'
+    >>> get_escaped_wine_registry_string('ä1')
+    '\\\\x00e41'
+    >>> s_test = 'a\\\\b"c\\x00äß\\t\\x1b\\x01'
+    >>> assert parse_wine_registry_string(get_escaped_wine_registry_string(s_test) + '"', 0, '"')[0] == s_test
+
+    """
+    l_units = get_utf16_units(value)
+    l_escaped = list()      # type: List[str]
+    for index, unit in enumerate(l_units):
+        next_char = chr(l_units[index + 1]) if index + 1 < len(l_units) and l_units[index + 1] < 128 else ''
+        if unit > 127:
+            if next_char and next_char in '0123456789abcdefABCDEF':
+                l_escaped.append('\\x{unit:04x}'.format(unit=unit))
+            else:
+                l_escaped.append('\\x{unit:x}'.format(unit=unit))
+        elif unit < 32:
+            if WINE_REGISTRY_ESCAPES[unit] != '.':
+                l_escaped.append('\\' + WINE_REGISTRY_ESCAPES[unit])
+            elif next_char and next_char in '01234567':
+                l_escaped.append('\\{unit:03o}'.format(unit=unit))
+            else:
+                l_escaped.append('\\{unit:o}'.format(unit=unit))
+        else:
+            char = chr(unit)
+            if char == '\\' or char in delimiters:
+                l_escaped.append('\\')
+            l_escaped.append(char)
+    return ''.join(l_escaped)
+
+
+def get_utf16_units(value: str) -> List[int]:
+    """ wine works with utf-16 code units, characters outside the BMP are surrogate pairs
+
+    >>> get_utf16_units('a\\U0001F600')
+    [97, 55357, 56832]
+
+    """
+    data_bytes = value.encode('utf-16-le', errors='surrogatepass')
+    return [int.from_bytes(data_bytes[pos:pos + 2], byteorder='little') for pos in range(0, len(data_bytes), 2)]
+
+
+def get_reg_file_content(l_registry_entries: Sequence[RegistryEntry]) -> str:
+    """ get the content of a regedit file which sets all the entries, the keys in the order of their first appearance
+
+    >>> print(get_reg_file_content([RegistryEntry('HKCU\\\\Software\\\\Test', 'a', 'REG_SZ', 'C:\\\\x'),
+    ...                             RegistryEntry('HKCU\\\\Software\\\\Test', '', 'REG_DWORD', '1')]).replace('\\r', ''))
+    Windows Registry Editor Version 5.00
+    <BLANKLINE>
+    [HKEY_CURRENT_USER\\Software\\Test]
+    "a"="C:\\\\x"
+    @=dword:00000001
+    <BLANKLINE>
+    <BLANKLINE>
+
+    """
+    d_keys = collections.OrderedDict()   # type: Dict[str, List[RegistryEntry]]
+    for registry_entry in l_registry_entries:
+        reg_key = get_reg_key_with_long_root_key(registry_entry.reg_key)
+        d_keys.setdefault(reg_key.lower(), list()).append(registry_entry._replace(reg_key=reg_key))
+
+    l_lines = ['Windows Registry Editor Version 5.00', '']
+    for l_key_entries in d_keys.values():
+        l_lines.append('[{reg_key}]'.format(reg_key=l_key_entries[0].reg_key))
+        for registry_entry in l_key_entries:
+            l_lines.append(get_reg_file_value_line(registry_entry))
+        l_lines.append('')
+    return '\r\n'.join(l_lines) + '\r\n'
+
+
+def get_reg_file_value_line(registry_entry: RegistryEntry) -> str:
+    """ format a value line for a regedit file
+
+    >>> get_reg_file_value_line(RegistryEntry('HKCU\\\\Software', 'Path', 'REG_EXPAND_SZ', '%A'))
+    '"Path"=hex(2):25,00,41,00,00,00'
+    >>> get_reg_file_value_line(RegistryEntry('HKCU\\\\Software', 'x', 'REG_QWORD', '1'))
+    '"x"=hex(b):01,00,00,00,00,00,00,00'
+    >>> get_reg_file_value_line(RegistryEntry('HKCU\\\\Software', 'x', 'REG_BINARY', '0102'))
+    '"x"=hex:01,02'
+
+    """
+    if registry_entry.reg_subkey:
+        value_name = '"{reg_subkey}"'.format(reg_subkey=registry_entry.reg_subkey.replace('\\', '\\\\').replace('"', '\\"'))
+    else:
+        value_name = '@'
+    reg_data_type = registry_entry.reg_data_type
+    if reg_data_type == 'REG_SZ':
+        reg_data = '"{reg_data}"'.format(reg_data=registry_entry.reg_data.replace('\\', '\\\\').replace('"', '\\"'))
+    elif reg_data_type == 'REG_DWORD':
+        reg_data = 'dword:{value:08x}'.format(value=int(registry_entry.reg_data, 0))
+    else:
+        data_bytes = get_registry_bytes_from_data(reg_data_type, registry_entry.reg_data)
+        s_bytes = ','.join('{data_byte:02x}'.format(data_byte=data_byte) for data_byte in data_bytes)
+        if reg_data_type == 'REG_BINARY':
+            reg_data = 'hex:' + s_bytes
+        else:
+            reg_data = 'hex({type_number:x}):'.format(type_number=get_reg_data_type_number(reg_data_type)) + s_bytes
+    return '{value_name}={reg_data}'.format(value_name=value_name, reg_data=reg_data)
+
+
+def import_wine_registry_entries(l_registry_entries: Sequence[RegistryEntry],
+                                 wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                                 username: str = configmagick_linux.get_current_username()) -> None:
+    """ write all registry entries with one single 'wine reg import', instead of one 'wine reg add' per value """
+    if lib_wine_plan.is_plan_mode():
+        add_registry_entries_to_plan(l_registry_entries, note="'wine reg import'")
+        return
+    import_wine_reg_file_content(get_reg_file_content(l_registry_entries), wine_prefix=wine_prefix, username=username)
+
+
+def import_wine_reg_file_content(reg_file_content: str,
+                                 wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                                 username: str = configmagick_linux.get_current_username()) -> None:
+    """ import the content of a regedit file with one single 'wine reg import' """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
+    reg_filename = 'configmagick_wine_{pid}.reg'.format(pid=os.getpid())
+    path_reg_file = wine_prefix / 'drive_c/windows/temp' / reg_filename
+    path_reg_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(path_reg_file), mode='wb') as reg_file:
+        reg_file.write(('\ufeff' + reg_file_content).encode('utf-16-le'))
+    try:
+        is_wineserver_running_before = is_wineserver_running(wine_prefix=wine_prefix, username=username)
+        command = 'WINEPREFIX="{wine_prefix}" WINEARCH="{wine_arch}" wine reg import "C:\\windows\\temp\\{reg_filename}"'\
+                  .format(wine_prefix=wine_prefix, wine_arch=wine_arch, reg_filename=reg_filename)
+        lib_shell.run_shell_command(command, quiet=True, shell=True, run_as_user=username)
+        if not is_wineserver_running_before:
+            # wait for the wineserver we started to exit - it saves the hive files on exit, so the next read from the hive files is up to date
+            lib_shell.run_shell_command('WINEPREFIX="{wine_prefix}" wineserver -w'.format(wine_prefix=wine_prefix),
+                                        quiet=True, shell=True, run_as_user=username)
+    except subprocess.CalledProcessError:
+        raise RuntimeError('can not import Wine Registry, WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix))
+    finally:
+        if path_reg_file.exists():
+            path_reg_file.unlink()
+
+
+def write_wine_registry_entries(l_registry_entries: Sequence[RegistryEntry],
+                                wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                                username: str = configmagick_linux.get_current_username()) -> None:
+    """ write all registry entries in one batch - directly into the hive files if no wineserver is running on the prefix,
+    otherwise with one single 'wine reg import'
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> reg_key = 'HKEY_CURRENT_USER\\\\Software\\\\configmagick_wine_test'
+    >>> write_wine_registry_entries([RegistryEntry(reg_key, 'test_batch', 'REG_SZ', 'batch')], wine_prefix='wine_test_64')
+    >>> assert lib_wine.get_wine_registry_data(reg_key=reg_key, reg_subkey='test_batch', wine_prefix='wine_test_64') == 'batch'
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    with wineserver_lock(wine_prefix=wine_prefix, username=username) as is_wineserver_locked:
+        if is_wineserver_locked:
+            write_wine_registry_hives_offline(l_registry_entries, wine_prefix=wine_prefix)
+            return
+    import_wine_registry_entries(l_registry_entries, wine_prefix=wine_prefix, username=username)
+
+
+def write_wine_registry_hives_offline(l_registry_entries: Sequence[RegistryEntry], wine_prefix: pathlib.Path) -> None:
+    """ set the values in the hive files - the caller must hold the wineserver lock """
+    if lib_wine_plan.is_plan_mode():
+        add_registry_entries_to_plan(l_registry_entries, note='offline, into the hive files')
+        return
+    timestamp = time.time()
+    d_hives = read_wine_registry_hives_for_keys([registry_entry.reg_key for registry_entry in l_registry_entries], wine_prefix=wine_prefix)
+    for registry_entry in l_registry_entries:
+        hive_filename, relative_key = get_hive_filename_and_relative_key(registry_entry.reg_key)
+        set_wine_registry_hive_value(d_hives[hive_filename], relative_key, registry_entry.reg_subkey, registry_entry.reg_data_type,
+                                     registry_entry.reg_data, timestamp=timestamp)
+    for hive_filename, hive in d_hives.items():
+        write_wine_registry_hive(get_path_wine_registry_hive(wine_prefix, hive_filename), hive)
+
+
+def add_registry_entries_to_plan(l_registry_entries: Sequence[RegistryEntry], note: str) -> None:
+    for registry_entry in l_registry_entries:
+        lib_wine_plan.add_plan_step('registry', description='{reg_key}\\{reg_subkey} = {reg_data_type}:{reg_data}'
+                                    .format(reg_key=registry_entry.reg_key, reg_subkey=registry_entry.reg_subkey,
+                                            reg_data_type=registry_entry.reg_data_type, reg_data=registry_entry.reg_data),
+                                    step_key='', note=note, expected_seconds=0.0)
+
+
+def write_wine_registry_hive(path_hive: pathlib.Path, hive: WineRegistryHive) -> None:
+    """ replace the hive file atomically - the new file gets the mode and owner of the old file """
+    stat_hive = path_hive.stat()
+    path_hive_tmp = path_hive.parent / '.{hive_filename}.configmagick_wine.tmp'.format(hive_filename=path_hive.name)
+    try:
+        with open(str(path_hive_tmp), mode='w', encoding='utf-8', errors='surrogateescape', newline='') as hive_file:
+            hive_file.write(get_wine_registry_hive_content(hive))
+            hive_file.flush()
+            os.fsync(hive_file.fileno())
+        os.chmod(str(path_hive_tmp), stat.S_IMODE(stat_hive.st_mode))
+        if (os.geteuid() == 0) and ((stat_hive.st_uid, stat_hive.st_gid) != (os.geteuid(), os.getegid())):
+            os.chown(str(path_hive_tmp), stat_hive.st_uid, stat_hive.st_gid)
+        os.replace(str(path_hive_tmp), str(path_hive))
+    finally:
+        if path_hive_tmp.exists():
+            path_hive_tmp.unlink()
+
+
+def get_wine_registry_hive_content(hive: WineRegistryHive) -> str:
+    """
+    >>> hive = parse_wine_registry_hive(HIVE_CONTENT_EXAMPLE)
+    >>> assert get_wine_registry_hive_content(hive) == HIVE_CONTENT_EXAMPLE
+
+    """
+    l_lines = list(hive.l_header_lines)
+    for hive_key in hive.d_keys.values():
+        l_lines.extend(hive_key.l_lines)
+    return ''.join(l_lines)
+
+
+def set_wine_registry_hive_value(hive: WineRegistryHive, relative_key: str, reg_subkey: str, reg_data_type: str, reg_data: str,
+                                 timestamp: Optional[float] = None) -> None:
+    """ set a value in the parsed hive, lines of other values and keys stay untouched.
+    the modification time of the key is set, like wine does.
+
+    >>> hive = parse_wine_registry_hive(HIVE_CONTENT_EXAMPLE)
+    >>> set_wine_registry_hive_value(hive, 'Software\\\\Wine', 'Version', 'REG_SZ', 'win10', timestamp=1572355400)
+    >>> set_wine_registry_hive_value(hive, 'Software\\\\Wine', 'Binary', 'REG_DWORD', '1', timestamp=1572355400)
+    >>> set_wine_registry_hive_value(hive, 'Software\\\\Wine', 'New', 'REG_MULTI_SZ', 'a\\\\0b', timestamp=1572355400)
+    >>> set_wine_registry_hive_value(hive, 'Software\\\\Wine\\\\New[1]', '', 'REG_EXPAND_SZ', '%PATH%', timestamp=1572355400)
+    >>> print(get_wine_registry_hive_content(hive))
+    WINE REGISTRY Version 2
+    ;; All keys relative to \\\\Machine
+    <BLANKLINE>
+    #arch=win32
+    <BLANKLINE>
+    [Software\\\\Wine] 1572355400
+    #time=1d58e5c08055400
+    @="default"
+    "Binary"=dword:00000001
+    "Version"="win10"
+    "New"=str(7):"a\\0b\\0"
+    <BLANKLINE>
+    [System\\\\CurrentControlSet\\\\Control\\\\Session Manager\\\\Environment] 1572355339
+    #time=1d58fd7b6d3c8b2
+    "PATH"=str(2):"C:\\\\windows\\\\system32;C:\\\\windows"
+    "windir"=str(2):"C:\\\\windows"
+    <BLANKLINE>
+    [Software\\\\Wine\\\\New\\[1\\]] 1572355400
+    #time=1d58e5c08055400
+    @=str(2):"%PATH%"
+    <BLANKLINE>
+    <BLANKLINE>
+    >>> assert get_wine_registry_hive_value(hive, 'Software\\\\Wine', 'Binary') == ('REG_DWORD', '0x1')
+    >>> assert get_wine_registry_hive_value(hive, 'Software\\\\Wine\\\\New[1]', '') == ('REG_EXPAND_SZ', '%PATH%')
+
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    l_value_lines = get_wine_registry_hive_value_lines(reg_subkey=reg_subkey, reg_data_type=reg_data_type, reg_data=reg_data)
+    relative_key = relative_key.strip('\\')
+    hive_key = hive.d_keys.get(relative_key.lower())
+    if hive_key is None:
+        if hive.d_keys:
+            l_last_lines = list(hive.d_keys.values())[-1].l_lines
+            if l_last_lines[-1].strip():
+                l_last_lines.append('\n')
+        # in the key header the key parts are separated by an escaped backslash
+        l_escaped_key_parts = [get_escaped_wine_registry_string(key_part, delimiters='[]') for key_part in relative_key.split('\\')]
+        key_header = '[{key_name}] 0\n'.format(key_name='\\\\'.join(l_escaped_key_parts))
+        hive_key = WineRegistryHiveKey(name=relative_key, l_lines=[key_header, '#time=0\n', '\n'])
+        hive.d_keys[relative_key.lower()] = hive_key
+
+    l_lines = hive_key.l_lines
+    start_index, end_index = get_wine_registry_hive_value_line_range(hive_key, reg_subkey)
+    if start_index == end_index:
+        # a new value goes after the last value, before the blank line which ends the key section
+        while start_index > 1 and not l_lines[start_index - 1].strip():
+            start_index -= 1
+        end_index = start_index
+    l_lines[start_index:end_index] = l_value_lines
+    set_wine_registry_hive_key_timestamp(hive_key, timestamp)
+
+
+def get_wine_registry_hive_value_line_range(hive_key: WineRegistryHiveKey, reg_subkey: str) -> Tuple[int, int]:
+    """ get the range of the raw lines of a value (long hex values span more lines), or (len(l_lines), len(l_lines)) if not found
+
+    >>> hive = parse_wine_registry_hive(HIVE_CONTENT_EXAMPLE)
+    >>> get_wine_registry_hive_value_line_range(hive.d_keys['software\\\\wine'], 'binary')
+    (3, 5)
+    >>> get_wine_registry_hive_value_line_range(hive.d_keys['software\\\\wine'], 'unknown')
+    (7, 7)
+
+    """
+    l_lines = hive_key.l_lines
+    index = 1
+    while index < len(l_lines):
+        start_index = index
+        while l_lines[index].rstrip('\r\n').endswith('\\') and not l_lines[index].rstrip('\r\n').endswith('"') and index + 1 < len(l_lines):
+            index += 1
+        index += 1
+        line = l_lines[start_index]
+        if line.startswith('@') and not reg_subkey:
+            return start_index, index
+        if line.startswith('"') and parse_wine_registry_string(line, 1, '"')[0].lower() == reg_subkey.lower():
+            return start_index, index
+    return len(l_lines), len(l_lines)
+
+
+def set_wine_registry_hive_key_timestamp(hive_key: WineRegistryHiveKey, timestamp: float) -> None:
+    """ the key header holds the modification time in seconds since 1970, the #time line as windows FILETIME
+
+    >>> hive_key = WineRegistryHiveKey(name='Software', l_lines=['[Software] 1\\n', '#time=1\\n', '"a"="b"\\n'])
+    >>> set_wine_registry_hive_key_timestamp(hive_key, 1572355400.5)
+    >>> hive_key.l_lines
+    ['[Software] 1572355400\\n', '#time=1d58e5c08519f40\\n', '"a"="b"\\n']
+
+    """
+    l_lines = hive_key.l_lines
+    l_lines[0] = '{key_header}] {timestamp}\n'.format(key_header=l_lines[0].rsplit(']', 1)[0], timestamp=int(timestamp))
+    for index, line in enumerate(l_lines):
+        if line.startswith('#time='):
+            filetime = int((timestamp + 11644473600) * 10000000)
+            l_lines[index] = '#time={filetime:x}\n'.format(filetime=filetime)
+            break
+
+
+def get_wine_registry_hive_value_lines(reg_subkey: str, reg_data_type: str, reg_data: str) -> List[str]:
+    """ format a value the way wine writes it into the hive files, long hex values are wrapped like wine does
+
+    >>> get_wine_registry_hive_value_lines('Path', 'REG_EXPAND_SZ', 'C:\\\\windows')
+    ['"Path"=str(2):"C:\\\\\\\\windows"\\n']
+    >>> get_wine_registry_hive_value_lines('', 'REG_SZ', 'x')
+    ['@="x"\\n']
+    >>> get_wine_registry_hive_value_lines('Big', 'REG_BINARY', '00' * 30)  # doctest: +NORMALIZE_WHITESPACE
+    ['"Big"=hex:00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,00,\\\\\\n',
+     '  00,00,00,00,00,00,00\\n']
+
+    """
+    if reg_subkey:
+        value_name = '"{reg_subkey}"'.format(reg_subkey=get_escaped_wine_registry_string(reg_subkey))
+    else:
+        value_name = '@'
+    reg_data = get_normalized_registry_data(reg_data_type, reg_data)
+    if reg_data_type == 'REG_SZ':
+        return ['{value_name}="{reg_data}"\n'.format(value_name=value_name, reg_data=get_escaped_wine_registry_string(reg_data))]
+    if reg_data_type in ('REG_EXPAND_SZ', 'REG_MULTI_SZ'):
+        # wine writes the string without the terminating zero
+        reg_string = get_registry_bytes_from_data(reg_data_type, reg_data).decode('utf-16-le', errors='surrogatepass')[:-1]
+        return ['{value_name}=str({type_number:x}):"{reg_data}"\n'
+                .format(value_name=value_name, type_number=get_reg_data_type_number(reg_data_type), reg_data=get_escaped_wine_registry_string(reg_string))]
+    if reg_data_type == 'REG_DWORD':
+        return ['{value_name}=dword:{value:08x}\n'.format(value_name=value_name, value=int(reg_data, 0))]
+
+    data_bytes = get_registry_bytes_from_data(reg_data_type, reg_data)
+    if reg_data_type == 'REG_BINARY':
+        line = '{value_name}=hex:'.format(value_name=value_name)
+    else:
+        line = '{value_name}=hex({type_number:x}):'.format(value_name=value_name, type_number=get_reg_data_type_number(reg_data_type))
+    l_lines = list()    # type: List[str]
+    count = len(line)
+    for index, data_byte in enumerate(data_bytes):
+        line += '{data_byte:02x}'.format(data_byte=data_byte)
+        count += 2
+        if index < len(data_bytes) - 1:
+            line += ','
+            count += 1
+            if count > 76:
+                l_lines.append(line + '\\\n')
+                line = '  '
+                count = 2
+    l_lines.append(line + '\n')
+    return l_lines
+
+
+@contextlib.contextmanager
+def wineserver_lock(wine_prefix: pathlib.Path, username: str) -> Iterator[bool]:
+    """ take the lock a wineserver holds while it is running on the prefix.
+    yields True if we got the lock - no wineserver is running, and none can start until the lock is released,
+    yields False if a wineserver is running on the prefix
+
+    the server directory is created the way wine creates it (mode 0700, owned by the user), so a wineserver
+    started later can use it.
+    """
+    path_wineserver_directory = get_path_wineserver_directory(wine_prefix=wine_prefix, username=username)
+    user_entry = pwd.getpwnam(username)
+    for path_directory in (path_wineserver_directory.parent, path_wineserver_directory):
+        if not path_directory.is_dir():
+            path_directory.mkdir(mode=0o700, exist_ok=True)
+            if os.geteuid() == 0:
+                os.chown(str(path_directory), user_entry.pw_uid, user_entry.pw_gid)
+    path_lock_file = path_wineserver_directory / 'lock'
+    lock_file_descriptor = os.open(str(path_lock_file), os.O_CREAT | os.O_WRONLY, 0o600)
+    try:
+        if os.geteuid() == 0:
+            os.fchown(lock_file_descriptor, user_entry.pw_uid, user_entry.pw_gid)
+        try:
+            fcntl.lockf(lock_file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as exc:
+            if exc.errno in (errno.EACCES, errno.EAGAIN):
+                yield False
+                return
+            raise
+        try:
+            yield True
+        finally:
+            fcntl.lockf(lock_file_descriptor, fcntl.LOCK_UN)
+    finally:
+        os.close(lock_file_descriptor)
+
+
+@contextlib.contextmanager
+def offline_wine_registry_lock(wine_prefix: pathlib.Path, username: str, timeout: int = WINESERVER_EXIT_TIMEOUT_SECONDS) -> Iterator[None]:
+    """ the hive files are up to date only while no wineserver runs on the prefix. a running wineserver is waited for to exit
+    (it saves the hive files on exit), then its lock is held - no wineserver can start and change the registry until the lock is released.
+    read, compare and write the hive files within that lock, so nothing changes between the read and the write.
+
+    raises RuntimeError if the wineserver does not exit within the timeout, like while a windows program is running on the prefix.
+    while planning, a running wineserver is not waited for - the writes are only planned anyway
+    """
+    for _ in range(WINESERVER_LOCK_ATTEMPTS):
+        with wineserver_lock(wine_prefix=wine_prefix, username=username) as is_wineserver_locked:
+            if is_wineserver_locked:
+                yield
+                return
+        if lib_wine_plan.is_plan_mode():
+            yield
+            return
+        wait_for_wineserver_exit(wine_prefix=wine_prefix, username=username, timeout=timeout)
+    raise RuntimeError('can not lock the Wine Registry, a wineserver keeps starting on WINEPREFIX="{wine_prefix}"'.format(wine_prefix=wine_prefix))
+
+
+def wait_for_wineserver_exit(wine_prefix: pathlib.Path, username: str, timeout: int = WINESERVER_EXIT_TIMEOUT_SECONDS) -> None:
+    """ 'wineserver -w' waits until the wineserver of the prefix exits, after the last windows program of the prefix ended """
+    try:
+        lib_shell.run_shell_command('WINEPREFIX="{wine_prefix}" timeout {timeout} wineserver -w'.format(wine_prefix=wine_prefix, timeout=timeout),
+                                    quiet=True, shell=True, run_as_user=username)
+    except subprocess.CalledProcessError:
+        raise RuntimeError('can not read the Wine Registry, the wineserver on WINEPREFIX="{wine_prefix}" did not exit within {timeout} seconds'
+                           .format(wine_prefix=wine_prefix, timeout=timeout))
+
+
+def get_path_wineserver_directory(wine_prefix: pathlib.Path, username: str) -> pathlib.Path:
+    """ the wineserver of a prefix lives in /tmp/.wine-<uid>/server-<device>-<inode of the prefix>,
+    that is the same way wine finds the server for a WINEPREFIX
+    """
+    stat_wine_prefix = pathlib.Path(wine_prefix).stat()
+    uid = pwd.getpwnam(username).pw_uid
+    path_wineserver_directory = pathlib.Path('/tmp/.wine-{uid}/server-{device:x}-{inode:x}'
+                                             .format(uid=uid, device=stat_wine_prefix.st_dev, inode=stat_wine_prefix.st_ino))
+    return path_wineserver_directory
+
+
+def is_wineserver_running(wine_prefix: Union[str, pathlib.Path],
+                          username: str = configmagick_linux.get_current_username()) -> bool:
+    """ a running wineserver holds a write lock on the 'lock' file of its server directory
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix='wine_test_32')
+    >>> assert is_wineserver_running(wine_prefix=wine_prefix) in (True, False)
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    path_lock_file = get_path_wineserver_directory(wine_prefix=wine_prefix, username=username) / 'lock'
+    if not path_lock_file.exists():
+        return False
+    with open(str(path_lock_file), mode='r+b') as lock_file:
+        try:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as exc:
+            if exc.errno in (errno.EACCES, errno.EAGAIN):
+                return True
+            raise
+        fcntl.lockf(lock_file, fcntl.LOCK_UN)
+    return False
+
+
+# a small wine hive file, used in the doctests
+HIVE_CONTENT_EXAMPLE = ('WINE REGISTRY Version 2\n'
+                        ';; All keys relative to \\\\Machine\n'
+                        '\n'
+                        '#arch=win32\n'
+                        '\n'
+                        '[Software\\\\Wine] 1572355339\n'
+                        '#time=1d58fd7b6d3c8b2\n'
+                        '@="default"\n'
+                        '"Binary"=hex:01,02,03,04,05,06,07,08,09,0a,0b,0c,0d,0e,0f,\\\n'
+                        '  10\n'
+                        '"Version"="win7"\n'
+                        '\n'
+                        '[System\\\\CurrentControlSet\\\\Control\\\\Session Manager\\\\Environment] 1572355339\n'
+                        '#time=1d58fd7b6d3c8b2\n'
+                        '"PATH"=str(2):"C:\\\\windows\\\\system32;C:\\\\windows"\n'
+                        '"windir"=str(2):"C:\\\\windows"\n'
+                        '\n')
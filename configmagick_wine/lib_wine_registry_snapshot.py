@@ -0,0 +1,257 @@
+# ### STDLIB
+import collections
+import json
+import os
+import pathlib
+import time
+from typing import Any, Dict, List, Sequence, Union
+
+# ### OWN
+import configmagick_linux
+import lib_log_utils
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_check                # type: ignore # pragma: no cover
+    from . import lib_wine_plan                 # type: ignore # pragma: no cover
+    from . import lib_wine_registry             # type: ignore # pragma: no cover
+    from . import install_wine_machine          # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_check                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_plan                        # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry                    # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import install_wine_machine                 # type: ignore # pragma: no cover
+
+
+SNAPSHOT_VERSION = 1
+L_WINE_REGISTRY_HIVE_FILENAMES = ['system.reg', 'user.reg', 'userdef.reg']
+
+
+def snapshot_wine_registry(snapshot_file: Union[str, pathlib.Path],
+                           l_reg_keys: Sequence[str] = (),
+                           l_hive_filenames: Sequence[str] = (),
+                           wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                           username: str = configmagick_linux.get_current_username(),
+                           quiet: bool = False) -> None:
+    """ save whole hive files and/or registry subtrees of a wine prefix into a json snapshot file, without starting wine.
+    syntax: snapshot_registry --snapshot_file=<file.json> --wine_prefix=<prefix> [--l_reg_keys=[...]] [--l_hive_filenames=[...]]
+
+    the snapshot is read from the hive files - a running wineserver saves its changes to the hive files
+    only from time to time and on exit, so it is waited for to exit first (see lib_wine_registry.offline_wine_registry_lock).
+
+    Args:
+        --snapshot_file=<file.json>     the snapshot file to write
+        --l_reg_keys=[...]              registry subtrees to save, like 'HKCU\\Software\\Wine'
+        --l_hive_filenames=[...]        whole hive files to save, 'system.reg', 'user.reg', 'userdef.reg'
+                                        if neither l_reg_keys nor l_hive_filenames are given, all hive files are saved
+
+    >>> install_wine_machine.create_wine_test_prefixes()
+    >>> wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix='wine_test_32')
+    >>> reg_key = 'HKEY_CURRENT_USER\\\\Software\\\\configmagick_wine_test_snapshot'
+    >>> snapshot_file = wine_prefix / 'configmagick_wine_test_snapshot.json'
+    >>> lib_wine_registry.write_wine_registry_entries([lib_wine_registry.RegistryEntry(reg_key, 'test', 'REG_SZ', 'before')], wine_prefix=wine_prefix)
+    >>> snapshot_wine_registry(snapshot_file, l_reg_keys=[reg_key], wine_prefix=wine_prefix, quiet=True)
+    >>> lib_wine_registry.write_wine_registry_entries([lib_wine_registry.RegistryEntry(reg_key, 'test', 'REG_SZ', 'after'),
+    ...                                                lib_wine_registry.RegistryEntry(reg_key, 'new', 'REG_SZ', 'new')], wine_prefix=wine_prefix)
+    >>> restore_wine_registry(snapshot_file, wine_prefix=wine_prefix, quiet=True)
+    >>> assert lib_wine.get_wine_registry_data(reg_key=reg_key, reg_subkey='test', wine_prefix=wine_prefix) == 'before'
+    >>> snapshot_file.unlink()
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    if not l_reg_keys and not l_hive_filenames:
+        l_hive_filenames = L_WINE_REGISTRY_HIVE_FILENAMES
+
+    d_hive_contents = collections.OrderedDict()     # type: Dict[str, str]
+    with lib_wine_registry.offline_wine_registry_lock(wine_prefix=wine_prefix, username=username):
+        for hive_filename in l_hive_filenames:
+            path_hive = lib_wine_registry.get_and_check_path_wine_registry_hive(wine_prefix, hive_filename)
+            d_hive_contents[hive_filename] = lib_wine_registry.get_wine_registry_hive_content(lib_wine_registry.read_wine_registry_hive(path_hive))
+        d_hives = lib_wine_registry.read_wine_registry_hives_for_keys(l_reg_keys, wine_prefix=wine_prefix)
+
+    l_subtrees = list()     # type: List[Dict[str, Any]]
+    for reg_key in l_reg_keys:
+        hive_filename, relative_key = lib_wine_registry.get_hive_filename_and_relative_key(reg_key)
+        l_hive_keys = get_wine_registry_hive_subtree(d_hives[hive_filename], relative_key)
+        l_subtrees.append({'reg_key': lib_wine_registry.get_reg_key_from_hive_filename_and_relative_key(hive_filename, relative_key),
+                           'hive_filename': hive_filename,
+                           'relative_key': relative_key,
+                           'keys': [hive_key.l_lines for hive_key in l_hive_keys]})
+
+    snapshot = {'version': SNAPSHOT_VERSION,
+                'wine_prefix': str(wine_prefix),
+                'wine_arch': lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username),
+                'timestamp': time.time(),
+                'hives': d_hive_contents,
+                'subtrees': l_subtrees}
+    write_snapshot_file(pathlib.Path(snapshot_file), snapshot)
+    lib_log_utils.banner_success('Wine Registry snapshot of WINEPREFIX="{wine_prefix}" saved to "{snapshot_file}"'
+                                 .format(wine_prefix=wine_prefix, snapshot_file=snapshot_file), quiet=quiet)
+
+
+def restore_wine_registry(snapshot_file: Union[str, pathlib.Path],
+                          wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                          username: str = configmagick_linux.get_current_username(),
+                          force: bool = False,
+                          quiet: bool = False) -> None:
+    """ restore a registry snapshot. syntax: restore_registry --snapshot_file=<file.json> --wine_prefix=<prefix> [--force]
+
+    the hive files are replaced atomically - no wine startup at all. a running wineserver is waited for to exit first,
+    and its lock is held while the hive files are replaced (see lib_wine_registry.offline_wine_registry_lock).
+    a snapshot of an other wine prefix, or of an other wine arch, is only restored with --force.
+
+    Args:
+        --snapshot_file=<file.json>     the snapshot file, made with snapshot_registry
+        --force                         restore also a snapshot of an other wine prefix or wine arch
+
+    """
+    wine_prefix = lib_wine.get_and_check_wine_prefix(wine_prefix=wine_prefix, username=username)
+    snapshot = read_snapshot_file(pathlib.Path(snapshot_file))
+    wine_arch = lib_wine.get_wine_arch_from_wine_prefix(wine_prefix=wine_prefix, username=username)
+    l_mismatches = get_l_snapshot_mismatches(snapshot, wine_prefix=wine_prefix, wine_arch=wine_arch)
+    if l_mismatches and not force:
+        raise RuntimeError('can not restore the Wine Registry snapshot "{snapshot_file}" on WINEPREFIX="{wine_prefix}", {mismatches} - use --force'
+                           .format(snapshot_file=snapshot_file, wine_prefix=wine_prefix, mismatches=', '.join(l_mismatches)))
+    for mismatch in l_mismatches:
+        lib_log_utils.log_warning('restore the Wine Registry snapshot "{snapshot_file}" with --force, {mismatch}'
+                                  .format(snapshot_file=snapshot_file, mismatch=mismatch))
+    with lib_wine_registry.offline_wine_registry_lock(wine_prefix=wine_prefix, username=username):
+        restore_wine_registry_hives_offline(snapshot, wine_prefix=wine_prefix)
+    lib_log_utils.banner_success('Wine Registry of WINEPREFIX="{wine_prefix}" restored from "{snapshot_file}"'
+                                 .format(wine_prefix=wine_prefix, snapshot_file=snapshot_file), quiet=quiet)
+
+
+def get_l_snapshot_mismatches(snapshot: Dict[str, Any], wine_prefix: pathlib.Path, wine_arch: str) -> List[str]:
+    """ the differences between the prefix of the snapshot and the prefix to restore. the wine arch of older snapshots is read from their system.reg
+
+    >>> snapshot = {'wine_prefix': '/home/test/wine32', 'hives': {'system.reg': lib_wine_check.SYSTEM_HIVE_CONTENT_EXAMPLE}}
+    >>> get_l_snapshot_mismatches(snapshot, wine_prefix=pathlib.Path('/home/test/wine32'), wine_arch='win32')
+    []
+    >>> get_l_snapshot_mismatches(snapshot, wine_prefix=pathlib.Path('/home/test/wine64'), wine_arch='win64')
+    ['snapshot of WINEPREFIX="/home/test/wine32"', 'snapshot of WINEARCH="win32", not "win64"']
+
+    """
+    l_mismatches = list()   # type: List[str]
+    if pathlib.Path(snapshot.get('wine_prefix', '')) != pathlib.Path(wine_prefix):
+        l_mismatches.append('snapshot of WINEPREFIX="{snapshot_wine_prefix}"'.format(snapshot_wine_prefix=snapshot.get('wine_prefix', '')))
+    snapshot_wine_arch = snapshot.get('wine_arch', '')
+    if not snapshot_wine_arch and 'system.reg' in snapshot.get('hives', {}):
+        snapshot_wine_arch = lib_wine_check.get_wine_arch_from_hive(lib_wine_registry.parse_wine_registry_hive(snapshot['hives']['system.reg']))
+    if snapshot_wine_arch and snapshot_wine_arch != wine_arch:
+        l_mismatches.append('snapshot of WINEARCH="{snapshot_wine_arch}", not "{wine_arch}"'.format(snapshot_wine_arch=snapshot_wine_arch, wine_arch=wine_arch))
+    return l_mismatches
+
+
+def restore_wine_registry_hives_offline(snapshot: Dict[str, Any], wine_prefix: pathlib.Path) -> None:
+    """ replace the hive files and subtrees - the caller must hold the wineserver lock """
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('registry', description='restore {hives} from the snapshot'
+                                    .format(hives=', '.join(list(snapshot['hives']) + [subtree['hive_filename'] + ':' + subtree['relative_key']
+                                                                                       for subtree in snapshot['subtrees']])),
+                                    step_key='', note='offline, into the hive files', expected_seconds=0.0)
+        return
+    d_hives = collections.OrderedDict()     # type: Dict[str, lib_wine_registry.WineRegistryHive]
+    for hive_filename, hive_content in snapshot['hives'].items():
+        d_hives[hive_filename] = lib_wine_registry.parse_wine_registry_hive(hive_content)
+    for subtree in snapshot['subtrees']:
+        hive_filename = subtree['hive_filename']
+        if hive_filename not in d_hives:
+            path_hive = lib_wine_registry.get_and_check_path_wine_registry_hive(wine_prefix, hive_filename)
+            d_hives[hive_filename] = lib_wine_registry.read_wine_registry_hive(path_hive)
+        replace_wine_registry_hive_subtree(d_hives[hive_filename], subtree['relative_key'], get_l_hive_keys_from_subtree(subtree))
+    for hive_filename, hive in d_hives.items():
+        lib_wine_registry.write_wine_registry_hive(lib_wine_registry.get_path_wine_registry_hive(wine_prefix, hive_filename), hive)
+
+
+def get_wine_registry_hive_subtree(hive: lib_wine_registry.WineRegistryHive, relative_key: str) -> List[lib_wine_registry.WineRegistryHiveKey]:
+    """ get the key sections of a key and all its subkeys
+
+    >>> hive = lib_wine_registry.parse_wine_registry_hive(lib_wine_registry.HIVE_CONTENT_EXAMPLE)
+    >>> [hive_key.name for hive_key in get_wine_registry_hive_subtree(hive, 'SYSTEM\\\\CurrentControlSet')]
+    ['System\\\\CurrentControlSet\\\\Control\\\\Session Manager\\\\Environment']
+    >>> get_wine_registry_hive_subtree(hive, 'System\\\\Current')
+    []
+
+    """
+    return [hive_key for key_name_lower, hive_key in hive.d_keys.items() if is_key_in_subtree(key_name_lower, relative_key)]
+
+
+def replace_wine_registry_hive_subtree(hive: lib_wine_registry.WineRegistryHive, relative_key: str,
+                                       l_hive_keys: Sequence[lib_wine_registry.WineRegistryHiveKey]) -> None:
+    """ replace a key and all its subkeys, the new key sections take the place of the first old one
+
+    >>> hive = lib_wine_registry.parse_wine_registry_hive(lib_wine_registry.HIVE_CONTENT_EXAMPLE)
+    >>> l_subtree = get_wine_registry_hive_subtree(hive, 'Software')
+    >>> replace_wine_registry_hive_subtree(hive, 'Software', [])
+    >>> list(hive.d_keys)
+    ['system\\\\currentcontrolset\\\\control\\\\session manager\\\\environment']
+    >>> replace_wine_registry_hive_subtree(hive, 'Software', l_subtree)
+    >>> list(hive.d_keys)
+    ['system\\\\currentcontrolset\\\\control\\\\session manager\\\\environment', 'software\\\\wine']
+
+    """
+    l_old_keys = list(hive.d_keys.items())
+    hive.d_keys.clear()
+    is_inserted = False
+    for key_name_lower, hive_key in l_old_keys:
+        if is_key_in_subtree(key_name_lower, relative_key):
+            if not is_inserted:
+                hive.d_keys.update((new_hive_key.name.lower(), new_hive_key) for new_hive_key in l_hive_keys)
+                is_inserted = True
+        else:
+            hive.d_keys[key_name_lower] = hive_key
+    if not is_inserted:
+        hive.d_keys.update((new_hive_key.name.lower(), new_hive_key) for new_hive_key in l_hive_keys)
+
+
+def is_key_in_subtree(key_name: str, relative_key: str) -> bool:
+    """
+    >>> assert is_key_in_subtree('Software\\\\Wine\\\\Drivers', 'software\\\\wine')
+    >>> assert is_key_in_subtree('Software\\\\Wine', 'software\\\\wine\\\\')
+    >>> assert not is_key_in_subtree('Software\\\\Wine2', 'software\\\\wine')
+
+    """
+    key_name = key_name.lower()
+    relative_key = relative_key.strip('\\').lower()
+    return (key_name == relative_key) or key_name.startswith(relative_key + '\\')
+
+
+def get_l_hive_keys_from_subtree(subtree: Dict[str, Any]) -> List[lib_wine_registry.WineRegistryHiveKey]:
+    l_hive_keys = list()    # type: List[lib_wine_registry.WineRegistryHiveKey]
+    for l_lines in subtree['keys']:
+        l_hive_keys.append(lib_wine_registry.WineRegistryHiveKey(name=lib_wine_registry.get_key_name_from_hive_key_header(l_lines[0]),
+                                                                 l_lines=list(l_lines)))
+    return l_hive_keys
+
+
+def write_snapshot_file(path_snapshot_file: pathlib.Path, snapshot: Dict[str, Any]) -> None:
+    """ undecodable bytes of the hive files (read with surrogateescape) are written by json as '\\udcxx' and survive the round trip """
+    if lib_wine_plan.is_plan_mode():
+        lib_wine_plan.add_plan_step('file', description='write "{path_snapshot_file}"'.format(path_snapshot_file=path_snapshot_file),
+                                    step_key='', expected_seconds=0.0)
+        return
+    path_snapshot_file_tmp = path_snapshot_file.parent / '.{filename}.tmp'.format(filename=path_snapshot_file.name)
+    try:
+        with open(str(path_snapshot_file_tmp), mode='w', encoding='utf-8') as snapshot_file:
+            json.dump(snapshot, snapshot_file, indent=1)
+        os.replace(str(path_snapshot_file_tmp), str(path_snapshot_file))
+    finally:
+        if path_snapshot_file_tmp.exists():
+            path_snapshot_file_tmp.unlink()
+
+
+def read_snapshot_file(path_snapshot_file: pathlib.Path) -> Dict[str, Any]:
+    with open(str(path_snapshot_file), mode='r', encoding='utf-8') as snapshot_file:
+        snapshot = json.load(snapshot_file)     # type: Dict[str, Any]
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise RuntimeError('unknown Wine Registry snapshot version in "{snapshot_file}"'.format(snapshot_file=path_snapshot_file))
+    return snapshot
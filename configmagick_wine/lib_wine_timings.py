@@ -0,0 +1,366 @@
+# ### STDLIB
+import contextlib
+import pathlib
+import re
+import socket
+import sqlite3
+import sys
+import time
+import urllib.parse
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine                      # type: ignore # pragma: no cover
+    from . import lib_wine_cache                # type: ignore # pragma: no cover
+    from . import lib_wine_detect               # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine                             # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_cache                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_detect                      # type: ignore # pragma: no cover
+
+
+# the history of the step durations, one row per run of configmagick_wine and one row per timed step of the run
+STEP_TIMINGS_FILENAME = 'step_timings.sqlite'
+STEP_TIMINGS_SCHEMA_VERSION = 2
+# the runs which are kept in the history, older runs and their steps are removed
+TIMING_HISTORY_MAX_RUNS = 2000
+# the expected duration of a step is the median of its latest durations
+EXPECTED_SECONDS_SAMPLES = 10
+# a step regressed, if the median of its latest durations is more than the threshold (0.25 = 25 %) above the median of the baseline
+REGRESSION_THRESHOLD = 0.25
+REGRESSION_RECENT_SAMPLES = 5
+# fewer samples are not compared, and differences below REGRESSION_MIN_SECONDS are noise
+REGRESSION_MIN_SAMPLES = 3
+REGRESSION_MIN_SECONDS = 1.0
+L_STATS_PERCENTILES = [50, 90, 99]
+# the programs whose subcommand is part of the step key, like 'wine msiexec' or 'apt-get install'
+L_PROGRAMS_WITH_SUBCOMMANDS = ['apt-get', 'git', 'wine', 'wine64', 'winetricks']
+
+# one run of configmagick_wine, wine_version like '5.0 staging', wine_cache 'node' or 'user' - the only cache metadata of the timings:
+# a download step is only timed if the file was fetched, a file from the wine cache is just linked and takes no time
+TimingRun = NamedTuple('TimingRun', [('started', float), ('host', str), ('command', str), ('wine_version', str), ('wine_cache', str)])
+# one timed step, with the metadata of its run
+StepTiming = NamedTuple('StepTiming', [('step_key', str), ('seconds', float), ('wine_arch', str), ('finished', float), ('host', str), ('wine_version', str)])
+# the statistics of a step on one wine arch, the medians are None if there are not enough samples to compare
+StepStats = NamedTuple('StepStats', [('step_key', str),
+                                     ('wine_arch', str),
+                                     ('n_samples', int),
+                                     ('percentiles', Dict[int, float]),
+                                     ('baseline_median', Optional[float]),
+                                     ('recent_median', Optional[float]),
+                                     ('is_regression', bool)])
+
+# the run which is timed now, see begin_timing_run - the run is written with its first step, {str(path_timings_file): run_id}
+_d_timing_run = {'command': '', 'started': 0.0}     # type: Dict[str, Union[str, float]]
+_d_timing_run_ids = dict()                          # type: Dict[str, int]
+
+
+def show_step_stats(step: str = '',
+                    wine_arch: str = '',
+                    baseline_wine_version: str = '',
+                    threshold: float = REGRESSION_THRESHOLD,
+                    recent: int = REGRESSION_RECENT_SAMPLES,
+                    timings_file: str = '') -> None:
+    """show the percentiles of the step durations, and flag the steps which regressed. syntax: stats [--step=<step>] [--baseline_wine_version=<version>]
+
+    the latest durations of a step are compared with the older durations of the step, on the same wine arch.
+    with --baseline_wine_version they are compared with the durations under that wine version, like '5.0 stable'
+
+    Args:
+        --step=<step>                       only the steps which start with it, like 'wine msiexec'
+        --wine_arch=<win32|win64>           only the steps on that wine arch
+        --baseline_wine_version=<version>   compare with the durations under that wine version
+        --threshold=<fraction>              flag a step if its median is more than that above the baseline, default 0.25
+        --recent=<n>                        the number of latest durations which are compared, default 5
+        --timings_file=<file.sqlite>        default the step_timings.sqlite in the state directory
+
+    """
+    path_timings_file = pathlib.Path(timings_file) if timings_file else get_path_step_timings_file()
+    l_step_timings = list()     # type: List[StepTiming]
+    if path_timings_file.is_file():
+        with open_step_timings(path_timings_file) as timings:
+            l_step_timings = read_step_timings(timings, step_key_prefix=step, wine_arch=wine_arch)
+    l_step_stats = get_l_step_stats(l_step_timings, baseline_wine_version=baseline_wine_version, threshold=threshold, recent=recent)
+    sys.stdout.write(get_step_stats_report(l_step_stats, threshold=threshold))
+
+
+def get_step_key_from_command(command: str) -> str:
+    """ the step of a shell command, without the environment assignments and the arguments - commands of the same step take about the same time
+
+    >>> get_step_key_from_command('WINEPREFIX="/root/.wine" WINEARCH="win64" wine msiexec /i "/root/.cache/wine/wine-mono-4.9.4.msi"')
+    'wine msiexec'
+    >>> get_step_key_from_command('DEBIAN_FRONTEND=noninteractive apt-get install -y --install-recommends winehq-staging')
+    'apt-get install'
+    >>> get_step_key_from_command('chown -R "test"."test" "/home/test/.wine"')
+    'chown'
+    >>> get_step_key_from_command('"/opt/wine-staging/bin/wine" --version')
+    'wine'
+
+    """
+    l_words = [word.strip('"\'') for word in command.split()]
+    while l_words and re.match(r'^[A-Za-z_][A-Za-z0-9_]*=', l_words[0]):
+        l_words = l_words[1:]
+    if not l_words:
+        return ''
+    program = pathlib.PurePosixPath(l_words[0]).name
+    l_subcommands = [word for word in l_words[1:] if not word.startswith('-')]
+    if program in L_PROGRAMS_WITH_SUBCOMMANDS and l_subcommands:
+        return '{program} {subcommand}'.format(program=program, subcommand=pathlib.PureWindowsPath(l_subcommands[0]).name)
+    return program
+
+
+def get_wine_arch_from_command(command: str) -> str:
+    """
+    >>> get_wine_arch_from_command('WINEPREFIX="/root/.wine" WINEARCH="win64" wine msiexec /i "a.msi"')
+    'win64'
+    >>> get_wine_arch_from_command('apt-get update')
+    ''
+
+    """
+    match = re.search(r'WINEARCH="?(win32|win64)', command)
+    return match.group(1) if match else ''
+
+
+def get_step_key_from_windows_commands(l_commands: Sequence[str]) -> str:
+    """ a batch of windows commands, see lib_wine_batch
+
+    >>> get_step_key_from_windows_commands(['msiexec /i "Z:\\\\a.msi"', 'msiexec /i "Z:\\\\b.msi"', 'python --version'])
+    'wine cmd msiexec msiexec python'
+
+    """
+    return ' '.join(['wine cmd'] + [command.split()[0] for command in l_commands if command.split()])
+
+
+def get_step_key_from_download(filename: str) -> str:
+    return 'download {filename}'.format(filename=pathlib.Path(filename).name)
+
+
+def begin_timing_run(command: str) -> None:
+    """ the following steps belong to a new run - the run is written to the history with its first timed step """
+    _d_timing_run['command'] = command
+    _d_timing_run['started'] = time.time()
+    _d_timing_run_ids.clear()
+
+
+@contextlib.contextmanager
+def timed_step(step_key: str, username: str = configmagick_linux.get_current_username(), wine_arch: str = '') -> Iterator[None]:
+    """ record the duration of the step, if it does not fail """
+    start = time.perf_counter()
+    yield
+    record_step_timing(step_key, seconds=time.perf_counter() - start, username=username, wine_arch=wine_arch)
+
+
+def record_step_timing(step_key: str, seconds: float, username: str = configmagick_linux.get_current_username(), wine_arch: str = '') -> None:
+    """ a damaged or locked timings file must not fail an installation, the timing is just not recorded """
+    if not step_key:
+        return
+    path_timings_file = get_path_step_timings_file(username=username)
+    try:
+        with open_step_timings(path_timings_file) as timings:
+            run_id = get_timing_run_id(timings, path_timings_file)
+            timings.execute('INSERT INTO step_timings VALUES (?, ?, ?, ?, ?)', (run_id, step_key, seconds, wine_arch, time.time()))
+    except (OSError, sqlite3.Error):
+        pass
+
+
+def get_timing_run_id(timings: sqlite3.Connection, path_timings_file: pathlib.Path) -> int:
+    """ the id of the current run, the run is inserted if it is not in the history yet. the oldest runs are removed """
+    if str(path_timings_file) in _d_timing_run_ids:
+        return _d_timing_run_ids[str(path_timings_file)]
+    timing_run = get_timing_run()
+    cursor = timings.execute('INSERT INTO runs (started, host, command, wine_version, wine_cache) VALUES (?, ?, ?, ?, ?)', timing_run)
+    run_id = int(cursor.lastrowid)
+    timings.execute('DELETE FROM step_timings WHERE run_id <= ?', (run_id - TIMING_HISTORY_MAX_RUNS, ))
+    timings.execute('DELETE FROM runs WHERE run_id <= ?', (run_id - TIMING_HISTORY_MAX_RUNS, ))
+    _d_timing_run_ids[str(path_timings_file)] = run_id
+    return run_id
+
+
+def get_timing_run() -> TimingRun:
+    """ the metadata of the current run. the wine version is read from the installed files, wine is not started """
+    wine_installation = lib_wine_detect.get_wine_installation()
+    wine_version = '{version} {flavour}'.format(version=wine_installation.version, flavour=wine_installation.flavour) if wine_installation else ''
+    return TimingRun(started=float(_d_timing_run['started'] or time.time()),
+                     host=socket.gethostname(),
+                     command=str(_d_timing_run['command']),
+                     wine_version=wine_version.strip(),
+                     wine_cache='node' if lib_wine_cache.is_node_wine_cache_enabled() else 'user')
+
+
+def get_expected_step_seconds(step_key: str, username: str = configmagick_linux.get_current_username(), wine_arch: str = '') -> Optional[float]:
+    """ the median of the latest durations of the step on the wine arch (on any arch if wine_arch is not known),
+    None if it was never recorded. the history is only read, this is called while planning
+
+    >>> import tempfile
+    >>> import unittest.mock
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     path_timings_file = pathlib.Path(tmp_dir) / STEP_TIMINGS_FILENAME
+    ...     with open_step_timings(path_timings_file) as timings:
+    ...         _ = timings.executemany('INSERT INTO step_timings VALUES (1, ?, ?, ?, ?)',
+    ...                                 [('wine msiexec', 10.0, 'win32', 1.0), ('wine msiexec', 30.0, 'win64', 2.0), ('wine msiexec', 32.0, 'win64', 3.0)])
+    ...     with unittest.mock.patch(__name__ + '.get_path_step_timings_file', return_value=path_timings_file):
+    ...         get_expected_step_seconds('wine msiexec', wine_arch='win32'), get_expected_step_seconds('wine msiexec', wine_arch='win64')
+    (10.0, 31.0)
+
+    """
+    path_timings_file = get_path_step_timings_file(username=username)
+    if not path_timings_file.is_file():
+        return None
+    try:
+        timings = sqlite3.connect('file:{path}?mode=ro'.format(path=urllib.parse.quote(str(path_timings_file))), uri=True, timeout=60)
+        try:
+            if timings.execute('PRAGMA user_version').fetchone()[0] != STEP_TIMINGS_SCHEMA_VERSION:
+                return None
+            l_seconds = [seconds for seconds, in timings.execute('SELECT seconds FROM step_timings WHERE step_key = ? AND wine_arch LIKE ? '
+                                                                 'ORDER BY finished DESC LIMIT ?',
+                                                                 (step_key, wine_arch or '%', EXPECTED_SECONDS_SAMPLES))]
+        finally:
+            timings.close()
+    except sqlite3.Error:
+        return None
+    if not l_seconds:
+        return None
+    return get_percentile(l_seconds, 50)
+
+
+def get_path_step_timings_file(username: str = configmagick_linux.get_current_username()) -> pathlib.Path:
+    return lib_wine.get_path_configmagick_wine_state_file(STEP_TIMINGS_FILENAME, username=username)
+
+
+@contextlib.contextmanager
+def open_step_timings(path_timings_file: pathlib.Path) -> Iterator[sqlite3.Connection]:
+    """ open the history and create the tables if needed, the changes are committed when the context is left without exception """
+    path_timings_file.parent.mkdir(parents=True, exist_ok=True)
+    timings = sqlite3.connect(str(path_timings_file), timeout=60)
+    try:
+        if timings.execute('PRAGMA user_version').fetchone()[0] != STEP_TIMINGS_SCHEMA_VERSION:
+            timings.executescript('DROP TABLE IF EXISTS runs;'
+                                  'DROP TABLE IF EXISTS step_timings;'
+                                  'CREATE TABLE runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, started REAL, host TEXT, command TEXT, wine_version TEXT, '
+                                  'wine_cache TEXT);'
+                                  'CREATE TABLE step_timings (run_id INTEGER, step_key TEXT, seconds REAL, wine_arch TEXT, finished REAL);'
+                                  'CREATE INDEX step_timings_step_key ON step_timings (step_key, finished);'
+                                  'PRAGMA user_version = {schema_version};'.format(schema_version=STEP_TIMINGS_SCHEMA_VERSION))
+        with timings:
+            yield timings
+    finally:
+        timings.close()
+
+
+def read_step_timings(timings: sqlite3.Connection, step_key_prefix: str = '', wine_arch: str = '') -> List[StepTiming]:
+    """ the timed steps, the oldest first """
+    l_step_timings = list()     # type: List[StepTiming]
+    for row in timings.execute('SELECT step_timings.step_key, step_timings.seconds, step_timings.wine_arch, '
+                               'step_timings.finished, runs.host, runs.wine_version '
+                               'FROM step_timings JOIN runs ON step_timings.run_id = runs.run_id ORDER BY step_timings.finished'):
+        step_timing = StepTiming(*row)
+        if step_timing.step_key.startswith(step_key_prefix) and (not wine_arch or step_timing.wine_arch == wine_arch):
+            l_step_timings.append(step_timing)
+    return l_step_timings
+
+
+def get_l_step_stats(l_step_timings: Sequence[StepTiming],
+                     baseline_wine_version: str = '',
+                     threshold: float = REGRESSION_THRESHOLD,
+                     recent: int = REGRESSION_RECENT_SAMPLES) -> List[StepStats]:
+    """ the statistics per step and wine arch. the latest durations are compared with the older ones, or with those under the baseline wine version
+
+    >>> l_timings = [StepTiming('wine msiexec', seconds, 'win64', finished, 'host', '4.0 stable') for finished, seconds in enumerate([10, 11, 10, 12])]
+    >>> l_timings += [StepTiming('wine msiexec', seconds, 'win64', 10 + finished, 'host', '5.0 staging') for finished, seconds in enumerate([20, 19, 21])]
+    >>> l_timings += [StepTiming('chown', 0.1, '', 20, 'host', '5.0 staging')]
+    >>> l_step_stats = get_l_step_stats(l_timings, recent=3)
+    >>> [(stats.step_key, stats.n_samples, stats.percentiles[50], stats.baseline_median, stats.recent_median, stats.is_regression) for stats in l_step_stats]
+    [('chown', 1, 0.1, None, None, False), ('wine msiexec', 7, 12.0, 10.5, 20.0, True)]
+    >>> get_l_step_stats(l_timings, baseline_wine_version='5.0 staging', recent=3)[1].is_regression
+    False
+
+    """
+    d_l_seconds = dict()    # type: Dict[Tuple[str, str], List[StepTiming]]
+    for step_timing in sorted(l_step_timings, key=lambda step_timing: step_timing.finished):
+        d_l_seconds.setdefault((step_timing.step_key, step_timing.wine_arch), list()).append(step_timing)
+
+    l_step_stats = list()   # type: List[StepStats]
+    for (step_key, wine_arch), l_step_key_timings in sorted(d_l_seconds.items()):
+        l_recent = l_step_key_timings[-recent:] if recent > 0 else list()
+        l_older = l_step_key_timings[:len(l_step_key_timings) - len(l_recent)]
+        if baseline_wine_version:
+            l_baseline = [step_timing for step_timing in l_older if step_timing.wine_version == baseline_wine_version]
+        else:
+            l_baseline = l_older
+        baseline_median = recent_median = None
+        is_regression = False
+        if len(l_baseline) >= REGRESSION_MIN_SAMPLES and len(l_recent) >= REGRESSION_MIN_SAMPLES:
+            baseline_median = get_percentile([step_timing.seconds for step_timing in l_baseline], 50)
+            recent_median = get_percentile([step_timing.seconds for step_timing in l_recent], 50)
+            is_regression = recent_median > baseline_median * (1 + threshold) and recent_median - baseline_median >= REGRESSION_MIN_SECONDS
+        l_seconds = [step_timing.seconds for step_timing in l_step_key_timings]
+        l_step_stats.append(StepStats(step_key=step_key,
+                                      wine_arch=wine_arch,
+                                      n_samples=len(l_seconds),
+                                      percentiles={percent: get_percentile(l_seconds, percent) for percent in L_STATS_PERCENTILES},
+                                      baseline_median=baseline_median,
+                                      recent_median=recent_median,
+                                      is_regression=is_regression))
+    return l_step_stats
+
+
+def get_percentile(l_values: Sequence[float], percent: float) -> float:
+    """ linear interpolation between the closest ranks
+
+    >>> get_percentile([4, 1, 3, 2], 50)
+    2.5
+    >>> get_percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90)
+    9.1
+    >>> get_percentile([7], 99)
+    7.0
+
+    """
+    l_sorted = sorted(l_values)
+    rank = (len(l_sorted) - 1) * percent / 100
+    index_lower = int(rank)
+    index_upper = min(index_lower + 1, len(l_sorted) - 1)
+    return round(float(l_sorted[index_lower] + (l_sorted[index_upper] - l_sorted[index_lower]) * (rank - index_lower)), 4)
+
+
+def get_step_stats_report(l_step_stats: Sequence[StepStats], threshold: float = REGRESSION_THRESHOLD) -> str:
+    """
+    >>> l_step_stats = [StepStats('wine msiexec', 'win64', 7, {50: 12.0, 90: 20.4, 99: 20.94}, 10.5, 20.0, True),
+    ...                 StepStats('chown', '', 1, {50: 0.1, 90: 0.1, 99: 0.1}, None, None, False)]
+    >>> print(get_step_stats_report(l_step_stats))
+    step                                     arch       runs       p50       p90       p99  baseline    recent
+    wine msiexec                             win64         7    12.0 s    20.4 s    20.9 s    10.5 s    20.0 s  REGRESSION +90 %
+    chown                                                  1     0.1 s     0.1 s     0.1 s         -         -
+    1 of 2 steps regressed more than 25 %
+    <BLANKLINE>
+
+    """
+    def get_seconds(seconds: Optional[float]) -> str:
+        return '-' if seconds is None else '{seconds:.1f} s'.format(seconds=seconds)
+
+    l_lines = ['{step:<40} {arch:<6} {runs:>8} {percentiles}{baseline:>10}{recent:>10}'
+               .format(step='step', arch='arch', runs='runs', baseline='baseline', recent='recent',
+                       percentiles=''.join('{p:>10}'.format(p='p{percent}'.format(percent=percent)) for percent in L_STATS_PERCENTILES))]
+    for step_stats in l_step_stats:
+        regression = ''
+        if step_stats.is_regression and step_stats.baseline_median and step_stats.recent_median is not None:
+            regression = '  REGRESSION +{percent:.0f} %'.format(percent=(step_stats.recent_median / step_stats.baseline_median - 1) * 100)
+        l_lines.append('{step:<40} {arch:<6} {runs:>8} {percentiles}{baseline:>10}{recent:>10}{regression}'
+                       .format(step=step_stats.step_key, arch=step_stats.wine_arch, runs=step_stats.n_samples,
+                               percentiles=''.join('{seconds:>10}'.format(seconds=get_seconds(step_stats.percentiles[percent]))
+                                                   for percent in L_STATS_PERCENTILES),
+                               baseline=get_seconds(step_stats.baseline_median), recent=get_seconds(step_stats.recent_median), regression=regression))
+    if not l_step_stats:
+        l_lines.append('no timings recorded')
+    l_lines.append('{n_regressions} of {n_steps} steps regressed more than {threshold:.0f} %'
+                   .format(n_regressions=len([step_stats for step_stats in l_step_stats if step_stats.is_regression]), n_steps=len(l_step_stats),
+                           threshold=threshold * 100))
+    return '\n'.join(l_lines) + '\n'
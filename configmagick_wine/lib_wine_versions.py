@@ -0,0 +1,383 @@
+# ### STDLIB
+import pathlib
+import re
+import struct
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+# ### OWN
+import configmagick_linux
+
+# ####### PROJ
+try:
+    # imports for local pytest
+    from . import lib_wine_batch                # type: ignore # pragma: no cover
+    from . import lib_wine_check                # type: ignore # pragma: no cover
+    from . import lib_wine_registry             # type: ignore # pragma: no cover
+except ImportError:                             # type: ignore # pragma: no cover
+    # imports for doctest
+    # noinspection PyUnresolvedReferences
+    import lib_wine_batch                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_check                       # type: ignore # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import lib_wine_registry                    # type: ignore # pragma: no cover
+
+
+# 'gecko' is the 32 Bit Gecko, 'gecko_64' the 64 Bit Gecko of a 64 Bit prefix
+L_VERSION_COMPONENTS = ['gecko', 'gecko_64', 'git', 'mono', 'python']
+# the executables of a component, relative to the prefix - python is searched in the PATH of the prefix
+D_COMPONENT_EXECUTABLES = {'git': ['drive_c/Program Files/PortableGit/cmd/git.exe', 'drive_c/Program Files/Git/cmd/git.exe']}     # type: Dict[str, List[str]]
+D_COMPONENT_PATH_EXECUTABLES = {'git': 'git.exe', 'python': 'python.exe'}
+# the beginning of the DisplayName in the Uninstall keys
+D_COMPONENT_UNINSTALL_NAMES = {'gecko': 'Wine Gecko', 'gecko_64': 'Wine Gecko', 'git': 'Git', 'mono': 'Wine Mono', 'python': 'Python '}
+# the windows commands which report the version, if the files do not tell it
+D_COMPONENT_VERSION_COMMANDS = {'git': 'git --version', 'python': 'python --version'}
+REG_KEY_UNINSTALL = 'HKEY_LOCAL_MACHINE\\Software\\Microsoft\\Windows\\CurrentVersion\\Uninstall'
+REG_KEY_UNINSTALL_WOW64 = 'HKEY_LOCAL_MACHINE\\Software\\Wow6432Node\\Microsoft\\Windows\\CurrentVersion\\Uninstall'
+
+# the resource type of the version information, and the signature of VS_FIXEDFILEINFO
+RT_VERSION = 16
+VS_FIXEDFILEINFO_SIGNATURE = 0xFEEF04BD
+
+# source is the file, directory or registry key the version was read from. version is '' if the component is there, but its version is unknown
+ComponentVersion = NamedTuple('ComponentVersion', [('component', str), ('version', str), ('source', str)])
+# an entry of the Uninstall keys
+UninstallEntry = NamedTuple('UninstallEntry', [('reg_key', str), ('display_name', str), ('display_version', str)])
+
+# {str(path): ((st_mtime_ns, st_size, st_ino), result)} - a file is parsed again only if it changed
+_d_pe_version_info_cache = dict()              # type: Dict[str, Tuple[Tuple[int, int, int], Dict[str, str]]]
+_d_uninstall_entries_cache = dict()            # type: Dict[str, Tuple[Tuple[int, int, int], List[UninstallEntry]]]
+
+
+def get_d_component_versions(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                             components: Sequence[str] = L_VERSION_COMPONENTS,
+                             username: str = configmagick_linux.get_current_username()) -> Dict[str, Optional[ComponentVersion]]:
+    """ the installed versions of the components, read from the files of the prefix without starting wine. None if a component is not installed
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     wine_prefix = pathlib.Path(tmp_dir)
+    ...     _ = (wine_prefix / 'system.reg').write_text('WINE REGISTRY Version 2\\n#arch=win32\\n\\n'
+    ...         '[Software\\\\\\\\Microsoft\\\\\\\\Windows\\\\\\\\CurrentVersion\\\\\\\\Uninstall\\\\\\\\{E45D8920-A758-4088-B6C6-31DBB0C4CA5F}] 1\\n'
+    ...         '"DisplayName"="Wine Mono Runtime"\\n"DisplayVersion"="4.9.4"\\n')
+    ...     (wine_prefix / 'drive_c/windows/system32/gecko/2.47.1/wine_gecko').mkdir(parents=True)
+    ...     d_versions = get_d_component_versions(wine_prefix, components=['gecko', 'mono', 'python'])
+    >>> d_versions['gecko'].version, d_versions['mono'].version, d_versions['python']
+    ('2.47.1', '4.9.4', None)
+
+    """
+    wine_prefix = lib_wine_check.get_path_wine_prefix_to_check(wine_prefix, username)
+    wine_arch = get_wine_arch_from_system_hive(wine_prefix)
+    l_uninstall_entries = get_l_uninstall_entries(wine_prefix)
+    d_component_versions = dict()      # type: Dict[str, Optional[ComponentVersion]]
+    for component in components:
+        d_component_versions[component] = get_component_version_from_files(wine_prefix, component, wine_arch, l_uninstall_entries)
+    return d_component_versions
+
+
+def get_component_version(wine_prefix: Union[str, pathlib.Path] = configmagick_linux.get_path_home_dir_current_user() / '.wine',
+                          component: str = 'python',
+                          username: str = configmagick_linux.get_current_username(),
+                          use_wine: bool = False) -> Optional[ComponentVersion]:
+    """ the installed version of a component, None if it is not installed.
+    only with use_wine=True, and if the files do not tell the version, the version command of the component is run under wine.
+    the hive files are written by the wineserver when it exits, so right after an installation the files might not know the component yet
+    """
+    component_version = get_d_component_versions(wine_prefix, components=[component], username=username)[component]
+    if (component_version is None or not component_version.version) and use_wine and component in D_COMPONENT_VERSION_COMMANDS:
+        result = lib_wine_batch.run_windows_commands([D_COMPONENT_VERSION_COMMANDS[component]], wine_prefix=wine_prefix, username=username)[0]
+        if result.returncode == 0 and result.output:
+            component_version = ComponentVersion(component=component, version=get_version_from_version_output(result.output),
+                                                 source=D_COMPONENT_VERSION_COMMANDS[component])
+    return component_version
+
+
+def get_component_version_from_files(wine_prefix: pathlib.Path, component: str, wine_arch: str,
+                                     l_uninstall_entries: Sequence[UninstallEntry]) -> Optional[ComponentVersion]:
+    if component not in L_VERSION_COMPONENTS:
+        raise RuntimeError('can not probe the version of the unknown component "{component}"'.format(component=component))
+    if component in ('gecko', 'gecko_64'):
+        component_version = get_gecko_version_from_directory(wine_prefix, component, wine_arch)
+        if component_version is not None:
+            return component_version
+    for path_executable in get_l_paths_component_executables(wine_prefix, component):
+        version = get_version_from_pe_file(path_executable)
+        if version:
+            return ComponentVersion(component=component, version=version, source=str(path_executable))
+    component_version = get_component_version_from_uninstall_entries(component, wine_arch, l_uninstall_entries)
+    if component_version is None and component == 'mono':
+        # installed, but without Uninstall entry - the version is unknown
+        for relative_path in lib_wine_check.D_WINE_COMPONENT_PATHS['mono']:
+            if (wine_prefix / relative_path).is_dir():
+                return ComponentVersion(component=component, version='', source=str(wine_prefix / relative_path))
+    return component_version
+
+
+def get_gecko_version_from_directory(wine_prefix: pathlib.Path, component: str, wine_arch: str) -> Optional[ComponentVersion]:
+    """ gecko is installed to C:\\windows\\system32\\gecko\\<version>, the 32 Bit gecko of a 64 Bit prefix to syswow64 """
+    if component == 'gecko_64' and wine_arch != 'win64':
+        return None
+    system_directory = 'syswow64' if component == 'gecko' and wine_arch == 'win64' else 'system32'
+    path_gecko = wine_prefix / 'drive_c/windows' / system_directory / 'gecko'
+    if not path_gecko.is_dir():
+        return None
+    l_versions = [path_version.name for path_version in path_gecko.iterdir() if path_version.is_dir() and re.match(r'^\d+(\.\d+)+$', path_version.name)]
+    if not l_versions:
+        return None
+    version = max(l_versions, key=get_version_sort_key)
+    return ComponentVersion(component=component, version=version, source=str(path_gecko / version))
+
+
+def get_l_paths_component_executables(wine_prefix: pathlib.Path, component: str) -> List[pathlib.Path]:
+    """ the fixed places of the component, then the PATH of the prefix """
+    l_paths = [wine_prefix / relative_path for relative_path in D_COMPONENT_EXECUTABLES.get(component, []) if (wine_prefix / relative_path).is_file()]
+    if component in D_COMPONENT_PATH_EXECUTABLES:
+        path_system_hive = wine_prefix / 'system.reg'
+        if path_system_hive.is_file():
+            system_hive = lib_wine_registry.read_wine_registry_hive(path_system_hive)
+            for path_entry in lib_wine_check.get_l_wine_registry_path_entries(system_hive):
+                path_executable = lib_wine_check.get_path_linux_from_windows_path(wine_prefix, path_entry + '\\' + D_COMPONENT_PATH_EXECUTABLES[component])
+                if path_executable is not None and path_executable.is_file():
+                    l_paths.append(path_executable)
+    return l_paths
+
+
+def get_component_version_from_uninstall_entries(component: str, wine_arch: str, l_uninstall_entries: Sequence[UninstallEntry]) -> Optional[ComponentVersion]:
+    """
+    >>> l_entries = [UninstallEntry(REG_KEY_UNINSTALL + '\\\\{A}', 'Wine Gecko (64-bit)', '2.47'),
+    ...              UninstallEntry(REG_KEY_UNINSTALL_WOW64 + '\\\\{B}', 'Wine Gecko', '2.47.1')]
+    >>> get_component_version_from_uninstall_entries('gecko', 'win64', l_entries).version
+    '2.47.1'
+    >>> get_component_version_from_uninstall_entries('gecko_64', 'win64', l_entries).version
+    '2.47'
+    >>> assert get_component_version_from_uninstall_entries('python', 'win64', l_entries) is None
+
+    """
+    if component == 'gecko_64' and wine_arch != 'win64':
+        return None
+    for uninstall_entry in l_uninstall_entries:
+        if not uninstall_entry.display_name.startswith(D_COMPONENT_UNINSTALL_NAMES[component]):
+            continue
+        # the 32 Bit msi packages of a 64 Bit prefix are registered in the Wow6432Node
+        if component == 'gecko' and wine_arch == 'win64' and not uninstall_entry.reg_key.startswith(REG_KEY_UNINSTALL_WOW64):
+            continue
+        if component == 'gecko_64' and uninstall_entry.reg_key.startswith(REG_KEY_UNINSTALL_WOW64):
+            continue
+        return ComponentVersion(component=component, version=uninstall_entry.display_version, source=uninstall_entry.reg_key)
+    return None
+
+
+def get_l_uninstall_entries(wine_prefix: pathlib.Path) -> List[UninstallEntry]:
+    """ the entries of the Uninstall keys in system.reg, cached until the hive changes """
+    path_system_hive = wine_prefix / 'system.reg'
+    if not path_system_hive.is_file():
+        return list()
+    stat_hive = path_system_hive.stat()
+    cache_key = (stat_hive.st_mtime_ns, stat_hive.st_size, stat_hive.st_ino)
+    if str(path_system_hive) in _d_uninstall_entries_cache and _d_uninstall_entries_cache[str(path_system_hive)][0] == cache_key:
+        return _d_uninstall_entries_cache[str(path_system_hive)][1]
+    l_uninstall_entries = get_l_uninstall_entries_from_hive(lib_wine_registry.read_wine_registry_hive(path_system_hive))
+    _d_uninstall_entries_cache[str(path_system_hive)] = (cache_key, l_uninstall_entries)
+    return l_uninstall_entries
+
+
+def get_l_uninstall_entries_from_hive(system_hive: lib_wine_registry.WineRegistryHive) -> List[UninstallEntry]:
+    l_uninstall_entries = list()    # type: List[UninstallEntry]
+    for reg_key_uninstall in (REG_KEY_UNINSTALL, REG_KEY_UNINSTALL_WOW64):
+        _, relative_key = lib_wine_registry.get_hive_filename_and_relative_key(reg_key_uninstall)
+        prefix = relative_key.lower() + '\\'
+        for key_name_lower, hive_key in system_hive.d_keys.items():
+            if not key_name_lower.startswith(prefix) or '\\' in key_name_lower[len(prefix):]:
+                continue
+            d_values = lib_wine_registry.get_wine_registry_hive_key_values(hive_key)
+            if 'displayname' not in d_values:
+                continue
+            display_version = d_values['displayversion'][2] if 'displayversion' in d_values else ''
+            l_uninstall_entries.append(UninstallEntry(reg_key=reg_key_uninstall + hive_key.name[len(prefix) - 1:],
+                                                      display_name=d_values['displayname'][2], display_version=display_version))
+    return l_uninstall_entries
+
+
+def get_wine_arch_from_system_hive(wine_prefix: pathlib.Path) -> str:
+    """ the '#arch=' header line, without parsing the whole hive """
+    path_system_hive = wine_prefix / 'system.reg'
+    if not path_system_hive.is_file():
+        return ''
+    with open(str(path_system_hive), mode='r', encoding='utf-8', errors='surrogateescape') as system_hive_file:
+        for _ in range(10):
+            line = system_hive_file.readline()
+            if line.startswith('#arch='):
+                return line.strip()[len('#arch='):]
+    return ''
+
+
+def get_version_from_pe_file(path_pe_file: pathlib.Path) -> str:
+    """ the ProductVersion of the version resource of an .exe or .dll, '' if it has none """
+    d_version_info = get_d_pe_version_info(path_pe_file)
+    return d_version_info.get('ProductVersion', d_version_info.get('FileVersion', '')).strip()
+
+
+def get_d_pe_version_info(path_pe_file: pathlib.Path) -> Dict[str, str]:
+    """ the strings of the version resource of a PE file like 'ProductVersion', 'FileVersion', 'ProductName' - cached until the file changes.
+    if the resource has no strings, ProductVersion and FileVersion are taken from VS_FIXEDFILEINFO. empty if the file has no version resource
+    """
+    try:
+        stat_file = path_pe_file.stat()
+    except OSError:
+        return dict()
+    cache_key = (stat_file.st_mtime_ns, stat_file.st_size, stat_file.st_ino)
+    if str(path_pe_file) in _d_pe_version_info_cache and _d_pe_version_info_cache[str(path_pe_file)][0] == cache_key:
+        return _d_pe_version_info_cache[str(path_pe_file)][1]
+    try:
+        d_version_info = parse_pe_version_info(path_pe_file.read_bytes())
+    except (OSError, struct.error, ValueError, IndexError):
+        d_version_info = dict()
+    _d_pe_version_info_cache[str(path_pe_file)] = (cache_key, d_version_info)
+    return d_version_info
+
+
+def parse_pe_version_info(pe_data: bytes) -> Dict[str, str]:
+    """
+    >>> parse_pe_version_info(b'not a PE file')
+    {}
+
+    """
+    version_data = get_pe_version_resource(pe_data)
+    if not version_data:
+        return dict()
+    key, value, l_children = parse_version_info_block(version_data, 0)
+    if key != 'VS_VERSION_INFO':
+        return dict()
+    d_version_info = dict()    # type: Dict[str, str]
+    for child_key, _, l_string_tables in l_children:
+        if child_key != 'StringFileInfo':
+            continue
+        for _, _, l_strings in l_string_tables:
+            for string_key, string_value, _ in l_strings:
+                d_version_info.setdefault(string_key, string_value.decode('utf-16-le', errors='replace').rstrip('\x00').strip())
+    if len(value) >= 52 and struct.unpack_from('<I', value, 0)[0] == VS_FIXEDFILEINFO_SIGNATURE:
+        file_version_ms, file_version_ls, product_version_ms, product_version_ls = struct.unpack_from('<IIII', value, 8)
+        d_version_info.setdefault('FileVersion', get_version_from_fixed_file_info(file_version_ms, file_version_ls))
+        d_version_info.setdefault('ProductVersion', get_version_from_fixed_file_info(product_version_ms, product_version_ls))
+    return d_version_info
+
+
+def get_pe_version_resource(pe_data: bytes) -> bytes:
+    """ the data of the first RT_VERSION resource, b'' if there is none """
+    if pe_data[:2] != b'MZ':
+        return b''
+    pe_offset = struct.unpack_from('<I', pe_data, 0x3C)[0]
+    if pe_data[pe_offset:pe_offset + 4] != b'PE\x00\x00':
+        return b''
+    n_sections, size_optional_header = struct.unpack_from('<H12xH', pe_data, pe_offset + 6)
+    optional_header_offset = pe_offset + 24
+    magic = struct.unpack_from('<H', pe_data, optional_header_offset)[0]
+    # the data directories follow the standard and windows specific fields, which are longer in PE32+
+    data_directories_offset = optional_header_offset + (112 if magic == 0x20B else 96)
+    resource_rva, resource_size = struct.unpack_from('<II', pe_data, data_directories_offset + 2 * 8)
+    if not resource_rva or not resource_size:
+        return b''
+
+    l_sections = list()     # type: List[Tuple[int, int, int]]
+    sections_offset = optional_header_offset + size_optional_header
+    for index in range(n_sections):
+        virtual_size, virtual_address, raw_size, raw_offset = struct.unpack_from('<IIII', pe_data, sections_offset + index * 40 + 8)
+        l_sections.append((virtual_address, max(virtual_size, raw_size), raw_offset - virtual_address))
+
+    def get_file_offset(rva: int) -> int:
+        for virtual_address, size, delta in l_sections:
+            if virtual_address <= rva < virtual_address + size:
+                return rva + delta
+        raise ValueError('RVA {rva:#x} is not in a section'.format(rva=rva))
+
+    resource_offset = get_file_offset(resource_rva)
+    # three levels : type, name, language - we take the first name and language of RT_VERSION
+    entry_offset = get_resource_directory_entry(pe_data, resource_offset, resource_offset, RT_VERSION)
+    for _ in range(2):
+        if entry_offset < 0:
+            return b''
+        entry_offset = get_resource_directory_entry(pe_data, resource_offset, entry_offset, None)
+    if entry_offset < 0:
+        return b''
+    data_rva, data_size = struct.unpack_from('<II', pe_data, entry_offset)
+    data_offset = get_file_offset(data_rva)
+    return pe_data[data_offset:data_offset + data_size]
+
+
+def get_resource_directory_entry(pe_data: bytes, resource_offset: int, directory_offset: int, entry_id: Optional[int]) -> int:
+    """ the offset the entry with the id (or the first entry if entry_id is None) points to, -1 if not found """
+    n_named_entries, n_id_entries = struct.unpack_from('<HH', pe_data, directory_offset + 12)
+    for index in range(n_named_entries + n_id_entries):
+        name, target = struct.unpack_from('<II', pe_data, directory_offset + 16 + index * 8)
+        if entry_id is None or (not name & 0x80000000 and name == entry_id):
+            return resource_offset + (target & 0x7FFFFFFF)
+    return -1
+
+
+def parse_version_info_block(data: bytes, offset: int) -> Tuple[str, bytes, List[Tuple[str, bytes, list]]]:
+    """ a block of the version resource : wLength, wValueLength, wType, szKey, padding, Value, padding, Children.
+    returns the key, the value and the parsed children
+
+    >>> block = b'\\x18\\x00\\x04\\x00\\x01\\x00' + 'Ver\\x00'.encode('utf-16-le') + b'\\x00\\x00' + '1.0\\x00'.encode('utf-16-le')
+    >>> parse_version_info_block(block, 0)
+    ('Ver', b'1\\x00.\\x000\\x00\\x00\\x00', [])
+
+    """
+    length, value_length, value_type = struct.unpack_from('<HHH', data, offset)
+    end = offset + length
+    key_end = offset + 6
+    while data[key_end:key_end + 2] != b'\x00\x00':
+        key_end += 2
+    key = data[offset + 6:key_end].decode('utf-16-le', errors='replace')
+    position = get_dword_aligned(key_end + 2)
+    # the length of text values is counted in words
+    value_size = value_length * 2 if value_type == 1 else value_length
+    value = data[position:min(position + value_size, end)]
+    position = get_dword_aligned(position + value_size)
+    l_children = list()     # type: List[Tuple[str, bytes, list]]
+    while position + 6 <= end:
+        child_length = struct.unpack_from('<H', data, position)[0]
+        if child_length == 0:
+            break
+        l_children.append(parse_version_info_block(data, position))
+        position = get_dword_aligned(position + child_length)
+    return key, value, l_children
+
+
+def get_dword_aligned(offset: int) -> int:
+    """
+    >>> get_dword_aligned(34), get_dword_aligned(36)
+    (36, 36)
+
+    """
+    return (offset + 3) & ~3
+
+
+def get_version_from_fixed_file_info(version_ms: int, version_ls: int) -> str:
+    """
+    >>> get_version_from_fixed_file_info(0x00030008, 0x00960001)
+    '3.8.150.1'
+
+    """
+    return '{}.{}.{}.{}'.format(version_ms >> 16, version_ms & 0xFFFF, version_ls >> 16, version_ls & 0xFFFF)
+
+
+def get_version_from_version_output(output: str) -> str:
+    """
+    >>> get_version_from_version_output('Python 3.8.0')
+    '3.8.0'
+    >>> get_version_from_version_output('git version 2.24.0.windows.2')
+    '2.24.0.windows.2'
+
+    """
+    l_words = output.strip().split()
+    return l_words[-1] if l_words else ''
+
+
+def get_version_sort_key(version: str) -> List[int]:
+    """
+    >>> sorted(['2.47.1', '2.40', '2.47'], key=get_version_sort_key)
+    ['2.40', '2.47', '2.47.1']
+
+    """
+    return [int(part) for part in re.findall(r'\d+', version)]